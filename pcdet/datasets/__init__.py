@@ -1,10 +1,14 @@
+import math
+
 import torch
 from torch.utils.data import DataLoader
 from torch.utils.data import DistributedSampler as _DistributedSampler
 
 from pcdet.utils import common_utils
 
+from .dataloader_utils import autotune_dataloader, broadcast_loader_kwargs, build_sleep_consumer, get_loader_kwargs
 from .dataset import DatasetTemplate
+from .shard_dataset import ShardStreamDataset
 from .kitti.kitti_dataset import KittiDataset
 from .nuscenes.nuscenes_dataset import NuScenesDataset
 from .waymo.waymo_dataset import WaymoDataset
@@ -54,9 +58,93 @@ class DistributedSampler(_DistributedSampler):
         return iter(indices)
 
 
+class TrainableFrameSampler(torch.utils.data.Sampler):
+    """
+    Draws only the frames of dataset.trainable_frame_inds, sharded over ranks like DistributedSampler.
+    """
+
+    def __init__(self, dataset, num_replicas=1, rank=0, shuffle=True, seed=0):
+        assert dataset.trainable_frame_inds is not None and len(dataset.trainable_frame_inds) > 0
+        self.dataset = dataset
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+
+        num_frames = len(dataset.trainable_frame_inds)
+        if dataset._merge_all_iters_to_one_epoch:
+            num_frames *= dataset.total_epochs
+        self.num_samples = int(math.ceil(num_frames / self.num_replicas))
+        self.total_size = self.num_samples * self.num_replicas
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __iter__(self):
+        frame_inds = torch.from_numpy(self.dataset.trainable_frame_inds).long()
+        if self.dataset._merge_all_iters_to_one_epoch:
+            frame_inds = frame_inds.repeat(self.dataset.total_epochs)
+
+        if self.shuffle:
+            g = torch.Generator()
+            g.manual_seed(self.seed + self.epoch)
+            frame_inds = frame_inds[torch.randperm(len(frame_inds), generator=g)]
+        indices = frame_inds.tolist()
+
+        indices += indices[:(self.total_size - len(indices))]
+        assert len(indices) == self.total_size
+
+        indices = indices[self.rank:self.total_size:self.num_replicas]
+        assert len(indices) == self.num_samples
+
+        return iter(indices)
+
+    def __len__(self):
+        return self.num_samples
+
+
+def build_trainable_frame_index(dataset, class_names, logger=None):
+    box_counts = dataset.build_trainable_frame_index()
+    if logger is not None:
+        logger.info('Trainable frames: %d / %d, %d frames without boxes of %s are skipped per epoch' % (
+            len(dataset.trainable_frame_inds), len(box_counts),
+            len(box_counts) - len(dataset.trainable_frame_inds), class_names))
+
+
+def build_loader_kwargs(dataset, batch_size, dataset_cfg, workers, training, logger, dataloader_args, dist=False):
+    """
+    DATA_CONFIG.DATALOADER.AUTOTUNE: profile the candidate settings on rank 0 and broadcast the pick to the other
+    ranks. The batches are consumed by a stand-in that waits AUTOTUNE_STEP_TIME seconds (default 0.2), set it to
+    the training step time of the model, the model itself is not built yet.
+    """
+    loader_cfg = dataset_cfg.get('DATALOADER', None)
+    if not (training and loader_cfg is not None and loader_cfg.get('AUTOTUNE', False)):
+        return get_loader_kwargs(loader_cfg, workers)
+
+    rank, world_size = common_utils.get_dist_info() if dist else (0, 1)
+    loader_kwargs = None
+    if rank == 0:
+        loader_kwargs = autotune_dataloader(
+            dataset, batch_size, max_workers=workers,
+            consumer=build_sleep_consumer(loader_cfg.get('AUTOTUNE_STEP_TIME', 0.2)),
+            loader_cfg=loader_cfg, num_batches=loader_cfg.get('AUTOTUNE_BATCHES', 20),
+            tolerance=loader_cfg.get('AUTOTUNE_TOLERANCE', 0.05), logger=logger, **dataloader_args
+        )
+    if world_size > 1:
+        loader_kwargs = broadcast_loader_kwargs(loader_kwargs, src=0)
+    return loader_kwargs
+
+
 def build_dataloader(dataset_cfg, class_names, batch_size, dist, root_path=None, workers=4,
                      logger=None, training=True, merge_all_iters_to_one_epoch=False, total_epochs=0):
 
+    if training and dataset_cfg.get('USE_SHARDS', False):
+        return build_shard_dataloader(
+            dataset_cfg, class_names, batch_size, dist, root_path=root_path, workers=workers, logger=logger,
+            merge_all_iters_to_one_epoch=merge_all_iters_to_one_epoch, total_epochs=total_epochs
+        )
+
     dataset = __all__[dataset_cfg.DATASET](
         dataset_cfg=dataset_cfg,
         class_names=class_names,
@@ -65,11 +153,18 @@ def build_dataloader(dataset_cfg, class_names, batch_size, dist, root_path=None,
         logger=logger,
     )
 
+    filter_empty_frames = training and dataset_cfg.get('FILTER_EMPTY_FRAMES', False)
+    if filter_empty_frames:
+        build_trainable_frame_index(dataset, class_names, logger)
+
     if merge_all_iters_to_one_epoch:
         assert hasattr(dataset, 'merge_all_iters_to_one_epoch')
         dataset.merge_all_iters_to_one_epoch(merge=True, epochs=total_epochs)
 
-    if dist:
+    if filter_empty_frames:
+        rank, world_size = common_utils.get_dist_info() if dist else (0, 1)
+        sampler = TrainableFrameSampler(dataset, world_size, rank, shuffle=True)
+    elif dist:
         if training:
             sampler = torch.utils.data.distributed.DistributedSampler(dataset)
         else:
@@ -77,10 +172,91 @@ def build_dataloader(dataset_cfg, class_names, batch_size, dist, root_path=None,
             sampler = DistributedSampler(dataset, world_size, rank, shuffle=False)
     else:
         sampler = None
-    dataloader = DataLoader(
-        dataset, batch_size=batch_size, pin_memory=True, num_workers=workers,
+    dataloader_args = dict(
         shuffle=(sampler is None) and training, collate_fn=dataset.collate_batch,
         drop_last=False, sampler=sampler, timeout=0
     )
+    loader_kwargs = build_loader_kwargs(
+        dataset, batch_size, dataset_cfg, workers, training, logger, dataloader_args, dist=dist
+    )
+    dataloader = DataLoader(dataset, batch_size=batch_size, **loader_kwargs, **dataloader_args)
 
     return dataset, dataloader, sampler
+
+
+def build_shard_dataloader(dataset_cfg, class_names, batch_size, dist, root_path=None, workers=4,
+                           logger=None, merge_all_iters_to_one_epoch=False, total_epochs=0):
+    dataset = ShardStreamDataset(
+        dataset_cfg=dataset_cfg,
+        class_names=class_names,
+        root_path=root_path,
+        training=True,
+        logger=logger,
+    )
+    rank, world_size = common_utils.get_dist_info() if dist else (0, 1)
+    dataset.set_distributed(rank, world_size, batch_size)
+
+    if merge_all_iters_to_one_epoch:
+        dataset.merge_all_iters_to_one_epoch(merge=True, epochs=total_epochs)
+
+    dataloader_args = dict(collate_fn=dataset.collate_batch, drop_last=False, timeout=0)
+    loader_kwargs = build_loader_kwargs(
+        dataset, batch_size, dataset_cfg, workers, True, logger, dataloader_args, dist=dist
+    )
+    dataloader = DataLoader(dataset, batch_size=batch_size, **loader_kwargs, **dataloader_args)
+
+    # the stream dataset splits and shuffles the shards itself, set_epoch is called on it in place of a sampler
+    return dataset, dataloader, dataset
+
+
+def build_semi_dataloader(dataset_cfg, class_names, batch_size, dist, root_path=None, workers=4, logger=None,
+                          merge_all_iters_to_one_epoch=False, total_epochs=0):
+    """
+    Labeled and unlabeled training loaders of the mean teacher training, split by the PARTITION_FUNC of the dataset.
+    Every sample of the loaders is a (teacher, student) pair of views (LABELED_DATA_FOR / UNLABELED_DATA_FOR).
+
+    Returns:
+        datasets, dataloaders, samplers: dicts with the keys labeled and unlabeled
+    """
+    semi_dataset_dict = _semi_dataset_dict[dataset_cfg.DATASET]
+    _, _, labeled_infos, unlabeled_infos = semi_dataset_dict['PARTITION_FUNC'](
+        dataset_cfg.INFO_PATH, dataset_cfg.DATA_SPLIT, dataset_cfg.DATA_PATH if root_path is None else root_path,
+        dataset_cfg.get('LABELED_RATIO', 1.0), logger
+    )
+
+    datasets, dataloaders, samplers = {}, {}, {}
+    for split, infos in [('labeled', labeled_infos), ('unlabeled', unlabeled_infos)]:
+        dataset = semi_dataset_dict[split.upper()](
+            dataset_cfg=dataset_cfg,
+            class_names=class_names,
+            infos=infos,
+            root_path=root_path,
+            training=True,
+            logger=logger,
+        )
+        # the unlabeled frames have no boxes to filter on
+        filter_empty_frames = split == 'labeled' and dataset_cfg.get('FILTER_EMPTY_FRAMES', False)
+        if filter_empty_frames:
+            build_trainable_frame_index(dataset, class_names, logger)
+
+        if merge_all_iters_to_one_epoch:
+            dataset.merge_all_iters_to_one_epoch(merge=True, epochs=total_epochs)
+
+        if filter_empty_frames:
+            rank, world_size = common_utils.get_dist_info() if dist else (0, 1)
+            sampler = TrainableFrameSampler(dataset, world_size, rank, shuffle=True)
+        elif dist:
+            sampler = torch.utils.data.distributed.DistributedSampler(dataset)
+        else:
+            sampler = None
+        dataloader_args = dict(
+            shuffle=sampler is None, collate_fn=dataset.collate_batch, drop_last=False, sampler=sampler, timeout=0
+        )
+        loader_kwargs = build_loader_kwargs(
+            dataset, batch_size, dataset_cfg, workers, True, logger, dataloader_args, dist=dist
+        )
+        datasets[split] = dataset
+        dataloaders[split] = DataLoader(dataset, batch_size=batch_size, **loader_kwargs, **dataloader_args)
+        samplers[split] = sampler
+
+    return datasets, dataloaders, samplers
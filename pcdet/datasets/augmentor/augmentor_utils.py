@@ -105,3 +105,125 @@ def global_translation(gt_boxes, points, noise_translate_std):
     gt_boxes[:, :3] += noise_translate
 
     return gt_boxes, points
+
+
+def sample_world_transform(aug_configs):
+    """
+    Samples the parameters of a sequence of world-level augmentations and composes them into a single transform.
+    The random draws happen in the same order and under the same conditions as in random_flip_along_x/y,
+    global_rotation, global_scaling and global_translation, so a fixed seed gives the same augmentation.
+    Args:
+        aug_configs: list of configs of random_world_flip / random_world_rotation / random_world_scaling /
+            random_world_translation, in the order they are applied
+    Returns:
+        transform: dict
+            affine: (4, 4) applied to [x, y, z, 1]
+            heading_sign, heading_offset: heading' = heading_sign * heading + heading_offset
+            velocity_matrix: (2, 2) applied to [vx, vy]
+            size_scale: scale applied to [dx, dy, dz]
+            params: the sampled parameters in the format of SSLDataAugmentor augmentation_params
+    """
+    affine = np.eye(4)
+    velocity_matrix = np.eye(2)
+    heading_sign, heading_offset, size_scale = 1.0, 0.0, 1.0
+    params = {}
+
+    for cur_cfg in aug_configs:
+        cur_affine = np.eye(4)
+        if cur_cfg['NAME'] == 'random_world_flip':
+            params['random_world_flip'] = []
+            for cur_axis in cur_cfg['ALONG_AXIS_LIST']:
+                assert cur_axis in ['x', 'y']
+                enable = np.random.choice([False, True], replace=False, p=[0.5, 0.5])
+                if not enable:
+                    continue
+                params['random_world_flip'].append(cur_axis)
+                flip_dim = 1 if cur_axis == 'x' else 0
+                cur_affine[flip_dim, flip_dim] *= -1
+                velocity_matrix[flip_dim] *= -1
+                heading_sign, heading_offset = -heading_sign, -heading_offset
+                if cur_axis == 'y':
+                    heading_offset -= np.pi
+        elif cur_cfg['NAME'] == 'random_world_rotation':
+            rot_range = cur_cfg['WORLD_ROT_ANGLE']
+            if not isinstance(rot_range, list):
+                rot_range = [-rot_range, rot_range]
+            noise_rotation = np.random.uniform(rot_range[0], rot_range[1])
+            params['random_world_rotation'] = noise_rotation
+            cosa, sina = np.cos(noise_rotation), np.sin(noise_rotation)
+            rot_matrix = np.array([[cosa, -sina], [sina, cosa]])
+            cur_affine[0:2, 0:2] = rot_matrix
+            velocity_matrix = rot_matrix @ velocity_matrix
+            heading_offset += noise_rotation
+        elif cur_cfg['NAME'] == 'random_world_scaling':
+            scale_range = cur_cfg['WORLD_SCALE_RANGE']
+            if scale_range[1] - scale_range[0] < 1e-3:
+                params['random_world_scaling'] = 1
+                continue
+            noise_scale = np.random.uniform(scale_range[0], scale_range[1])
+            params['random_world_scaling'] = noise_scale
+            cur_affine[0:3, 0:3] *= noise_scale
+            size_scale *= noise_scale
+        elif cur_cfg['NAME'] == 'random_world_translation':
+            noise_translate_std = cur_cfg['WORLD_TRANSLATE_STD']
+            if not isinstance(noise_translate_std, (list, tuple, np.ndarray)):
+                noise_translate_std = np.array(
+                    [noise_translate_std, noise_translate_std, noise_translate_std]
+                )
+            if all([e == 0 for e in noise_translate_std]):
+                continue
+            cur_affine[0:3, 3] = [np.random.normal(0, noise_translate_std[k], 1)[0] for k in range(3)]
+            params['random_world_translation'] = cur_affine[0:3, 3].copy()
+        else:
+            raise NotImplementedError(cur_cfg['NAME'])
+        affine = cur_affine @ affine
+
+    return {
+        'affine': affine,
+        'heading_sign': heading_sign,
+        'heading_offset': heading_offset,
+        'velocity_matrix': velocity_matrix,
+        'size_scale': size_scale,
+        'params': params,
+    }
+
+
+def get_relative_world_transform(src_transform, dst_transform):
+    """
+    Args:
+        src_transform, dst_transform: dicts from sample_world_transform, applied to the same input
+    Returns:
+        transform: dict in the format of sample_world_transform, maps the view of src_transform onto the view of
+            dst_transform
+    """
+    # the heading sign is +-1, its own inverse
+    heading_sign = dst_transform['heading_sign'] * src_transform['heading_sign']
+    return {
+        'affine': dst_transform['affine'] @ np.linalg.inv(src_transform['affine']),
+        'heading_sign': heading_sign,
+        'heading_offset': dst_transform['heading_offset'] - heading_sign * src_transform['heading_offset'],
+        'velocity_matrix': dst_transform['velocity_matrix'] @ np.linalg.inv(src_transform['velocity_matrix']),
+        'size_scale': dst_transform['size_scale'] / src_transform['size_scale'],
+    }
+
+
+def apply_world_transform(gt_boxes, points, transform):
+    """
+    Args:
+        gt_boxes: (N, 7 + C), [x, y, z, dx, dy, dz, heading, [vx], [vy]]
+        points: (M, 3 + C)
+        transform: dict from sample_world_transform
+    Returns:
+    """
+    rot = transform['affine'][0:3, 0:3].T
+    trans = transform['affine'][0:3, 3]
+
+    points[:, 0:3] = points[:, 0:3] @ rot.astype(points.dtype) + trans.astype(points.dtype)
+
+    gt_boxes[:, 0:3] = gt_boxes[:, 0:3] @ rot.astype(gt_boxes.dtype) + trans.astype(gt_boxes.dtype)
+    gt_boxes[:, 3:6] *= transform['size_scale']
+    gt_boxes[:, 6] = transform['heading_sign'] * gt_boxes[:, 6] + transform['heading_offset']
+    if gt_boxes.shape[1] > 7:
+        gt_boxes[:, 7:9] = gt_boxes[:, 7:9] @ transform['velocity_matrix'].T.astype(gt_boxes.dtype)
+
+    return gt_boxes, points
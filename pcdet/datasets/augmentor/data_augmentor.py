@@ -1,11 +1,15 @@
 from functools import partial
 
 import numpy as np
+from easydict import EasyDict
 
 from ...utils import common_utils
 from . import augmentor_utils, database_sampler
 
 
+WORLD_AUG_NAMES = ['random_world_flip', 'random_world_rotation', 'random_world_scaling', 'random_world_translation']
+
+
 class DataAugmentor(object):
     def __init__(self, root_path, augmentor_configs, class_names, logger=None):
         self.root_path = root_path
@@ -16,13 +20,32 @@ class DataAugmentor(object):
         aug_config_list = augmentor_configs if isinstance(augmentor_configs, list) \
             else augmentor_configs.AUG_CONFIG_LIST
 
+        if not isinstance(augmentor_configs, list):
+            aug_config_list = [
+                cur_cfg for cur_cfg in aug_config_list if cur_cfg.NAME not in augmentor_configs.DISABLE_AUG_LIST
+            ]
+            if augmentor_configs.get('FUSE_WORLD_AUG', False):
+                aug_config_list = self.fuse_world_aug_configs(aug_config_list)
+
         for cur_cfg in aug_config_list:
-            if not isinstance(augmentor_configs, list):
-                if cur_cfg.NAME in augmentor_configs.DISABLE_AUG_LIST:
-                    continue
             cur_augmentor = getattr(self, cur_cfg.NAME)(config=cur_cfg)
             self.data_augmentor_queue.append(cur_augmentor)
 
+    @staticmethod
+    def fuse_world_aug_configs(aug_config_list):
+        """
+        Merges every run of consecutive world-level augmentations into one random_world_transform stage.
+        """
+        fused_config_list = []
+        for cur_cfg in aug_config_list:
+            if cur_cfg.NAME not in WORLD_AUG_NAMES:
+                fused_config_list.append(cur_cfg)
+            elif len(fused_config_list) > 0 and fused_config_list[-1].NAME == 'random_world_transform':
+                fused_config_list[-1].AUG_CONFIG_LIST.append(cur_cfg)
+            else:
+                fused_config_list.append(EasyDict({'NAME': 'random_world_transform', 'AUG_CONFIG_LIST': [cur_cfg]}))
+        return fused_config_list
+
     def gt_sampling(self, config=None):
         db_sampler = database_sampler.DataBaseSampler(
             root_path=self.root_path,
@@ -88,6 +111,21 @@ class DataAugmentor(object):
         data_dict['points'] = points
         return data_dict
 
+    def random_world_transform(self, data_dict=None, config=None):
+        """
+        Flip, rotation, scaling and translation composed into one transform and applied in a single pass.
+        """
+        if data_dict is None:
+            return partial(self.random_world_transform, config=config)
+        transform = augmentor_utils.sample_world_transform(config['AUG_CONFIG_LIST'])
+        gt_boxes, points = augmentor_utils.apply_world_transform(
+            data_dict['gt_boxes'], data_dict['points'], transform
+        )
+
+        data_dict['gt_boxes'] = gt_boxes
+        data_dict['points'] = points
+        return data_dict
+
     def forward(self, data_dict):
         """
         Args:
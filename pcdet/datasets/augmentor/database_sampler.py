@@ -39,6 +39,13 @@ class DataBaseSampler(object):
                 'indices': np.arange(len(self.db_infos[class_name]))
             }
 
+        # per-class pools of the boxes, the collisions of all the classes are found with one BEV IoU call
+        self.pooled_sampling = sampler_cfg.get('POOLED_SAMPLING', False)
+        if self.pooled_sampling:
+            self.db_boxes = {}
+            for class_name in self.sample_groups.keys():
+                self.db_boxes[class_name] = self.build_pool(self.db_infos[class_name])
+
     def __getstate__(self):
         d = dict(self.__dict__)
         del d['logger']
@@ -76,6 +83,21 @@ class DataBaseSampler(object):
 
         return db_infos
 
+    def build_pool(self, infos):
+        """
+        Args:
+            infos: database infos of a class
+        Returns:
+            boxes: (N, 7 + C) box3d_lidar of the infos
+        """
+        if len(infos) == 0:
+            return np.zeros((0, 7), dtype=np.float32)
+
+        boxes = np.stack([x['box3d_lidar'] for x in infos], axis=0).astype(np.float32)
+        if self.sampler_cfg.get('DATABASE_WITH_FAKELIDAR', False):
+            boxes = box_utils.boxes3d_kitti_fakelidar_to_lidar(boxes)
+        return boxes
+
     def sample_with_fixed_number(self, class_name, sample_group):
         """
         Args:
@@ -83,17 +105,28 @@ class DataBaseSampler(object):
             sample_group:
         Returns:
 
+        """
+        indices = self.sample_indices_with_fixed_number(class_name, sample_group)
+        return [self.db_infos[class_name][idx] for idx in indices]
+
+    def sample_indices_with_fixed_number(self, class_name, sample_group):
+        """
+        Args:
+            class_name:
+            sample_group:
+        Returns:
+            indices: of the sampled infos of the class
         """
         sample_num, pointer, indices = int(sample_group['sample_num']), sample_group['pointer'], sample_group['indices']
         if pointer >= len(self.db_infos[class_name]):
             indices = np.random.permutation(len(self.db_infos[class_name]))
             pointer = 0
 
-        sampled_dict = [self.db_infos[class_name][idx] for idx in indices[pointer: pointer + sample_num]]
+        sampled_indices = indices[pointer: pointer + sample_num]
         pointer += sample_num
         sample_group['pointer'] = pointer
         sample_group['indices'] = indices
-        return sampled_dict
+        return sampled_indices
 
     @staticmethod
     def put_boxes_on_road_planes(gt_boxes, road_planes, calib):
@@ -164,16 +197,42 @@ class DataBaseSampler(object):
 
         Returns:
 
+        """
+        if self.pooled_sampling:
+            sampled_gt_boxes, total_valid_sampled_dict = self.sample_boxes_pooled(data_dict)
+        else:
+            sampled_gt_boxes, total_valid_sampled_dict = self.sample_boxes(data_dict)
+
+        if total_valid_sampled_dict.__len__() > 0:
+            data_dict = self.add_sampled_boxes_to_scene(data_dict, sampled_gt_boxes, total_valid_sampled_dict)
+
+        data_dict.pop('gt_boxes_mask')
+        return data_dict
+
+    def get_sample_num(self, class_name, sample_group, gt_names):
+        if self.limit_whole_scene:
+            num_gt = np.sum(class_name == gt_names)
+            sample_group['sample_num'] = str(int(self.sample_class_num[class_name]) - num_gt)
+        return int(sample_group['sample_num'])
+
+    def sample_boxes(self, data_dict):
+        """
+        Samples the classes one after the other, a sampled box is kept if it has no BEV overlap with the boxes of
+        the scene, the kept boxes of the previous classes and the other sampled boxes of its class
+        Args:
+            data_dict:
+                gt_boxes: (N, 7 + C) [x, y, z, dx, dy, dz, heading, ...]
+                gt_names: (N)
+        Returns:
+            sampled_gt_boxes: (M, 7 + C)
+            total_valid_sampled_dict: M database infos
         """
         gt_boxes = data_dict['gt_boxes']
         gt_names = data_dict['gt_names'].astype(str)
         existed_boxes = gt_boxes
         total_valid_sampled_dict = []
         for class_name, sample_group in self.sample_groups.items():
-            if self.limit_whole_scene:
-                num_gt = np.sum(class_name == gt_names)
-                sample_group['sample_num'] = str(int(self.sample_class_num[class_name]) - num_gt)
-            if int(sample_group['sample_num']) > 0:
+            if self.get_sample_num(class_name, sample_group, gt_names) > 0:
                 sampled_dict = self.sample_with_fixed_number(class_name, sample_group)
 
                 sampled_boxes = np.stack([x['box3d_lidar'] for x in sampled_dict], axis=0).astype(np.float32)
@@ -193,8 +252,51 @@ class DataBaseSampler(object):
                 total_valid_sampled_dict.extend(valid_sampled_dict)
 
         sampled_gt_boxes = existed_boxes[gt_boxes.shape[0]:, :]
-        if total_valid_sampled_dict.__len__() > 0:
-            data_dict = self.add_sampled_boxes_to_scene(data_dict, sampled_gt_boxes, total_valid_sampled_dict)
+        return sampled_gt_boxes, total_valid_sampled_dict
 
-        data_dict.pop('gt_boxes_mask')
-        return data_dict
+    def sample_boxes_pooled(self, data_dict):
+        """
+        sample_boxes on the pools: the BEV IoUs of all the sampled boxes against the sampled boxes and the scene are
+        computed in one boxes_bev_iou_cpu call, then the classes are accepted in order on the masks
+        Args:
+            data_dict:
+                gt_boxes: (N, 7 + C) [x, y, z, dx, dy, dz, heading, ...]
+                gt_names: (N)
+        Returns:
+            sampled_gt_boxes: (M, 7 + C)
+            total_valid_sampled_dict: M database infos
+        """
+        gt_boxes = data_dict['gt_boxes']
+        gt_names = data_dict['gt_names'].astype(str)
+        class_names, class_indices = [], []
+        for class_name, sample_group in self.sample_groups.items():
+            if self.get_sample_num(class_name, sample_group, gt_names) > 0:
+                class_names.append(class_name)
+                class_indices.append(self.sample_indices_with_fixed_number(class_name, sample_group))
+
+        if len(class_names) == 0:
+            return gt_boxes[0:0], []
+
+        sampled_boxes = np.concatenate([self.db_boxes[x][idx] for x, idx in zip(class_names, class_indices)], axis=0)
+        group_ids = np.concatenate([np.full(len(idx), k) for k, idx in enumerate(class_indices)], axis=0)
+        num_sampled = sampled_boxes.shape[0]
+
+        # the rows are the sampled boxes, as the first argument of the per-class calls of sample_boxes
+        overlap = iou3d_nms_utils.boxes_bev_iou_cpu(
+            sampled_boxes[:, 0:7], np.concatenate([sampled_boxes[:, 0:7], gt_boxes[:, 0:7]], axis=0)
+        ) > 0
+        valid_mask = ~overlap[:, num_sampled:].any(axis=1)
+        overlap = overlap[:, :num_sampled]
+        np.fill_diagonal(overlap, False)
+        # a box colliding with another sampled box of its class is dropped even if that one is dropped too
+        valid_mask &= ~(overlap & (group_ids[:, None] == group_ids[None, :])).any(axis=1)
+        for k in range(1, len(class_names)):
+            cur_mask = group_ids == k
+            kept_before = valid_mask & (group_ids < k)
+            valid_mask[cur_mask] &= ~overlap[cur_mask][:, kept_before].any(axis=1)
+
+        total_valid_sampled_dict = []
+        for k, (class_name, indices) in enumerate(zip(class_names, class_indices)):
+            valid_indices = indices[valid_mask[group_ids == k]]
+            total_valid_sampled_dict.extend([self.db_infos[class_name][idx] for idx in valid_indices])
+        return sampled_boxes[valid_mask], total_valid_sampled_dict
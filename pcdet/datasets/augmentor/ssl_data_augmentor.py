@@ -3,8 +3,11 @@ import numpy as np
 import copy
 
 from ...utils import common_utils
+from . import augmentor_utils
 from .ssl_database_sampler import SSLDataBaseSampler
 
+WORLD_AUG_NAMES = ['random_world_flip', 'random_world_rotation', 'random_world_scaling']
+
 class SSLDataAugmentor(object):
     def __init__(self, root_path, augmentor_configs, class_names, logger=None):
         self.root_path = root_path
@@ -12,6 +15,7 @@ class SSLDataAugmentor(object):
         self.logger = logger
 
         self.aug_list = []
+        self.aug_config_list = []
         self.augmentor_queue = []
         aug_config_list = augmentor_configs.AUG_CONFIG_LIST
         for cur_cfg in aug_config_list:
@@ -20,6 +24,25 @@ class SSLDataAugmentor(object):
             cur_augmentor = getattr(self, cur_cfg.NAME)(config=cur_cfg)
             self.augmentor_queue.append(cur_augmentor)
             self.aug_list.append(cur_cfg.NAME)
+            self.aug_config_list.append(cur_cfg)
+
+    @property
+    def world_transform_only(self):
+        """
+        Whether the augmentations are world-level flips, rotations and scalings only, so that a view is a single
+        transform of the input (see sample_world_transform).
+        """
+        return all([name in WORLD_AUG_NAMES for name in self.aug_list])
+
+    def sample_world_transform(self):
+        """
+        Draws the augmentations of the queue in the same order and under the same conditions as forward, composed
+        into one transform, only valid if world_transform_only.
+        Returns:
+            transform: dict from augmentor_utils.sample_world_transform
+        """
+        assert self.world_transform_only, self.aug_list
+        return augmentor_utils.sample_world_transform(self.aug_config_list)
 
     def gt_sampling(self, config=None):
         db_sampler = SSLDataBaseSampler(
@@ -0,0 +1,140 @@
+import time
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import DataLoader
+
+
+def get_loader_kwargs(loader_cfg, workers):
+    """
+    Args:
+        loader_cfg: DATA_CONFIG.DATALOADER, optional
+            PERSISTENT_WORKERS: keep the worker pool (and the dataset copies) alive across epochs, default False
+            PREFETCH_FACTOR: batches loaded in advance by every worker
+            PIN_MEMORY:
+        workers: number of worker processes
+
+    Returns:
+        loader_kwargs: dict, keyword arguments of DataLoader
+    """
+    loader_cfg = loader_cfg if loader_cfg is not None else {}
+    loader_kwargs = {'num_workers': workers, 'pin_memory': loader_cfg.get('PIN_MEMORY', True)}
+    if workers > 0:
+        loader_kwargs['persistent_workers'] = loader_cfg.get('PERSISTENT_WORKERS', False)
+        loader_kwargs['prefetch_factor'] = loader_cfg.get('PREFETCH_FACTOR', 2)
+    return loader_kwargs
+
+
+def build_sleep_consumer(step_time):
+    """
+    Stands in for the training step, the model is not built yet when the dataloader is tuned: copies the batch to
+    the GPU when there is one and then waits step_time seconds (DATALOADER.AUTOTUNE_STEP_TIME, an estimate of the
+    training step time, not a measured one).
+    """
+    def consumer(batch):
+        if torch.cuda.is_available():
+            for val in batch.values():
+                if isinstance(val, np.ndarray) and val.dtype.kind in 'biuf':
+                    val = torch.from_numpy(val)
+                if isinstance(val, torch.Tensor):
+                    val.cuda(non_blocking=True)
+            torch.cuda.synchronize()
+        time.sleep(step_time)
+
+    return consumer
+
+
+def profile_dataloader(dataset, batch_size, loader_kwargs, consumer, num_batches, **dataloader_args):
+    """
+    Returns:
+        wait_time: mean time the consumer is blocked on the next batch, worker start-up excluded
+        step_time: mean time of the consumer
+    """
+    loader_kwargs = dict(loader_kwargs)
+    loader_kwargs.pop('persistent_workers', None)
+    dataloader = DataLoader(dataset, batch_size=batch_size, **loader_kwargs, **dataloader_args)
+
+    dataloader_iter = iter(dataloader)
+    consumer(next(dataloader_iter))
+    wait_time, step_time, num_steps = 0, 0, 0
+    for _ in range(num_batches):
+        start = time.perf_counter()
+        try:
+            batch = next(dataloader_iter)
+        except StopIteration:
+            break
+        fetched = time.perf_counter()
+        consumer(batch)
+        wait_time += fetched - start
+        step_time += time.perf_counter() - fetched
+        num_steps += 1
+    del dataloader_iter
+
+    return wait_time / max(num_steps, 1), step_time / max(num_steps, 1)
+
+
+def broadcast_loader_kwargs(loader_kwargs, src=0):
+    """
+    All ranks load the same amount of data per step, the setting tuned on rank src is used by all of them.
+    """
+    object_list = [loader_kwargs]
+    dist.broadcast_object_list(object_list, src=src)
+    return object_list[0]
+
+
+def autotune_dataloader(dataset, batch_size, max_workers, consumer, loader_cfg=None, num_batches=20,
+                        tolerance=0.05, logger=None, **dataloader_args):
+    """
+    Profiles candidate (num_workers, prefetch_factor, pin_memory) settings from the cheapest one upwards and picks
+    the first one that keeps the consumer fed, i.e. the consumer waits less than tolerance * its own step time.
+    Falls back to the setting with the least waiting if none of them does.
+
+    Args:
+        dataset:
+        batch_size:
+        max_workers: upper bound of num_workers
+        consumer: callable(batch), the training step or a stand-in of it (build_sleep_consumer)
+        loader_cfg: DATA_CONFIG.DATALOADER, PERSISTENT_WORKERS is kept from it and defaults to True here, the
+            tuned loader is the training loader that is iterated every epoch
+        num_batches: profiled batches of every candidate
+        tolerance:
+        **dataloader_args: sampler, shuffle, collate_fn, ... forwarded to DataLoader
+
+    Returns:
+        loader_kwargs: dict, keyword arguments of DataLoader
+    """
+    loader_cfg = loader_cfg if loader_cfg is not None else {}
+    worker_candidates = sorted(set([0] + [2 ** k for k in range(max_workers.bit_length()) if 2 ** k < max_workers]
+                                   + [max_workers]))
+    prefetch_candidates = loader_cfg.get('AUTOTUNE_PREFETCH_FACTORS', [2, 4])
+    pin_candidates = [False, True] if torch.cuda.is_available() else [False]
+
+    candidates = []
+    for workers in worker_candidates:
+        for prefetch_factor in (prefetch_candidates if workers > 0 else [None]):
+            for pin_memory in pin_candidates:
+                candidates.append((workers, prefetch_factor, pin_memory))
+
+    best_kwargs, best_wait_ratio = None, float('inf')
+    for workers, prefetch_factor, pin_memory in candidates:
+        loader_kwargs = get_loader_kwargs(
+            {'PERSISTENT_WORKERS': True, **loader_cfg, 'PREFETCH_FACTOR': prefetch_factor, 'PIN_MEMORY': pin_memory},
+            workers
+        )
+        wait_time, step_time = profile_dataloader(
+            dataset, batch_size, loader_kwargs, consumer, num_batches, **dataloader_args
+        )
+        wait_ratio = wait_time / max(step_time, 1e-6)
+        if logger is not None:
+            logger.info('DataLoader autotune: workers=%d, prefetch_factor=%s, pin_memory=%s: '
+                        'wait %.1fms / step %.1fms' % (workers, prefetch_factor, pin_memory,
+                                                       wait_time * 1000, step_time * 1000))
+        if wait_ratio < best_wait_ratio:
+            best_kwargs, best_wait_ratio = loader_kwargs, wait_ratio
+        if wait_ratio <= tolerance:
+            break
+
+    if logger is not None:
+        logger.info('DataLoader autotune picked %s' % best_kwargs)
+    return best_kwargs
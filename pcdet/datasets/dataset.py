@@ -4,13 +4,14 @@ from pathlib import Path
 import numpy as np
 import torch.utils.data as torch_data
 
-from ..utils import common_utils
+from ..utils import common_utils, tta_utils
 from .augmentor.data_augmentor import DataAugmentor
+from .frame_sampling import TrainableFrameMixin
 from .processor.data_processor import DataProcessor
 from .processor.point_feature_encoder import PointFeatureEncoder
 
 
-class DatasetTemplate(torch_data.Dataset):
+class DatasetTemplate(TrainableFrameMixin, torch_data.Dataset):
     def __init__(self, dataset_cfg=None, class_names=None, training=True, root_path=None, logger=None):
         super().__init__()
         self.dataset_cfg = dataset_cfg
@@ -39,6 +40,9 @@ class DatasetTemplate(torch_data.Dataset):
         self.total_epochs = 0
         self._merge_all_iters_to_one_epoch = False
 
+        tta_cfg = self.dataset_cfg.get('TEST_TIME_AUGMENTATION', None)
+        self.tta_views = tta_utils.get_tta_views(tta_cfg) if tta_cfg is not None and not self.training else None
+
     @property
     def mode(self):
         return 'train' if self.training else 'test'
@@ -113,7 +117,14 @@ class DatasetTemplate(torch_data.Dataset):
                 voxel_coords: optional (num_voxels, 3)
                 voxel_num_points: optional (num_voxels)
                 ...
+                tta_views: optional, list of the data_dicts of the other test-time augmented views, see tta_utils
         """
+        if self.tta_views is not None and not self.training:
+            view_dicts = [{
+                **{key: val for key, val in data_dict.items() if key not in ['gt_boxes', 'gt_names']},
+                'points': tta_utils.transform_points(data_dict['points'], view), 'tta_view': view
+            } for view in self.tta_views[1:]]
+
         if self.training:
             assert 'gt_boxes' in data_dict, 'gt_boxes should be provided for training'
             gt_boxes_mask = np.array([n in self.class_names for n in data_dict['gt_names']], dtype=np.bool_)
@@ -125,8 +136,7 @@ class DatasetTemplate(torch_data.Dataset):
                 }
             )
             if len(data_dict['gt_boxes']) == 0:
-                new_index = np.random.randint(self.__len__())
-                return self.__getitem__(new_index)
+                return self.resample_empty_frame()
 
         if data_dict.get('gt_boxes', None) is not None:
             selected = common_utils.keep_arrays_by_name(data_dict['gt_names'], self.class_names)
@@ -143,28 +153,36 @@ class DatasetTemplate(torch_data.Dataset):
         )
         data_dict.pop('gt_names', None)
 
+        if self.tta_views is not None and not self.training:
+            data_dict['tta_view'] = self.tta_views[0]
+            data_dict['tta_views'] = [
+                self.data_processor.forward(data_dict=self.point_feature_encoder.forward(view_dict))
+                for view_dict in view_dicts
+            ]
         return data_dict
 
     @staticmethod
     def collate_batch(batch_list, _unused=False):
         data_dict = defaultdict(list)
-        use_double_flip_test = False
+        num_views = 1
         for cur_sample in batch_list:
+            # test-time augmentation, the views follow the sample like the double flip ones
+            if isinstance(cur_sample, dict) and 'tta_views' in cur_sample:
+                cur_sample = dict(cur_sample)
+                cur_sample = (cur_sample, *cur_sample.pop('tta_views'))
             # common batch dict
             if isinstance(cur_sample, dict):
                 for key, val in cur_sample.items():
                     data_dict[key].append(val)
             # double flip test
             elif isinstance(cur_sample, tuple):
-                use_double_flip_test = True
-                i_dict, y_dict, x_dict, d_dict = cur_sample
+                num_views = len(cur_sample)
+                i_dict = cur_sample[0]
                 for key in i_dict.keys():
                     # save only one copy of annotations
                     if key not in ['gt_boxes', 'frame_id', 'metadata']:
-                        data_dict[key].append(i_dict[key])
-                        data_dict[key].append(y_dict[key])
-                        data_dict[key].append(x_dict[key])
-                        data_dict[key].append(d_dict[key])
+                        for view_dict in cur_sample:
+                            data_dict[key].append(view_dict.get(key, i_dict[key]))
                     else:
                         data_dict[key].append(i_dict[key])
             else:
@@ -197,5 +215,5 @@ class DatasetTemplate(torch_data.Dataset):
                 print('Error in collate_batch: key=%s' % key)
                 raise TypeError
 
-        ret['batch_size'] = batch_size * 4 if use_double_flip_test else batch_size
+        ret['batch_size'] = batch_size * num_views
         return ret
@@ -0,0 +1,107 @@
+import numpy as np
+
+from ..utils import common_utils
+
+
+class EmptyFrameError(Exception):
+    """
+    Raised by resample_empty_frame inside its own retry loop, unwinds to that loop instead of recursing.
+    """
+
+
+def add_resample_count(sample, num_resamples):
+    """
+    Tags a re-sampled sample with the number of frames drawn for it, collated into batch['num_resamples'], so the
+    counts of all the workers reach the training loop with the batches. Only the first view of a tuple of views
+    (teacher / student) is tagged, a frame is counted once.
+    """
+    views = sample if isinstance(sample, tuple) else (sample,)
+    for view in views:
+        if isinstance(view, dict):
+            view['num_resamples'] = num_resamples
+            break
+    return sample
+
+
+def pop_resample_count(batch):
+    """
+    Args:
+        batch: collated batch, or a tuple of them (teacher / student, labeled / unlabeled), None views are skipped
+
+    Returns:
+        num_resamples: frames re-sampled by resample_empty_frame for the batch, the key is removed from the batch
+    """
+    if isinstance(batch, dict):
+        return int(np.sum(batch.pop('num_resamples', 0)))
+    if isinstance(batch, (tuple, list)):
+        return sum([pop_resample_count(x) for x in batch])
+    return 0
+
+
+class TrainableFrameMixin(object):
+    """
+    Trainable frame index and bounded re-sampling of empty frames, shared by DatasetTemplate and SemiDatasetTemplate.
+    """
+    trainable_frame_inds = None
+    num_empty_frames = None
+    _resampling = False
+
+    def get_frame_gt_names(self, index):
+        """
+        To support the trainable frame index, implement this function to return the annotated names of a frame
+        from its info only, without loading the point cloud.
+
+        Args:
+            index:
+
+        Returns:
+            gt_names: (N), string, None if the frame is not annotated
+        """
+        raise NotImplementedError
+
+    def build_trainable_frame_index(self):
+        """
+        Count the boxes of self.class_names in every frame from the infos, frames without any of them are
+        skipped by the sampler instead of being loaded, augmented and re-sampled in prepare_data.
+        Should be called before merge_all_iters_to_one_epoch.
+
+        Returns:
+            box_counts: (num_frames), number of boxes of self.class_names in each frame
+        """
+        assert not self._merge_all_iters_to_one_epoch
+        box_counts = np.zeros(len(self), dtype=np.int32)
+        for index in range(len(self)):
+            gt_names = self.get_frame_gt_names(index)
+            if gt_names is not None:
+                box_counts[index] = len(common_utils.keep_arrays_by_name(gt_names, self.class_names))
+        self.trainable_frame_inds = np.nonzero(box_counts > 0)[0]
+        self.num_empty_frames = len(box_counts) - len(self.trainable_frame_inds)
+        return box_counts
+
+    def sample_trainable_index(self):
+        if self.trainable_frame_inds is not None and len(self.trainable_frame_inds) > 0:
+            return int(np.random.choice(self.trainable_frame_inds))
+        return np.random.randint(self.__len__())
+
+    def resample_empty_frame(self):
+        """
+        Fallback for frames whose boxes are all removed by the augmentation, another trainable frame is drawn
+        at most MAX_RESAMPLE_TRIES times in a loop. A frame loaded by the loop that is empty again unwinds to it
+        with EmptyFrameError, so the stack does not grow with the number of tries. The returned sample carries the
+        number of tries, see add_resample_count.
+        """
+        if self._resampling:
+            raise EmptyFrameError
+
+        max_tries = self.dataset_cfg.get('MAX_RESAMPLE_TRIES', 10)
+        self._resampling = True
+        try:
+            for num_tries in range(1, max_tries + 1):
+                try:
+                    sample = self.__getitem__(self.sample_trainable_index())
+                except EmptyFrameError:
+                    continue
+                return add_resample_count(sample, num_tries)
+        finally:
+            self._resampling = False
+        raise RuntimeError('No trainable frame after %d re-samples' % max_tries)
@@ -117,6 +117,10 @@ class HuaweiDataset(DatasetTemplate):
             painted[mask] = proj_scores.numpy()
         return np.concatenate([points, painted], axis=1)
 
+    def get_frame_gt_names(self, index):
+        info = self.huawei_infos[index]
+        return info['annos']['name'] if 'annos' in info else None
+
     def __len__(self):
         if self._merge_all_iters_to_one_epoch:
             return len(self.huawei_infos) * self.total_epochs
@@ -127,6 +131,12 @@ class HuaweiDataset(DatasetTemplate):
         if self._merge_all_iters_to_one_epoch:
             index = index % len(self.huawei_infos)
 
+        input_dict = self.get_input_dict(index)
+        data_dict = self.prepare_data(data_dict=input_dict)
+        data_dict.pop('num_points_in_gt', None)
+        return data_dict
+
+    def get_input_dict(self, index):
         info = copy.deepcopy(self.huawei_infos[index])
         frame_id = info['frame_id']
         seq_id = info['sequence_id']
@@ -148,9 +158,7 @@ class HuaweiDataset(DatasetTemplate):
                 'num_points_in_gt': annos.get('num_points_in_gt', None)
             })
 
-        data_dict = self.prepare_data(data_dict=input_dict)
-        data_dict.pop('num_points_in_gt', None)
-        return data_dict
+        return input_dict
 
     def get_infos(self, num_workers=4, sample_seq_list=None):
         import concurrent.futures as futures
@@ -316,14 +324,14 @@ class HuaweiDataset(DatasetTemplate):
             gt_boxes = annos['boxes_3d']
 
             num_obj = gt_boxes.shape[0]
-            point_indices = roiaware_pool3d_utils.points_in_boxes_cpu(
+            box_ptr, pts_idx = roiaware_pool3d_utils.points_in_boxes_csr_cpu(
                 torch.from_numpy(points[:, 0:3]), torch.from_numpy(gt_boxes)
-            ).numpy()  # (nboxes, npoints)
+            )  # (nboxes + 1), (npoints in boxes)
 
             for i in range(num_obj):
                 filename = '%s_%s_%d.bin' % (frame_id, names[i], i)
                 filepath = database_save_path / filename
-                gt_points = points[point_indices[i] > 0]
+                gt_points = points[pts_idx[box_ptr[i]:box_ptr[i + 1]].numpy()]
 
                 gt_points[:, :3] -= gt_boxes[i, :3]
                 with open(filepath, 'w') as f:
@@ -3,6 +3,7 @@ import pickle
 import numpy as np
 from pathlib import Path
 from ..semi_dataset import SemiDatasetTemplate
+from .huawei_dataset import HuaweiDataset
 from .huawei_toolkits import Octopus
 
 def split_huawei_semi_data(info_paths, data_splits, root_path, labeled_ratio, logger):
@@ -75,6 +76,9 @@ class HuaweiSemiDataset(SemiDatasetTemplate):
     def project_lidar_to_image(self, sequence_id, frame_id):
         return self.toolkits.project_lidar_to_image(sequence_id, frame_id)
 
+    # both read the names from self.huawei_infos
+    get_frame_gt_names = HuaweiDataset.get_frame_gt_names
+
     def __len__(self):
         if self._merge_all_iters_to_one_epoch:
             return len(self.huawei_infos) * self.total_epochs
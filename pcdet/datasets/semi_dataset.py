@@ -5,13 +5,19 @@ import numpy as np
 import torch.utils.data as torch_data
 
 from ..utils import common_utils
+from .augmentor import augmentor_utils
 from .augmentor.data_augmentor import DataAugmentor
 from .augmentor.ssl_data_augmentor import SSLDataAugmentor
+from .frame_sampling import TrainableFrameMixin
 from .processor.data_processor import DataProcessor
 from .processor.point_feature_encoder import PointFeatureEncoder
 
 
-class SemiDatasetTemplate(torch_data.Dataset):
+# processors that commute with an axis flip of a point cloud range symmetric along the axis
+DERIVABLE_PROCESSORS = ['mask_points_and_boxes_outside_range', 'shuffle_points', 'transform_points_to_voxels']
+
+
+class SemiDatasetTemplate(TrainableFrameMixin, torch_data.Dataset):
     def __init__(self, dataset_cfg=None, class_names=None, training=True, root_path=None, logger=None):
         super().__init__()
         self.dataset_cfg = dataset_cfg
@@ -50,6 +56,16 @@ class SemiDatasetTemplate(torch_data.Dataset):
             self.root_path, self.dataset_cfg.STUDENT_AUGMENTOR, self.class_names, logger=self.logger
         ) if self.training else None
 
+        # teacher and student views as transforms of one preprocessed sample, see prepare_data_ssl_shared
+        self.shared_view = self.training and self.dataset_cfg.get('SHARED_VIEW_PREPROCESSING', False) and \
+            self.teacher_augmentor.world_transform_only and self.student_augmentor.world_transform_only
+        if self.training and self.dataset_cfg.get('SHARED_VIEW_PREPROCESSING', False) and not self.shared_view \
+                and self.logger is not None:
+            self.logger.info('SHARED_VIEW_PREPROCESSING is ignored, the teacher or student augmentations are not '
+                             'only world flips, rotations and scalings')
+        processor_names = [cur_cfg.NAME for cur_cfg in self.dataset_cfg.DATA_PROCESSOR]
+        self.derivable_processors = all([name in DERIVABLE_PROCESSORS for name in processor_names])
+
         self.grid_size = self.data_processor.grid_size
         self.voxel_size = self.data_processor.voxel_size
         self.total_epochs = 0
@@ -141,8 +157,7 @@ class SemiDatasetTemplate(torch_data.Dataset):
                 }
             )
             if len(data_dict['gt_boxes']) == 0:
-                new_index = np.random.randint(self.__len__())
-                return self.__getitem__(new_index)
+                return self.resample_empty_frame()
 
         if data_dict.get('gt_boxes', None) is not None:
             selected = common_utils.keep_arrays_by_name(data_dict['gt_names'], self.class_names)
@@ -182,6 +197,9 @@ class SemiDatasetTemplate(torch_data.Dataset):
                 voxel_num_points: optional (num_voxels)
                 ...
         """
+        if self.shared_view:
+            return self.prepare_data_ssl_shared(data_dict, output_dicts)
+
         if 'gt_boxes' in data_dict:
             gt_boxes_mask = np.array([n in self.class_names for n in data_dict['gt_names']], dtype=np.bool_)
             data_dict={
@@ -208,8 +226,7 @@ class SemiDatasetTemplate(torch_data.Dataset):
 
             if 'gt_boxes' in data_dict:
                 if len(data_dict['gt_boxes']) == 0:
-                    new_index = np.random.randint(self.__len__())
-                    return self.__getitem__(new_index)
+                    return self.resample_empty_frame()
 
                 selected = common_utils.keep_arrays_by_name(data_dict['gt_names'], self.class_names)
                 data_dict['gt_boxes'] = data_dict['gt_boxes'][selected]
@@ -227,6 +244,134 @@ class SemiDatasetTemplate(torch_data.Dataset):
 
         return teacher_data_dict, student_data_dict
 
+    def prepare_data_ssl_shared(self, data_dict, output_dicts):
+        """
+        prepare_data_ssl for teacher and student augmentations made of world flips, rotations and scalings only
+        (DATA_CONFIG.SHARED_VIEW_PREPROCESSING). The sample is filtered and encoded once and every view is a single
+        transform of it: only the points and boxes are copied, the other arrays are shared by the views instead of
+        deep copied. The student view is derived from the processed teacher view when the transform between them is
+        an axis flip the processors commute with, it is processed on its own otherwise.
+
+        Args:
+            data_dict: see prepare_data_ssl
+            output_dicts: views to return, 'teacher' and / or 'student'
+
+        Returns:
+            teacher_data_dict, student_data_dict: see prepare_data_ssl, plus
+                world_affine: (4, 4) transform of [x, y, z, 1] from the sample to the view
+                world_heading: (2) [sign, offset], heading in the view = sign * heading + offset
+        """
+        data_dict = dict(data_dict)
+        if 'gt_boxes' in data_dict:
+            gt_boxes_mask = np.array([n in self.class_names for n in data_dict['gt_names']], dtype=np.bool_)
+            if self.share_augmentor is not None:
+                data_dict = self.share_augmentor.forward({**data_dict, 'gt_boxes_mask': gt_boxes_mask})
+            else:
+                data_dict['gt_boxes'] = data_dict['gt_boxes'][gt_boxes_mask]
+                data_dict['gt_names'] = data_dict['gt_names'][gt_boxes_mask]
+            if len(data_dict['gt_boxes']) == 0:
+                return self.resample_empty_frame()
+            data_dict['gt_classes'] = np.array(
+                [self.class_names.index(n) + 1 for n in data_dict.pop('gt_names')], dtype=np.int32
+            )
+        elif self.share_augmentor is not None:
+            data_dict = self.share_augmentor.forward(data_dict)
+        data_dict.pop('calib', None)
+        data_dict.pop('road_plane', None)
+        data_dict = self.point_feature_encoder.forward(data_dict)
+
+        # the augmentations of the views are drawn before any processing, like in prepare_data_ssl
+        augmentors = {'teacher': self.teacher_augmentor, 'student': self.student_augmentor}
+        transforms = {
+            name: augmentors[name].sample_world_transform() for name in ['teacher', 'student'] if name in output_dicts
+        }
+
+        view_dicts = {}
+        for name, transform in transforms.items():
+            if name == 'student' and 'teacher' in view_dicts:
+                relative = augmentor_utils.get_relative_world_transform(transforms['teacher'], transform)
+                if self.is_derivable_transform(relative):
+                    view_dicts[name] = self.derive_view(view_dicts['teacher'], relative)
+                    view_dicts[name].update(self.get_view_info(transform, augmentors[name]))
+                    continue
+
+            view_dict = {key: val for key, val in data_dict.items() if key not in ['points', 'gt_boxes', 'gt_classes']}
+            gt_boxes = data_dict['gt_boxes'].copy() if 'gt_boxes' in data_dict else np.zeros((0, 7), dtype=np.float32)
+            gt_boxes, view_dict['points'] = augmentor_utils.apply_world_transform(
+                gt_boxes, data_dict['points'].copy(), transform
+            )
+            if 'gt_boxes' in data_dict:
+                gt_boxes[:, 6] = common_utils.limit_period(gt_boxes[:, 6], offset=0.5, period=2 * np.pi)
+                view_dict['gt_boxes'] = np.concatenate(
+                    (gt_boxes, data_dict['gt_classes'].reshape(-1, 1).astype(np.float32)), axis=1
+                )
+            view_dict.update(self.get_view_info(transform, augmentors[name]))
+            view_dicts[name] = self.data_processor.forward(data_dict=view_dict)
+
+        return view_dicts.get('teacher', None), view_dicts.get('student', None)
+
+    @staticmethod
+    def get_view_info(transform, augmentor):
+        return {
+            'augmentation_list': copy.deepcopy(augmentor.aug_list),
+            'augmentation_params': transform['params'],
+            'world_affine': transform['affine'].astype(np.float32),
+            'world_heading': np.array([transform['heading_sign'], transform['heading_offset']], dtype=np.float32),
+        }
+
+    def is_derivable_transform(self, transform):
+        """
+        Whether the processed view of transform can be derived from the processed view it is applied to: the identity
+        or flips along x / y of a point cloud range symmetric along the flipped axes, split into whole voxels, with
+        processors that commute with the flips.
+        """
+        if not self.derivable_processors:
+            return False
+        flip = np.sign(np.diag(transform['affine']))
+        if np.abs(transform['affine'] - np.diag(flip)).max() > 1e-9 or flip[2] < 0:
+            return False
+        for dim in np.nonzero(flip[0:2] < 0)[0]:
+            if self.point_cloud_range[dim] != -self.point_cloud_range[dim + 3]:
+                return False
+            if self.voxel_size is not None and not np.isclose(
+                    self.grid_size[dim] * self.voxel_size[dim], self.point_cloud_range[dim + 3] * 2):
+                return False
+        return True
+
+    def derive_view(self, src_dict, transform):
+        """
+        Args:
+            src_dict: processed view
+            transform: flips from src_dict to the new view, see is_derivable_transform
+        Returns:
+            data_dict: processed view, the voxels are the ones of src_dict mirrored, same as voxelizing the flipped
+                points except for the few points within float rounding of a voxel boundary
+        """
+        data_dict = dict(src_dict)
+        flip_dims = np.nonzero(np.diag(transform['affine'])[0:2] < 0)[0]
+        if len(flip_dims) == 0:
+            return data_dict
+
+        gt_boxes = src_dict['gt_boxes'].copy() if 'gt_boxes' in src_dict else np.zeros((0, 8), dtype=np.float32)
+        _, data_dict['points'] = augmentor_utils.apply_world_transform(
+            gt_boxes[:, :-1], src_dict['points'].copy(), transform
+        )
+        if 'gt_boxes' in src_dict:
+            gt_boxes[:, 6] = common_utils.limit_period(gt_boxes[:, 6], offset=0.5, period=2 * np.pi)
+            data_dict['gt_boxes'] = gt_boxes
+
+        if 'voxels' in src_dict:
+            # voxel_coords are (z, y, x)
+            voxel_coords = src_dict['voxel_coords'].copy()
+            voxels = src_dict['voxels'].copy() if src_dict['use_lead_xyz'] else src_dict['voxels']
+            for dim in flip_dims:
+                voxel_coords[:, 2 - dim] = self.grid_size[dim] - 1 - voxel_coords[:, 2 - dim]
+                if src_dict['use_lead_xyz']:
+                    voxels[:, :, dim] = -voxels[:, :, dim]
+            data_dict['voxels'] = voxels
+            data_dict['voxel_coords'] = voxel_coords
+        return data_dict
+
     @staticmethod
     def collate_batch(batch_list, _unused=False):
 
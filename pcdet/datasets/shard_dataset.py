@@ -0,0 +1,219 @@
+import os
+import pickle
+import time
+from concurrent import futures
+from pathlib import Path
+
+import numpy as np
+import torch.utils.data as torch_data
+
+from ..utils import common_utils
+from .dataset import DatasetTemplate
+
+SHARD_INFO_FILE = 'shard_infos.pkl'
+
+
+def create_shards(dataset, save_path, frames_per_shard=256, num_workers=4, logger=None):
+    """
+    Pack the un-augmented input dicts of a dataset (points with sweeps merged, gt_boxes, gt_names, ...) into
+    sequential shard files, every shard is a stream of pickled frames that ShardStreamDataset reads front to back.
+
+    Args:
+        dataset: a dataset implementing get_input_dict(index)
+        save_path: directory of the shards and of shard_infos.pkl
+        frames_per_shard:
+        num_workers: threads loading the frames of a shard
+
+    Returns:
+        shard_infos: list of dict, shard file name and number of frames
+    """
+    save_path = Path(save_path)
+    save_path.mkdir(parents=True, exist_ok=True)
+    assert not dataset._merge_all_iters_to_one_epoch
+
+    num_frames = len(dataset)
+    shard_infos = []
+    with futures.ThreadPoolExecutor(num_workers) as executor:
+        for shard_idx, start in enumerate(range(0, num_frames, frames_per_shard)):
+            shard_name = 'shard_%05d.pkl' % shard_idx
+            frame_inds = range(start, min(start + frames_per_shard, num_frames))
+            tmp_path = save_path / (shard_name + '.tmp')
+            with open(tmp_path, 'wb') as f:
+                for input_dict in executor.map(dataset.get_input_dict, frame_inds):
+                    pickle.dump(input_dict, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, save_path / shard_name)
+            shard_infos.append({'shard': shard_name, 'num_frames': len(frame_inds)})
+
+            if logger is not None:
+                logger.info('Shard %s: frames %d-%d / %d' % (shard_name, frame_inds[0], frame_inds[-1], num_frames))
+
+    with open(save_path / SHARD_INFO_FILE, 'wb') as f:
+        pickle.dump(shard_infos, f)
+    return shard_infos
+
+
+class ShardStreamDataset(DatasetTemplate, torch_data.IterableDataset):
+    """
+    Streams the frames written by create_shards. Shards are shuffled per epoch and split over
+    (rank, worker) streams, frames are shuffled through an in-memory buffer of SHUFFLE_BUFFER_SIZE frames.
+    Every rank yields the same number of full batches, streams cycle over their shards to fill their quota,
+    so the number of shards should be well above world_size * num_workers to keep repeated frames rare.
+    """
+
+    def __init__(self, dataset_cfg, class_names, training=True, root_path=None, logger=None):
+        super().__init__(
+            dataset_cfg=dataset_cfg, class_names=class_names, training=training, root_path=root_path, logger=logger
+        )
+        self.shard_path = self.root_path / self.dataset_cfg.SHARD_PATH
+        with open(self.shard_path / SHARD_INFO_FILE, 'rb') as f:
+            self.shard_infos = pickle.load(f)
+        self.num_frames = sum([info['num_frames'] for info in self.shard_infos])
+        self.shuffle_buffer_size = self.dataset_cfg.get('SHUFFLE_BUFFER_SIZE', 64)
+
+        self.rank, self.world_size, self.batch_size = 0, 1, 1
+        self.seed = 0
+        self.epoch = 0
+
+        if self.logger is not None:
+            self.logger.info('Total samples for shard stream dataset: %d in %d shards' % (
+                self.num_frames, len(self.shard_infos)))
+
+    def set_distributed(self, rank, world_size, batch_size):
+        self.rank, self.world_size, self.batch_size = rank, world_size, batch_size
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        num_batches = self.num_frames // self.world_size // self.batch_size
+        if self._merge_all_iters_to_one_epoch:
+            num_batches *= self.total_epochs
+        return num_batches * self.batch_size
+
+    def __getitem__(self, index):
+        raise NotImplementedError('ShardStreamDataset only supports sequential iteration')
+
+    def resample_empty_frame(self):
+        # a streamed frame emptied by the augmentation is dropped, the next frame of the stream replaces it
+        return None
+
+    def get_stream_shards(self, epoch, worker_id, num_workers):
+        """
+        Returns:
+            shard_ids: shards of this (rank, worker) stream, the same shard permutation is drawn on every stream
+            num_samples: number of samples this stream has to yield
+        """
+        num_streams = self.world_size * num_workers
+        stream_id = self.rank * num_workers + worker_id
+
+        shard_ids = np.arange(len(self.shard_infos))
+        if self.training:
+            shard_ids = np.random.RandomState(self.seed + epoch).permutation(shard_ids)
+        if len(shard_ids) < num_streams:
+            shard_ids = np.resize(shard_ids, num_streams)
+
+        num_batches = len(self) // self.batch_size
+        num_batches = num_batches // num_workers + int(worker_id < num_batches % num_workers)
+        return shard_ids[stream_id::num_streams], num_batches * self.batch_size
+
+    def read_shards(self, shard_ids, rng):
+        while True:
+            for shard_id in shard_ids:
+                shard_info = self.shard_infos[shard_id]
+                with open(self.shard_path / shard_info['shard'], 'rb') as f:
+                    for _ in range(shard_info['num_frames']):
+                        yield pickle.load(f)
+            if self.training:
+                shard_ids = rng.permutation(shard_ids)
+
+    def __iter__(self):
+        worker_info = torch_data.get_worker_info()
+        worker_id, num_workers = (0, 1) if worker_info is None else (worker_info.id, worker_info.num_workers)
+        # persistent workers keep their own copy of the dataset, so the epoch also advances on every pass
+        epoch = self.epoch
+        self.epoch += 1
+
+        shard_ids, num_samples = self.get_stream_shards(epoch, worker_id, num_workers)
+        if num_samples == 0:
+            return
+
+        rng = np.random.RandomState((self.seed + epoch * 1000 + self.rank * num_workers + worker_id) % 2 ** 32)
+        buffer_size = self.shuffle_buffer_size if self.training else 0
+        max_tries = self.dataset_cfg.get('MAX_RESAMPLE_TRIES', 10)
+
+        buffer = []
+        num_yielded, num_empty = 0, 0
+        for input_dict in self.read_shards(shard_ids, rng):
+            if len(buffer) < buffer_size:
+                buffer.append(input_dict)
+                continue
+            if buffer_size > 0:
+                k = rng.randint(buffer_size)
+                input_dict, buffer[k] = buffer[k], input_dict
+
+            data_dict = self.prepare_data(data_dict=input_dict)
+            if data_dict is None:
+                num_empty += 1
+                if num_empty > max_tries:
+                    raise RuntimeError('No trainable frame after %d frames' % max_tries)
+                continue
+            num_empty = 0
+
+            data_dict.pop('num_points_in_gt', None)
+            yield data_dict
+            num_yielded += 1
+            if num_yielded >= num_samples:
+                return
+
+
+def benchmark_loaders(dataloaders, num_batches, logger):
+    for name, dataloader in dataloaders.items():
+        dataloader_iter = iter(dataloader)
+        next(dataloader_iter)
+        start = time.perf_counter()
+        num_frames = 0
+        for _ in range(num_batches):
+            num_frames += next(dataloader_iter)['batch_size']
+        cost = time.perf_counter() - start
+        logger.info('%s: %.1f frames/s (%d frames in %.1fs)' % (name, num_frames / cost, num_frames, cost))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    import yaml
+    from easydict import EasyDict
+
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--cfg_file', type=str, default=None, help='specify the config of dataset')
+    parser.add_argument('--func', type=str, default='create_shards', help='create_shards or benchmark')
+    parser.add_argument('--frames_per_shard', type=int, default=256, help='')
+    parser.add_argument('--workers', type=int, default=4, help='')
+    parser.add_argument('--batch_size', type=int, default=4, help='')
+    parser.add_argument('--num_batches', type=int, default=200, help='batches to time with --func benchmark')
+    args = parser.parse_args()
+
+    from . import __all__ as dataset_dict, build_dataloader
+
+    dataset_cfg = EasyDict(yaml.safe_load(open(args.cfg_file)))
+    class_names = dataset_cfg.get('CLASS_NAMES', ['Vehicle', 'Pedestrian', 'Cyclist'])
+    logger = common_utils.create_logger()
+
+    if args.func == 'create_shards':
+        dataset = dataset_dict[dataset_cfg.DATASET](
+            dataset_cfg=dataset_cfg, class_names=class_names, training=True, logger=logger
+        )
+        create_shards(
+            dataset, dataset.root_path / dataset_cfg.SHARD_PATH, frames_per_shard=args.frames_per_shard,
+            num_workers=args.workers, logger=logger
+        )
+    elif args.func == 'benchmark':
+        dataloaders = {}
+        for use_shards in [False, True]:
+            dataset_cfg.USE_SHARDS = use_shards
+            _, dataloaders['shards' if use_shards else 'files'], _ = build_dataloader(
+                dataset_cfg, class_names, batch_size=args.batch_size, dist=False, workers=args.workers, logger=logger
+            )
+        benchmark_loaders(dataloaders, args.num_batches, logger)
+    else:
+        raise NotImplementedError
@@ -12,7 +12,7 @@ import multiprocessing
 from tqdm import tqdm
 from pathlib import Path
 from ...ops.roiaware_pool3d import roiaware_pool3d_utils
-from ...utils import box_utils, common_utils
+from ...utils import box_utils, common_utils, point_codec
 from ..dataset import DatasetTemplate
 
 
@@ -91,7 +91,8 @@ class WaymoDataset(DatasetTemplate):
 
         process_single_sequence = partial(
             waymo_utils.process_single_sequence,
-            save_path=save_path, sampled_interval=sampled_interval, has_label=has_label
+            save_path=save_path, sampled_interval=sampled_interval, has_label=has_label,
+            codec_cfg=self.dataset_cfg.get('POINT_CODEC', None), point_cloud_range=self.point_cloud_range
         )
         sample_sequence_file_list = [
             self.check_sequence_name_with_all_version(raw_data_path / sequence_file)
@@ -106,12 +107,19 @@ class WaymoDataset(DatasetTemplate):
         return all_sequences_infos
 
     def get_lidar(self, sequence_name, sample_idx):
-        lidar_file = self.data_path / sequence_name / ('%04d.npy' % sample_idx)
-        point_features = np.load(lidar_file)  # (N, 7): [x, y, z, intensity, elongation, NLZ_flag]
+        use_codec = self.dataset_cfg.get('POINT_CODEC', None) is not None
+        if use_codec:
+            # intensity is stored after tanh by save_lidar_points
+            lidar_file = self.data_path / sequence_name / ('%04d.pcz' % sample_idx)
+            point_features = point_codec.load_points(lidar_file)
+        else:
+            lidar_file = self.data_path / sequence_name / ('%04d.npy' % sample_idx)
+            point_features = np.load(lidar_file)  # (N, 7): [x, y, z, intensity, elongation, NLZ_flag]
 
         points_all, NLZ_flag = point_features[:, 0:5], point_features[:, 5]
         points_all = points_all[NLZ_flag == -1]
-        points_all[:, 3] = np.tanh(points_all[:, 3])
+        if not use_codec:
+            points_all[:, 3] = np.tanh(points_all[:, 3])
         return points_all
 
     def get_lidar_with_sweeps(self, sweep_infos, max_sweeps=3):
@@ -149,6 +157,10 @@ class WaymoDataset(DatasetTemplate):
         points[:3, :] = np.dot(inv_rot, points[:3, :])
         return points.T
 
+    def get_frame_gt_names(self, index):
+        info = self.infos[index]
+        return info['annos']['name'] if 'annos' in info else None
+
     def __len__(self):
         if self._merge_all_iters_to_one_epoch:
             return len(self.infos) * self.total_epochs
@@ -159,6 +171,12 @@ class WaymoDataset(DatasetTemplate):
         if self._merge_all_iters_to_one_epoch:
             index = index % len(self.infos)
 
+        input_dict = self.get_input_dict(index)
+        data_dict = self.prepare_data(data_dict=input_dict)
+        data_dict.pop('num_points_in_gt', None)
+        return data_dict
+
+    def get_input_dict(self, index):
         info = copy.deepcopy(self.infos[index])
         pc_info = info['point_cloud']
         sequence_name = pc_info['lidar_sequence']
@@ -176,6 +194,7 @@ class WaymoDataset(DatasetTemplate):
         input_dict = {
             'points': points,
             'frame_id': info['frame_id'],
+            'metadata': info.get('metadata', info['frame_id'])
         }
 
         if 'annos' in info:
@@ -193,10 +212,7 @@ class WaymoDataset(DatasetTemplate):
                 'num_points_in_gt': annos.get('num_points_in_gt', None)
             })
 
-        data_dict = self.prepare_data(data_dict=input_dict)
-        data_dict['metadata'] = info.get('metadata', info['frame_id'])
-        data_dict.pop('num_points_in_gt', None)
-        return data_dict
+        return input_dict
 
     @staticmethod
     def generate_prediction_dicts(batch_dict, pred_dicts, class_names, output_path=None):
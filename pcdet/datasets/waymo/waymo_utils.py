@@ -7,7 +7,7 @@
 import os
 import pickle
 import numpy as np
-from ...utils import common_utils
+from ...utils import common_utils, point_codec
 import tensorflow as tf
 from waymo_open_dataset.utils import frame_utils, transform_utils, range_image_utils
 from waymo_open_dataset import dataset_pb2
@@ -146,7 +146,7 @@ def convert_range_image_to_point_cloud(frame, range_images, camera_projections,
     return points, cp_points, points_NLZ, points_intensity, points_elongation
 
 
-def save_lidar_points(frame, cur_save_path):
+def save_lidar_points(frame, cur_save_path, codec_cfg=None, point_cloud_range=None):
     range_images, camera_projections, range_image_top_pose = \
         frame_utils.parse_range_image_and_camera_projection(frame)
 
@@ -164,12 +164,18 @@ def save_lidar_points(frame, cur_save_path):
         points_all, points_intensity, points_elongation, points_in_NLZ_flag
     ], axis=-1).astype(np.float32)
 
-    np.save(cur_save_path, save_points)
+    if codec_cfg is not None:
+        # intensity is stored after tanh, the squashed range survives the uint8 quantization
+        save_points[:, 3] = np.tanh(save_points[:, 3])
+        point_codec.save_points(cur_save_path, save_points, codec_cfg, point_cloud_range)
+    else:
+        np.save(cur_save_path, save_points)
     # print('saving to ', cur_save_path)
     return num_points_of_each_lidar
 
 
-def process_single_sequence(sequence_file, save_path, sampled_interval, has_label=True):
+def process_single_sequence(sequence_file, save_path, sampled_interval, has_label=True,
+                            codec_cfg=None, point_cloud_range=None):
     sequence_name = os.path.splitext(os.path.basename(sequence_file))[0]
 
     # print('Load record (sampled_interval=%d): %s' % (sampled_interval, sequence_name))
@@ -214,7 +220,8 @@ def process_single_sequence(sequence_file, save_path, sampled_interval, has_labe
             annotations = generate_labels(frame)
             info['annos'] = annotations
 
-        num_points_of_each_lidar = save_lidar_points(frame, cur_save_dir / ('%04d.npy' % cnt))
+        lidar_file = cur_save_dir / (('%04d.pcz' if codec_cfg is not None else '%04d.npy') % cnt)
+        num_points_of_each_lidar = save_lidar_points(frame, lidar_file, codec_cfg, point_cloud_range)
         info['num_points_of_each_lidar'] = num_points_of_each_lidar
 
         sequence_infos.append(info)
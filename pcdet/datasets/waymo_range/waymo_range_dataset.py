@@ -13,7 +13,7 @@ from tqdm import tqdm
 from pathlib import Path
 from . import waymo_range_utils
 from ...ops.roiaware_pool3d import roiaware_pool3d_utils
-from ...utils import box_utils, common_utils
+from ...utils import box_utils, common_utils, point_codec
 from ..dataset import DatasetTemplate
 from . import range_image_utils as riu
 import copy
@@ -95,7 +95,8 @@ class WaymoRangeDataset(DatasetTemplate):
 
         process_single_sequence = partial(
             waymo_range_utils.process_single_sequence,
-            save_path=save_path, sampled_interval=sampled_interval, has_label=has_label
+            save_path=save_path, sampled_interval=sampled_interval, has_label=has_label,
+            codec_cfg=self.dataset_cfg.get('POINT_CODEC', None), point_cloud_range=self.point_cloud_range
         )
         sample_sequence_file_list = [
             self.check_sequence_name_with_all_version(raw_data_path / sequence_file)
@@ -110,12 +111,19 @@ class WaymoRangeDataset(DatasetTemplate):
         return all_sequences_infos
 
     def get_lidar(self, sequence_name, sample_idx):
-        lidar_file = self.data_path / sequence_name / ('%04d.npy' % sample_idx)
-        point_features = np.load(lidar_file)  # (N, 7): [x, y, z, intensity, elongation, NLZ_flag]
+        use_codec = self.dataset_cfg.get('POINT_CODEC', None) is not None
+        if use_codec:
+            # intensity is stored after tanh by save_lidar_points
+            lidar_file = self.data_path / sequence_name / ('%04d.pcz' % sample_idx)
+            point_features = point_codec.load_points(lidar_file)
+        else:
+            lidar_file = self.data_path / sequence_name / ('%04d.npy' % sample_idx)
+            point_features = np.load(lidar_file)  # (N, 7): [x, y, z, intensity, elongation, NLZ_flag]
 
         points_all, NLZ_flag = point_features[:, 0:5], point_features[:, 5]
         points_all = points_all[NLZ_flag == -1]
-        points_all[:, 3] = np.tanh(points_all[:, 3])
+        if not use_codec:
+            points_all[:, 3] = np.tanh(points_all[:, 3])
         return points_all
 
     def get_lidar_with_sweeps(self, sweep_infos, max_sweeps=3):
@@ -7,7 +7,7 @@
 import os
 import pickle
 import numpy as np
-from ...utils import common_utils
+from ...utils import common_utils, point_codec
 import tensorflow as tf
 from waymo_open_dataset.utils import frame_utils, transform_utils, range_image_utils
 from waymo_open_dataset import dataset_pb2
@@ -149,7 +149,7 @@ def convert_range_image_to_point_cloud(frame, range_images, camera_projections,
     return points, cp_points, points_NLZ, points_intensity, points_elongation
 
 
-def save_lidar_points(frame, cur_save_path):
+def save_lidar_points(frame, cur_save_path, codec_cfg=None, point_cloud_range=None):
     range_images, camera_projections, range_image_top_pose = \
         frame_utils.parse_range_image_and_camera_projection(frame)
 
@@ -167,12 +167,18 @@ def save_lidar_points(frame, cur_save_path):
         points_all, points_intensity, points_elongation, points_in_NLZ_flag
     ], axis=-1).astype(np.float32)
 
-    np.save(cur_save_path, save_points)
+    if codec_cfg is not None:
+        # intensity is stored after tanh, the squashed range survives the uint8 quantization
+        save_points[:, 3] = np.tanh(save_points[:, 3])
+        point_codec.save_points(cur_save_path, save_points, codec_cfg, point_cloud_range)
+    else:
+        np.save(cur_save_path, save_points)
     # print('saving to ', cur_save_path)
     return num_points_of_each_lidar
 
 
-def process_single_sequence(sequence_file, save_path, sampled_interval, has_label=True):
+def process_single_sequence(sequence_file, save_path, sampled_interval, has_label=True,
+                            codec_cfg=None, point_cloud_range=None):
     sequence_name = os.path.splitext(os.path.basename(sequence_file))[0]
 
     # print('Load record (sampled_interval=%d): %s' % (sampled_interval, sequence_name))
@@ -222,7 +228,8 @@ def process_single_sequence(sequence_file, save_path, sampled_interval, has_labe
             annotations = generate_labels(frame)
             info['annos'] = annotations
 
-        num_points_of_each_lidar = save_lidar_points(frame, cur_save_dir / ('%04d.npy' % cnt))
+        lidar_file = cur_save_dir / (('%04d.pcz' if codec_cfg is not None else '%04d.npy') % cnt)
+        num_points_of_each_lidar = save_lidar_points(frame, lidar_file, codec_cfg, point_cloud_range)
         info['num_points_of_each_lidar'] = num_points_of_each_lidar
 
         sequence_infos.append(info)
@@ -293,23 +300,23 @@ def convert_point_cloud_to_range_image(data_dict, training=True, USE_XYZ=False):
 
     if training:
         gt_boxes = data_dict['gt_boxes']
-        # CPU method, 0 or 1
-        point_indices = roiaware_pool3d_utils.points_in_boxes_cpu(
+        # CPU method, point indices of each box
+        box_ptr, pts_idx = roiaware_pool3d_utils.points_in_boxes_csr_cpu(
             torch.from_numpy(points_vehicle_frame).float(),
             torch.from_numpy(gt_boxes[:, 0:7]).float()
-        ).long().numpy()
+        )
+        box_ptr, pts_idx = box_ptr.numpy(), pts_idx.numpy()
 
         # filter gt boxes which contain less points
-        flag_of_gts = point_indices.sum(axis=1)
+        flag_of_gts = np.diff(box_ptr)
         min_points_in_gt = 0
         flag_of_gts = flag_of_gts > min_points_in_gt
         gt_boxes = gt_boxes[flag_of_gts]
         data_dict['gt_boxes'] = gt_boxes
 
         # less gt points will not be treated as gt points
-        point_indices = point_indices[flag_of_gts]
-        flag_of_pts = point_indices.max(axis=0)
-        select = flag_of_pts > 0
+        select = np.zeros(points_vehicle_frame.shape[0], dtype=bool)
+        select[pts_idx[np.repeat(flag_of_gts, np.diff(box_ptr))]] = True
 
         # point_indices = points_in_rbbox(points[..., :3].squeeze(axis=0), gt_boxes).numpy()
         # flag_of_pts = point_indices.max(axis=0)
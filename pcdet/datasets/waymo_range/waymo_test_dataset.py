@@ -12,7 +12,7 @@ import multiprocessing
 from tqdm import tqdm
 from pathlib import Path
 from ...ops.roiaware_pool3d import roiaware_pool3d_utils
-from ...utils import box_utils, common_utils
+from ...utils import box_utils, common_utils, point_codec
 from ..dataset import DatasetTemplate
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
 
@@ -106,12 +106,19 @@ class WaymoDataset(DatasetTemplate):
         return all_sequences_infos
 
     def get_lidar(self, sequence_name, sample_idx):
-        lidar_file = self.data_path / sequence_name / ('%04d.npy' % sample_idx)
-        point_features = np.load(lidar_file)  # (N, 7): [x, y, z, intensity, elongation, NLZ_flag]
+        use_codec = self.dataset_cfg.get('POINT_CODEC', None) is not None
+        if use_codec:
+            # intensity is stored after tanh by save_lidar_points
+            lidar_file = self.data_path / sequence_name / ('%04d.pcz' % sample_idx)
+            point_features = point_codec.load_points(lidar_file)
+        else:
+            lidar_file = self.data_path / sequence_name / ('%04d.npy' % sample_idx)
+            point_features = np.load(lidar_file)  # (N, 7): [x, y, z, intensity, elongation, NLZ_flag]
 
         points_all, NLZ_flag = point_features[:, 0:5], point_features[:, 5]
         points_all = points_all[NLZ_flag == -1]
-        points_all[:, 3] = np.tanh(points_all[:, 3])
+        if not use_codec:
+            points_all[:, 3] = np.tanh(points_all[:, 3])
         return points_all
 
     def get_lidar_with_sweeps(self, sweep_infos, max_sweeps=3):
@@ -13,20 +13,26 @@ def build_network(model_cfg, num_class, dataset):
     return model
 
 
-def load_data_to_gpu(batch_dict):
+def load_data_to_gpu(batch_dict, device=None):
+    """
+    Args:
+        batch_dict:
+        device: target device of the arrays, the current GPU if None
+    """
     for key, val in batch_dict.items():
         if not isinstance(val, np.ndarray):
             continue
         if key in ['frame_id', 'metadata', 'calib', 'image_shape']:
             continue
-        batch_dict[key] = torch.from_numpy(val).float().cuda()
+        val = torch.from_numpy(val).float()
+        batch_dict[key] = val.cuda() if device is None else val.to(device)
 
 
 def model_fn_decorator():
     ModelReturn = namedtuple('ModelReturn', ['loss', 'tb_dict', 'disp_dict'])
 
     def model_func(model, batch_dict):
-        load_data_to_gpu(batch_dict)
+        load_data_to_gpu(batch_dict, next(model.parameters()).device)
         ret_dict, tb_dict, disp_dict = model(batch_dict)
 
         loss = ret_dict['loss'].mean()
@@ -1,3 +1,5 @@
+import spconv
+import torch
 import torch.nn as nn
 
 
@@ -6,6 +8,31 @@ class HeightCompression(nn.Module):
         super().__init__()
         self.model_cfg = model_cfg
         self.num_bev_features = self.model_cfg.NUM_BEV_FEATURES
+        # a sparse BEV map for the SparseBEVBackbone instead of the dense one
+        self.sparse_output = self.model_cfg.get('SPARSE_OUTPUT', False)
+
+    @staticmethod
+    def to_sparse_bev(encoded_spconv_tensor):
+        """
+        The active BEV sites of the dense map, with the same C x D features
+        Args:
+            encoded_spconv_tensor: sparse tensor, indices (N, 4) [bs_idx, z, y, x], features (N, C)
+        Returns:
+            sparse tensor, indices (M, 3) [bs_idx, y, x], features (M, C x D)
+        """
+        D, H, W = encoded_spconv_tensor.spatial_shape
+        indices = encoded_spconv_tensor.indices.long()
+        voxel_features = encoded_spconv_tensor.features
+        bev_ids = (indices[:, 0] * H + indices[:, 2]) * W + indices[:, 3]
+        unique_ids, inverse = torch.unique(bev_ids, return_inverse=True)
+
+        features = voxel_features.new_zeros((unique_ids.shape[0], voxel_features.shape[1], D))
+        features[inverse, :, indices[:, 1]] = voxel_features
+        bev_indices = torch.stack([unique_ids // (H * W), unique_ids // W % H, unique_ids % W], dim=1).int()
+        return spconv.SparseConvTensor(
+            features=features.view(unique_ids.shape[0], -1), indices=bev_indices, spatial_shape=[H, W],
+            batch_size=encoded_spconv_tensor.batch_size
+        )
 
     def forward(self, batch_dict):
         """
@@ -18,6 +45,11 @@ class HeightCompression(nn.Module):
 
         """
         encoded_spconv_tensor = batch_dict['encoded_spconv_tensor']
+        if self.sparse_output:
+            batch_dict['spatial_features'] = self.to_sparse_bev(encoded_spconv_tensor)
+            batch_dict['spatial_features_stride'] = batch_dict['encoded_spconv_tensor_stride']
+            return batch_dict
+
         spatial_features = encoded_spconv_tensor.dense()
         N, C, D, H, W = spatial_features.shape
         spatial_features = spatial_features.view(N, C * D, H, W)
@@ -5,11 +5,51 @@ import spconv
 from functools import partial
 
 
+def sparse_cat(x_list):
+    """
+    Channel concatenation of 2D sparse tensors of the same spatial shape on the union of their active sites, the
+    sites that are inactive in one of the tensors get zero features, as in the concatenation of the dense tensors.
+
+    Args:
+        x_list: [SparseConvTensor, ...], indices (N_i, 3) [bs_idx, y, x], features (N_i, C_i)
+    Returns:
+        x: SparseConvTensor, features (N, sum(C_i))
+    """
+    if len(x_list) == 1:
+        return x_list[0]
+
+    ny, nx = x_list[0].spatial_shape
+    site_ids = [(x.indices[:, 0].long() * ny + x.indices[:, 1].long()) * nx + x.indices[:, 2].long() for x in x_list]
+    unique_ids, inverse = torch.unique(torch.cat(site_ids), return_inverse=True)
+
+    features = x_list[0].features.new_zeros((unique_ids.shape[0], sum([x.features.shape[1] for x in x_list])))
+    row_offset = channel_offset = 0
+    for x in x_list:
+        num_sites, num_channels = x.features.shape
+        features[inverse[row_offset:row_offset + num_sites], channel_offset:channel_offset + num_channels] = x.features
+        row_offset += num_sites
+        channel_offset += num_channels
+
+    indices = torch.stack([unique_ids // (ny * nx), unique_ids // nx % ny, unique_ids % nx], dim=1).int()
+    return spconv.SparseConvTensor(
+        features=features, indices=indices, spatial_shape=[ny, nx], batch_size=x_list[0].batch_size
+    )
+
+
 class SparseBEVBackbone(nn.Module):
+    """
+    BaseBEVBackbone on a sparse BEV map (SparseScatter, or HeightCompression with SPARSE_OUTPUT).
+
+    With SPARSITY_PRESERVING, the stride 1 layers of a stage are submanifold convolutions, which keep the active
+    sites, except the first DILATION_BUDGET[idx] ones, which are regular sparse convolutions and grow the active set
+    by one cell in every direction. The levels are concatenated sparsely and densified once for the head. Without it
+    every layer is a regular sparse convolution and every level is densified before the concatenation.
+    """
     def __init__(self, model_cfg, input_channels):
         super().__init__()
         self.model_cfg = model_cfg
         norm_fn = partial(nn.BatchNorm1d, eps=1e-3, momentum=0.01)
+        self.sparsity_preserving = self.model_cfg.get('SPARSITY_PRESERVING', False)
 
         if self.model_cfg.get('LAYER_NUMS', None) is not None:
             assert len(self.model_cfg.LAYER_NUMS) == len(self.model_cfg.LAYER_STRIDES) == len(self.model_cfg.NUM_FILTERS)
@@ -28,14 +68,18 @@ class SparseBEVBackbone(nn.Module):
 
         num_levels = len(layer_nums)
         c_in_list = [input_channels, *num_filters[:-1]]
+        dilation_budget = self.model_cfg.get('DILATION_BUDGET', [0] * num_levels)
+        assert len(dilation_budget) == num_levels
         self.blocks = nn.ModuleList()
         self.deblocks = nn.ModuleList()
 
         indice_key_temp = 'fpn_{0}_{1}_{2}'
 
         for idx in range(num_levels):
-            cur_layers = [
-                spconv.SparseConv2d(
+            # stride 1 layers of the stage which are regular sparse convolutions, the others are submanifold
+            num_dilations = dilation_budget[idx] if self.sparsity_preserving else layer_nums[idx] + 1
+            if layer_strides[idx] > 1 or num_dilations > 0:
+                first_conv = spconv.SparseConv2d(
                     c_in_list[idx],
                     num_filters[idx],
                     kernel_size=3,
@@ -43,21 +87,37 @@ class SparseBEVBackbone(nn.Module):
                     padding=1,
                     bias=False,
                     indice_key = indice_key_temp.format('block', idx, 0)
-                ),
+                )
+                num_dilations -= 1 if layer_strides[idx] == 1 else 0
+            else:
+                first_conv = spconv.SubMConv2d(
+                    c_in_list[idx], num_filters[idx], kernel_size=3, padding=1, bias=False,
+                    indice_key=indice_key_temp.format('subm', idx, 0)
+                )
+            cur_layers = [
+                first_conv,
                 norm_fn(num_filters[idx]),
                 nn.ReLU()
             ]
 
             for k in range(layer_nums[idx]):
-                cur_layers.extend([
-                    spconv.SparseConv2d(
+                if k < num_dilations:
+                    conv = spconv.SparseConv2d(
                         num_filters[idx],
                         num_filters[idx],
                         kernel_size=3,
                         padding=1,
                         bias=False,
                         indice_key=indice_key_temp.format('block', idx, k + 1)
-                    ),
+                    )
+                else:
+                    # the submanifold layers after the last dilation share the active sites and the rulebook
+                    conv = spconv.SubMConv2d(
+                        num_filters[idx], num_filters[idx], kernel_size=3, padding=1, bias=False,
+                        indice_key=indice_key_temp.format('subm', idx, min(num_dilations, layer_nums[idx]))
+                    )
+                cur_layers.extend([
+                    conv,
                     norm_fn(num_filters[idx]),
                     nn.ReLU()
                 ])
@@ -101,7 +161,7 @@ class SparseBEVBackbone(nn.Module):
         c_in = sum(num_upsample_filters)
         if len(upsample_strides) > num_levels:
             self.deblocks.append(
-                nn.Sequential(
+                spconv.SparseSequential(
                     spconv.SparseConvTranspose2d(
                         c_in,
                         c_in,
@@ -130,18 +190,22 @@ class SparseBEVBackbone(nn.Module):
 
         for i in range(len(self.blocks)):
             x = self.blocks[i](x)
-            if len(self.deblocks) > 0:
-                ups.append(self.deblocks[i](x).dense())
-            else:
-                ups.append(x.dense())
-
-        if len(ups) > 1:
-            x = torch.cat(ups, dim=1)
-        elif len(ups) == 1:
-            x = ups[0]
+            up = self.deblocks[i](x) if len(self.deblocks) > 0 else x
+            ups.append(up if self.sparsity_preserving else up.dense())
+
+        if self.sparsity_preserving:
+            x = sparse_cat(ups)
+            if len(self.deblocks) > len(self.blocks):
+                x = self.deblocks[-1](x)
+            x = x.dense()
+        else:
+            if len(ups) > 1:
+                x = torch.cat(ups, dim=1)
+            elif len(ups) == 1:
+                x = ups[0]
 
-        if len(self.deblocks) > len(self.blocks):
-            x = self.deblocks[-1](x)
+            if len(self.deblocks) > len(self.blocks):
+                x = self.deblocks[-1](x)
 
         data_dict['spatial_features_2d'] = x
 
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -180,8 +182,42 @@ def window_reverse(windows, window_size, H, W):
     return x
 
 
+@lru_cache(maxsize=32)
+def get_shifted_window_mask(Hp, Wp, window_size, shift_size, device):
+    """
+    The (0/-100) attention mask of SW-MSA, it only depends on the padded feature size, the window and the shift, so it
+    is built once per (Hp, Wp, window_size, shift_size, device) and shared by all the blocks and layers.
+    Args:
+        Hp, Wp: padded feature size, multiples of window_size
+        window_size (int): Window size
+        shift_size (int): Shift size
+        device:
+    Returns:
+        attn_mask: (num_windows, window_size*window_size, window_size*window_size), must not be modified in place
+    """
+    img_mask = torch.zeros((1, Hp, Wp, 1), device=device)  # 1 Hp Wp 1
+    h_slices = (slice(0, -window_size),
+                slice(-window_size, -shift_size),
+                slice(-shift_size, None))
+    w_slices = (slice(0, -window_size),
+                slice(-window_size, -shift_size),
+                slice(-shift_size, None))
+    cnt = 0
+    for h in h_slices:
+        for w in w_slices:
+            img_mask[:, h, w, :] = cnt
+            cnt += 1
+
+    mask_windows = window_partition(img_mask, window_size)  # nW, window_size, window_size, 1
+    mask_windows = mask_windows.view(-1, window_size * window_size)
+    attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
+    attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
+    return attn_mask
+
+
 class WindowAttention(nn.Module):
-    def __init__(self, dim, window_size, num_heads, qkv_bias=True, qk_scale=None, attn_drop=0., proj_drop=0., share_kv=False):
+    def __init__(self, dim, window_size, num_heads, qkv_bias=True, qk_scale=None, attn_drop=0., proj_drop=0., share_kv=False,
+                 use_sdpa=False):
 
         super().__init__()
         self.dim = dim
@@ -190,6 +226,8 @@ class WindowAttention(nn.Module):
         head_dim = dim // num_heads
         self.scale = qk_scale or head_dim ** -0.5
         self.share_kv = share_kv
+        self.use_sdpa = use_sdpa
+        self._relative_position_bias = (None, None)
 
         # define a parameter table of relative position bias
         self.relative_position_bias_table = nn.Parameter(
@@ -222,6 +260,25 @@ class WindowAttention(nn.Module):
         trunc_normal_(self.relative_position_bias_table, std=.02)
         self.softmax = nn.Softmax(dim=-1)
 
+    def get_relative_position_bias(self):
+        """
+        Returns:
+            relative_position_bias: (nH, Wh*Ww, Wh*Ww), gathered from the table once per table update when no gradient
+                is needed (inference), on every call otherwise
+        """
+        table = self.relative_position_bias_table
+        use_cache = not (torch.is_grad_enabled() and table.requires_grad)
+        key = (table._version, table.device, table.dtype)
+        if use_cache and self._relative_position_bias[0] == key:
+            return self._relative_position_bias[1]
+
+        relative_position_bias = table[self.relative_position_index.view(-1)].view(
+            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
+        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
+        if use_cache:
+            self._relative_position_bias = (key, relative_position_bias)
+        return relative_position_bias
+
     def forward(self, x, mask=None):
         """ Forward function.
         Args:
@@ -237,12 +294,23 @@ class WindowAttention(nn.Module):
             q, k = qkv[0], qkv[1]
             v = k
 
+        relative_position_bias = self.get_relative_position_bias()  # nH, Wh*Ww, Wh*Ww
+        if self.use_sdpa:
+            # fused softmax(q k^T * scale + bias + mask) v, the mask of every window is repeated over the batch
+            if mask is not None:
+                nW = mask.shape[0]
+                attn_mask = (relative_position_bias.unsqueeze(0) + mask.unsqueeze(1)).unsqueeze(0)
+                attn_mask = attn_mask.expand(B_ // nW, -1, -1, -1, -1).reshape(B_, self.num_heads, N, N)
+            else:
+                attn_mask = relative_position_bias.unsqueeze(0)
+            x = F.scaled_dot_product_attention(
+                q, k, v, attn_mask=attn_mask.to(q.dtype), dropout_p=self.attn_drop.p if self.training else 0.,
+                scale=self.scale
+            )
+            return x.transpose(1, 2).reshape(B_, N, C)
+
         q = q * self.scale
         attn = (q @ k.transpose(-2, -1))
-
-        relative_position_bias = self.relative_position_bias_table[self.relative_position_index.view(-1)].view(
-            self.window_size[0] * self.window_size[1], self.window_size[0] * self.window_size[1], -1)  # Wh*Ww,Wh*Ww,nH
-        relative_position_bias = relative_position_bias.permute(2, 0, 1).contiguous()  # nH, Wh*Ww, Wh*Ww
         attn = attn + relative_position_bias.unsqueeze(0)
 
         if mask is not None:
@@ -276,11 +344,12 @@ class SwinTransformerBlock(nn.Module):
         drop_path (float, optional): Stochastic depth rate. Default: 0.0
         act_layer (nn.Module, optional): Activation layer. Default: nn.GELU
         norm_layer (nn.Module, optional): Normalization layer.  Default: nn.LayerNorm
+        use_sdpa (bool, optional): If True, use the fused F.scaled_dot_product_attention. Default: False
     """
 
     def __init__(self, dim, num_heads, window_size=7, shift_size=0,
                  mlp_ratio=4., qkv_bias=True, qk_scale=None, drop=0., attn_drop=0., drop_path=0.,
-                 act_layer=GELU, norm_layer=nn.LayerNorm, share_kv=False):
+                 act_layer=GELU, norm_layer=nn.LayerNorm, share_kv=False, use_sdpa=False):
         super().__init__()
         self.dim = dim
         self.num_heads = num_heads
@@ -298,7 +367,8 @@ class SwinTransformerBlock(nn.Module):
             qk_scale=qk_scale,
             attn_drop=attn_drop,
             proj_drop=drop,
-            share_kv=share_kv
+            share_kv=share_kv,
+            use_sdpa=use_sdpa
         )
 
         self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
@@ -384,6 +454,7 @@ class BasicLayer(nn.Module):
         norm_layer (nn.Module, optional): Normalization layer. Default: nn.LayerNorm
         downsample (nn.Module | None, optional): Downsample layer at the end of the layer. Default: None
         use_checkpoint (bool): Whether to use checkpointing to save memory. Default: False.
+        use_sdpa (bool): If True, use the fused F.scaled_dot_product_attention. Default: False.
     """
 
     def __init__(self,
@@ -399,7 +470,8 @@ class BasicLayer(nn.Module):
                  drop_path=0.,
                  norm_layer=nn.LayerNorm,
                  downsample=None,
-                 share_kv=False):
+                 share_kv=False,
+                 use_sdpa=False):
         super().__init__()
         self.window_size = window_size
         self.shift_size = window_size // 2
@@ -419,7 +491,8 @@ class BasicLayer(nn.Module):
                 attn_drop=attn_drop,
                 drop_path=drop_path[i] if isinstance(drop_path, list) else drop_path,
                 norm_layer=norm_layer,
-                share_kv=share_kv)
+                share_kv=share_kv,
+                use_sdpa=use_sdpa)
             for i in range(depth)])
 
         # patch merging layer
@@ -435,26 +508,10 @@ class BasicLayer(nn.Module):
             H, W: Spatial resolution of the input feature.
         """
 
-        # calculate attention mask for SW-MSA
+        # attention mask for SW-MSA
         Hp = int(np.ceil(H / self.window_size)) * self.window_size
         Wp = int(np.ceil(W / self.window_size)) * self.window_size
-        img_mask = torch.zeros((1, Hp, Wp, 1), device=x.device)  # 1 Hp Wp 1
-        h_slices = (slice(0, -self.window_size),
-                    slice(-self.window_size, -self.shift_size),
-                    slice(-self.shift_size, None))
-        w_slices = (slice(0, -self.window_size),
-                    slice(-self.window_size, -self.shift_size),
-                    slice(-self.shift_size, None))
-        cnt = 0
-        for h in h_slices:
-            for w in w_slices:
-                img_mask[:, h, w, :] = cnt
-                cnt += 1
-
-        mask_windows = window_partition(img_mask, self.window_size)  # nW, window_size, window_size, 1
-        mask_windows = mask_windows.view(-1, self.window_size * self.window_size)
-        attn_mask = mask_windows.unsqueeze(1) - mask_windows.unsqueeze(2)
-        attn_mask = attn_mask.masked_fill(attn_mask != 0, float(-100.0)).masked_fill(attn_mask == 0, float(0.0))
+        attn_mask = get_shifted_window_mask(Hp, Wp, self.window_size, self.shift_size, x.device)
 
         for blk in self.blocks:
             blk.H, blk.W = H, W
@@ -493,6 +550,7 @@ class SwinTransformer(nn.Module):
         frozen_stages (int): Stages to be frozen (stop grad and set eval mode).
             -1 means not freezing any parameters.
         use_checkpoint (bool): Whether to use checkpointing to save memory. Default: False.
+        use_sdpa (bool): If True, use the fused F.scaled_dot_product_attention. Default: False.
     """
 
     def __init__(self, swin_cfg, input_channels):
@@ -511,6 +569,7 @@ class SwinTransformer(nn.Module):
         self.patch_norm = swin_cfg['patch_norm']
 
         self.share_kv = swin_cfg.get('share_kv', False)
+        self.use_sdpa = swin_cfg.get('use_sdpa', False)
         self.qkv_bias = swin_cfg.get('qkv_bias', True)
         self.qk_scale = swin_cfg.get('qk_scale', None)
         self.drop_rate = swin_cfg.get('drop_rate', 0)
@@ -555,7 +614,8 @@ class SwinTransformer(nn.Module):
                 drop_path=dpr[sum(self.depths[:i_layer]):sum(self.depths[:i_layer + 1])],
                 norm_layer=norm_layer,
                 downsample=PatchMerging if (i_layer < self.num_layers - 1) else None,
-                share_kv=self.share_kv
+                share_kv=self.share_kv,
+                use_sdpa=self.use_sdpa
             )
             self.layers.append(layer)
             self.norm_layers.append(norm_layer(num_feature))
@@ -639,7 +699,8 @@ class SwinFPN(nn.Module):
                 drop_path=0,
                 norm_layer=nn.LayerNorm,
                 downsample=None,
-                share_kv=swin_cfg.get('share_kv', False)
+                share_kv=swin_cfg.get('share_kv', False),
+                use_sdpa=swin_cfg.get('use_sdpa', False)
             )
 
             self.decoders.append(layer)
@@ -1,7 +1,7 @@
 import torch
 import torch.nn as nn
 
-from ...ops.votr_ops import votr_utils
+from ...ops.votr_ops import votr_sorted_utils, votr_utils
 from pcdet.models.backbones_2d.swin_helpers import GELU
 
 
@@ -21,9 +21,52 @@ def scatter_nd(indices, updates, shape):
     return ret
 
 
+def get_grouping_operation(indices_backend):
+    if indices_backend == 'searchsorted':
+        return votr_sorted_utils.grouping_operation
+    return votr_utils.grouping_operation
+
+
+def get_attention_indices_func(indices_backend, subm, attention_name):
+    """
+    Args:
+        indices_backend: hash or searchsorted
+        subm: indices of the submanifold attention, of the strided sparse attention if not
+        attention_name: LocalAttention or StridedAttention
+    Returns:
+        func: attention indices function of votr_utils (hash) or votr_sorted_utils (searchsorted), the sparse ones
+            take the strides before map_table
+    """
+    if attention_name not in ['LocalAttention', 'StridedAttention']:
+        raise NotImplementedError
+    kind = 'subm' if subm else 'sparse'
+    name = 'local' if attention_name == 'LocalAttention' else 'strided'
+    if indices_backend == 'searchsorted':
+        return getattr(votr_sorted_utils, '%s_%s_attention_indices' % (kind, name))
+    return getattr(votr_utils, '%s_%s_attention_hash_indices' % (kind, name))
+
+
+def table_down_sample(sp_tensor, strides, num_ds_voxels, spatial_shape):
+    """
+    Returns:
+        ds_voxel_indices: (num_ds_voxels, 4) downsampled voxels of sp_tensor
+        map_table: map table of ds_voxel_indices in the indices backend of sp_tensor
+    """
+    if sp_tensor.indices_backend == 'searchsorted':
+        return votr_sorted_utils.sorted_table_down_sample(strides, num_ds_voxels, sp_tensor.batch_size,
+                                                          spatial_shape, sp_tensor.indices)
+    return votr_utils.hash_table_down_sample(strides, num_ds_voxels, sp_tensor.batch_size, sp_tensor.hash_size,
+                                             spatial_shape, sp_tensor.indices)
+
+
 class SparseTensor(object):
     def __init__(self, features, indices, spatial_shape, voxel_size, point_cloud_range, batch_size, hash_size,
-                 map_table=None, gather_dict=None):
+                 map_table=None, gather_dict=None, indices_backend='hash'):
+        """
+        Args:
+            indices_backend: hash, CUDA hash table of votr_utils, or searchsorted, sorted voxel keys of
+                votr_sorted_utils that also run on the CPU
+        """
         self.features = features
         self.indices = indices
         self.spatial_shape = spatial_shape  # [x, y, z]
@@ -32,14 +75,14 @@ class SparseTensor(object):
         self.point_cloud_range = point_cloud_range
         self.hash_size = hash_size
         self.gather_dict = gather_dict
+        self.indices_backend = indices_backend
         self.map_table = self.build_map_table() if not map_table else map_table
 
     @torch.no_grad()
     def build_map_table(self):
-        bs_cnt = torch.zeros(self.batch_size).int()
-        for i in range(self.batch_size):
-            bs_cnt[i] = (self.indices[:, 0] == i).sum().item()
-        bs_cnt = bs_cnt.to(self.indices.device)
+        if self.indices_backend == 'searchsorted':
+            return votr_sorted_utils.build_sorted_table(self.batch_size, self.spatial_shape, self.indices)
+        bs_cnt = votr_sorted_utils.get_batch_cnt(self.indices, self.batch_size)
         map_table = votr_utils.build_hash_table(
             self.batch_size,
             self.hash_size,
@@ -92,11 +135,7 @@ class Attention3d(nn.Module):
 
     @torch.no_grad()
     def with_bs_cnt(self, indices, batch_size):
-        bs_cnt = torch.zeros(batch_size).int()
-        for i in range(batch_size):
-            bs_cnt[i] = (indices[:, 0] == i).sum().item()
-        bs_cnt = bs_cnt.to(indices.device)
-        return bs_cnt
+        return votr_sorted_utils.get_batch_cnt(indices, batch_size)
 
     @torch.no_grad()
     def with_coords(self, indices, point_cloud_range, voxel_size):
@@ -135,23 +174,19 @@ class SparseAttention3d(Attention3d):
         )
 
     @torch.no_grad()
-    def create_gather_dict(self, attention_modes, map_table, voxel_indices, spatial_shape):
+    def create_gather_dict(self, attention_modes, map_table, voxel_indices, spatial_shape, indices_backend='hash'):
         _gather_dict = {}
         for attention_mode in attention_modes:
             if attention_mode.NAME == 'LocalAttention':
-                attend_size = attention_mode.SIZE
                 attend_range = attention_mode.RANGE
-                _gather_indices = votr_utils.sparse_local_attention_hash_indices(spatial_shape, attend_size,
-                                                                                 attend_range, self.strides, map_table,
-                                                                                 voxel_indices)
             elif attention_mode.NAME == 'StridedAttention':
-                attend_size = attention_mode.SIZE
-                range_spec = attention_mode.RANGE_SPEC
-                _gather_indices = votr_utils.sparse_strided_attention_hash_indices(spatial_shape, attend_size,
-                                                                                   range_spec, self.strides, map_table,
-                                                                                   voxel_indices)
+                attend_range = attention_mode.RANGE_SPEC
             else:
                 raise NotImplementedError
+            indices_func = get_attention_indices_func(indices_backend, False, attention_mode.NAME)
+            _gather_indices = indices_func(
+                spatial_shape, attention_mode.SIZE, attend_range, self.strides, map_table, voxel_indices
+            )
 
             _gather_mask = (_gather_indices < 0)
             # _gather_indices[_gather_indices < 0] = 0
@@ -165,9 +200,8 @@ class SparseAttention3d(Attention3d):
         y_shape = sp_tensor.spatial_shape[1] // self.strides[1]
         z_shape = sp_tensor.spatial_shape[2] // self.strides[2]
         new_spatial_shape = [x_shape, y_shape, z_shape]
-        new_indices, new_map_table = votr_utils.hash_table_down_sample(self.strides, self.num_ds_voxels,
-                                                                       sp_tensor.batch_size, sp_tensor.hash_size,
-                                                                       new_spatial_shape, sp_tensor.indices)
+        new_indices, new_map_table = table_down_sample(sp_tensor, self.strides, self.num_ds_voxels,
+                                                       new_spatial_shape)
         return new_spatial_shape, new_indices, new_map_table
 
     def forward(self, sp_tensor):
@@ -175,7 +209,8 @@ class SparseAttention3d(Attention3d):
         vx, vy, vz = sp_tensor.voxel_size
         new_voxel_size = [vx * self.strides[0], vy * self.strides[1], vz * self.strides[2]]
         gather_dict = self.create_gather_dict(self.attention_modes, sp_tensor.map_table, new_indices,
-                                              sp_tensor.spatial_shape)
+                                              sp_tensor.spatial_shape, sp_tensor.indices_backend)
+        grouping_operation = get_grouping_operation(sp_tensor.indices_backend)
 
         voxel_features = sp_tensor.features
         v_bs_cnt = self.with_bs_cnt(sp_tensor.indices, sp_tensor.batch_size)
@@ -190,9 +225,9 @@ class SparseAttention3d(Attention3d):
         key_indices = torch.cat(a_key_indices, dim=1)
         key_mask = torch.cat(a_key_mask, dim=1)
 
-        key_features = votr_utils.grouping_operation(voxel_features, v_bs_cnt, key_indices, k_bs_cnt)
+        key_features = grouping_operation(voxel_features, v_bs_cnt, key_indices, k_bs_cnt)
         voxel_coords = self.with_coords(sp_tensor.indices, sp_tensor.point_cloud_range, sp_tensor.voxel_size)
-        key_coords = votr_utils.grouping_operation(voxel_coords, v_bs_cnt, key_indices, k_bs_cnt)
+        key_coords = grouping_operation(voxel_coords, v_bs_cnt, key_indices, k_bs_cnt)
 
         query_coords = self.with_coords(new_indices, sp_tensor.point_cloud_range, new_voxel_size)
 
@@ -265,21 +300,17 @@ class SubMAttention3d(Attention3d):
             )
 
     @torch.no_grad()
-    def create_gather_dict(self, attention_modes, map_table, voxel_indices, spatial_shape):
+    def create_gather_dict(self, attention_modes, map_table, voxel_indices, spatial_shape, indices_backend='hash'):
         _gather_dict = {}
         for attention_mode in attention_modes:
             if attention_mode.NAME == 'LocalAttention':
-                attend_size = attention_mode.SIZE
                 attend_range = attention_mode.RANGE
-                _gather_indices = votr_utils.subm_local_attention_hash_indices(spatial_shape, attend_size, attend_range,
-                                                                               map_table, voxel_indices)
             elif attention_mode.NAME == 'StridedAttention':
-                attend_size = attention_mode.SIZE
-                range_spec = attention_mode.RANGE_SPEC
-                _gather_indices = votr_utils.subm_strided_attention_hash_indices(spatial_shape, attend_size, range_spec,
-                                                                                 map_table, voxel_indices)
+                attend_range = attention_mode.RANGE_SPEC
             else:
                 raise NotImplementedError
+            indices_func = get_attention_indices_func(indices_backend, True, attention_mode.NAME)
+            _gather_indices = indices_func(spatial_shape, attention_mode.SIZE, attend_range, map_table, voxel_indices)
 
             _gather_mask = (_gather_indices < 0)
             # _gather_indices[_gather_indices < 0] = 0
@@ -290,7 +321,9 @@ class SubMAttention3d(Attention3d):
     def forward(self, sp_tensor):
         if not sp_tensor.gather_dict:
             sp_tensor.gather_dict = self.create_gather_dict(self.attention_modes, sp_tensor.map_table,
-                                                            sp_tensor.indices, sp_tensor.spatial_shape)
+                                                            sp_tensor.indices, sp_tensor.spatial_shape,
+                                                            sp_tensor.indices_backend)
+        grouping_operation = get_grouping_operation(sp_tensor.indices_backend)
 
         voxel_features = sp_tensor.features
         v_bs_cnt = self.with_bs_cnt(sp_tensor.indices, sp_tensor.batch_size)
@@ -306,11 +339,11 @@ class SubMAttention3d(Attention3d):
         key_mask = torch.cat(a_key_mask, dim=1)
 
         query_features = voxel_features.unsqueeze(0)  # (1, N1+N2, C)
-        key_features = votr_utils.grouping_operation(voxel_features, v_bs_cnt, key_indices, k_bs_cnt)
+        key_features = grouping_operation(voxel_features, v_bs_cnt, key_indices, k_bs_cnt)
 
         if self.use_pos_emb:
             voxel_coords = self.with_coords(sp_tensor.indices, sp_tensor.point_cloud_range, sp_tensor.voxel_size)
-            key_coords = votr_utils.grouping_operation(voxel_coords, v_bs_cnt, key_indices, k_bs_cnt)
+            key_coords = grouping_operation(voxel_coords, v_bs_cnt, key_indices, k_bs_cnt)
             if self.use_relative_coords:
                 key_coords = key_coords - voxel_coords.unsqueeze(-1)
             key_pos_emb = self.k_pos_proj(key_coords)
@@ -423,6 +456,7 @@ class VoxelTransformer(nn.Module):
             hash_size=self.model_cfg.HASH_SIZE,
             map_table=None,
             gather_dict=None,
+            indices_backend=self.model_cfg.get('INDICES_BACKEND', 'hash'),
         )
         for attention_block in self.backbone:
             sp_tensor = attention_block(sp_tensor)
@@ -510,23 +544,19 @@ class SparseAttention3dv2(Attention3d):
         return global_features, global_coords
 
     @torch.no_grad()
-    def create_gather_dict(self, attention_modes, map_table, voxel_indices, spatial_shape):
+    def create_gather_dict(self, attention_modes, map_table, voxel_indices, spatial_shape, indices_backend='hash'):
         _gather_dict = {}
         for attention_mode in attention_modes:
             if attention_mode.NAME == 'LocalAttention':
-                attend_size = attention_mode.SIZE
                 attend_range = attention_mode.RANGE
-                _gather_indices = votr_utils.sparse_local_attention_hash_indices(spatial_shape, attend_size,
-                                                                                 attend_range, self.strides, map_table,
-                                                                                 voxel_indices)
             elif attention_mode.NAME == 'StridedAttention':
-                attend_size = attention_mode.SIZE
-                range_spec = attention_mode.RANGE_SPEC
-                _gather_indices = votr_utils.sparse_strided_attention_hash_indices(spatial_shape, attend_size,
-                                                                                   range_spec, self.strides, map_table,
-                                                                                   voxel_indices)
+                attend_range = attention_mode.RANGE_SPEC
             else:
                 raise NotImplementedError
+            indices_func = get_attention_indices_func(indices_backend, False, attention_mode.NAME)
+            _gather_indices = indices_func(
+                spatial_shape, attention_mode.SIZE, attend_range, self.strides, map_table, voxel_indices
+            )
 
             _gather_mask = (_gather_indices < 0)
             # _gather_indices[_gather_indices < 0] = 0
@@ -540,9 +570,8 @@ class SparseAttention3dv2(Attention3d):
         y_shape = sp_tensor.spatial_shape[1] // self.strides[1]
         z_shape = sp_tensor.spatial_shape[2] // self.strides[2]
         new_spatial_shape = [x_shape, y_shape, z_shape]
-        new_indices, new_map_table = votr_utils.hash_table_down_sample(self.strides, self.num_ds_voxels,
-                                                                       sp_tensor.batch_size, sp_tensor.hash_size,
-                                                                       new_spatial_shape, sp_tensor.indices)
+        new_indices, new_map_table = table_down_sample(sp_tensor, self.strides, self.num_ds_voxels,
+                                                       new_spatial_shape)
         return new_spatial_shape, new_indices, new_map_table
 
     def forward(self, sp_tensor):
@@ -550,7 +579,8 @@ class SparseAttention3dv2(Attention3d):
         vx, vy, vz = sp_tensor.voxel_size
         new_voxel_size = [vx * self.strides[0], vy * self.strides[1], vz * self.strides[2]]
         gather_dict = self.create_gather_dict(self.attention_modes, sp_tensor.map_table, new_indices,
-                                              sp_tensor.spatial_shape)
+                                              sp_tensor.spatial_shape, sp_tensor.indices_backend)
+        grouping_operation = get_grouping_operation(sp_tensor.indices_backend)
 
         voxel_features = sp_tensor.features
         v_bs_cnt = self.with_bs_cnt(sp_tensor.indices, sp_tensor.batch_size)
@@ -565,9 +595,9 @@ class SparseAttention3dv2(Attention3d):
         key_indices = torch.cat(a_key_indices, dim=1)
         key_mask = torch.cat(a_key_mask, dim=1)
 
-        key_features = votr_utils.grouping_operation(voxel_features, v_bs_cnt, key_indices, k_bs_cnt)
+        key_features = grouping_operation(voxel_features, v_bs_cnt, key_indices, k_bs_cnt)
         voxel_coords = self.with_coords(sp_tensor.indices, sp_tensor.point_cloud_range, sp_tensor.voxel_size)
-        key_coords = votr_utils.grouping_operation(voxel_coords, v_bs_cnt, key_indices, k_bs_cnt)
+        key_coords = grouping_operation(voxel_coords, v_bs_cnt, key_indices, k_bs_cnt)
 
         query_coords = self.with_coords(new_indices, sp_tensor.point_cloud_range, new_voxel_size)
 
@@ -700,21 +730,17 @@ class SubMAttention3dv2(Attention3d):
         return global_features, global_coords
 
     @torch.no_grad()
-    def create_gather_dict(self, attention_modes, map_table, voxel_indices, spatial_shape):
+    def create_gather_dict(self, attention_modes, map_table, voxel_indices, spatial_shape, indices_backend='hash'):
         _gather_dict = {}
         for attention_mode in attention_modes:
             if attention_mode.NAME == 'LocalAttention':
-                attend_size = attention_mode.SIZE
                 attend_range = attention_mode.RANGE
-                _gather_indices = votr_utils.subm_local_attention_hash_indices(spatial_shape, attend_size, attend_range,
-                                                                               map_table, voxel_indices)
             elif attention_mode.NAME == 'StridedAttention':
-                attend_size = attention_mode.SIZE
-                range_spec = attention_mode.RANGE_SPEC
-                _gather_indices = votr_utils.subm_strided_attention_hash_indices(spatial_shape, attend_size, range_spec,
-                                                                                 map_table, voxel_indices)
+                attend_range = attention_mode.RANGE_SPEC
             else:
                 raise NotImplementedError
+            indices_func = get_attention_indices_func(indices_backend, True, attention_mode.NAME)
+            _gather_indices = indices_func(spatial_shape, attention_mode.SIZE, attend_range, map_table, voxel_indices)
 
             _gather_mask = (_gather_indices < 0)
             # _gather_indices[_gather_indices < 0] = 0
@@ -725,7 +751,9 @@ class SubMAttention3dv2(Attention3d):
     def forward(self, sp_tensor):
         if not sp_tensor.gather_dict:
             sp_tensor.gather_dict = self.create_gather_dict(self.attention_modes, sp_tensor.map_table,
-                                                            sp_tensor.indices, sp_tensor.spatial_shape)
+                                                            sp_tensor.indices, sp_tensor.spatial_shape,
+                                                            sp_tensor.indices_backend)
+        grouping_operation = get_grouping_operation(sp_tensor.indices_backend)
 
         voxel_features = sp_tensor.features
         v_bs_cnt = self.with_bs_cnt(sp_tensor.indices, sp_tensor.batch_size)
@@ -741,7 +769,7 @@ class SubMAttention3dv2(Attention3d):
         key_mask = torch.cat(a_key_mask, dim=1)
 
         query_features = voxel_features.unsqueeze(0)  # (1, N1+N2, C)
-        key_features = votr_utils.grouping_operation(voxel_features, v_bs_cnt, key_indices, k_bs_cnt)
+        key_features = grouping_operation(voxel_features, v_bs_cnt, key_indices, k_bs_cnt)
 
         if self.global_mode:
             global_key_features, global_key_coords = self.global_attention(query_features=query_features.squeeze(0),
@@ -754,7 +782,7 @@ class SubMAttention3dv2(Attention3d):
 
         if self.use_pos_emb:
             voxel_coords = self.with_coords(sp_tensor.indices, sp_tensor.point_cloud_range, sp_tensor.voxel_size)
-            key_coords = votr_utils.grouping_operation(voxel_coords, v_bs_cnt, key_indices, k_bs_cnt)
+            key_coords = grouping_operation(voxel_coords, v_bs_cnt, key_indices, k_bs_cnt)
 
             # added
             if self.global_mode:
@@ -874,6 +902,7 @@ class VoxelTransformerV2(nn.Module):
             hash_size=self.model_cfg.HASH_SIZE,
             map_table=None,
             gather_dict=None,
+            indices_backend=self.model_cfg.get('INDICES_BACKEND', 'hash'),
         )
         for attention_block in self.backbone:
             sp_tensor = attention_block(sp_tensor)
@@ -936,6 +965,7 @@ class VoxelTransformerV3(nn.Module):
             hash_size=self.model_cfg.HASH_SIZE,
             map_table=None,
             gather_dict=None,
+            indices_backend=self.model_cfg.get('INDICES_BACKEND', 'hash'),
         )
         for attention_block in self.backbone:
             sp_tensor = attention_block(sp_tensor)
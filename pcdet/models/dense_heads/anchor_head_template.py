@@ -28,7 +28,8 @@ class AnchorHeadTemplate(nn.Module):
             anchor_generator_cfg, grid_size=grid_size, point_cloud_range=point_cloud_range,
             anchor_ndim=self.box_coder.code_size
         )
-        self.anchors = [x.cuda() for x in anchors]
+        # the model is moved to the GPU after it is built, CPU (gloo) runs keep the anchors on the CPU
+        self.anchors = [x.cuda() if torch.cuda.is_available() else x for x in anchors]
         self.target_assigner = self.get_target_assigner(anchor_target_cfg)
 
         self.forward_ret_dict = {}
@@ -57,7 +58,8 @@ class AnchorHeadTemplate(nn.Module):
                 topk=anchor_target_cfg.TOPK,
                 box_coder=self.box_coder,
                 use_multihead=self.use_multihead,
-                match_height=anchor_target_cfg.MATCH_HEIGHT
+                match_height=anchor_target_cfg.MATCH_HEIGHT,
+                batched=anchor_target_cfg.get('BATCHED_ASSIGN', False)
             )
         elif anchor_target_cfg.NAME == 'AxisAlignedTargetAssigner':
             target_assigner = AxisAlignedTargetAssigner(
@@ -124,8 +126,8 @@ class AnchorHeadTemplate(nn.Module):
             y_stride = (bev_range[4] - bev_range[1]) / (grid_size[1] - 1)
             x_offset, y_offset = 0, 0
         
-        x_shifts = torch.arange(bev_range[0] + x_offset, bev_range[3] + 1e-5, step = x_stride, dtype= torch.float32).cuda()
-        y_shifts = torch.arange(bev_range[1] + y_offset, bev_range[4] + 1e-5, step = y_stride, dtype= torch.float32).cuda()
+        x_shifts = torch.arange(bev_range[0] + x_offset, bev_range[3] + 1e-5, step = x_stride, dtype= torch.float32).to(gt_boxes.device)
+        y_shifts = torch.arange(bev_range[1] + y_offset, bev_range[4] + 1e-5, step = y_stride, dtype= torch.float32).to(gt_boxes.device)
         x_shifts, y_shifts = torch.meshgrid([x_shifts, y_shifts])
         bev_coords = torch.stack([x_shifts, y_shifts], dim = -1)
         bev_indices = roiaware_pool3d_utils.bev_in_boxes_gpu(bev_coords, gt_boxes[:, :, 0:7].contiguous(), bev_range)
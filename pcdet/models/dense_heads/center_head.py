@@ -3,13 +3,11 @@ import torch.nn as nn
 import copy
 import sys
 from collections import OrderedDict
-import numpy as np
-import numba
 from ...ops.dcn import DeformConv
 from ...ops.iou3d_nms import iou3d_nms_cuda
 from ...ops.center_ops import center_ops_cuda
 
-from ..model_utils import centernet_box_utils
+from ..model_utils import centernet_box_utils, model_nms_utils
 from ...utils import loss_utils
 from .target_assigner.center_assigner import CenterAssigner
 
@@ -85,7 +83,7 @@ class CenterHead(nn.Module):
         Returns:
 
         """
-        targets_dict = self.target_assigner.assign_targets_v2(
+        targets_dict = self.target_assigner.assign_targets(
             gt_boxes
         )
 
@@ -293,40 +291,6 @@ class CenterHead(nn.Module):
 
         return topk_score, topk_inds, topk_clses, topk_ys, topk_xs
 
-    @numba.jit(nopython=True)
-    def circle_nms(self, dets, thresh):
-        x1 = dets[:, 0]
-        y1 = dets[:, 1]
-        scores = dets[:, 2]
-        order = scores.argsort()[::-1].astype(np.int32)  # highest->lowest
-        ndets = dets.shape[0]
-        suppressed = np.zeros((ndets), dtype=np.int32)
-        keep = []
-        for _i in range(ndets):
-            i = order[_i]  # start with highest score box
-            if suppressed[i] == 1:  # if any box have enough iou with this, remove it
-                continue
-            keep.append(i)
-            for _j in range(_i + 1, ndets):
-                j = order[_j]
-                if suppressed[j] == 1:
-                    continue
-                # calculate center distance between i and j box
-                dist = (x1[i] - x1[j]) ** 2 + (y1[i] - y1[j]) ** 2
-
-                # ovr = inter / areas[j]
-                if dist <= thresh:
-                    suppressed[j] = 1
-        return keep
-
-    def _circle_nms(self, boxes, min_radius, post_max_size=83):
-        """
-        NMS according to center distance
-        """
-        keep = np.array(self.circle_nms(boxes.cpu().numpy(), thresh=min_radius))[:post_max_size]
-        keep = torch.from_numpy(keep).long().to(boxes.device)
-        return keep
-
     def _rotate_nms(self, boxes, scores, thresh, pre_maxsize=None, post_max_size=None):
         """
         :param boxes: (N, 5) [x1, y1, x2, y2, ry]
@@ -446,6 +410,14 @@ class CenterHead(nn.Module):
         thresh_mask = final_scores > score_threshold
         mask &= thresh_mask
 
+        # the dense (B, K, K) suppression matrix pays off on the GPU, the numba loop stays faster on a few CPU cores
+        batched_circle_nms = use_circle_nms and nms_cfg.get('batched_circle_nms', final_box_preds.is_cuda)
+        if batched_circle_nms:
+            nms_order, nms_keep = model_nms_utils.batched_circle_nms(
+                final_box_preds[..., 0:2], final_scores, thresh=nms_cfg.min_radius[task_id], valid_mask=mask,
+                post_max_size=nms_cfg.post_max_size
+            )
+
         predictions_dicts = []
         for i in range(batch):
             cmask = mask[i, :]
@@ -454,10 +426,16 @@ class CenterHead(nn.Module):
             labels = final_preds[i, cmask]
 
             # circle nms
-            if use_circle_nms:
+            if batched_circle_nms:
+                selected = nms_order[i, nms_keep[i]]
+                boxes3d = final_box_preds[i, selected]
+                scores = final_scores[i, selected]
+                labels = final_preds[i, selected]
+
+            elif use_circle_nms:
                 centers = boxes3d[:, [0, 1]]
                 boxes = torch.cat([centers, scores.view(-1, 1)], dim=1)
-                keep = self._circle_nms(boxes, min_radius=nms_cfg.min_radius[task_id], post_max_size=nms_cfg.post_max_size)
+                keep = model_nms_utils.circle_nms_keep(boxes, min_radius=nms_cfg.min_radius[task_id], post_max_size=nms_cfg.post_max_size)
 
                 boxes3d = boxes3d[keep]
                 scores = scores[keep]
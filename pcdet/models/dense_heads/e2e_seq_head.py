@@ -108,8 +108,11 @@ class E2ESeqHead(nn.Module):
 
         boxes = boxes[order].contiguous()
         keep = torch.LongTensor(boxes.size(0))
-        num_out = iou3d_nms_cuda.nms_gpu(boxes, keep, thresh)
-        selected = order[keep[:num_out].cuda()].contiguous()
+        if boxes.is_cuda:
+            num_out = iou3d_nms_cuda.nms_gpu(boxes, keep, thresh)
+        else:
+            num_out = iou3d_nms_cuda.nms_cpu(boxes, keep, thresh)
+        selected = order[keep[:num_out].to(order.device)].contiguous()
 
         if post_max_size is not None:
             selected = selected[:post_max_size]
@@ -186,16 +189,16 @@ class E2ESeqHead(nn.Module):
 
             tb_key = 'task_' + str(task_id) + '/'
             tb_dict.update({
-                tb_key + 'loss_x': task_loss_dicts['loc_loss_elem'][0].item(),
-                tb_key + 'loss_y': task_loss_dicts['loc_loss_elem'][1].item(),
-                tb_key + 'loss_z': task_loss_dicts['loc_loss_elem'][2].item(),
-                tb_key + 'loss_w': task_loss_dicts['loc_loss_elem'][3].item(),
-                tb_key + 'loss_l': task_loss_dicts['loc_loss_elem'][4].item(),
-                tb_key + 'loss_h': task_loss_dicts['loc_loss_elem'][5].item(),
-                tb_key + 'loss_sin': task_loss_dicts['loc_loss_elem'][6].item(),
-                tb_key + 'loss_cos': task_loss_dicts['loc_loss_elem'][7].item(),
-                tb_key + 'loss_ce': task_loss_dicts['loss_ce'],
-                tb_key + 'loss_bbox': task_loss_dicts['loss_bbox'],
+                tb_key + 'loss_x': task_loss_dicts['loc_loss_elem'][0],
+                tb_key + 'loss_y': task_loss_dicts['loc_loss_elem'][1],
+                tb_key + 'loss_z': task_loss_dicts['loc_loss_elem'][2],
+                tb_key + 'loss_w': task_loss_dicts['loc_loss_elem'][3],
+                tb_key + 'loss_l': task_loss_dicts['loc_loss_elem'][4],
+                tb_key + 'loss_h': task_loss_dicts['loc_loss_elem'][5],
+                tb_key + 'loss_sin': task_loss_dicts['loc_loss_elem'][6],
+                tb_key + 'loss_cos': task_loss_dicts['loc_loss_elem'][7],
+                tb_key + 'loss_ce': task_loss_dicts['loss_ce'].detach(),
+                tb_key + 'loss_bbox': task_loss_dicts['loss_bbox'].detach(),
             })
 
 
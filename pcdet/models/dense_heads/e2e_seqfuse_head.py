@@ -240,19 +240,19 @@ class E2ESeqFusionHead(nn.Module):
 
             tb_key = 'task_' + str(task_id) + '/'
             tb_dict.update({
-                tb_key + 'loss_x': task_loss_dicts['loc_loss_elem'][0].item(),
-                tb_key + 'loss_y': task_loss_dicts['loc_loss_elem'][1].item(),
-                tb_key + 'loss_z': task_loss_dicts['loc_loss_elem'][2].item(),
-                tb_key + 'loss_w': task_loss_dicts['loc_loss_elem'][3].item(),
-                tb_key + 'loss_l': task_loss_dicts['loc_loss_elem'][4].item(),
-                tb_key + 'loss_h': task_loss_dicts['loc_loss_elem'][5].item(),
-                tb_key + 'loss_sin': task_loss_dicts['loc_loss_elem'][6].item(),
-                tb_key + 'loss_cos': task_loss_dicts['loc_loss_elem'][7].item(),
-                tb_key + 'loss_ce': task_loss_dicts['loss_ce'],
-                tb_key + 'loss_bbox': task_loss_dicts['loss_bbox'],
-                tb_key + 'loss_center': task_loss_dicts['loss_center'],
-                tb_key + 'loss_corner': task_loss_dicts['loss_corner'],
-                tb_key + 'loss_foreground': task_loss_dicts['loss_foreground'],
+                tb_key + 'loss_x': task_loss_dicts['loc_loss_elem'][0],
+                tb_key + 'loss_y': task_loss_dicts['loc_loss_elem'][1],
+                tb_key + 'loss_z': task_loss_dicts['loc_loss_elem'][2],
+                tb_key + 'loss_w': task_loss_dicts['loc_loss_elem'][3],
+                tb_key + 'loss_l': task_loss_dicts['loc_loss_elem'][4],
+                tb_key + 'loss_h': task_loss_dicts['loc_loss_elem'][5],
+                tb_key + 'loss_sin': task_loss_dicts['loc_loss_elem'][6],
+                tb_key + 'loss_cos': task_loss_dicts['loc_loss_elem'][7],
+                tb_key + 'loss_ce': task_loss_dicts['loss_ce'].detach(),
+                tb_key + 'loss_bbox': task_loss_dicts['loss_bbox'].detach(),
+                tb_key + 'loss_center': task_loss_dicts['loss_center'].detach(),
+                tb_key + 'loss_corner': task_loss_dicts['loss_corner'].detach(),
+                tb_key + 'loss_foreground': task_loss_dicts['loss_foreground'].detach(),
             })
 
             losses.append(task_loss_dicts['loss'])
@@ -1,14 +1,12 @@
 import torch
 import torch.nn as nn
 import copy
-import numpy as np
-import numba
 from pcdet.models.dense_heads.fusion_modules import DCNFusionHead, NaiveFusionHead
 from pcdet.models.dense_heads.utils import _sigmoid
 from ...ops.iou3d_nms import iou3d_nms_cuda
 from ...ops.center_ops import center_ops_cuda
 
-from ..model_utils import centernet_box_utils
+from ..model_utils import centernet_box_utils, model_nms_utils
 from ...utils import loss_utils
 from .target_assigner.bundle_assigner import BundleAssigner
 
@@ -293,40 +291,6 @@ class FusionHead(nn.Module):
 
         return topk_score, topk_inds, topk_clses, topk_ys, topk_xs
 
-    @numba.jit(nopython=True)
-    def circle_nms(self, dets, thresh):
-        x1 = dets[:, 0]
-        y1 = dets[:, 1]
-        scores = dets[:, 2]
-        order = scores.argsort()[::-1].astype(np.int32)  # highest->lowest
-        ndets = dets.shape[0]
-        suppressed = np.zeros((ndets), dtype=np.int32)
-        keep = []
-        for _i in range(ndets):
-            i = order[_i]  # start with highest score box
-            if suppressed[i] == 1:  # if any box have enough iou with this, remove it
-                continue
-            keep.append(i)
-            for _j in range(_i + 1, ndets):
-                j = order[_j]
-                if suppressed[j] == 1:
-                    continue
-                # calculate center distance between i and j box
-                dist = (x1[i] - x1[j]) ** 2 + (y1[i] - y1[j]) ** 2
-
-                # ovr = inter / areas[j]
-                if dist <= thresh:
-                    suppressed[j] = 1
-        return keep
-
-    def _circle_nms(self, boxes, min_radius, post_max_size=83):
-        """
-        NMS according to center distance
-        """
-        keep = np.array(self.circle_nms(boxes.cpu().numpy(), thresh=min_radius))[:post_max_size]
-        keep = torch.from_numpy(keep).long().to(boxes.device)
-        return keep
-
     def _rotate_nms(self, boxes, scores, thresh, pre_maxsize=None, post_max_size=None):
         """
         :param boxes: (N, 5) [x1, y1, x2, y2, ry]
@@ -471,7 +435,7 @@ class FusionHead(nn.Module):
             if use_circle_nms:
                 centers = boxes3d[:, [0, 1]]
                 boxes = torch.cat([centers, scores.view(-1, 1)], dim=1)
-                keep = self._circle_nms(boxes, min_radius=nms_cfg.min_radius[task_id],
+                keep = model_nms_utils.circle_nms_keep(boxes, min_radius=nms_cfg.min_radius[task_id],
                                         post_max_size=nms_cfg.post_max_size)
 
                 boxes3d = boxes3d[keep]
@@ -8,12 +8,14 @@ class ATSSTargetAssigner(object):
     """
     Reference: https://arxiv.org/abs/1912.02424
     """
-    def __init__(self, topk, box_coder, match_height=False):
+    def __init__(self, topk, box_coder, match_height=False, use_multihead=False, batched=False):
         self.topk = topk
         self.box_coder = box_coder
         self.match_height = match_height
+        self.use_multihead = use_multihead
+        self.batched = batched
 
-    def assign_targets(self, anchors_list, gt_boxes_with_classes, use_multihead=False):
+    def assign_targets(self, anchors_list, gt_boxes_with_classes, use_multihead=None):
         """
         Args:
             anchors: [(N, 7), ...]
@@ -21,6 +23,7 @@ class ATSSTargetAssigner(object):
         Returns:
 
         """
+        use_multihead = self.use_multihead if use_multihead is None else use_multihead
         if not isinstance(anchors_list, list):
             anchors_list = [anchors_list]
             single_set_of_anchor = True
@@ -35,6 +38,13 @@ class ATSSTargetAssigner(object):
                 anchors = anchors.permute(3, 4, 0, 1, 2, 5).contiguous().view(-1, anchors.shape[-1])
             else:
                 anchors = anchors.view(-1, anchors.shape[-1])
+            if self.batched:
+                cls_labels, reg_targets, reg_weights = self.assign_targets_batch(anchors, gt_boxes, gt_classes)
+                cls_labels_list.append(cls_labels)
+                reg_targets_list.append(reg_targets)
+                reg_weights_list.append(reg_weights)
+                continue
+
             cls_labels, reg_targets, reg_weights = [], [], []
             for k in range(batch_size):
                 cur_gt = gt_boxes[k]
@@ -139,3 +149,87 @@ class ATSSTargetAssigner(object):
             reg_weights[pos_mask] = 1.0
 
         return cls_labels, reg_targets, reg_weights
+
+    def assign_targets_batch(self, anchors, gt_boxes, gt_classes):
+        """
+        assign_targets_single on the padded boxes of the whole batch: the IoUs, the distances and the top-k of the
+        valid boxes of all the samples are computed in one call, side by side in the (N, M) layout of the single
+        sample version, and the matches are resolved per sample on the zero padded (N, B, M) layout.
+
+        Args:
+            anchors: (N, 7) [x, y, z, dx, dy, dz, heading]
+            gt_boxes: (B, M, 7) [x, y, z, dx, dy, dz, heading], zero padded
+            gt_classes: (B, M)
+        Returns:
+            cls_labels: (B, N)
+            reg_targets: (B, N, code_size)
+            reg_weights: (B, N)
+        """
+        num_anchor = anchors.shape[0]
+        batch_size, num_boxes = gt_boxes.shape[0:2]
+        device = gt_boxes.device
+
+        # trailing all-zero boxes are padding, the first box of a sample is always kept
+        nonzero = gt_boxes.sum(dim=-1) != 0
+        nonzero[:, 0] = True
+        box_ids = torch.arange(num_boxes, device=device)
+        num_valid = (nonzero * (box_ids + 1)).max(dim=1)[0]
+        valid_idxs = (box_ids[None, :] < num_valid[:, None]).view(-1).nonzero()[:, 0]  # (T), index in BxM
+        valid_gt_boxes = gt_boxes.reshape(-1, gt_boxes.shape[-1])[valid_idxs]  # (T, 7)
+        num_gt = valid_gt_boxes.shape[0]
+
+        # select topk anchors for each gt_boxes
+        if self.match_height:
+            ious = iou3d_nms_utils.boxes_iou3d_gpu(anchors[:, 0:7], valid_gt_boxes[:, 0:7])  # (N, T)
+        else:
+            ious = iou3d_nms_utils.boxes_iou_bev(anchors[:, 0:7], valid_gt_boxes[:, 0:7])
+
+        distance = (anchors[:, None, 0:3] - valid_gt_boxes[None, :, 0:3]).norm(dim=-1)  # (N, T)
+        _, topk_idxs = distance.topk(self.topk, dim=0, largest=False)  # (K, T)
+        gt_idxs = torch.arange(num_gt, device=device)
+        candidate_ious = ious[topk_idxs, gt_idxs]  # (K, T)
+        iou_mean_per_gt = candidate_ious.mean(dim=0)
+        iou_std_per_gt = candidate_ious.std(dim=0)
+        iou_thresh_per_gt = iou_mean_per_gt + iou_std_per_gt + 1e-6
+        is_pos = candidate_ious >= iou_thresh_per_gt[None, :]  # (K, T)
+
+        # check whether anchor_center in gt_boxes, only check BEV x-y axes
+        candidate_anchors = anchors[topk_idxs.view(-1)]  # (KxT, 7)
+        gt_boxes_of_each_anchor = valid_gt_boxes.repeat(self.topk, 1)  # (KxT, 7)
+        xyz_local = candidate_anchors[:, 0:3] - gt_boxes_of_each_anchor[:, 0:3]
+        xyz_local = common_utils.rotate_points_along_z(
+            xyz_local[:, None, :], -gt_boxes_of_each_anchor[:, 6]
+        ).squeeze(dim=1)
+        xy_local = xyz_local[:, 0:2]
+        lw = gt_boxes_of_each_anchor[:, 3:5][:, [1, 0]]  # bugfixed: w ==> y, l ==> x in local coords
+        is_in_gt = ((xy_local <= lw / 2) & (xy_local >= -lw / 2)).all(dim=-1).view(-1, num_gt)  # (K, T)
+        is_pos = is_pos & is_in_gt  # (K, T)
+
+        # select the highest IoU if an anchor box is assigned with multiple gt_boxes of its sample
+        INF = -0x7FFFFFFF
+        pos_anchor_idxs = topk_idxs[is_pos]
+        pos_gt_idxs = gt_idxs[None, :].expand_as(topk_idxs)[is_pos]
+        ious_inf = ious.new_full((num_anchor, batch_size * num_boxes), INF)  # (N, BxM)
+        ious_inf[pos_anchor_idxs, valid_idxs[pos_gt_idxs]] = ious[pos_anchor_idxs, pos_gt_idxs]
+        anchors_to_gt_values, anchors_to_gt_indexs = ious_inf.view(num_anchor, batch_size, num_boxes).max(dim=2)
+
+        # match the gt_boxes to the anchors which have maximum iou with them, in the order of the boxes
+        max_iou_of_each_gt, argmax_iou_of_each_gt = ious.max(dim=0)
+        anchors_to_gt_indexs[argmax_iou_of_each_gt, valid_idxs // num_boxes] = valid_idxs % num_boxes
+        anchors_to_gt_values[argmax_iou_of_each_gt, valid_idxs // num_boxes] = max_iou_of_each_gt
+
+        anchors_to_gt_indexs = anchors_to_gt_indexs.t()  # (B, N)
+        cls_labels = gt_classes.gather(1, anchors_to_gt_indexs)
+        cls_labels[anchors_to_gt_values.t() == INF] = 0
+        matched_gts = gt_boxes.gather(1, anchors_to_gt_indexs[..., None].expand(-1, -1, gt_boxes.shape[-1]))
+
+        pos_mask = cls_labels > 0
+        reg_targets = matched_gts.new_zeros((batch_size, num_anchor, self.box_coder.code_size))
+        reg_weights = matched_gts.new_zeros((batch_size, num_anchor))
+        if pos_mask.sum() > 0:
+            reg_targets[pos_mask] = self.box_coder.encode_torch(
+                matched_gts[pos_mask], anchors[None].expand(batch_size, -1, -1)[pos_mask]
+            )
+            reg_weights[pos_mask] = 1.0
+
+        return cls_labels, reg_targets, reg_weights
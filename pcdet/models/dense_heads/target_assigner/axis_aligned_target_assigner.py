@@ -18,6 +18,8 @@ class AxisAlignedTargetAssigner(object):
         self.pos_fraction = anchor_target_cfg.POS_FRACTION if anchor_target_cfg.POS_FRACTION >= 0 else None
         self.sample_size = anchor_target_cfg.SAMPLE_SIZE
         self.norm_by_num_examples = anchor_target_cfg.NORM_BY_NUM_EXAMPLES
+        # the batched assignment has no per-sample random sampling, POS_FRACTION falls back to the loop
+        self.batched = anchor_target_cfg.get('BATCHED_ASSIGN', False) and self.pos_fraction is None
         self.matched_thresholds = {}
         self.unmatched_thresholds = {}
         for config in anchor_generator_cfg:
@@ -42,6 +44,9 @@ class AxisAlignedTargetAssigner(object):
 
         """
 
+        if self.batched:
+            return self.assign_targets_batch(all_anchors, gt_boxes_with_classes)
+
         bbox_targets = []
         cls_labels = []
         reg_weights = []
@@ -128,6 +133,151 @@ class AxisAlignedTargetAssigner(object):
         }
         return all_targets_dict
 
+    def assign_targets_batch(self, all_anchors, gt_boxes_with_classes):
+        """
+        assign_targets on the padded boxes of the whole batch: the anchor-gt IoUs of every anchor class are computed
+        in one call for all the samples and the labels are resolved with masked tensor ops, the same targets as
+        assign_targets_single on the stripped boxes of every sample.
+
+        Args:
+            all_anchors: [(N, 7), ...]
+            gt_boxes_with_classes: (B, M, 8)
+        Returns:
+
+        """
+        batch_size, num_boxes = gt_boxes_with_classes.shape[0:2]
+        device = gt_boxes_with_classes.device
+        gt_classes = gt_boxes_with_classes[:, :, -1].int()
+        gt_boxes = gt_boxes_with_classes[:, :, :-1]
+
+        # trailing all-zero boxes are padding, the first box of a sample is always kept
+        nonzero = gt_boxes.sum(dim=-1) != 0
+        nonzero[:, 0] = True
+        box_ids = torch.arange(num_boxes, device=device)
+        num_valid = (nonzero * (box_ids + 1)).max(dim=1)[0]
+        valid = box_ids[None, :] < num_valid[:, None]
+
+        target_list = []
+        for anchor_class_name, anchors in zip(self.anchor_class_names, all_anchors):
+            class_ids = np.nonzero(self.class_names == anchor_class_name)[0] + 1
+            mask = (valid & (gt_classes == int(class_ids[0]))) if len(class_ids) > 0 else torch.zeros_like(valid)
+            if self.use_multihead:
+                anchors = anchors.permute(3, 4, 0, 1, 2, 5).contiguous().view(-1, anchors.shape[-1])
+            else:
+                feature_map_size = anchors.shape[:3]
+                anchors = anchors.view(-1, anchors.shape[-1])
+
+            # the boxes of the class to the front of every sample, in their order
+            num_gt = mask.sum(dim=1)
+            max_gt = int(num_gt.max().item())
+            order = torch.sort(mask.int(), dim=1, descending=True, stable=True)[1][:, :max_gt]
+            cur_gt = gt_boxes.gather(1, order[..., None].expand(-1, -1, gt_boxes.shape[-1]))
+            cur_gt_classes = gt_classes.gather(1, order)
+            if self.seperate_multihead:
+                cur_gt_classes = torch.full_like(cur_gt_classes, self.gt_remapping[anchor_class_name])
+            cur_valid = torch.arange(max_gt, device=device)[None, :] < num_gt[:, None]
+
+            target_list.append(self.assign_targets_single_batch(
+                anchors, cur_gt, cur_gt_classes, cur_valid,
+                matched_threshold=self.matched_thresholds[anchor_class_name],
+                unmatched_threshold=self.unmatched_thresholds[anchor_class_name]
+            ))
+
+        code_size = self.box_coder.code_size
+        if self.use_multihead:
+            cls_labels = torch.cat([t['box_cls_labels'] for t in target_list], dim=1)
+            bbox_targets = torch.cat([t['box_reg_targets'] for t in target_list], dim=1)
+            reg_weights = torch.cat([t['reg_weights'] for t in target_list], dim=1)
+        else:
+            cls_labels = torch.cat(
+                [t['box_cls_labels'].view(batch_size, *feature_map_size, -1) for t in target_list], dim=-1
+            ).view(batch_size, -1)
+            bbox_targets = torch.cat(
+                [t['box_reg_targets'].view(batch_size, *feature_map_size, -1, code_size) for t in target_list], dim=-2
+            ).view(batch_size, -1, code_size)
+            reg_weights = torch.cat(
+                [t['reg_weights'].view(batch_size, *feature_map_size, -1) for t in target_list], dim=-1
+            ).view(batch_size, -1)
+
+        all_targets_dict = {
+            'box_cls_labels': cls_labels,
+            'box_reg_targets': bbox_targets,
+            'reg_weights': reg_weights
+
+        }
+        return all_targets_dict
+
+    def assign_targets_single_batch(self, anchors, gt_boxes, gt_classes, gt_valid, matched_threshold=0.6,
+                                    unmatched_threshold=0.45):
+        """
+        assign_targets_single without POS_FRACTION for the boxes of one class of all the samples.
+
+        Args:
+            anchors: (N, 7)
+            gt_boxes: (B, M, 7), the boxes of the class in the front of every sample
+            gt_classes: (B, M)
+            gt_valid: (B, M)
+        Returns:
+            box_cls_labels: (B, N)
+            box_reg_targets: (B, N, code_size)
+            reg_weights: (B, N)
+        """
+        batch_size, num_gt = gt_boxes.shape[0:2]
+        num_anchors = anchors.shape[0]
+        labels = torch.full((batch_size, num_anchors), -1, dtype=torch.int32, device=anchors.device)
+        bbox_targets = anchors.new_zeros((batch_size, num_anchors, self.box_coder.code_size))
+
+        if num_gt > 0 and num_anchors > 0:
+            # the IoUs of the valid boxes only, the padded columns stay -1 and never win the argmax of an anchor
+            valid_idxs = gt_valid.view(-1).nonzero()[:, 0]
+            valid_gt_boxes = gt_boxes[:, :, 0:7].reshape(-1, 7)[valid_idxs]
+            valid_overlap = iou3d_nms_utils.boxes_iou3d_gpu(anchors[:, 0:7], valid_gt_boxes) \
+                if self.match_height else box_utils.boxes3d_nearest_bev_iou(anchors[:, 0:7], valid_gt_boxes)
+            anchor_by_gt_overlap = valid_overlap.new_full((num_anchors, batch_size * num_gt), -1)
+            anchor_by_gt_overlap[:, valid_idxs] = valid_overlap
+            anchor_by_gt_overlap = anchor_by_gt_overlap.view(num_anchors, batch_size, num_gt)
+
+            anchor_to_gt_max, anchor_to_gt_argmax = anchor_by_gt_overlap.max(dim=2)  # (N, B)
+            gt_to_anchor_max = anchor_by_gt_overlap.max(dim=0)[0]  # (B, M)
+            gt_to_anchor_max[gt_to_anchor_max == 0] = -1
+            gt_to_anchor_max[~gt_valid] = -2
+            force_mask = (anchor_by_gt_overlap == gt_to_anchor_max[None]).any(dim=2).t()
+            anchor_to_gt_max, anchor_to_gt_argmax = anchor_to_gt_max.t(), anchor_to_gt_argmax.t()
+            pos_mask = anchor_to_gt_max >= matched_threshold
+            bg_mask = anchor_to_gt_max < unmatched_threshold
+
+            # the order of assign_targets_single: over the threshold, background, then the best anchor of every box
+            matched_classes = gt_classes.gather(1, anchor_to_gt_argmax)
+            labels = torch.where(pos_mask, matched_classes, labels)
+            labels[bg_mask] = 0
+            labels = torch.where(force_mask, matched_classes, labels)
+            # a sample without boxes of the class is all background
+            labels[~gt_valid.any(dim=1)] = 0
+
+            fg_mask = labels > 0
+            fg_gt_boxes = gt_boxes.gather(
+                1, anchor_to_gt_argmax[..., None].expand(-1, -1, gt_boxes.shape[-1])
+            )[fg_mask]
+            fg_anchors = anchors[None].expand(batch_size, -1, -1)[fg_mask]
+            bbox_targets[fg_mask] = self.box_coder.encode_torch(fg_gt_boxes, fg_anchors)
+        else:
+            labels[:] = 0
+
+        fg_mask = labels > 0
+        if self.norm_by_num_examples:
+            num_examples = (labels >= 0).sum(dim=1)
+            num_examples = torch.where(num_examples > 1.0, num_examples, torch.ones_like(num_examples))
+            reg_weights = fg_mask * (1.0 / num_examples)[:, None]
+        else:
+            reg_weights = fg_mask.to(anchors.dtype)
+
+        ret_dict = {
+            'box_cls_labels': labels,
+            'box_reg_targets': bbox_targets,
+            'reg_weights': reg_weights.to(anchors.dtype),
+        }
+        return ret_dict
+
     def assign_targets_single(self, anchors,
                          gt_boxes,
                          gt_classes,
@@ -145,12 +295,12 @@ class AxisAlignedTargetAssigner(object):
             anchor_by_gt_overlap = iou3d_nms_utils.boxes_iou3d_gpu(anchors[:, 0:7], gt_boxes[:, 0:7]) \
                 if self.match_height else box_utils.boxes3d_nearest_bev_iou(anchors[:, 0:7], gt_boxes[:, 0:7])
 
-            anchor_to_gt_argmax = torch.from_numpy(anchor_by_gt_overlap.cpu().numpy().argmax(axis=1)).cuda()
+            anchor_to_gt_argmax = torch.from_numpy(anchor_by_gt_overlap.cpu().numpy().argmax(axis=1)).to(anchors.device)
             anchor_to_gt_max = anchor_by_gt_overlap[
                 torch.arange(num_anchors, device=anchors.device), anchor_to_gt_argmax
             ]
 
-            gt_to_anchor_argmax = torch.from_numpy(anchor_by_gt_overlap.cpu().numpy().argmax(axis=0)).cuda()
+            gt_to_anchor_argmax = torch.from_numpy(anchor_by_gt_overlap.cpu().numpy().argmax(axis=0)).to(anchors.device)
             gt_to_anchor_max = anchor_by_gt_overlap[gt_to_anchor_argmax, torch.arange(num_gt, device=anchors.device)]
             empty_gt_mask = gt_to_anchor_max == 0
             gt_to_anchor_max[empty_gt_mask] = -1
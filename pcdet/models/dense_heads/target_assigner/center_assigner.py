@@ -17,6 +17,8 @@ class CenterAssigner(object):
         self.pc_range = pc_range
         self.voxel_size = voxel_size
         self.no_log = no_log
+        self.assign_version = assigner_cfg.get('assign_version', 'v2')
+        self._gaussian_kernels = {}
 
     def gaussian_radius(self, height, width, min_overlap=0.5):
         a1 = 1
@@ -38,6 +40,25 @@ class CenterAssigner(object):
         r3 = (b3 + sq3) / 2
         return min(r1, r2, r3)
 
+    def gaussian_radius_batch(self, height, width, min_overlap=0.5):
+        # gaussian_radius on float32 tensors, the square roots are taken in float64 like math.sqrt
+        b1 = (height + width)
+        c1 = width * height * (1 - min_overlap) / (1 + min_overlap)
+        sq1 = (b1 ** 2 - 4 * c1).double().sqrt().float()
+        r1 = (b1 + sq1) / 2
+
+        b2 = 2 * (height + width)
+        c2 = (1 - min_overlap) * width * height
+        sq2 = (b2 ** 2 - 4 * 4 * c2).double().sqrt().float()
+        r2 = (b2 + sq2) / 2
+
+        a3 = 4 * min_overlap
+        b3 = -2 * min_overlap * (height + width)
+        c3 = (min_overlap - 1) * width * height
+        sq3 = (b3 ** 2 - 4 * a3 * c3).double().sqrt().float()
+        r3 = (b3 + sq3) / 2
+        return torch.min(torch.min(r1, r2), r3)
+
     def gaussian_2d(self, shape, sigma = 1):
         m, n = [(ss - 1.) / 2. for ss in shape]
         mesh_m = torch.arange(start=-m, end=m+1, step=1, dtype=torch.float32)
@@ -69,6 +90,16 @@ class CenterAssigner(object):
     def limit_period(self, val, offset=0.5, period=math.pi):
         return val - math.floor(val / period + offset) * period
 
+    def get_gaussian_kernel(self, radius, device):
+        key = (radius, str(device))
+        if key not in self._gaussian_kernels:
+            diameter = 2 * radius + 1
+            self._gaussian_kernels[key] = self.gaussian_2d((diameter, diameter), sigma=diameter / 6).to(device)
+        return self._gaussian_kernels[key]
+
+    def assign_targets(self, gt_boxes):
+        return getattr(self, 'assign_targets_%s' % self.assign_version)(gt_boxes)
+
     def assign_targets_v1(self, gt_boxes):
         """
         Args:
@@ -266,4 +297,110 @@ class CenterAssigner(object):
             'cat': gt_cats,
             'box_encoding': gt_box_encodings
         }
-        return target_dict
\ No newline at end of file
+        return target_dict
+
+    def assign_targets_v3(self, gt_boxes):
+        """
+        Batched version of assign_targets_v1 with bit-identical outputs: radii, centers, indices and encodings
+        of all the boxes are computed at once (the float32 / float64 operations of v1 in the same order) and
+        the gaussians are drawn by a scatter-max of the cached kernels, one scatter per distinct radius.
+
+        Args:
+            gt_boxes: (B, M, C + cls)
+        Returns:
+
+        """
+        max_objs = self._max_objs * self.dense_reg
+        feature_map_size = self.grid_size[:2] // self.out_size_factor # grid_size WxHxD feature_map_size WxH
+        width, height = int(feature_map_size[0]), int(feature_map_size[1])
+        batch_size, num_boxes = gt_boxes.shape[0:2]
+        device = gt_boxes.device
+        gt_classes = gt_boxes[:, :, -1].int()
+        gt_boxes = gt_boxes[:, :, :-1]
+
+        # trailing all-zero boxes are padding, the first box of a sample is always kept
+        nonzero = gt_boxes.sum(dim=-1) != 0
+        nonzero[:, 0] = True
+        box_ids = torch.arange(num_boxes, device=device)
+        num_valid = (nonzero * (box_ids + 1)).max(dim=1)[0]
+        valid = box_ids[None, :] < num_valid[:, None]
+
+        x, y, z, w, l, h, r, vx, vy = gt_boxes.reshape(-1, gt_boxes.shape[-1]).unbind(dim=1)
+        r = r - ((r / (math.pi * 2) + 0.5).floor().double() * (math.pi * 2)).float()
+        w_fm, l_fm = w / self.voxel_size[0] / self.out_size_factor, l / self.voxel_size[1] / self.out_size_factor
+        radius = self.gaussian_radius_batch(l_fm, w_fm, min_overlap=self.gaussian_overlap)
+        radius = radius.int().clamp(min=self._min_radius)
+
+        coor_x = (x - self.pc_range[0]) / self.voxel_size[0] / self.out_size_factor
+        coor_y = (y - self.pc_range[1]) / self.voxel_size[1] / self.out_size_factor
+        ct_ft = torch.stack([coor_x, coor_y], dim=1)
+        ct_int = ct_ft.int()
+        in_range = (ct_int[:, 0] >= 0) & (ct_int[:, 0] < width) & (ct_int[:, 1] >= 0) & (ct_int[:, 1] < height)
+
+        size = torch.stack([w, l, h], dim=1)
+        if not self.no_log:
+            size = size.double().log().float()
+        r = r.double()
+        box_encoding = torch.cat([
+            ct_ft - ct_int, z[:, None], size, r.sin().float()[:, None], r.cos().float()[:, None],
+            vx[:, None], vy[:, None]
+        ], dim=1)
+        box_ind = ct_int[:, 1].long() * width + ct_int[:, 0].long()
+
+        heatmaps = {}
+        gt_inds = {}
+        gt_masks = {}
+        gt_box_encodings = {}
+        gt_cats = {}
+        for task_id, task in enumerate(self.tasks):
+            num_cls = len(task.class_names)
+            # v1 stacks the boxes of a task class by class, the slot of a box is its position in that stack
+            class_masks = torch.stack([
+                valid & (gt_classes == self.class_to_idx[class_name]) for class_name in task.class_names
+            ], dim=1).view(batch_size, -1)
+            slots = class_masks.long().cumsum(dim=1) - 1
+            bs_idx, flat_idx = class_masks.nonzero(as_tuple=True)
+            cat, slot = flat_idx // num_boxes, slots[bs_idx, flat_idx]
+            box_idx = bs_idx * num_boxes + flat_idx % num_boxes
+
+            keep = in_range[box_idx]
+            bs_idx, cat, slot, box_idx = bs_idx[keep], cat[keep], slot[keep], box_idx[keep]
+            assert slot.numel() == 0 or slot.max().item() < max_objs, 'more than %d boxes in a task' % max_objs
+
+            gt_ind = torch.zeros((batch_size, max_objs), dtype=torch.long, device=device)
+            gt_mask = torch.zeros((batch_size, max_objs), dtype=torch.bool, device=device)
+            gt_cat = torch.zeros((batch_size, max_objs), dtype=torch.long, device=device)
+            gt_box_encoding = torch.zeros((batch_size, max_objs, 10), dtype=torch.float32, device=device)
+            gt_ind[bs_idx, slot] = box_ind[box_idx]
+            gt_mask[bs_idx, slot] = True
+            gt_cat[bs_idx, slot] = cat
+            gt_box_encoding[bs_idx, slot] = box_encoding[box_idx]
+
+            heatmap = torch.zeros((batch_size * num_cls * height * width), dtype=torch.float32, device=device)
+            map_offset = (bs_idx * num_cls + cat) * height * width
+            box_radius = radius[box_idx]
+            for cur_radius in box_radius.unique().tolist():
+                radius_mask = box_radius == cur_radius
+                kernel = self.get_gaussian_kernel(cur_radius, device)
+                offsets = torch.arange(-cur_radius, cur_radius + 1, device=device)
+                kx = ct_int[box_idx[radius_mask], 0, None, None].long() + offsets[None, None, :]
+                ky = ct_int[box_idx[radius_mask], 1, None, None].long() + offsets[None, :, None]
+                in_map = (kx >= 0) & (kx < width) & (ky >= 0) & (ky < height)
+                pixel = map_offset[radius_mask, None, None] + ky * width + kx
+                values = kernel[None].expand(pixel.shape[0], -1, -1)
+                heatmap.scatter_reduce_(0, pixel[in_map], values[in_map], reduce='amax', include_self=True)
+
+            heatmaps[task_id] = heatmap.view(batch_size, num_cls, height, width)
+            gt_inds[task_id] = gt_ind
+            gt_masks[task_id] = gt_mask
+            gt_cats[task_id] = gt_cat
+            gt_box_encodings[task_id] = gt_box_encoding
+
+        target_dict = {
+            'heatmap': heatmaps,
+            'ind': gt_inds,
+            'mask': gt_masks,
+            'cat': gt_cats,
+            'box_encoding': gt_box_encodings
+        }
+        return target_dict
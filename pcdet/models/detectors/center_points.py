@@ -33,6 +33,8 @@ class CenterPoints(Detector3DTemplate):
         return loss, tb_dict, disp_dict
 
     def post_processing(self, batch_dict):
+        if 'tta_view' in batch_dict:
+            batch_dict = self.fuse_tta_views(batch_dict)
         pred_dicts = batch_dict['pred_dicts']
 
         recall_dict = {}
@@ -4,6 +4,7 @@ import torch
 import torch.nn as nn
 
 from ...ops.iou3d_nms import iou3d_nms_utils
+from ...utils import tta_utils
 from .. import backbones_2d, backbones_3d, dense_heads, roi_heads
 from ..backbones_2d import map_to_bev
 from ..backbones_3d import pfe, vfe
@@ -186,11 +187,13 @@ class Detector3DTemplate(nn.Module):
                 has_class_labels: True/False
                 roi_labels: (B, num_rois)  1 .. num_classes
                 batch_pred_labels: (B, num_boxes, 1)
+                tta_view: optional, the views of every sample are fused after NMS, see fuse_tta_views
         Returns:
 
         """
         post_process_cfg = self.model_cfg.POST_PROCESSING
         batch_size = batch_dict['batch_size']
+        use_tta = 'tta_view' in batch_dict
         recall_dict = {}
         pred_dicts = []
         for index in range(batch_size):
@@ -271,11 +274,12 @@ class Detector3DTemplate(nn.Module):
                 final_labels = final_labels[zero_mask]
                 final_scores = final_scores[zero_mask]
 
-            recall_dict = self.generate_recall_record(
-                box_preds=final_boxes if 'rois' not in batch_dict else src_box_preds,
-                recall_dict=recall_dict, batch_index=index, data_dict=batch_dict,
-                thresh_list=post_process_cfg.RECALL_THRESH_LIST
-            )
+            if not use_tta:
+                recall_dict = self.generate_recall_record(
+                    box_preds=final_boxes if 'rois' not in batch_dict else src_box_preds,
+                    recall_dict=recall_dict, batch_index=index, data_dict=batch_dict,
+                    thresh_list=post_process_cfg.RECALL_THRESH_LIST
+                )
 
             record_dict = {
                 'pred_boxes': final_boxes,
@@ -284,8 +288,44 @@ class Detector3DTemplate(nn.Module):
             }
             pred_dicts.append(record_dict)
 
+        if use_tta:
+            # the annotations are kept once per sample, the recall is taken on the fused boxes
+            batch_dict['pred_dicts'] = pred_dicts
+            batch_dict = self.fuse_tta_views(batch_dict)
+            pred_dicts = batch_dict['pred_dicts']
+            for index in range(batch_dict['batch_size']):
+                recall_dict = self.generate_recall_record(
+                    box_preds=pred_dicts[index]['pred_boxes'],
+                    recall_dict=recall_dict, batch_index=index, data_dict=batch_dict,
+                    thresh_list=post_process_cfg.RECALL_THRESH_LIST
+                )
+
         return pred_dicts, recall_dict
 
+    def fuse_tta_views(self, batch_dict):
+        """
+        Fuses the predictions of the test-time augmented views of every sample (DATA_CONFIG.TEST_TIME_AUGMENTATION),
+        the batch is reduced to one entry per sample.
+
+        Args:
+            batch_dict:
+                batch_size: B * V
+                pred_dicts: list of B * V dicts
+                tta_view: (B * V, 5) [view_idx, flip_x, flip_y, rot_angle, scale]
+        Returns:
+            batch_dict:
+                batch_size: B
+                pred_dicts: list of B dicts, boxes in the frame of the sample
+        """
+        tta_views = batch_dict.pop('tta_view')
+        num_views = int(tta_views[:, 0].max().item()) + 1
+        fusion_cfg = self.model_cfg.POST_PROCESSING.get('TTA_FUSION', {})
+        batch_dict['pred_dicts'] = tta_utils.fuse_tta_predictions(batch_dict['pred_dicts'], tta_views, fusion_cfg)
+        batch_dict['batch_size'] = batch_dict['batch_size'] // num_views
+        if 'rois' in batch_dict:
+            batch_dict['rois'] = batch_dict['rois'][::num_views]
+        return batch_dict
+
     @staticmethod
     def generate_recall_record(box_preds, recall_dict, batch_index, data_dict=None, thresh_list=None):
         if 'gt_boxes' not in data_dict:
@@ -62,6 +62,8 @@ class E2E2StagePV(Detector3DTemplate):
         return loss, tb_dict, disp_dict
 
     def post_processing(self, batch_dict):
+        if 'tta_view' in batch_dict:
+            batch_dict = self.fuse_tta_views(batch_dict)
         pred_dicts = batch_dict['pred_dicts']
 
         recall_dict = {}
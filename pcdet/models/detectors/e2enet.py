@@ -36,7 +36,7 @@ class E2ENet(Detector3DTemplate):
 
         loss_rpn, tb_dict = self.dense_head.get_loss(self.cur_epoch)
         tb_dict = {
-            'loss_rpn': loss_rpn.item(),
+            'loss_rpn': loss_rpn.detach(),
             **tb_dict
         }
 
@@ -44,6 +44,8 @@ class E2ENet(Detector3DTemplate):
         return loss, tb_dict, disp_dict
 
     def post_processing(self, batch_dict):
+        if 'tta_view' in batch_dict:
+            batch_dict = self.fuse_tta_views(batch_dict)
         pred_dicts = batch_dict['pred_dicts']
 
         recall_dict = {}
@@ -1,3 +1,5 @@
+import numba
+import numpy as np
 import torch
 
 from ...ops.iou3d_nms import iou3d_nms_utils
@@ -63,3 +65,114 @@ def multi_classes_nms(cls_scores, box_preds, nms_config, score_thresh=None):
     pred_boxes = torch.cat(pred_boxes, dim=0)
 
     return pred_scores, pred_labels, pred_boxes
+
+
+@numba.jit(nopython=True)
+def circle_nms(dets, thresh):
+    """
+    Args:
+        dets: (N, 3) [x, y, score]
+        thresh: boxes whose squared center distance to a kept box is <= thresh are suppressed
+
+    Returns:
+        keep: list of kept indices, highest score first
+    """
+    x1 = dets[:, 0]
+    y1 = dets[:, 1]
+    scores = dets[:, 2]
+    # highest->lowest, a stable sort keeps tied scores in index order like batched_circle_nms
+    order = (-scores).argsort(kind='mergesort').astype(np.int32)
+    ndets = dets.shape[0]
+    suppressed = np.zeros((ndets), dtype=np.int32)
+    keep = []
+    for _i in range(ndets):
+        i = order[_i]  # start with highest score box
+        if suppressed[i] == 1:  # if any box have enough iou with this, remove it
+            continue
+        keep.append(i)
+        for _j in range(_i + 1, ndets):
+            j = order[_j]
+            if suppressed[j] == 1:
+                continue
+            # calculate center distance between i and j box
+            dist = (x1[i] - x1[j]) ** 2 + (y1[i] - y1[j]) ** 2
+            if dist <= thresh:
+                suppressed[j] = 1
+    return keep
+
+
+def circle_nms_keep(boxes, min_radius, post_max_size=83):
+    """
+    NMS according to center distance
+
+    Args:
+        boxes: (N, 3) [x, y, score]
+        min_radius: squared center distance threshold of circle_nms
+        post_max_size:
+
+    Returns:
+        keep: (M), kept indices on the device of boxes, highest score first
+    """
+    keep = np.array(circle_nms(boxes.cpu().numpy(), thresh=min_radius))[:post_max_size]
+    return torch.from_numpy(keep).long().to(boxes.device)
+
+
+@torch.no_grad()
+def batched_circle_nms(centers, scores, thresh, valid_mask=None, post_max_size=None):
+    """
+    Greedy circle NMS of a batch of padded detections on any device. A box is kept if no kept box of higher score
+    lies within the squared center distance thresh, i.e. keep = valid & ~any(keep[i] & suppress[i, j] for i < j).
+    That system is solved by fixed-point iteration, the first t boxes are final after t rounds and the number of
+    rounds is bounded by the longest suppression chain, usually a handful.
+
+    Args:
+        centers: (B, K, 2) [x, y]
+        scores: (B, K)
+        thresh: squared center distance, as in circle_nms
+        valid_mask: (B, K) bool, padded or filtered boxes are neither kept nor suppress others
+        post_max_size: max kept boxes per sample
+
+    Returns:
+        order: (B, K) box indices sorted by descending score
+        keep: (B, K) bool, keep[b, k] tells whether box order[b, k] is kept
+    """
+    batch_size, num_boxes = scores.shape
+    if valid_mask is None:
+        valid_mask = torch.ones_like(scores, dtype=torch.bool)
+    # tied scores are ordered by box index, as the stable sort of the numba circle_nms does: the boxes are sorted
+    # by (dense score rank, index), a unique key, so the order does not depend on the sort of the device
+    sorted_scores, sorted_idxs = torch.sort(scores.masked_fill(~valid_mask, -float('inf')), dim=1, descending=True)
+    is_new_score = torch.ones_like(valid_mask)
+    is_new_score[:, 1:] = sorted_scores[:, 1:] != sorted_scores[:, :-1]
+    score_rank = torch.empty_like(sorted_idxs).scatter_(1, sorted_idxs, torch.cumsum(is_new_score.long(), dim=1))
+    order = torch.sort(score_rank * num_boxes + torch.arange(num_boxes, device=scores.device), dim=1)[1]
+    centers = torch.gather(centers, 1, order[:, :, None].expand(-1, -1, 2))
+    valid = torch.gather(valid_mask, 1, order)
+
+    # float32 distances compared with the largest float32 <= thresh, as the float32 numba kernel does
+    thresh_f32 = np.float32(thresh)
+    if thresh_f32 > thresh:
+        thresh_f32 = np.nextafter(thresh_f32, np.float32(-np.inf))
+    x, y = centers[..., 0].contiguous(), centers[..., 1].contiguous()
+    dist = x[:, :, None] - x[:, None, :]
+    dist.mul_(dist)
+    dist_y = y[:, :, None] - y[:, None, :]
+    dist_y.mul_(dist_y)
+    dist.add_(dist_y)
+    del dist_y
+    # rows of invalid boxes need no masking, they are never kept
+    suppress = (dist <= float(thresh_f32)) & valid[:, None, :]
+    del dist
+    suppress = suppress.triu_(diagonal=1).to(centers.dtype)  # (B, K, K) box i of higher score suppresses box j
+
+    keep = valid
+    for _ in range(num_boxes):
+        suppressed = torch.bmm(keep[:, None, :].to(suppress.dtype), suppress)[:, 0] > 0
+        new_keep = valid & ~suppressed
+        if torch.equal(new_keep, keep):
+            break
+        keep = new_keep
+
+    if post_max_size is not None:
+        keep = keep & (torch.cumsum(keep, dim=1) <= post_max_size)
+    return order, keep
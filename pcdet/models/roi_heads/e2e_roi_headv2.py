@@ -351,19 +351,19 @@ class E2EROIHeadV2(nn.Module):
         rois = batch_dict['rois']  # (B, num_rois, 7 + C)
         bs, m, _ = rois.shape
 
-        roi_center = rois[:, :, 0:3].view(bs, m, 1, 3).contiguous()
-        roi_ry = batch_dict['rois'][..., 6]
-
-        roi_corners = box_utils.boxes_to_sps_3d(rois.view(bs * m, -1)[:, :7].contiguous()).view(bs, m, self.sample_points - 1, 3)
-        roi_queries = torch.cat([roi_corners, roi_center], dim=2).contiguous()
-        roi_queries = self.to_local_coords(roi_queries, roi_center, roi_ry)
+        # the face / edge points and the center in the local frames of the rois, built from the sizes
+        roi_corners = box_utils.boxes_to_local_points_3d(rois[:, :, :7], box_utils.BOX_SPS_TEMPLATE)
+        roi_queries = torch.cat([roi_corners, roi_corners.new_zeros((bs, m, 1, 3))], dim=2)
         return roi_queries
 
     def to_local_coords(self, points, ref_point, angle):
-        tmp = points - ref_point
-        b, m, p, _ = tmp.shape
-        rlt = common_utils.rotate_points_along_z(tmp.view(b * m, p, -1), -angle.view(-1)).view(b, m, p, -1)
-        return rlt
+        """
+        Args:
+            points: (B, M, P, 3)
+            ref_point: (B, M, 1, 3)
+            angle: (B, M)
+        """
+        return common_utils.points_to_local_coords(points, ref_point[:, :, 0], angle)
 
     def get_point_infos(self, batch_dict):
         """
@@ -346,10 +346,13 @@ class E2EROIHeadV3(nn.Module):
 
 
     def to_local_coords(self, points, ref_point, angle):
-        tmp = points - ref_point
-        b, m, p, _ = tmp.shape
-        rlt = common_utils.rotate_points_along_z(tmp.view(b * m, p, -1), -angle.view(-1)).view(b, m, p, -1)
-        return rlt
+        """
+        Args:
+            points: (B, M, P, 3)
+            ref_point: (B, M, 1, 3)
+            angle: (B, M)
+        """
+        return common_utils.points_to_local_coords(points, ref_point[:, :, 0], angle)
 
     def get_point_infos(self, batch_dict):
         """
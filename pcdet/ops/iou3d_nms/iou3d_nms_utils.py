@@ -51,9 +51,12 @@ def boxes_iou_bev(boxes_a, boxes_b):
         ans_iou: (N, M)
     """
     assert boxes_a.shape[1] == boxes_b.shape[1] == 7
-    ans_iou = torch.cuda.FloatTensor(torch.Size((boxes_a.shape[0], boxes_b.shape[0]))).zero_()
+    ans_iou = boxes_a.new_zeros(torch.Size((boxes_a.shape[0], boxes_b.shape[0])))
 
-    iou3d_nms_cuda.boxes_iou_bev_gpu(boxes_a.contiguous(), boxes_b.contiguous(), ans_iou)
+    if boxes_a.is_cuda:
+        iou3d_nms_cuda.boxes_iou_bev_gpu(boxes_a.contiguous(), boxes_b.contiguous(), ans_iou)
+    else:
+        iou3d_nms_cuda.boxes_iou_bev_cpu(boxes_a.contiguous(), boxes_b.contiguous(), ans_iou)
 
     return ans_iou
 
@@ -76,8 +79,11 @@ def boxes_iou3d_gpu(boxes_a, boxes_b):
     boxes_b_height_min = (boxes_b[:, 2] - boxes_b[:, 5] / 2).view(1, -1)
 
     # bev overlap
-    overlaps_bev = torch.cuda.FloatTensor(torch.Size((boxes_a.shape[0], boxes_b.shape[0]))).zero_()  # (N, M)
-    iou3d_nms_cuda.boxes_overlap_bev_gpu(boxes_a.contiguous(), boxes_b.contiguous(), overlaps_bev)
+    overlaps_bev = boxes_a.new_zeros(torch.Size((boxes_a.shape[0], boxes_b.shape[0])))  # (N, M)
+    if boxes_a.is_cuda:
+        iou3d_nms_cuda.boxes_overlap_bev_gpu(boxes_a.contiguous(), boxes_b.contiguous(), overlaps_bev)
+    else:
+        iou3d_nms_cuda.boxes_overlap_bev_cpu(boxes_a.contiguous(), boxes_b.contiguous(), overlaps_bev)
 
     max_of_min = torch.max(boxes_a_height_min, boxes_b_height_min)
     min_of_max = torch.min(boxes_a_height_max, boxes_b_height_max)
@@ -108,8 +114,11 @@ def nms_gpu(boxes, scores, thresh, pre_maxsize=None, **kwargs):
 
     boxes = boxes[order].contiguous()
     keep = torch.LongTensor(boxes.size(0))
-    num_out = iou3d_nms_cuda.nms_gpu(boxes, keep, thresh)
-    return order[keep[:num_out].cuda()].contiguous(), None
+    if boxes.is_cuda:
+        num_out = iou3d_nms_cuda.nms_gpu(boxes, keep, thresh)
+    else:
+        num_out = iou3d_nms_cuda.nms_cpu(boxes, keep, thresh)
+    return order[keep[:num_out].to(order.device)].contiguous(), None
 
 
 def nms_normal_gpu(boxes, scores, thresh, **kwargs):
@@ -125,5 +134,8 @@ def nms_normal_gpu(boxes, scores, thresh, **kwargs):
     boxes = boxes[order].contiguous()
 
     keep = torch.LongTensor(boxes.size(0))
-    num_out = iou3d_nms_cuda.nms_normal_gpu(boxes, keep, thresh)
-    return order[keep[:num_out].cuda()].contiguous(), None
+    if boxes.is_cuda:
+        num_out = iou3d_nms_cuda.nms_normal_gpu(boxes, keep, thresh)
+    else:
+        num_out = iou3d_nms_cuda.nms_normal_cpu(boxes, keep, thresh)
+    return order[keep[:num_out].to(order.device)].contiguous(), None
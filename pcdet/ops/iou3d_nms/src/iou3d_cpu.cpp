@@ -9,6 +9,7 @@ All Rights Reserved 2020.
 #include <torch/serialize/tensor.h>
 #include <torch/extension.h>
 #include <vector>
+#include <ATen/Parallel.h>
 #include <cuda.h>
 #include <cuda_runtime_api.h>
 #include "iou3d_cpu.h"
@@ -229,6 +230,45 @@ inline float iou_bev(const float *box_a, const float *box_b){
 }
 
 
+inline float iou_normal(const float *a, const float *b){
+    // params: a: [x, y, z, dx, dy, dz, heading]
+    // params: b: [x, y, z, dx, dy, dz, heading]
+    float left = fmaxf(a[0] - a[3] / 2, b[0] - b[3] / 2), right = fminf(a[0] + a[3] / 2, b[0] + b[3] / 2);
+    float top = fmaxf(a[1] - a[4] / 2, b[1] - b[4] / 2), bottom = fminf(a[1] + a[4] / 2, b[1] + b[4] / 2);
+    float width = fmaxf(right - left, 0.f), height = fmaxf(bottom - top, 0.f);
+    float interS = width * height;
+    float Sa = a[3] * a[4];
+    float Sb = b[3] * b[4];
+    return interS / fmaxf(Sa + Sb - interS, EPS);
+}
+
+
+int boxes_overlap_bev_cpu(at::Tensor boxes_a_tensor, at::Tensor boxes_b_tensor, at::Tensor ans_overlap_tensor){
+    // params boxes_a_tensor: (N, 7) [x, y, z, dx, dy, dz, heading]
+    // params boxes_b_tensor: (M, 7) [x, y, z, dx, dy, dz, heading]
+    // params ans_overlap_tensor: (N, M)
+
+    CHECK_CONTIGUOUS(boxes_a_tensor);
+    CHECK_CONTIGUOUS(boxes_b_tensor);
+    CHECK_CONTIGUOUS(ans_overlap_tensor);
+
+    int num_boxes_a = boxes_a_tensor.size(0);
+    int num_boxes_b = boxes_b_tensor.size(0);
+    const float *boxes_a = boxes_a_tensor.data<float>();
+    const float *boxes_b = boxes_b_tensor.data<float>();
+    float *ans_overlap = ans_overlap_tensor.data<float>();
+
+    at::parallel_for(0, num_boxes_a, 0, [&](int64_t begin, int64_t end){
+        for (int64_t i = begin; i < end; i++){
+            for (int j = 0; j < num_boxes_b; j++){
+                ans_overlap[i * num_boxes_b + j] = box_overlap(boxes_a + i * 7, boxes_b + j * 7);
+            }
+        }
+    });
+    return 1;
+}
+
+
 int boxes_iou_bev_cpu(at::Tensor boxes_a_tensor, at::Tensor boxes_b_tensor, at::Tensor ans_iou_tensor){
     // params boxes_a_tensor: (N, 7) [x, y, z, dx, dy, dz, heading]
     // params boxes_b_tensor: (M, 7) [x, y, z, dx, dy, dz, heading]
@@ -236,6 +276,7 @@ int boxes_iou_bev_cpu(at::Tensor boxes_a_tensor, at::Tensor boxes_b_tensor, at::
 
     CHECK_CONTIGUOUS(boxes_a_tensor);
     CHECK_CONTIGUOUS(boxes_b_tensor);
+    CHECK_CONTIGUOUS(ans_iou_tensor);
 
     int num_boxes_a = boxes_a_tensor.size(0);
     int num_boxes_b = boxes_b_tensor.size(0);
@@ -243,10 +284,73 @@ int boxes_iou_bev_cpu(at::Tensor boxes_a_tensor, at::Tensor boxes_b_tensor, at::
     const float *boxes_b = boxes_b_tensor.data<float>();
     float *ans_iou = ans_iou_tensor.data<float>();
 
-    for (int i = 0; i < num_boxes_a; i++){
-        for (int j = 0; j < num_boxes_b; j++){
-            ans_iou[i * num_boxes_b + j] = iou_bev(boxes_a + i * 7, boxes_b + j * 7);
+    at::parallel_for(0, num_boxes_a, 0, [&](int64_t begin, int64_t end){
+        for (int64_t i = begin; i < end; i++){
+            for (int j = 0; j < num_boxes_b; j++){
+                ans_iou[i * num_boxes_b + j] = iou_bev(boxes_a + i * 7, boxes_b + j * 7);
+            }
         }
-    }
+    });
     return 1;
 }
+
+
+const int BITS_PER_BLOCK_NMS = sizeof(unsigned long long) * 8;
+
+template <typename IouFunc>
+int nms_cpu_template(at::Tensor boxes_tensor, at::Tensor keep_tensor, float nms_overlap_thresh, IouFunc iou_func){
+    // params boxes_tensor: (N, 7) [x, y, z, dx, dy, dz, heading], sorted by score in descending order
+    // params keep_tensor: (N)
+    // The suppression mask is laid out exactly as in the CUDA kernel, so the greedy reduction below
+    // keeps the same boxes as nms_gpu / nms_normal_gpu.
+
+    CHECK_CONTIGUOUS(boxes_tensor);
+    CHECK_CONTIGUOUS(keep_tensor);
+
+    int boxes_num = boxes_tensor.size(0);
+    const float *boxes = boxes_tensor.data<float>();
+    long *keep = keep_tensor.data<long>();
+
+    const int col_blocks = (boxes_num + BITS_PER_BLOCK_NMS - 1) / BITS_PER_BLOCK_NMS;
+    std::vector<unsigned long long> mask((size_t)boxes_num * col_blocks, 0);
+
+    at::parallel_for(0, boxes_num, 0, [&](int64_t begin, int64_t end){
+        for (int64_t i = begin; i < end; i++){
+            const float *cur_box = boxes + i * 7;
+            unsigned long long *cur_mask = &mask[0] + i * col_blocks;
+            for (int j = i + 1; j < boxes_num; j++){
+                if (iou_func(cur_box, boxes + j * 7) > nms_overlap_thresh){
+                    cur_mask[j / BITS_PER_BLOCK_NMS] |= 1ULL << (j % BITS_PER_BLOCK_NMS);
+                }
+            }
+        }
+    });
+
+    std::vector<unsigned long long> remv(col_blocks, 0);
+    int num_to_keep = 0;
+
+    for (int i = 0; i < boxes_num; i++){
+        int nblock = i / BITS_PER_BLOCK_NMS;
+        int inblock = i % BITS_PER_BLOCK_NMS;
+
+        if (!(remv[nblock] & (1ULL << inblock))){
+            keep[num_to_keep++] = i;
+            unsigned long long *p = &mask[0] + i * col_blocks;
+            for (int j = nblock; j < col_blocks; j++){
+                remv[j] |= p[j];
+            }
+        }
+    }
+
+    return num_to_keep;
+}
+
+
+int nms_cpu(at::Tensor boxes_tensor, at::Tensor keep_tensor, float nms_overlap_thresh){
+    return nms_cpu_template(boxes_tensor, keep_tensor, nms_overlap_thresh, iou_bev);
+}
+
+
+int nms_normal_cpu(at::Tensor boxes_tensor, at::Tensor keep_tensor, float nms_overlap_thresh){
+    return nms_cpu_template(boxes_tensor, keep_tensor, nms_overlap_thresh, iou_normal);
+}
@@ -6,6 +6,9 @@
 #include <cuda.h>
 #include <cuda_runtime_api.h>
 
+int boxes_overlap_bev_cpu(at::Tensor boxes_a_tensor, at::Tensor boxes_b_tensor, at::Tensor ans_overlap_tensor);
 int boxes_iou_bev_cpu(at::Tensor boxes_a_tensor, at::Tensor boxes_b_tensor, at::Tensor ans_iou_tensor);
+int nms_cpu(at::Tensor boxes_tensor, at::Tensor keep_tensor, float nms_overlap_thresh);
+int nms_normal_cpu(at::Tensor boxes_tensor, at::Tensor keep_tensor, float nms_overlap_thresh);
 
 #endif
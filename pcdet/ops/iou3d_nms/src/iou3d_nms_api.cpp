@@ -13,5 +13,8 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
 	m.def("boxes_iou_bev_gpu", &boxes_iou_bev_gpu, "oriented boxes iou");
 	m.def("nms_gpu", &nms_gpu, "oriented nms gpu");
 	m.def("nms_normal_gpu", &nms_normal_gpu, "nms gpu");
+	m.def("boxes_overlap_bev_cpu", &boxes_overlap_bev_cpu, "oriented boxes overlap cpu");
 	m.def("boxes_iou_bev_cpu", &boxes_iou_bev_cpu, "oriented boxes iou");
+	m.def("nms_cpu", &nms_cpu, "oriented nms cpu");
+	m.def("nms_normal_cpu", &nms_normal_cpu, "nms cpu");
 }
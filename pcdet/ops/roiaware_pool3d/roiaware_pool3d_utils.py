@@ -25,6 +25,31 @@ def points_in_boxes_cpu(points, boxes):
     return point_indices.numpy() if is_numpy else point_indices
 
 
+def points_in_boxes_csr_cpu(points, boxes, cell_size=1.0):
+    """
+    Memory-friendly replacement of points_in_boxes_cpu, boxes are bucketed on a BEV grid
+    and every point is only tested against the boxes of its own cell.
+    Args:
+        points: (num_points, 3)
+        boxes: [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
+        cell_size: BEV grid cell size in meters
+    Returns:
+        box_ptr: (N + 1), int64
+        pts_idx: (box_ptr[N]), int64, the points of box i are pts_idx[box_ptr[i]:box_ptr[i + 1]] in ascending
+            order, a point inside overlapped boxes is listed under each of them
+    """
+    assert boxes.shape[1] == 7
+    assert points.shape[1] == 3
+    points, is_numpy = common_utils.check_numpy_to_torch(points)
+    boxes, is_numpy = common_utils.check_numpy_to_torch(boxes)
+
+    box_ptr, pts_idx = roiaware_pool3d_cuda.points_in_boxes_csr_cpu(
+        boxes.float().contiguous(), points.float().contiguous(), float(cell_size)
+    )
+
+    return (box_ptr.numpy(), pts_idx.numpy()) if is_numpy else (box_ptr, pts_idx)
+
+
 def points_in_boxes_gpu(points, boxes):
     """
     :param points: (B, M, 3)
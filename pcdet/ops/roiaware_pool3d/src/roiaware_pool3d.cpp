@@ -8,7 +8,10 @@ All Rights Reserved 2019-2020.
 
 #include <torch/serialize/tensor.h>
 #include <torch/extension.h>
+#include <ATen/Parallel.h>
 #include <assert.h>
+#include <math.h>
+#include <vector>
 
 
 //#define CHECK_CUDA(x) AT_CHECK(x.type().is_cuda(), #x, " must be a CUDAtensor ")
@@ -197,6 +200,114 @@ int points_in_boxes_cpu(at::Tensor boxes_tensor, at::Tensor pts_tensor, at::Tens
 }
 
 
+std::vector<at::Tensor> points_in_boxes_csr_cpu(at::Tensor boxes_tensor, at::Tensor pts_tensor, float cell_size){
+    // params boxes: (N, 7) [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center
+    // params pts: (num_points, 3) [x, y, z]
+    // returns box_ptr: (N + 1), pts_idx: (box_ptr[N]), the points of box i are pts_idx[box_ptr[i]:box_ptr[i + 1]]
+    // in ascending order, a point inside several boxes is listed under each of them (same as points_in_boxes_cpu)
+    // boxes are bucketed on a BEV grid by their circumscribed circle, every point is only tested
+    // against the boxes of its own cell
+
+    const float MARGIN = 1e-2;
+    const int64_t MAX_CELLS = 1 << 22;
+    const int64_t GRAIN_SIZE = 2048;
+
+    int boxes_num = boxes_tensor.size(0);
+    int pts_num = pts_tensor.size(0);
+    at::Tensor box_ptr_tensor = at::zeros({boxes_num + 1}, boxes_tensor.options().dtype(at::kLong));
+    if (boxes_num == 0 || pts_num == 0) return {box_ptr_tensor, at::zeros({0}, box_ptr_tensor.options())};
+
+    const float *boxes = boxes_tensor.data_ptr<float>();
+    const float *pts = pts_tensor.data_ptr<float>();
+
+    std::vector<float> radius(boxes_num);
+    float x_min = INFINITY, y_min = INFINITY, x_max = -INFINITY, y_max = -INFINITY;
+    for (int i = 0; i < boxes_num; i++){
+        const float *box = boxes + i * 7;
+        radius[i] = 0.5 * sqrtf(box[3] * box[3] + box[4] * box[4]) + MARGIN;
+        x_min = fminf(x_min, box[0] - radius[i]);
+        x_max = fmaxf(x_max, box[0] + radius[i]);
+        y_min = fminf(y_min, box[1] - radius[i]);
+        y_max = fmaxf(y_max, box[1] + radius[i]);
+    }
+
+    if (cell_size <= 0) cell_size = 1.0;
+    int64_t x_cells = (int64_t)ceilf((x_max - x_min) / cell_size) + 1;
+    int64_t y_cells = (int64_t)ceilf((y_max - y_min) / cell_size) + 1;
+    while (x_cells * y_cells > MAX_CELLS){
+        cell_size *= 2;
+        x_cells = (int64_t)ceilf((x_max - x_min) / cell_size) + 1;
+        y_cells = (int64_t)ceilf((y_max - y_min) / cell_size) + 1;
+    }
+
+    // CSR layout of the grid: cell_start[c]..cell_start[c + 1] indexes cell_boxes
+    int64_t cells_num = x_cells * y_cells;
+    std::vector<int64_t> cell_range(boxes_num * 4);
+    std::vector<int> cell_start(cells_num + 1, 0);
+    for (int i = 0; i < boxes_num; i++){
+        const float *box = boxes + i * 7;
+        int64_t *range = cell_range.data() + i * 4;
+        range[0] = std::max<int64_t>((int64_t)floorf((box[0] - radius[i] - x_min) / cell_size), 0);
+        range[1] = std::min<int64_t>((int64_t)floorf((box[0] + radius[i] - x_min) / cell_size), x_cells - 1);
+        range[2] = std::max<int64_t>((int64_t)floorf((box[1] - radius[i] - y_min) / cell_size), 0);
+        range[3] = std::min<int64_t>((int64_t)floorf((box[1] + radius[i] - y_min) / cell_size), y_cells - 1);
+        for (int64_t xi = range[0]; xi <= range[1]; xi++){
+            for (int64_t yi = range[2]; yi <= range[3]; yi++) cell_start[xi * y_cells + yi + 1]++;
+        }
+    }
+    for (int64_t c = 0; c < cells_num; c++) cell_start[c + 1] += cell_start[c];
+
+    std::vector<int> cell_boxes(cell_start[cells_num]);
+    std::vector<int> cursor(cell_start.begin(), cell_start.end() - 1);
+    for (int i = 0; i < boxes_num; i++){
+        const int64_t *range = cell_range.data() + i * 4;
+        for (int64_t xi = range[0]; xi <= range[1]; xi++){
+            for (int64_t yi = range[2]; yi <= range[3]; yi++) cell_boxes[cursor[xi * y_cells + yi]++] = i;
+        }
+    }
+
+    // every chunk of points collects its (box, point) hits, the chunks are merged in point order below
+    int64_t chunks_num = (pts_num + GRAIN_SIZE - 1) / GRAIN_SIZE;
+    std::vector<std::vector<std::pair<int, int>>> chunk_hits(chunks_num);
+    at::parallel_for(0, chunks_num, 1, [&](int64_t chunk_begin, int64_t chunk_end){
+        float local_x = 0, local_y = 0;
+        for (int64_t chunk = chunk_begin; chunk < chunk_end; chunk++){
+            std::vector<std::pair<int, int>> &hits = chunk_hits[chunk];
+            int64_t end = std::min<int64_t>((chunk + 1) * GRAIN_SIZE, pts_num);
+            for (int64_t j = chunk * GRAIN_SIZE; j < end; j++){
+                const float *pt = pts + j * 3;
+                float fx = floorf((pt[0] - x_min) / cell_size);
+                float fy = floorf((pt[1] - y_min) / cell_size);
+                if (!(fx >= 0 && fx < x_cells && fy >= 0 && fy < y_cells)) continue;
+                int64_t cell = (int64_t)fx * y_cells + (int64_t)fy;
+                for (int k = cell_start[cell]; k < cell_start[cell + 1]; k++){
+                    int box_idx = cell_boxes[k];
+                    if (check_pt_in_box3d_cpu(pt, boxes + box_idx * 7, local_x, local_y)){
+                        hits.emplace_back(box_idx, (int)j);
+                    }
+                }
+            }
+        }
+    });
+
+    // stable counting sort of the hits by box keeps the points of each box in ascending order
+    int64_t *box_ptr = box_ptr_tensor.data_ptr<int64_t>();
+    for (const auto &hits : chunk_hits){
+        for (const auto &hit : hits) box_ptr[hit.first + 1]++;
+    }
+    for (int i = 0; i < boxes_num; i++) box_ptr[i + 1] += box_ptr[i];
+
+    at::Tensor pts_idx_tensor = at::empty({box_ptr[boxes_num]}, box_ptr_tensor.options());
+    int64_t *pts_idx = pts_idx_tensor.data_ptr<int64_t>();
+    std::vector<int64_t> box_cursor(box_ptr, box_ptr + boxes_num);
+    for (const auto &hits : chunk_hits){
+        for (const auto &hit : hits) pts_idx[box_cursor[hit.first]++] = hit.second;
+    }
+
+    return {box_ptr_tensor, pts_idx_tensor};
+}
+
+
 int bev_in_boxes_cpu(at::Tensor boxes_tensor, at::Tensor bev_tensor, at::Tensor bev_coords_tensor, float x_min, float x_max, float y_min, float y_max){
     // params boxes: (N, 7) [x, y, z, dx, dy, dz, heading], (x, y, z) is the box center, each box DO NOT overlaps
     // params bev: (X, Y)
@@ -285,6 +396,7 @@ PYBIND11_MODULE(TORCH_EXTENSION_NAME, m) {
     m.def("backward", &roiaware_pool3d_gpu_backward, "roiaware pool3d backward (CUDA)");
     m.def("points_in_boxes_gpu", &points_in_boxes_gpu, "points_in_boxes_gpu forward (CUDA)");
     m.def("points_in_boxes_cpu", &points_in_boxes_cpu, "points_in_boxes_cpu forward (CUDA)");
+    m.def("points_in_boxes_csr_cpu", &points_in_boxes_csr_cpu, "point indices of each box with a BEV grid join (CPU)");
     m.def("points_in_boxes_bev_gpu", &points_in_boxes_bev_gpu, "points_in_boxes_bev_gpu forward (CUDA)");
     m.def("bev_in_boxes_cpu", &bev_in_boxes_cpu, "boxes cover bev map CPU");
     m.def("bev_in_boxes_gpu", &bev_in_boxes_gpu, "boxes cover bev map CUDA");
@@ -0,0 +1,200 @@
+"""
+Device-agnostic counterpart of roipoint_pool3d_stack_cuda. The points are bucketed into BEV cells of cell_size and
+sorted by (bs_idx, y cell, x cell, point index), so that every cell row a rotated box overlaps is a single range of
+the sorted points found with torch.searchsorted. The candidates of these ranges are checked with the in-box test of
+the CUDA kernel and the first num_sampled_points points inside every box (in the order of the input points) are kept,
+like the CUDA kernel does.
+"""
+import torch
+
+from ...utils import box_utils
+
+CELL_SIZE = 1.0
+MAX_CANDIDATES_PER_CHUNK = 1 << 22
+# MARGIN of check_pt_in_box3d, a float32 constant
+BOX_MARGIN = torch.tensor(1e-5, dtype=torch.float32).item()
+
+
+def get_batch_cnt(points_batch_id, batch_size):
+    return torch.bincount(points_batch_id.long(), minlength=batch_size).int()
+
+
+def get_box_params(boxes):
+    """
+    Args:
+        boxes: (K, 7) [x, y, z, dx, dy, dz, heading]
+    Returns:
+        box_params: (K, 8) [x, y, z, cos(-heading), sin(-heading), dz / 2, x_limit, y_limit], float32, the limits
+            are the largest float32 values below the float64 bounds dx / 2.0 + MARGIN, dy / 2.0 + MARGIN of the kernel
+    """
+    bounds = boxes[:, 3:5].double() / 2.0 + BOX_MARGIN
+    limits = bounds.float()
+    limits = torch.where(limits.double() >= bounds, torch.nextafter(limits, limits.new_tensor(-float('inf'))), limits)
+    return torch.cat([
+        boxes[:, 0:3], torch.cos(-boxes[:, 6:7]), torch.sin(-boxes[:, 6:7]), boxes[:, 5:6] / 2, limits
+    ], dim=1).contiguous()
+
+
+def check_pts_in_box_params(points, box_params):
+    """
+    check_pt_in_box3d of the CUDA kernel on (point, box) pairs
+    Args:
+        points: (K, 3)
+        box_params: (K, 8) from get_box_params
+    Returns:
+        in_flag: (K)
+    """
+    shift = points - box_params[:, 0:3]
+    cosa, sina = box_params[:, 3], box_params[:, 4]
+    local_x = shift[:, 0] * cosa + shift[:, 1] * (-sina)
+    local_y = shift[:, 0] * sina + shift[:, 1] * cosa
+    in_flag = shift[:, 2].abs() <= box_params[:, 5]
+    in_flag &= local_x.abs() <= box_params[:, 6]
+    in_flag &= local_y.abs() <= box_params[:, 7]
+    return in_flag
+
+
+def check_pts_in_box3d(points, boxes):
+    """
+    Args:
+        points: (K, 3)
+        boxes: (K, 7) [x, y, z, dx, dy, dz, heading]
+    Returns:
+        in_flag: (K)
+    """
+    return check_pts_in_box_params(points, get_box_params(boxes))
+
+
+@torch.no_grad()
+def roipoint_query_stack(points, points_batch_id, boxes3d, num_sampled_points, cell_size=CELL_SIZE):
+    """
+    Args:
+        points: (P, 3)
+        points_batch_id: (P)
+        boxes3d: (B, M, 7) [x, y, z, dx, dy, dz, heading], already enlarged
+        num_sampled_points:
+        cell_size: BEV cell size of the point buckets
+    Returns:
+        point_idx: (B, M, num_sampled_points) int, the first points inside every box, -1 for the empty slots
+        point_cnt: (B, M) number of points inside every box, clipped at num_sampled_points
+    """
+    batch_size, boxes_num = boxes3d.shape[0:2]
+    device = points.device
+    point_idx = torch.full((batch_size * boxes_num, num_sampled_points), -1, dtype=torch.int32, device=device)
+    point_cnt = torch.zeros(batch_size * boxes_num, dtype=torch.long, device=device)
+    if points.shape[0] == 0 or boxes_num == 0:
+        return point_idx.view(batch_size, boxes_num, -1), point_cnt.view(batch_size, boxes_num)
+
+    # points sorted by (bs_idx, y cell, x cell), the stable sort keeps the input order inside a cell
+    xy_min = points[:, 0:2].min(dim=0)[0].double()
+    cell_xy = ((points[:, 0:2].double() - xy_min) / cell_size).floor().long()
+    num_x, num_y = (cell_xy.max(dim=0)[0] + 1).tolist()
+    keys = (points_batch_id.long() * num_y + cell_xy[:, 1]) * num_x + cell_xy[:, 0]
+    sorted_keys, order = torch.sort(keys, stable=True)
+    sorted_points = points.index_select(0, order)
+
+    # cells covered by the BEV bounding rectangle of every box, padded against rounding since the exact test follows
+    boxes = boxes3d.reshape(-1, 7)
+    box_params = get_box_params(boxes)
+    box_bs_idx = torch.arange(batch_size, device=device).repeat_interleave(boxes_num)
+    heading = boxes[:, 6].double()
+    cos_abs, sin_abs = heading.cos().abs(), heading.sin().abs()
+    dx, dy = boxes[:, 3].double().abs() / 2, boxes[:, 4].double().abs() / 2
+    half_size = torch.stack([dx * cos_abs + dy * sin_abs, dx * sin_abs + dy * cos_abs], dim=1) + 1e-3
+    center = boxes[:, 0:2].double() - xy_min
+    cell_lo = ((center - half_size) / cell_size).floor().long()
+    cell_hi = ((center + half_size) / cell_size).floor().long()
+    cell_lo = torch.max(cell_lo, cell_lo.new_zeros(2))
+    cell_hi = torch.min(cell_hi, cell_hi.new_tensor([num_x - 1, num_y - 1]))
+
+    # one range of sorted points per (box, cell row)
+    num_rows = (cell_hi[:, 1] - cell_lo[:, 1] + 1).clamp(min=0) * (cell_hi[:, 0] >= cell_lo[:, 0])
+    row_box = torch.arange(boxes.shape[0], device=device).repeat_interleave(num_rows)
+    row_start = torch.cumsum(num_rows, dim=0) - num_rows
+    row_y = cell_lo[row_box, 1] + torch.arange(row_box.shape[0], device=device) - row_start[row_box]
+    row_key = (box_bs_idx[row_box] * num_y + row_y) * num_x
+    pts_start = torch.searchsorted(sorted_keys, row_key + cell_lo[row_box, 0])
+    pts_end = torch.searchsorted(sorted_keys, row_key + cell_hi[row_box, 0], right=True)
+    row_cnt = pts_end - pts_start
+
+    box_cand_end = torch.cumsum(torch.zeros_like(num_rows).index_add_(0, row_box, row_cnt), dim=0)
+    row_end = torch.cumsum(num_rows, dim=0)
+    start_box = 0
+    while start_box < boxes.shape[0]:
+        # boxes of a chunk hold at most MAX_CANDIDATES_PER_CHUNK candidates, except a single oversized box
+        base = box_cand_end[start_box - 1].item() if start_box > 0 else 0
+        end_box = torch.searchsorted(box_cand_end, base + MAX_CANDIDATES_PER_CHUNK, right=True).item()
+        end_box = min(max(end_box, start_box + 1), boxes.shape[0])
+
+        row_lo, row_hi = row_start[start_box].item(), row_end[end_box - 1].item()
+        chunk_row_cnt = row_cnt[row_lo:row_hi]
+        cand_row = torch.arange(row_lo, row_hi, device=device).repeat_interleave(chunk_row_cnt)
+        cand_first = torch.cumsum(chunk_row_cnt, dim=0) - chunk_row_cnt
+        cand_pos = pts_start[cand_row] + torch.arange(cand_row.shape[0], device=device) - cand_first[cand_row - row_lo]
+        cand_pts = order[cand_pos]
+        cand_box = row_box[cand_row]
+
+        in_flag = check_pts_in_box_params(
+            sorted_points.index_select(0, cand_pos), box_params.index_select(0, cand_box)
+        )
+        cand_pts, cand_box = cand_pts[in_flag], cand_box[in_flag]
+
+        # rank of the inside points of a box in the input order
+        sort_key, _ = torch.sort(cand_box * points.shape[0] + cand_pts)
+        cand_box = torch.div(sort_key, points.shape[0], rounding_mode='floor')
+        cand_pts = sort_key - cand_box * points.shape[0]
+        box_cnt = torch.bincount(cand_box - start_box, minlength=end_box - start_box)
+        box_first = torch.cumsum(box_cnt, dim=0) - box_cnt
+        rank = torch.arange(cand_box.shape[0], device=device) - box_first[cand_box - start_box]
+        keep = rank < num_sampled_points
+        point_idx[cand_box[keep], rank[keep]] = cand_pts[keep].int()
+        point_cnt[start_box:end_box] = box_cnt.clamp(max=num_sampled_points)
+        start_box = end_box
+
+    return point_idx.view(batch_size, boxes_num, -1), point_cnt.view(batch_size, boxes_num)
+
+
+@torch.no_grad()
+def roipoint_pool3d_stack(points, point_features, points_batch_id, boxes3d, pool_extra_width, num_sampled_points=512,
+                          cell_size=CELL_SIZE):
+    """
+    Args:
+        points: (P, 3)
+        point_features: (P, C)
+        points_batch_id: (P)
+        boxes3d: (B, num_boxes, 7), [x, y, z, dx, dy, dz, heading]
+        pool_extra_width:
+        num_sampled_points:
+        cell_size:
+
+    Returns:
+        pooled_features: (B, num_boxes, num_sampled_points, 3 + C)
+        pooled_empty_flag: (B, num_boxes)
+        point_empty_flag: (B, num_boxes, num_sampled_points), 1 for the sampled points and -1 for the empty slots
+    """
+    pool_extra_width = (pool_extra_width, pool_extra_width, pool_extra_width)
+    batch_size, boxes_num, feature_len = boxes3d.shape[0], boxes3d.shape[1], point_features.shape[1]
+    pooled_boxes3d = box_utils.enlarge_box3d(boxes3d.view(-1, 7), pool_extra_width).view(batch_size, -1, 7)
+    point_idx, point_cnt = roipoint_query_stack(
+        points, points_batch_id, pooled_boxes3d, num_sampled_points, cell_size=cell_size
+    )
+
+    valid = point_idx >= 0
+    pooled_features = point_features.new_zeros((batch_size, boxes_num, num_sampled_points, 3 + feature_len))
+    pooled_features[valid] = torch.cat([points, point_features], dim=1)[point_idx[valid].long()]
+    pooled_empty_flag = (point_cnt == 0).int()
+    point_empty_flag = valid.int() * 2 - 1
+    return pooled_features, pooled_empty_flag, point_empty_flag
+
+
+@torch.no_grad()
+def roipoint_query_stack_idx(points, points_batch_id, boxes3d, pool_extra_width, num_sampled_points=512,
+                             cell_size=CELL_SIZE):
+    """
+    Returns:
+        point_idx: (B, num_boxes, num_sampled_points) int, -1 for the empty slots
+    """
+    pool_extra_width = (pool_extra_width, pool_extra_width, pool_extra_width)
+    batch_size, boxes_num = boxes3d.shape[0], boxes3d.shape[1]
+    pooled_boxes3d = box_utils.enlarge_box3d(boxes3d.view(-1, 7), pool_extra_width).view(batch_size, boxes_num, 7)
+    return roipoint_query_stack(points, points_batch_id, pooled_boxes3d, num_sampled_points, cell_size=cell_size)[0]
@@ -3,7 +3,7 @@ import torch.nn as nn
 from torch.autograd import Function, Variable
 
 from ...utils import box_utils
-from . import roipoint_pool3d_stack_cuda
+from . import roipoint_pool3d_stack_cuda, roipoint_pool3d_stack_grid_utils
 
 
 class RoIPointPool3dStack(nn.Module):
@@ -23,6 +23,10 @@ class RoIPointPool3dStack(nn.Module):
             pooled_features: (B, M, 512, 3 + C)
             pooled_empty_flag: (B, M)
         """
+        if not points.is_cuda:
+            return roipoint_pool3d_stack_grid_utils.roipoint_pool3d_stack(
+                points, point_features, points_batch_id, boxes3d, self.pool_extra_width, self.num_sampled_points
+            )
         return RoIPointPool3dStackFunction.apply(
             points, point_features, points_batch_id, point_batch_cnt,
             boxes3d, self.pool_extra_width, self.num_sampled_points
@@ -86,6 +90,10 @@ class RoIPointQueryStack(nn.Module):
         Returns:
             point_ids: (B, M, 512, 3 + C)
         """
+        if not points.is_cuda:
+            return roipoint_pool3d_stack_grid_utils.roipoint_query_stack_idx(
+                points, points_batch_id, boxes3d, self.pool_extra_width, self.num_sampled_points
+            )
         return RoIPointQueryStackFunction.apply(
             points, points_batch_id, point_batch_cnt,
             boxes3d, self.pool_extra_width, self.num_sampled_points
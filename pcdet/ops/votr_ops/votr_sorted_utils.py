@@ -0,0 +1,254 @@
+"""
+Device-agnostic counterpart of the hash-table functions of votr_utils. The map table is the sorted array of
+linearized voxel keys ((bs_idx * z_max + z) * y_max + y) * x_max + x together with the per-sample voxel index of
+every key, neighbors are found with torch.searchsorted. The candidate neighbors of every attention mode are visited
+in the loop order of the CUDA kernels and the first attend_size non-empty ones are kept, so the attend indices are
+identical to those of the hash path for the same voxel_indices.
+"""
+from functools import lru_cache
+
+import torch
+
+MAX_CANDIDATES_PER_CHUNK = 1 << 22
+FIRST_OFFSET_BLOCK = 32
+
+
+def get_batch_cnt(voxel_indices, batch_size):
+    return torch.bincount(voxel_indices[:, 0].long(), minlength=batch_size).int()
+
+
+def linearize_indices(bs_idx, z_idx, y_idx, x_idx, spatial_shape):
+    x_max, y_max, z_max = spatial_shape
+    return ((bs_idx.long() * z_max + z_idx) * y_max + y_idx) * x_max + x_idx
+
+
+def in_bounds(z_idx, y_idx, x_idx, spatial_shape):
+    x_max, y_max, z_max = spatial_shape
+    return (z_idx >= 0) & (z_idx < z_max) & (y_idx >= 0) & (y_idx < y_max) & (x_idx >= 0) & (x_idx < x_max)
+
+
+@torch.no_grad()
+def build_sorted_table(batch_size, spatial_shape, voxel_indices):
+    """
+    Args:
+        batch_size:
+        spatial_shape: [x_max, y_max, z_max]
+        voxel_indices: (num_voxels, 4) (bs_idx, z, y, x), sorted by bs_idx
+    Returns:
+        map_table: (sorted_keys, sorted_v_idx), sorted_v_idx is the voxel index inside its own sample,
+            out-of-bound voxels get the key -1 that no query matches
+    """
+    voxel_indices = voxel_indices.long()
+    v_bs_cnt = get_batch_cnt(voxel_indices, batch_size).long()
+    bs_start = torch.cumsum(v_bs_cnt, dim=0) - v_bs_cnt
+    v_idx = torch.arange(voxel_indices.shape[0], device=voxel_indices.device) - bs_start[voxel_indices[:, 0]]
+
+    bs_idx, z_idx, y_idx, x_idx = voxel_indices.unbind(dim=1)
+    keys = linearize_indices(bs_idx, z_idx, y_idx, x_idx, spatial_shape)
+    keys[~in_bounds(z_idx, y_idx, x_idx, spatial_shape)] = -1
+    sorted_keys, order = torch.sort(keys, stable=True)
+    return sorted_keys, v_idx[order].int()
+
+
+@torch.no_grad()
+def sorted_table_down_sample(strides, num_ds_voxels, batch_size, spatial_shape, voxel_indices):
+    """
+    Args:
+        strides: [x_stride, y_stride, z_stride]
+        num_ds_voxels: max downsampled voxels per sample, as the per-sample buffer of hash_table_down_sample, the
+            voxels beyond it (in sorted order) are dropped
+        batch_size:
+        spatial_shape: [x_max, y_max, z_max] of the downsampled voxels
+        voxel_indices: (num_voxels, 4) (bs_idx, z, y, x)
+    Returns:
+        ds_voxel_indices: (num_ds_voxels, 4) unique downsampled voxels, sorted by (bs_idx, z, y, x) while the order
+            of the CUDA path depends on the thread schedule
+        map_table: map table of ds_voxel_indices
+    """
+    x_stride, y_stride, z_stride = strides
+    voxel_indices = voxel_indices.long()
+    bs_idx = voxel_indices[:, 0]
+    z_idx = torch.div(voxel_indices[:, 1], z_stride, rounding_mode='trunc')
+    y_idx = torch.div(voxel_indices[:, 2], y_stride, rounding_mode='trunc')
+    x_idx = torch.div(voxel_indices[:, 3], x_stride, rounding_mode='trunc')
+    keys = linearize_indices(bs_idx, z_idx, y_idx, x_idx, spatial_shape)
+    keys = torch.unique(keys[in_bounds(z_idx, y_idx, x_idx, spatial_shape)])
+
+    x_max, y_max, z_max = spatial_shape
+    ds_voxel_indices = torch.stack([
+        keys // (x_max * y_max * z_max), keys // (x_max * y_max) % z_max, keys // x_max % y_max, keys % x_max
+    ], dim=1).int().contiguous()
+
+    # keys are unique and sorted, the voxel index of a key is its rank inside its sample
+    ds_bs_cnt = get_batch_cnt(ds_voxel_indices, batch_size).long()
+    bs_start = torch.cumsum(ds_bs_cnt, dim=0) - ds_bs_cnt
+    v_idx = torch.arange(keys.shape[0], device=keys.device) - bs_start[ds_voxel_indices[:, 0].long()]
+    if keys.shape[0] > 0 and ds_bs_cnt.max() > num_ds_voxels:
+        keep = v_idx < num_ds_voxels
+        keys, ds_voxel_indices, v_idx = keys[keep], ds_voxel_indices[keep].contiguous(), v_idx[keep]
+    return ds_voxel_indices, (keys, v_idx.int())
+
+
+def _axis_range(start, end, step):
+    # a zero step never advances in the CUDA kernels, the position is visited once here
+    return range(start, end + 1, step) if step > 0 else [start]
+
+
+@lru_cache(maxsize=None)
+def get_local_offsets(attend_range, strides):
+    """
+    Returns:
+        offsets: list of (dz, dy, dx) relative to the query voxel scaled by strides, in the loop order of
+            sparse_local_attention_with_hash_kernel (subm_local_attention_with_hash_kernel with strides of 1)
+    """
+    x_stride, y_stride, z_stride = strides
+    return [
+        (dz, dy, dx)
+        for dz in range(-attend_range, z_stride + attend_range)
+        for dy in range(-attend_range, y_stride + attend_range)
+        for dx in range(-attend_range, x_stride + attend_range)
+    ]
+
+
+@lru_cache(maxsize=None)
+def get_strided_offsets(range_spec, strides, subm):
+    """
+    Args:
+        range_spec: tuple of (x_start, x_end, x_step, y_start, y_end, y_step, z_start, z_end, z_step)
+        strides: [x_stride, y_stride, z_stride]
+        subm: loop order of subm_strided_attention_with_hash_kernel, sparse_strided_attention_with_hash_kernel if not
+    Returns:
+        offsets: list of (dz, dy, dx) relative to the query voxel scaled by strides
+    """
+    x_stride, y_stride, z_stride = strides
+
+    def axis_offsets(offset, stride):
+        if subm:
+            return _axis_range(-offset, offset, 2 * offset if offset > 0 else 1)
+        return _axis_range(-offset, stride - 1 + offset, 2 * offset + stride - 1)
+
+    offsets = []
+    for x_start, x_end, x_step, y_start, y_end, y_step, z_start, z_end, z_step in range_spec:
+        for z_offset in range(0, z_end, z_step):
+            for y_offset in range(0, y_end, y_step):
+                for x_offset in range(0, x_end, x_step):
+                    if x_offset < x_start and y_offset < y_start and z_offset < z_start:
+                        continue
+                    for dz in axis_offsets(z_offset, z_stride):
+                        for dy in axis_offsets(y_offset, y_stride):
+                            for dx in axis_offsets(x_offset, x_stride):
+                                offsets.append((dz, dy, dx))
+    return offsets
+
+
+def gather_attend_indices(spatial_shape, attend_size, offsets, strides, map_table, voxel_indices, check_query=False):
+    """
+    Args:
+        spatial_shape: [x_max, y_max, z_max] of the attended voxels
+        attend_size:
+        offsets: list of (dz, dy, dx)
+        strides: [x_stride, y_stride, z_stride] from voxel_indices to the attended voxels
+        map_table: (sorted_keys, sorted_v_idx) of the attended voxels
+        voxel_indices: (num_voxels, 4) (bs_idx, z, y, x) query voxels
+        check_query: queries out of spatial_shape attend to nothing, as in the subm and strided kernels
+    Returns:
+        attend_indices: (num_voxels, attend_size) per-sample voxel indices, -1 for empty slots
+    """
+    sorted_keys, sorted_v_idx = map_table
+    num_voxels = voxel_indices.shape[0]
+    device = voxel_indices.device
+    attend_indices = torch.full((num_voxels, attend_size), -1, dtype=torch.int32, device=device)
+    if num_voxels == 0 or sorted_keys.shape[0] == 0 or len(offsets) == 0:
+        return attend_indices
+
+    x_stride, y_stride, z_stride = strides
+    offsets = torch.tensor(offsets, dtype=torch.long, device=device)
+    voxel_indices = voxel_indices.long()
+    base = voxel_indices[:, 1:4] * voxel_indices.new_tensor([z_stride, y_stride, x_stride])
+    # keys are linear in the coordinates, so the key of a neighbor is the key of the base plus that of the offset
+    base_keys = linearize_indices(voxel_indices[:, 0], base[:, 0], base[:, 1], base[:, 2], spatial_shape)
+    offset_keys = linearize_indices(offsets.new_zeros(()), offsets[:, 0], offsets[:, 1], offsets[:, 2], spatial_shape)
+    num_found = torch.zeros(num_voxels, dtype=torch.long, device=device)
+    if check_query:
+        num_found[~in_bounds(voxel_indices[:, 1], voxel_indices[:, 2], voxel_indices[:, 3], spatial_shape)] = attend_size
+
+    # the CUDA kernels stop at the first attend_size neighbors, so offsets are visited in growing blocks and only
+    # the voxels with free slots are carried over to the next block
+    offset_start, block_size = 0, FIRST_OFFSET_BLOCK
+    while offset_start < offsets.shape[0]:
+        block_offsets = offsets[offset_start:offset_start + block_size]
+        block_offset_keys = offset_keys[offset_start:offset_start + block_size]
+        offset_start += block_size
+        block_size *= 2
+
+        rows = torch.nonzero(num_found < attend_size).squeeze(1)
+        if rows.numel() == 0:
+            break
+        chunk_size = max(MAX_CANDIDATES_PER_CHUNK // block_offsets.shape[0], 1)
+        for chunk_rows in rows.split(chunk_size):
+            coords = base[chunk_rows, None, :] + block_offsets[None, :, :]  # (n, K, 3)
+            z_idx, y_idx, x_idx = coords.unbind(dim=-1)
+            keys = base_keys[chunk_rows, None] + block_offset_keys[None, :]
+            pos = torch.searchsorted(sorted_keys, keys).clamp_(max=sorted_keys.shape[0] - 1)
+            found = in_bounds(z_idx, y_idx, x_idx, spatial_shape) & (sorted_keys[pos] == keys)
+
+            # slot of every found neighbor in visiting order, the ones after the first attend_size are dropped
+            slots = num_found[chunk_rows, None] + torch.cumsum(found, dim=1) - 1
+            found &= slots < attend_size
+            num_found[chunk_rows] += found.sum(dim=1)
+            attend_indices[chunk_rows[:, None].expand_as(slots)[found], slots[found]] = sorted_v_idx[pos[found]]
+
+    return attend_indices
+
+
+def _as_tuple(range_spec):
+    return tuple(tuple(int(v) for v in spec) for spec in range_spec)
+
+
+@torch.no_grad()
+def sparse_local_attention_indices(spatial_shape, attend_size, attend_range, strides, map_table, voxel_indices):
+    offsets = get_local_offsets(attend_range, tuple(strides))
+    return gather_attend_indices(spatial_shape, attend_size, offsets, strides, map_table, voxel_indices)
+
+
+@torch.no_grad()
+def sparse_strided_attention_indices(spatial_shape, attend_size, range_spec, strides, map_table, voxel_indices):
+    offsets = get_strided_offsets(_as_tuple(range_spec), tuple(strides), subm=False)
+    return gather_attend_indices(spatial_shape, attend_size, offsets, strides, map_table, voxel_indices,
+                                 check_query=True)
+
+
+@torch.no_grad()
+def subm_local_attention_indices(spatial_shape, attend_size, attend_range, map_table, voxel_indices):
+    offsets = get_local_offsets(attend_range, (1, 1, 1))
+    return gather_attend_indices(spatial_shape, attend_size, offsets, (1, 1, 1), map_table, voxel_indices,
+                                 check_query=True)
+
+
+@torch.no_grad()
+def subm_strided_attention_indices(spatial_shape, attend_size, range_spec, map_table, voxel_indices):
+    offsets = get_strided_offsets(_as_tuple(range_spec), (1, 1, 1), subm=True)
+    return gather_attend_indices(spatial_shape, attend_size, offsets, (1, 1, 1), map_table, voxel_indices,
+                                 check_query=True)
+
+
+def grouping_operation(features, features_batch_cnt, idx, idx_batch_cnt):
+    """
+    Args:
+        features: (N1 + N2 ..., C) tensor of features to group
+        features_batch_cnt: (batch_size) [N1 + N2 ...]
+        idx: (M1 + M2 ..., nsample) per-sample indices of features to group, -1 for empty slots
+        idx_batch_cnt: (batch_size) [M1 + M2 ...]
+
+    Returns:
+        output: (M1 + M2, C, nsample) tensor, zeros for empty slots
+    """
+    features_batch_cnt = features_batch_cnt.long()
+    features_start = torch.cumsum(features_batch_cnt, dim=0) - features_batch_cnt
+    idx_bs = torch.repeat_interleave(
+        torch.arange(idx_batch_cnt.shape[0], device=idx.device), idx_batch_cnt.long(), output_size=idx.shape[0]
+    )
+    valid = idx >= 0
+    global_idx = torch.where(valid, idx.long() + features_start[idx_bs][:, None], torch.zeros_like(idx).long())
+    output = features[global_idx] * valid[..., None].to(features.dtype)  # (M, nsample, C)
+    return output.permute(0, 2, 1).contiguous()
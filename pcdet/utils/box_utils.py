@@ -6,6 +6,23 @@ from scipy.spatial import Delaunay
 from ..ops.roiaware_pool3d import roiaware_pool3d_utils
 from . import common_utils
 
+# corners of boxes_to_corners_3d and the face / edge points of boxes_to_sps_3d on a unit box
+BOX_CORNER_TEMPLATE = np.array((
+    [1, 1, -1], [1, -1, -1], [-1, -1, -1], [-1, 1, -1],
+    [1, 1, 1], [1, -1, 1], [-1, -1, 1], [-1, 1, 1],
+), dtype=np.float32) / 2
+BOX_SPS_TEMPLATE = np.array((
+    [1, 1, -1], [1, 0, -1],  [1, -1, -1],
+    [0, 1, -1], [0, 0, -1], [0, -1, -1],
+    [-1, -1, -1], [-1, 0, -1], [-1, 1, -1],
+    [1, 1, 0], [1, 0, 0], [1, -1, 0],
+    [0, 1, 0], [0, -1, 0],
+    [-1, -1, 0], [-1, 0, 0], [-1, 1, 0],
+    [1, 1, 1], [1, 0, 1], [1, -1, 1],
+    [0, 1, 1], [0, 0, 1], [0, -1, 1],
+    [-1, -1, 1], [-1, 0, 1], [-1, 1, 1],
+), dtype=np.float32) / 2
+
 
 def limit_period(val, offset=0.5, period=np.pi):
     return val - torch.floor(val / period + offset) * period
@@ -84,10 +101,7 @@ def boxes_to_corners_3d(boxes3d):
     """
     boxes3d, is_numpy = common_utils.check_numpy_to_torch(boxes3d)
 
-    template = boxes3d.new_tensor((
-        [1, 1, -1], [1, -1, -1], [-1, -1, -1], [-1, 1, -1],
-        [1, 1, 1], [1, -1, 1], [-1, -1, 1], [-1, 1, 1],
-    )) / 2
+    template = boxes3d.new_tensor(BOX_CORNER_TEMPLATE)
 
     corners3d = boxes3d[:, None, 3:6].repeat(1, 8, 1) * template[None, :, :]
     corners3d = common_utils.rotate_points_along_z(corners3d.view(-1, 8, 3), boxes3d[:, 6]).view(-1, 8, 3)
@@ -111,17 +125,7 @@ def boxes_to_sps_3d(boxes3d):
     """
     boxes3d, is_numpy = common_utils.check_numpy_to_torch(boxes3d)
 
-    template = boxes3d.new_tensor((
-        [1, 1, -1], [1, 0, -1],  [1, -1, -1],
-        [0, 1, -1], [0, 0, -1], [0, -1, -1],
-        [-1, -1, -1], [-1, 0, -1], [-1, 1, -1],
-        [1, 1, 0], [1, 0, 0], [1, -1, 0],
-        [0, 1, 0], [0, -1, 0],
-        [-1, -1, 0], [-1, 0, 0], [-1, 1, 0],
-        [1, 1, 1], [1, 0, 1], [1, -1, 1],
-        [0, 1, 1], [0, 0, 1], [0, -1, 1],
-        [-1, -1, 1], [-1, 0, 1], [-1, 1, 1],
-    )) / 2
+    template = boxes3d.new_tensor(BOX_SPS_TEMPLATE)
 
     corners3d = boxes3d[:, None, 3:6].repeat(1, 26, 1) * template[None, :, :]
     corners3d = common_utils.rotate_points_along_z(corners3d.view(-1, 26, 3), boxes3d[:, 6]).view(-1, 26, 3)
@@ -130,6 +134,20 @@ def boxes_to_sps_3d(boxes3d):
     return corners3d.numpy() if is_numpy else corners3d
 
 
+def boxes_to_local_points_3d(boxes3d, template=BOX_CORNER_TEMPLATE):
+    """
+    The template points of the boxes in their local frames (center at the origin, heading along x), in closed form:
+    the points of boxes_to_corners_3d / boxes_to_sps_3d transformed back with to_local_coords, without the rotation.
+    Args:
+        boxes3d: (..., 7 + C) [x, y, z, dx, dy, dz, heading, ...]
+        template: (P, 3) BOX_CORNER_TEMPLATE or BOX_SPS_TEMPLATE
+
+    Returns:
+        points3d: (..., P, 3)
+    """
+    return boxes3d[..., None, 3:6] * boxes3d.new_tensor(template)
+
+
 def mask_boxes_outside_range_numpy(boxes, limit_range, min_num_corners=1):
     """
     Args:
@@ -160,8 +178,10 @@ def remove_points_in_boxes3d(points, boxes3d):
     """
     boxes3d, is_numpy = common_utils.check_numpy_to_torch(boxes3d)
     points, is_numpy = common_utils.check_numpy_to_torch(points)
-    point_masks = roiaware_pool3d_utils.points_in_boxes_cpu(points[:, 0:3], boxes3d)
-    points = points[point_masks.sum(dim=0) == 0]
+    _, pts_idx = roiaware_pool3d_utils.points_in_boxes_csr_cpu(points[:, 0:3], boxes3d)
+    keep_mask = torch.ones(points.shape[0], dtype=torch.bool)
+    keep_mask[pts_idx] = False
+    points = points[keep_mask]
 
     return points.numpy() if is_numpy else points
 
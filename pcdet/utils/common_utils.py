@@ -1,3 +1,4 @@
+import contextlib
 import logging
 import os
 import pickle
@@ -70,6 +71,24 @@ def rotate_points_along_z(points, angle):
     return points_rot.numpy() if is_numpy else points_rot
 
 
+def points_to_local_coords(points, center, angle):
+    """
+    Translates and rotates the points of every box into its local frame (the inverse of rotate_points_along_z by angle
+    plus the center) with one batched 2x2 rotation of xy.
+    Args:
+        points: (..., N, 3)
+        center: (..., 3)
+        angle: (...), heading of the boxes
+    Returns:
+        points: (..., N, 3)
+    """
+    cosa = torch.cos(angle)
+    sina = torch.sin(angle)
+    rot_matrix = torch.stack((cosa, -sina, sina, cosa), dim=-1).view(*angle.shape, 2, 2)
+    points_xy = torch.matmul(points[..., 0:2] - center[..., None, 0:2], rot_matrix)
+    return torch.cat((points_xy, points[..., 2:3] - center[..., None, 2:3]), dim=-1)
+
+
 def mask_points_by_range(points, limit_range):
     mask = (points[:, 0] >= limit_range[0]) & (points[:, 0] <= limit_range[3]) \
            & (points[:, 1] >= limit_range[1]) & (points[:, 1] <= limit_range[4])
@@ -119,6 +138,36 @@ def set_random_seed(seed):
     torch.backends.cudnn.benchmark = False
 
 
+def autocast(device_type, dtype, enabled):
+    """
+    torch.autocast of torch>=1.10, torch.cuda.amp.autocast (fp16 on GPU) before; a nullcontext if disabled,
+    so that the fp32 path runs on every torch version the repo supports.
+    """
+    if not enabled:
+        return contextlib.nullcontext()
+    if hasattr(torch, 'autocast'):
+        return torch.autocast(device_type=device_type, dtype=dtype)
+    assert device_type == 'cuda' and dtype == torch.float16, 'USE_AMP on %s with %s needs torch>=1.10' % (
+        device_type, dtype)
+    return torch.cuda.amp.autocast()
+
+
+@contextlib.contextmanager
+def fp32_island():
+    """
+    Disable autocast (CUDA and CPU) inside the block, e.g. for matcher costs and losses under mixed precision.
+    Inputs are not cast, call .float() on them inside the block.
+    """
+    if hasattr(torch, 'autocast'):
+        with torch.autocast(device_type='cuda', enabled=False), torch.autocast(device_type='cpu', enabled=False):
+            yield
+    elif hasattr(torch.cuda, 'amp'):
+        with torch.cuda.amp.autocast(enabled=False):
+            yield
+    else:
+        yield
+
+
 def keep_arrays_by_name(gt_names, used_classes):
     inds = [i for i, x in enumerate(gt_names) if x in used_classes]
     inds = np.array(inds, dtype=np.int64)
@@ -157,15 +206,20 @@ def init_dist_pytorch(tcp_port, local_rank, backend='nccl'):
         mp.set_start_method('spawn')
 
     num_gpus = torch.cuda.device_count()
-    torch.cuda.set_device(local_rank % num_gpus)
+    if backend == 'gloo':
+        # CPU processes are not bound to a device, the launcher gives the number of processes
+        world_size = int(os.environ.get('WORLD_SIZE', max(num_gpus, 1)))
+    else:
+        torch.cuda.set_device(local_rank % num_gpus)
+        world_size = num_gpus
     dist.init_process_group(
         backend=backend,
         init_method='tcp://127.0.0.1:%d' % tcp_port,
         rank=local_rank,
-        world_size=num_gpus
+        world_size=world_size
     )
     rank = dist.get_rank()
-    return num_gpus, rank
+    return world_size, rank
 
 
 def get_dist_info():
@@ -4,7 +4,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 
 from pcdet.ops.iou3d_nms_diff.iou3d_nms_diff_utils import boxes_iou3d_gpu_differentiable
-from . import box_utils
+from . import box_utils, common_utils
 
 
 class SigmoidFocalClassificationLoss(nn.Module):
@@ -96,7 +96,9 @@ class WeightedSmoothL1Loss(nn.Module):
         self.beta = beta
         if code_weights is not None:
             self.code_weights = np.array(code_weights, dtype=np.float32)
-            self.code_weights = torch.from_numpy(self.code_weights).cuda()
+            self.code_weights = torch.from_numpy(self.code_weights)
+            if torch.cuda.is_available():
+                self.code_weights = self.code_weights.cuda()
 
     @staticmethod
     def smooth_l1_loss(diff, beta):
@@ -148,7 +150,9 @@ class WeightedL1Loss(nn.Module):
         super(WeightedL1Loss, self).__init__()
         if code_weights is not None:
             self.code_weights = np.array(code_weights, dtype=np.float32)
-            self.code_weights = torch.from_numpy(self.code_weights).cuda()
+            self.code_weights = torch.from_numpy(self.code_weights)
+            if torch.cuda.is_available():
+                self.code_weights = self.code_weights.cuda()
 
     def forward(self, input: torch.Tensor, target: torch.Tensor, weights: torch.Tensor = None):
         """
@@ -475,6 +479,7 @@ class E2ESigmoidFocalClassificationLoss(nn.Module):
         loss = torch.clamp(input, min=0) - input * target + torch.log1p(torch.exp(-torch.abs(input)))
         return loss
 
+    @common_utils.fp32_island()
     def forward(self, input: torch.Tensor, target: torch.Tensor):
         """
         Args:
@@ -488,6 +493,7 @@ class E2ESigmoidFocalClassificationLoss(nn.Module):
         Returns:
             weighted_loss: (B, #anchors, #classes) float tensor after weighting.
         """
+        input, target = input.float(), target.float()
         pred_sigmoid = torch.sigmoid(input)
         alpha_weight = target * self.alpha + (1.0 - target) * (1.0 - self.alpha)
         pt = target * (1.0 - pred_sigmoid) + (1.0 - target) * pred_sigmoid
@@ -523,9 +529,10 @@ class SmoothL1Loss(nn.Module):
         value = in_value * in_mask.type_as(in_value) + out_value * out_mask.type_as(out_value)
         return value
 
+    @common_utils.fp32_island()
     def forward(self, x):
         # x size (box_num, code_size)
-        value = self.smooth_l1_loss(x)
+        value = self.smooth_l1_loss(x.float())
         if self.reduction == 'sum':
             loss = value.mean(dim=1)
             loss = loss.sum()
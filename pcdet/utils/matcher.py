@@ -2,8 +2,11 @@ import torch
 import numpy as np
 import torch.nn as nn
 from scipy.optimize import linear_sum_assignment
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import min_weight_full_bipartite_matching
 from collections import defaultdict
 from pcdet.ops.iou3d_nms.iou3d_nms_utils import boxes_iou3d_gpu
+from pcdet.utils import common_utils
 
 class CornerMatcher(nn.Module):
     def __init__(
@@ -138,6 +141,7 @@ class TimeMatcher(nn.Module):
             code_weights,
             period=None,
             iou_th=-1,
+            chunk_memory_mb=-1,
             **kwargs
     ):
         super().__init__()
@@ -146,6 +150,7 @@ class TimeMatcher(nn.Module):
         self.weight_dict = weight_dict
         self.period = period
         self.iou_th = iou_th
+        self.chunk_memory_mb = chunk_memory_mb
         self.register_buffer('code_weights', torch.Tensor(code_weights))
         self.use_focal_loss = use_focal_loss
         self.loss_dict = {
@@ -171,14 +176,14 @@ class TimeMatcher(nn.Module):
         '''
 
         examples = defaultdict(lambda: None)
-        examples['pred_boxes'] = pred_dicts['pred_boxes']
+        examples['pred_boxes'] = pred_dicts['pred_boxes'].float()
         examples['gt_boxes'] = self.box_coder.encode(gt_dicts['gt_boxes'])
 
         if self.iou_th > 0.0:
-            examples['pred_boxes_iou'] = self.box_coder.decode_torch(pred_dicts['pred_boxes'])
+            examples['pred_boxes_iou'] = self.box_coder.decode_torch(examples['pred_boxes'])
             examples['gt_boxes_iou'] = gt_dicts['gt_boxes']
 
-        pred_logits = pred_dicts['pred_logits']
+        pred_logits = pred_dicts['pred_logits'].float()
         if self.use_focal_loss:
             pred_logits = pred_logits.sigmoid()
         else:
@@ -250,7 +255,64 @@ class TimeMatcher(nn.Module):
 
         return rlt
 
+    def get_cost(self, example):
+        loss_val_dict = self.get_loss(example)
+
+        loss = -1.0
+        if self.iou_th > 0.0:
+            loss = loss * loss_val_dict['iou_thresh_mask']
+        for k in self.losses:
+            if k not in self.weight_dict:
+                continue
+            tmp = loss_val_dict[k] ** self.weight_dict[k]
+            loss = loss * tmp
+        return loss
+
+    @staticmethod
+    def _get_query_example(example, query_inds):
+        rlt = dict(example)
+        for k in ['pred_logits', 'pred_boxes', 'pred_boxes_iou']:
+            if k in rlt:
+                rlt[k] = example[k][query_inds]
+        return rlt
+
+    def chunked_assignment(self, example):
+        """
+        Streams the cost over blocks of queries within chunk_memory_mb and only keeps the min(num_queries, num_gt)
+        cheapest queries of every gt as the edges of a sparse bipartite graph. An optimal assignment always lies in
+        these edges: a gt matched outside of them has at least one of its edges left free by the other gts,
+        which is not more expensive.
+        """
+        num_queries = example['pred_logits'].size(0)
+        num_gt = example['gt_classes'].size(0)
+        num_keep = min(num_queries, num_gt)
+        # a block peaks at about six (chunk_size, num_gt) float32 temporaries (the cost factors, the concatenated
+        # top-k and its int64 query indices), see tools/benchmark_time_matcher.py
+        chunk_size = max(int(self.chunk_memory_mb * 2 ** 20 / (32 * num_gt)), num_keep)
+
+        top_cost, top_inds = None, None
+        for start in range(0, num_queries, chunk_size):
+            query_inds = torch.arange(start, min(start + chunk_size, num_queries), device=example['pred_logits'].device)
+            cost = self.get_cost(self._get_query_example(example, query_inds))
+            query_inds = query_inds[:, None].expand_as(cost)
+            if top_cost is not None:
+                cost = torch.cat([top_cost, cost], dim=0)
+                query_inds = torch.cat([top_inds, query_inds], dim=0)
+            top_cost, keep = cost.topk(num_keep, dim=0, largest=False)
+            top_inds = query_inds.gather(0, keep)
+
+        # every gt is matched once, so shifting the costs to strictly positive edge weights keeps the optimum
+        weights = (top_cost.double() - top_cost.min() + 1).t().cpu().numpy()
+        graph = csr_matrix(
+            (weights.reshape(-1), top_inds.t().cpu().numpy().reshape(-1), np.arange(0, num_gt * num_keep + 1, num_keep)),
+            shape=(num_gt, num_queries)
+        )
+        gt_ind, query_ind = min_weight_full_bipartite_matching(graph)
+        order = np.argsort(query_ind)
+        return query_ind[order], gt_ind[order]
+
     @torch.no_grad()
+    @common_utils.fp32_island()
     def forward(self, pred_dicts, gt_dicts):
         rlt = {}
         examples = self._preprocess(pred_dicts, gt_dicts)
@@ -263,18 +325,10 @@ class TimeMatcher(nn.Module):
                 continue
 
             example = self._get_per_scene_example(examples, i)
-            loss_val_dict = self.get_loss(example)
-
-            loss = -1.0
-            if self.iou_th > 0.0:
-                loss = loss * loss_val_dict['iou_thresh_mask']
-            for k in self.losses:
-                if k not in self.weight_dict:
-                    continue
-                tmp = loss_val_dict[k] ** self.weight_dict[k]
-                loss = loss * tmp
-
-            ind = linear_sum_assignment(loss.cpu())
+            if self.chunk_memory_mb > 0:
+                ind = self.chunked_assignment(example)
+            else:
+                ind = linear_sum_assignment(self.get_cost(example).cpu())
             indices.append(ind)
 
         rlt['inds'] = [
@@ -0,0 +1,141 @@
+"""
+Compact storage of point clouds: xyz as int16 fixed point around the center of the point cloud range,
+every other feature as uint8 in the [min, max] range of the frame, the whole payload compressed by a fast
+general-purpose compressor (zlib from the standard library, zstd if the zstandard package is installed).
+"""
+import pickle
+import zlib
+
+import numpy as np
+
+CODEC_VERSION = 1
+
+
+def _compress(data, compressor, level):
+    if compressor == 'zlib':
+        return zlib.compress(data, level)
+    elif compressor == 'zstd':
+        import zstandard
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    elif compressor == 'none':
+        return data
+    raise NotImplementedError(compressor)
+
+
+def _decompress(data, compressor):
+    if compressor == 'zlib':
+        return zlib.decompress(data)
+    elif compressor == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompress(data)
+    elif compressor == 'none':
+        return data
+    raise NotImplementedError(compressor)
+
+
+def encode_points(points, point_cloud_range, xyz_step=0.005, compressor='zlib', level=1):
+    """
+    Args:
+        points: (N, 3 + C) [x, y, z, features...]
+        point_cloud_range: [x_min, y_min, z_min, x_max, y_max, z_max], xyz are stored relative to its center,
+            points beyond center +- 32767 * xyz_step are clipped
+        xyz_step: quantization step of xyz in meters, the max error is xyz_step / 2
+        compressor: zlib, zstd or none
+        level: compression level
+
+    Returns:
+        encoded: dict, header and compressed payload
+    """
+    points = np.asarray(points, dtype=np.float32)
+    point_cloud_range = np.array(point_cloud_range, dtype=np.float32)
+    xyz_offset = (point_cloud_range[0:3] + point_cloud_range[3:6]) / 2
+
+    xyz = np.round((points[:, 0:3] - xyz_offset) / xyz_step)
+    xyz = np.clip(xyz, -32767, 32767).astype(np.int16)
+
+    features = points[:, 3:]
+    feature_min = features.min(axis=0) if features.shape[0] > 0 else np.zeros(features.shape[1], dtype=np.float32)
+    feature_max = features.max(axis=0) if features.shape[0] > 0 else np.zeros(features.shape[1], dtype=np.float32)
+    feature_scale = np.maximum(feature_max - feature_min, 1e-12) / 255
+    features = np.round((features - feature_min) / feature_scale).astype(np.uint8)
+
+    # column major so that every channel is compressed as one contiguous run
+    payload = np.ascontiguousarray(xyz.T).tobytes() + np.ascontiguousarray(features.T).tobytes()
+    return {
+        'version': CODEC_VERSION,
+        'num_points': points.shape[0],
+        'num_features': points.shape[1] - 3,
+        'xyz_offset': xyz_offset,
+        'xyz_step': np.float32(xyz_step),
+        'feature_min': feature_min.astype(np.float32),
+        'feature_scale': feature_scale.astype(np.float32),
+        'compressor': compressor,
+        'payload': _compress(payload, compressor, level)
+    }
+
+
+def decode_points(encoded):
+    """
+    Args:
+        encoded: dict from encode_points
+
+    Returns:
+        points: (N, 3 + C) float32
+    """
+    assert encoded['version'] == CODEC_VERSION
+    num_points, num_features = encoded['num_points'], encoded['num_features']
+    payload = _decompress(encoded['payload'], encoded['compressor'])
+
+    xyz = np.frombuffer(payload, dtype=np.int16, count=3 * num_points).reshape(3, num_points)
+    features = np.frombuffer(payload, dtype=np.uint8, offset=6 * num_points).reshape(num_features, num_points)
+
+    points = np.empty((num_points, 3 + num_features), dtype=np.float32)
+    points[:, 0:3] = xyz.T * encoded['xyz_step'] + encoded['xyz_offset']
+    points[:, 3:] = features.T * encoded['feature_scale'] + encoded['feature_min']
+    return points
+
+
+def save_points(file_path, points, codec_cfg, point_cloud_range):
+    encoded = encode_points(
+        points, point_cloud_range, xyz_step=codec_cfg.get('XYZ_STEP', 0.005),
+        compressor=codec_cfg.get('COMPRESSOR', 'zlib'), level=codec_cfg.get('LEVEL', 1)
+    )
+    with open(file_path, 'wb') as f:
+        pickle.dump(encoded, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def load_points(file_path):
+    with open(file_path, 'rb') as f:
+        return decode_points(pickle.load(f))
+
+
+if __name__ == '__main__':
+    import argparse
+    import glob
+    import time
+
+    parser = argparse.ArgumentParser(description='compression ratio and decode throughput of the point codec')
+    parser.add_argument('--npy_glob', type=str, required=True, help='float32 .npy frames, e.g. data/waymo/*/*/0*.npy')
+    parser.add_argument('--point_cloud_range', type=float, nargs=6, default=[-75.2, -75.2, -2, 75.2, 75.2, 4])
+    parser.add_argument('--compressor', type=str, default='zlib', help='')
+    parser.add_argument('--level', type=int, default=1, help='')
+    parser.add_argument('--max_frames', type=int, default=100, help='')
+    args = parser.parse_args()
+
+    raw_bytes, encoded_bytes, decode_time, num_points, max_xyz_error = 0, 0, 0, 0, 0
+    for npy_file in sorted(glob.glob(args.npy_glob))[:args.max_frames]:
+        points = np.load(npy_file)
+        encoded = encode_points(points, args.point_cloud_range, compressor=args.compressor, level=args.level)
+        start = time.perf_counter()
+        decoded = decode_points(encoded)
+        decode_time += time.perf_counter() - start
+
+        raw_bytes += points.nbytes
+        encoded_bytes += len(pickle.dumps(encoded, protocol=pickle.HIGHEST_PROTOCOL))
+        num_points += points.shape[0]
+        max_xyz_error = max(max_xyz_error, float(np.abs(decoded[:, 0:3] - points[:, 0:3]).max(initial=0)))
+
+    print('compression ratio: %.2f (%.1f MB -> %.1f MB)' % (raw_bytes / encoded_bytes, raw_bytes / 2 ** 20,
+                                                            encoded_bytes / 2 ** 20))
+    print('decode throughput: %.1f M points/s per core' % (num_points / decode_time / 1e6))
+    print('max xyz error: %.4f m' % max_xyz_error)
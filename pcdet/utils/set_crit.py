@@ -308,7 +308,12 @@ class SetCriterion(nn.Module):
         assert loss in self.loss_map, f'do you really want to compute {loss} loss?'
         return self.loss_map[loss](**conds)
 
+    @common_utils.fp32_island()
     def forward(self, pred_dicts, gt_dicts, curr_epoch):
+        pred_dicts = {
+            key: val.float() if isinstance(val, torch.Tensor) and val.is_floating_point() else val
+            for key, val in pred_dicts.items()
+        }
         conds = self._preprocess(pred_dicts, gt_dicts, curr_epoch)
         losses = {}
         for loss in self.losses:
@@ -0,0 +1,227 @@
+"""
+Test-time augmentation. Every test sample is expanded into views (flip along x / y, yaw rotation, global scaling) that
+go through the network as extra samples of the same batch, the boxes predicted on every view are mapped back to the
+frame of the sample and fused with weighted box fusion or NMS.
+"""
+import itertools
+
+import numpy as np
+import torch
+
+from ..ops.iou3d_nms import iou3d_nms_utils
+from . import common_utils
+
+
+def get_tta_views(tta_cfg):
+    """
+    Args:
+        tta_cfg: DATA_CONFIG.TEST_TIME_AUGMENTATION, every combination of the options below is a view
+            FLIP_X: list of bool, flip along the x axis (y -> -y)
+            FLIP_Y: list of bool, flip along the y axis (x -> -x)
+            ROT_ANGLES: list of yaw rotations
+            SCALES: list of global scales
+
+    Returns:
+        views: (V, 5) [view_idx, flip_x, flip_y, rot_angle, scale], the first view is the identity
+    """
+    identity = (False, False, 0.0, 1.0)
+    views = itertools.product(
+        tta_cfg.get('FLIP_X', [False]), tta_cfg.get('FLIP_Y', [False]),
+        tta_cfg.get('ROT_ANGLES', [0.0]), tta_cfg.get('SCALES', [1.0])
+    )
+    views = [identity] + [view for view in views if view != identity]
+    return np.array([[view_idx, *view] for view_idx, view in enumerate(views)], dtype=np.float32)
+
+
+def transform_points(points, view):
+    """
+    Args:
+        points: (N, 3 + C)
+        view: [view_idx, flip_x, flip_y, rot_angle, scale]
+
+    Returns:
+        points: (N, 3 + C) points of the view, in the order of the augmentor: flips, rotation and then scaling
+    """
+    _, flip_x, flip_y, rot_angle, scale = view
+    points = points.copy()
+    if flip_x:
+        points[:, 1] = -points[:, 1]
+    if flip_y:
+        points[:, 0] = -points[:, 0]
+    if rot_angle != 0:
+        points = common_utils.rotate_points_along_z(points[np.newaxis, :, :], np.array([rot_angle]))[0]
+    if scale != 1:
+        points[:, 0:3] *= scale
+    return points
+
+
+def transform_boxes(boxes, view):
+    """
+    Args:
+        boxes: (N, 7 + C) [x, y, z, dx, dy, dz, heading, [vx], [vy]] in the frame of the sample
+        view: [view_idx, flip_x, flip_y, rot_angle, scale]
+
+    Returns:
+        boxes: (N, 7 + C) boxes of the view, inverse of inverse_transform_boxes
+    """
+    _, flip_x, flip_y, rot_angle, scale = view
+    boxes = boxes.copy()
+    has_velocity = boxes.shape[1] > 8
+    boxes[:, 0:3] = transform_points(boxes[:, 0:3], view)
+    if has_velocity:
+        velocity = np.concatenate([boxes[:, 7:9], np.zeros((boxes.shape[0], 1), dtype=boxes.dtype)], axis=1)
+        boxes[:, 7:9] = transform_points(velocity, view)[:, 0:2]
+    if flip_x:
+        boxes[:, 6] = -boxes[:, 6]
+    if flip_y:
+        boxes[:, 6] = -(boxes[:, 6] + np.pi)
+    boxes[:, 6] += rot_angle
+    boxes[:, 3:6] *= scale
+    return boxes
+
+
+def inverse_transform_boxes(boxes, view):
+    """
+    Args:
+        boxes: (N, 7 + C) [x, y, z, dx, dy, dz, heading, [vx], [vy]] predicted on the view
+        view: [view_idx, flip_x, flip_y, rot_angle, scale]
+
+    Returns:
+        boxes: (N, 7 + C) in the frame of the sample
+    """
+    _, flip_x, flip_y, rot_angle, scale = [float(x) for x in view]
+    boxes = boxes.clone()
+    has_velocity = boxes.shape[1] > 8
+    if scale != 1:
+        boxes[:, 0:6] /= scale
+        if has_velocity:
+            boxes[:, 7:9] /= scale
+    if rot_angle != 0:
+        angle = boxes.new_tensor([-rot_angle])
+        boxes[:, 0:3] = common_utils.rotate_points_along_z(boxes[None, :, 0:3], angle)[0]
+        boxes[:, 6] -= rot_angle
+        if has_velocity:
+            velocity = torch.cat([boxes[:, 7:9], boxes.new_zeros((boxes.shape[0], 1))], dim=1)
+            boxes[:, 7:9] = common_utils.rotate_points_along_z(velocity[None], angle)[0][:, 0:2]
+    if flip_y:
+        boxes[:, 0] = -boxes[:, 0]
+        boxes[:, 6] = -(boxes[:, 6] + np.pi)
+        if has_velocity:
+            boxes[:, 7] = -boxes[:, 7]
+    if flip_x:
+        boxes[:, 1] = -boxes[:, 1]
+        boxes[:, 6] = -boxes[:, 6]
+        if has_velocity:
+            boxes[:, 8] = -boxes[:, 8]
+    boxes[:, 6] = common_utils.limit_period(boxes[:, 6], offset=0.5, period=np.pi * 2)
+    return boxes
+
+
+def weighted_box_fusion(boxes, scores, iou_thresh, num_views):
+    """
+    Clusters the boxes of one class around the highest scored remaining box (BEV IoU above iou_thresh) and averages
+    every cluster weighted by the scores, the heading by its score weighted mean direction.
+
+    Args:
+        boxes: (N, 7 + C)
+        scores: (N)
+        iou_thresh:
+        num_views:
+
+    Returns:
+        fused_boxes: (K, 7 + C)
+        fused_scores: (K), mean score of the cluster, scaled down by min(cluster size, num_views) / num_views
+    """
+    order = scores.argsort(descending=True)
+    boxes, scores = boxes[order], scores[order]
+    overlaps = iou3d_nms_utils.boxes_iou_bev(boxes[:, 0:7].contiguous(), boxes[:, 0:7].contiguous()) > iou_thresh
+
+    cluster_ids = boxes.new_full((boxes.shape[0],), -1, dtype=torch.long)
+    num_clusters = 0
+    for k in range(boxes.shape[0]):
+        if cluster_ids[k] >= 0:
+            continue
+        cluster_ids[overlaps[k] & (cluster_ids < 0)] = num_clusters
+        num_clusters += 1
+
+    weights = torch.zeros((num_clusters,), dtype=scores.dtype, device=scores.device).index_add_(0, cluster_ids, scores)
+    cluster_size = torch.bincount(cluster_ids, minlength=num_clusters).to(scores.dtype)
+    weighted = torch.cat([
+        boxes[:, 0:6], boxes[:, 7:], torch.cos(boxes[:, 6:7]), torch.sin(boxes[:, 6:7])
+    ], dim=1) * scores[:, None]
+    fused = weighted.new_zeros((num_clusters, weighted.shape[1])).index_add_(0, cluster_ids, weighted)
+    fused = fused / weights[:, None]
+
+    fused_boxes = torch.cat([
+        fused[:, 0:6], torch.atan2(fused[:, -1], fused[:, -2])[:, None], fused[:, 6:-2]
+    ], dim=1)
+    fused_scores = weights / cluster_size * cluster_size.clamp(max=num_views) / num_views
+    return fused_boxes, fused_scores
+
+
+def fuse_boxes(boxes, scores, labels, num_views, fusion_cfg):
+    """
+    Args:
+        boxes: (N, 7 + C) boxes of all the views of a sample
+        scores: (N)
+        labels: (N)
+        num_views:
+        fusion_cfg: MODEL.POST_PROCESSING.TTA_FUSION
+            METHOD: wbf or nms
+            IOU_THRESH: BEV IoU of the boxes of an object
+            MAX_NUM: optional, max number of fused boxes
+
+    Returns:
+        boxes, scores, labels: sorted by scores
+    """
+    method = fusion_cfg.get('METHOD', 'wbf')
+    iou_thresh = fusion_cfg.get('IOU_THRESH', 0.55)
+
+    fused_boxes, fused_scores, fused_labels = [], [], []
+    for cur_label in labels.unique().tolist():
+        mask = labels == cur_label
+        cur_boxes, cur_scores = boxes[mask], scores[mask]
+        if method == 'wbf':
+            cur_boxes, cur_scores = weighted_box_fusion(cur_boxes, cur_scores, iou_thresh, num_views)
+        elif method == 'nms':
+            selected, _ = iou3d_nms_utils.nms_gpu(cur_boxes[:, 0:7].contiguous(), cur_scores, iou_thresh)
+            cur_boxes, cur_scores = cur_boxes[selected], cur_scores[selected]
+        else:
+            raise NotImplementedError
+        fused_boxes.append(cur_boxes)
+        fused_scores.append(cur_scores)
+        fused_labels.append(labels.new_full((cur_scores.shape[0],), cur_label))
+
+    if len(fused_boxes) == 0:
+        return boxes, scores, labels
+    boxes, scores, labels = torch.cat(fused_boxes), torch.cat(fused_scores), torch.cat(fused_labels)
+    order = scores.argsort(descending=True)[:fusion_cfg.get('MAX_NUM', None)]
+    return boxes[order], scores[order], labels[order]
+
+
+def fuse_tta_predictions(pred_dicts, tta_views, fusion_cfg):
+    """
+    Args:
+        pred_dicts: list of (B * V) dicts with pred_boxes, pred_scores and pred_labels, the V views of a sample in a row
+        tta_views: (B * V, 5) [view_idx, flip_x, flip_y, rot_angle, scale]
+        fusion_cfg: MODEL.POST_PROCESSING.TTA_FUSION
+
+    Returns:
+        pred_dicts: list of B dicts
+    """
+    tta_views = tta_views.tolist() if isinstance(tta_views, torch.Tensor) else tta_views
+    num_views = int(max([view[0] for view in tta_views])) + 1
+    assert len(pred_dicts) % num_views == 0
+
+    fused_pred_dicts = []
+    for start in range(0, len(pred_dicts), num_views):
+        boxes = [
+            inverse_transform_boxes(pred_dicts[k]['pred_boxes'], tta_views[k]) for k in range(start, start + num_views)
+        ]
+        scores = [pred_dicts[k]['pred_scores'] for k in range(start, start + num_views)]
+        labels = [pred_dicts[k]['pred_labels'] for k in range(start, start + num_views)]
+        boxes, scores, labels = fuse_boxes(
+            torch.cat(boxes), torch.cat(scores), torch.cat(labels), num_views, fusion_cfg
+        )
+        fused_pred_dicts.append({'pred_boxes': boxes, 'pred_scores': scores, 'pred_labels': labels})
+    return fused_pred_dicts
@@ -0,0 +1,140 @@
+import argparse
+import copy
+
+import numpy as np
+import torch
+import torch.nn as nn
+import tqdm
+from easydict import EasyDict
+
+from pcdet.utils import box_coder_utils, matcher
+from pcdet.utils.set_crit import SetCriterion
+from train_utils.train_utils import build_grad_scaler, train_one_epoch
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(
+        description='bf16 CPU autocast against fp32: losses of the TimeMatcher / SetCriterion set loss under '
+                    'train_one_epoch, from the same weights and batches'
+    )
+    parser.add_argument('--batch_size', type=int, default=2, help='')
+    parser.add_argument('--num_queries', type=int, default=300, help='')
+    parser.add_argument('--num_gt', type=int, default=30, help='gt boxes per sample')
+    parser.add_argument('--num_iters', type=int, default=300, help='')
+    parser.add_argument('--lr', type=float, default=1e-3, help='')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+class QueryHead(nn.Module):
+    """
+    per-query logits and CenterCoder box codes from query features, like the heads of the e2e detectors
+    """
+    def __init__(self, in_channels, num_classes, code_size):
+        super().__init__()
+        self.trunk = nn.Sequential(
+            nn.Linear(in_channels, 128), nn.ReLU(), nn.Linear(128, 128), nn.ReLU()
+        )
+        self.cls_head = nn.Linear(128, num_classes)
+        self.box_head = nn.Linear(128, code_size)
+        self.register_buffer('global_step', torch.LongTensor(1).zero_())
+
+    def set_cur_epoch(self, epoch):
+        pass
+
+    def forward(self, batch_dict):
+        features = self.trunk(batch_dict['query_features'])
+        return {'pred_logits': self.cls_head(features), 'pred_boxes': self.box_head(features)}
+
+
+def build_set_criterion():
+    # the TimeMatcher / SetCriterion settings of cfgs/waymo_p2s.yaml
+    box_coder = box_coder_utils.CenterCoder(code_size=7, encode_angle_by_sincos=True, period=2 * np.pi)
+    time_matcher = matcher.TimeMatcher(
+        box_coder=box_coder, losses=['loss_ce', 'loss_bbox'], weight_dict={'loss_ce': 0.25, 'loss_bbox': 0.75},
+        use_focal_loss=True, code_weights=[1.0] * 8, period=2 * np.pi
+    )
+    return SetCriterion(
+        matcher=time_matcher, weight_dict={'loss_ce': 1, 'loss_bbox': 2}, losses=['loss_ce', 'loss_bbox'],
+        sigma=3.0, box_coder=box_coder, code_weights=[1.0] * 8, gamma=2.0, alpha=0.25
+    ), box_coder
+
+
+def build_batches(args, box_coder):
+    """
+    every query sees a noisy code of one gt box (or of nothing), so the set loss has something to learn
+    """
+    generator = torch.Generator().manual_seed(args.seed)
+    batches = []
+    for _ in range(args.num_iters):
+        gt_boxes, gt_classes, query_features = [], [], []
+        for _ in range(args.batch_size):
+            boxes = torch.cat([
+                torch.rand(args.num_gt, 2, generator=generator) * 100 - 50,
+                torch.rand(args.num_gt, 1, generator=generator) * 2 - 1,
+                torch.rand(args.num_gt, 3, generator=generator) * 3 + 0.5,
+                torch.rand(args.num_gt, 1, generator=generator) * 2 * np.pi - np.pi,
+            ], dim=1)
+            codes = box_coder.encode([boxes])[0]
+            owner = torch.randint(0, args.num_gt + 1, (args.num_queries,), generator=generator)
+            codes = torch.cat([codes, torch.zeros(1, codes.shape[1])], dim=0)[owner]
+            query_features.append(codes + torch.randn(codes.shape, generator=generator) * 0.5)
+            gt_boxes.append(boxes)
+            gt_classes.append(torch.zeros(args.num_gt, dtype=torch.int64))
+        batches.append({
+            'query_features': torch.stack(query_features), 'gt_boxes': gt_boxes, 'gt_classes': gt_classes
+        })
+    return batches
+
+
+class ConstantScheduler(object):
+    def step(self, it):
+        pass
+
+
+def run_mode(model, set_crit, batches, optim_cfg, lr):
+    losses = []
+
+    def model_func(model, batch_dict):
+        pred_dicts = model(batch_dict)
+        loss_dict = set_crit(pred_dicts, {'gt_boxes': batch_dict['gt_boxes'],
+                                          'gt_classes': batch_dict['gt_classes']}, 0)
+        losses.append(loss_dict['loss'].item())
+        return loss_dict['loss'], {'loss_ce': loss_dict['loss_ce'].item(),
+                                   'loss_bbox': loss_dict['loss_bbox'].item()}, {}
+
+    optimizer = torch.optim.Adam(model.parameters(), lr=lr)
+    with tqdm.tqdm(disable=True) as tbar:
+        train_one_epoch(
+            model, optimizer, batches, model_func, lr_scheduler=ConstantScheduler(), accumulated_iter=0,
+            optim_cfg=optim_cfg, rank=1, tbar=tbar, total_it_each_epoch=len(batches),
+            dataloader_iter=iter(batches), scaler=build_grad_scaler(model, optim_cfg)
+        )
+    return np.array(losses)
+
+
+def main():
+    args = parse_config()
+    torch.manual_seed(args.seed)
+    set_crit, box_coder = build_set_criterion()
+    batches = build_batches(args, box_coder)
+    init_model = QueryHead(in_channels=box_coder.code_size, num_classes=1, code_size=box_coder.code_size)
+
+    results = {}
+    for name, amp_cfg in [('fp32', {'USE_AMP': False}), ('bf16', {'USE_AMP': True, 'AMP_DTYPE': 'bfloat16'})]:
+        optim_cfg = EasyDict({'GRAD_NORM_CLIP': 10, **amp_cfg})
+        results[name] = run_mode(copy.deepcopy(init_model), set_crit, batches, optim_cfg, args.lr)
+
+    rel_diff = np.abs(results['bf16'] - results['fp32']) / np.abs(results['fp32'])
+    print('%d iterations of %d x %d queries, %d gt boxes per sample, CPU autocast' % (
+        args.num_iters, args.batch_size, args.num_queries, args.num_gt))
+    print('%6s %12s %12s %12s' % ('iter', 'fp32 loss', 'bf16 loss', 'rel diff'))
+    for it in sorted(set([0, 1, 2, args.num_iters // 2, args.num_iters - 1])):
+        print('%6d %12.4f %12.4f %12.2e' % (it, results['fp32'][it], results['bf16'][it], rel_diff[it]))
+    print('max rel diff: %.2e, mean rel diff: %.2e, loss drop fp32 %.1f%% / bf16 %.1f%%' % (
+        rel_diff.max(), rel_diff.mean(), 100 * (1 - results['fp32'][-1] / results['fp32'][0]),
+        100 * (1 - results['bf16'][-1] / results['bf16'][0])))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+import argparse
+
+import numpy as np
+import torch
+from easydict import EasyDict
+
+from benchmark_utils.benchmark_utils import time_it
+
+from pcdet.models.dense_heads.target_assigner.anchor_generator import AnchorGenerator
+from pcdet.models.dense_heads.target_assigner.atss_target_assigner import ATSSTargetAssigner
+from pcdet.models.dense_heads.target_assigner.axis_aligned_target_assigner import AxisAlignedTargetAssigner
+from pcdet.utils import box_coder_utils
+
+CLASS_NAMES = ['Car', 'Pedestrian', 'Cyclist']
+# anchors of the KITTI anchor heads
+ANCHOR_GENERATOR_CONFIG = [
+    {'class_name': 'Car', 'anchor_sizes': [[3.9, 1.6, 1.56]], 'anchor_rotations': [0, 1.57],
+     'anchor_bottom_heights': [-1.78], 'align_center': False, 'feature_map_stride': 2,
+     'matched_threshold': 0.6, 'unmatched_threshold': 0.45},
+    {'class_name': 'Pedestrian', 'anchor_sizes': [[0.8, 0.6, 1.73]], 'anchor_rotations': [0, 1.57],
+     'anchor_bottom_heights': [-0.6], 'align_center': False, 'feature_map_stride': 2,
+     'matched_threshold': 0.5, 'unmatched_threshold': 0.35},
+    {'class_name': 'Cyclist', 'anchor_sizes': [[1.76, 0.6, 1.73]], 'anchor_rotations': [0, 1.57],
+     'anchor_bottom_heights': [-0.6], 'align_center': False, 'feature_map_stride': 2,
+     'matched_threshold': 0.5, 'unmatched_threshold': 0.35},
+]
+POINT_CLOUD_RANGE = [0, -39.68, -3, 69.12, 39.68, 1]
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='batched anchor target assignment against the per-sample loop')
+    parser.add_argument('--batch_sizes', type=int, nargs='+', default=[8, 16], help='')
+    parser.add_argument('--grid_size', type=int, nargs=2, default=[432, 496], help='x y of the voxel grid')
+    parser.add_argument('--max_boxes', type=int, default=30, help='boxes of the most crowded sample')
+    parser.add_argument('--assigners', type=str, nargs='+', default=['axis_aligned', 'atss'], help='')
+    parser.add_argument('--match_height', action='store_true', default=False, help='')
+    parser.add_argument('--norm_by_num_examples', action='store_true', default=False, help='')
+    parser.add_argument('--device', type=str, default='cpu', help='')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every step')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_gt_boxes(batch_size, max_boxes, rng):
+    """
+    Zero padded (B, M, 8) boxes with classes, a few samples without boxes
+    """
+    mean_sizes = np.array([config['anchor_sizes'][0] for config in ANCHOR_GENERATOR_CONFIG])
+    gt_boxes = np.zeros((batch_size, max_boxes, 8), dtype=np.float32)
+    for k in range(batch_size):
+        num_boxes = 0 if k % 5 == 4 else int(rng.integers(1, max_boxes + 1))
+        classes = rng.integers(1, len(CLASS_NAMES) + 1, num_boxes)
+        gt_boxes[k, :num_boxes] = np.concatenate([
+            rng.uniform([2, -36, -1.5], [66, 36, -0.5], (num_boxes, 3)),
+            mean_sizes[classes - 1] * rng.uniform(0.85, 1.15, (num_boxes, 3)),
+            rng.uniform(-np.pi, np.pi, (num_boxes, 1)), classes[:, None]
+        ], axis=1)
+    return gt_boxes
+
+
+def build_assigner(name, args, box_coder, batched):
+    if name == 'axis_aligned':
+        model_cfg = EasyDict({
+            'ANCHOR_GENERATOR_CONFIG': ANCHOR_GENERATOR_CONFIG,
+            'TARGET_ASSIGNER_CONFIG': {
+                'POS_FRACTION': -1.0, 'SAMPLE_SIZE': 512, 'NORM_BY_NUM_EXAMPLES': args.norm_by_num_examples,
+                'BATCHED_ASSIGN': batched,
+            },
+        })
+        return AxisAlignedTargetAssigner(model_cfg, CLASS_NAMES, box_coder, match_height=args.match_height)
+    elif name == 'atss':
+        # the IoUs are rotated BEV IoUs of the iou3d_nms kernels, both paths compare the same (anchor, box) pairs;
+        # --match_height goes through boxes_iou3d_gpu and needs a GPU
+        return ATSSTargetAssigner(topk=9, box_coder=box_coder, match_height=args.match_height, batched=batched)
+    raise NotImplementedError
+
+
+def compare_targets(ref, out):
+    """
+    Returns:
+        label_mismatch: number of anchors with other labels
+        max_diff: max difference of the regression targets and weights
+    """
+    label_mismatch = (ref['box_cls_labels'] != out['box_cls_labels']).sum().item()
+    max_diff = max(
+        (ref['box_reg_targets'] - out['box_reg_targets']).abs().max().item(),
+        (ref['reg_weights'] - out['reg_weights']).abs().max().item()
+    )
+    return label_mismatch, max_diff
+
+
+def main():
+    args = parse_config()
+    device = torch.device(args.device)
+    rng = np.random.default_rng(args.seed)
+
+    feature_map_size = [np.array(args.grid_size) // config['feature_map_stride'] for config in ANCHOR_GENERATOR_CONFIG]
+    anchors_list, _ = AnchorGenerator(
+        anchor_range=POINT_CLOUD_RANGE, anchor_generator_config=ANCHOR_GENERATOR_CONFIG
+    ).generate_anchors(feature_map_size)
+    anchors_list = [x.to(device) for x in anchors_list]
+    box_coder = box_coder_utils.ResidualCoder(code_size=7)
+    print('%d anchors in %d sets' % (sum([x.numel() // x.shape[-1] for x in anchors_list]), len(anchors_list)))
+
+    for name in args.assigners:
+        loop_assigner = build_assigner(name, args, box_coder, batched=False)
+        batch_assigner = build_assigner(name, args, box_coder, batched=True)
+        for batch_size in args.batch_sizes:
+            gt_boxes = torch.from_numpy(build_gt_boxes(batch_size, args.max_boxes, rng)).to(device)
+
+            ref, loop_latency = time_it(
+                lambda: loop_assigner.assign_targets(anchors_list, gt_boxes), args.repeat, device
+            )
+            out, batch_latency = time_it(
+                lambda: batch_assigner.assign_targets(anchors_list, gt_boxes), args.repeat, device
+            )
+            label_mismatch, max_diff = compare_targets(ref, out)
+            print('%-12s batch %2d: loop %9.2f ms, batched %9.2f ms, %d positives, '
+                  'label mismatches %d, max target diff %.3e' % (
+                      name, batch_size, loop_latency, batch_latency, (ref['box_cls_labels'] > 0).sum().item(),
+                      label_mismatch, max_diff
+                  ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+import argparse
+
+import numpy as np
+import torch
+from easydict import EasyDict
+
+from pcdet.models.dense_heads.target_assigner.center_assigner import CenterAssigner
+
+from benchmark_utils.benchmark_utils import time_it
+
+CLASS_NAMES = ['Vehicle', 'Pedestrian', 'Cyclist']
+# mean (l, w, h) of every class
+CLASS_SIZES = np.array([[4.7, 2.1, 1.7], [0.9, 0.9, 1.8], [1.8, 0.8, 1.8]])
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='latency of the CenterAssigner target generation')
+    parser.add_argument('--grid_size', type=int, nargs=3, default=[1504, 1504, 40], help='x y z voxels')
+    parser.add_argument('--voxel_size', type=float, nargs=3, default=[0.1, 0.1, 0.15], help='')
+    parser.add_argument('--point_cloud_range', type=float, nargs=6, default=[-75.2, -75.2, -2, 75.2, 75.2, 4],
+                        help='')
+    parser.add_argument('--out_size_factor', type=int, default=4, help='')
+    parser.add_argument('--num_boxes', type=int, default=250, help='max number of boxes of a sample')
+    parser.add_argument('--batch_size', type=int, default=4, help='')
+    parser.add_argument('--no_log', action='store_true', default=False, help='')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every assigner')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_gt_boxes(args, rng):
+    """
+    Crowded scenes, (B, M, 9 + cls) boxes with zero padded tails, some boxes are out of the point cloud range.
+    """
+    pc_range = np.array(args.point_cloud_range)
+    gt_boxes = np.zeros((args.batch_size, args.num_boxes, 10), dtype=np.float32)
+    for bs_idx in range(args.batch_size):
+        num_boxes = rng.integers(args.num_boxes // 2, args.num_boxes + 1)
+        classes = rng.integers(0, len(CLASS_NAMES), num_boxes)
+        sizes = CLASS_SIZES[classes] * rng.uniform(0.7, 1.5, (num_boxes, 3))
+        centers = rng.uniform(pc_range[0:3] - 2, pc_range[3:6] + 2, (num_boxes, 3))
+        heading = rng.uniform(-2 * np.pi, 2 * np.pi, (num_boxes, 1))
+        velocity = rng.normal(0, 5, (num_boxes, 2))
+        gt_boxes[bs_idx, :num_boxes] = np.concatenate(
+            [centers, sizes[:, [1, 0, 2]], heading, velocity, classes[:, None] + 1], axis=1
+        )
+    return torch.from_numpy(gt_boxes)
+
+
+def main():
+    args = parse_config()
+    rng = np.random.default_rng(args.seed)
+    assigner_cfg = EasyDict({
+        'tasks': [{'num_class': 1, 'class_names': [name]} for name in CLASS_NAMES],
+        'out_size_factor': args.out_size_factor,
+        'dense_reg': 1,
+        'gaussian_overlap': 0.1,
+        'max_objs': args.num_boxes,
+        'min_radius': 2,
+        'mapping': {name: idx + 1 for idx, name in enumerate(CLASS_NAMES)},
+    })
+    assigner = CenterAssigner(
+        assigner_cfg, num_classes=len(CLASS_NAMES), no_log=args.no_log, grid_size=np.array(args.grid_size),
+        pc_range=np.array(args.point_cloud_range), voxel_size=np.array(args.voxel_size)
+    )
+    gt_boxes = build_gt_boxes(args, rng)
+    print('%d boxes in %d samples' % ((gt_boxes[:, :, -1] > 0).sum().item(), args.batch_size))
+
+    targets_v1, latency_v1 = time_it(lambda: assigner.assign_targets_v1(gt_boxes), args.repeat)
+    targets_v3, latency_v3 = time_it(lambda: assigner.assign_targets_v3(gt_boxes), args.repeat)
+    print('assign_targets_v1 %8.2f ms' % latency_v1)
+    print('assign_targets_v3 %8.2f ms' % latency_v3)
+
+    for key in targets_v1:
+        for task_id in targets_v1[key]:
+            same = torch.equal(targets_v1[key][task_id], targets_v3[key][task_id])
+            print('    %-12s task %d: %s' % (key, task_id, 'identical' if same else 'DIFFERENT'))
+
+
+if __name__ == '__main__':
+    main()
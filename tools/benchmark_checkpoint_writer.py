@@ -0,0 +1,130 @@
+import argparse
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.nn as nn
+
+from train_utils.train_utils import CheckpointWriter, checkpoint_state, save_checkpoint, state_to_cpu
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(
+        description='training stall of the epoch checkpoints: synchronous save_checkpoint against CheckpointWriter, '
+                    'on a synthetic model and Adam state'
+    )
+    parser.add_argument('--param_mb', type=int, default=256, help='fp32 parameter size of the synthetic model')
+    parser.add_argument('--num_saves', type=int, default=3, help='checkpoints written by every path')
+    parser.add_argument('--epoch_time', type=float, default=2.0, help='seconds of "training" between two saves')
+    parser.add_argument('--save_dir', type=str, default=None, help='default: a temporary directory')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu', help='')
+    parser.add_argument('--tcp_port', type=int, default=18890, help='')
+    return parser.parse_args()
+
+
+def build_model_and_optimizer(param_mb, device):
+    """
+    Linear layers of 1024 x 1024 fp32 weights (4 MB each), Adam after one step holds two more copies of them
+    """
+    num_layers = max(param_mb // 4, 1)
+    model = nn.Sequential(*[nn.Linear(1024, 1024) for _ in range(num_layers)]).to(device)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    model(torch.randn(4, 1024, device=device)).sum().backward()
+    optimizer.step()
+    return model, optimizer
+
+
+def run_sync(model, optimizer, save_dir, args):
+    stalls = []
+    for epoch in range(1, args.num_saves + 1):
+        time.sleep(args.epoch_time)
+        start = time.perf_counter()
+        save_checkpoint(checkpoint_state(model, optimizer, epoch, epoch), filename=save_dir / ('sync_%d' % epoch))
+        stalls.append(time.perf_counter() - start)
+    return stalls
+
+
+def run_async(model, optimizer, save_dir, args, logger):
+    stalls = []
+    writer = CheckpointWriter(save_dir, max_ckpt_save_num=2, logger=logger)
+    for epoch in range(1, args.num_saves + 1):
+        time.sleep(args.epoch_time)
+        start = time.perf_counter()
+        state = checkpoint_state(model, optimizer, epoch, epoch, model_to_cpu=False)
+        writer.save(state, filename=save_dir / ('checkpoint_epoch_%d' % epoch))
+        stalls.append(time.perf_counter() - start)
+    writer.close()
+    return stalls
+
+
+def check_remove_error(save_dir):
+    """
+    An exception of remove_old_checkpoints is raised by the next wait() instead of killing the thread silently
+    """
+    class FailingWriter(CheckpointWriter):
+        def remove_old_checkpoints(self):
+            raise OSError('remove_old_checkpoints failed')
+
+    writer = FailingWriter(save_dir)
+    writer.save({'x': torch.zeros(4)}, filename=save_dir / 'checkpoint_epoch_error')
+    try:
+        writer.close()
+    except OSError as e:
+        return str(e)
+    return None
+
+
+def time_ddp_snapshot(model, optimizer, device, args):
+    """
+    Returns:
+        latencies: ms of checkpoint_state + state_to_cpu of a DDP model, with and without model_state_to_cpu
+    """
+    os.environ.setdefault('MASTER_ADDR', '127.0.0.1')
+    os.environ.setdefault('MASTER_PORT', str(args.tcp_port))
+    dist.init_process_group(backend='nccl' if device.type == 'cuda' else 'gloo', rank=0, world_size=1)
+    ddp_model = nn.parallel.DistributedDataParallel(model, device_ids=[device.index] if device.type == 'cuda' else None)
+    latencies = {}
+    for model_to_cpu in [True, False]:
+        runs = []
+        for _ in range(3):
+            if device.type == 'cuda':
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            state_to_cpu(checkpoint_state(ddp_model, optimizer, 0, 0, model_to_cpu=model_to_cpu))
+            runs.append(time.perf_counter() - start)
+        latencies[model_to_cpu] = np.median(runs) * 1000
+    dist.destroy_process_group()
+    return latencies
+
+
+def main():
+    args = parse_config()
+    device = torch.device(args.device)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s  %(message)s')
+    logger = logging.getLogger(__name__)
+
+    tmp_dir = tempfile.TemporaryDirectory() if args.save_dir is None else None
+    save_dir = Path(tmp_dir.name if tmp_dir is not None else args.save_dir)
+    model, optimizer = build_model_and_optimizer(args.param_mb, device)
+    num_bytes = sum([x.numel() * x.element_size() for x in checkpoint_state(model, optimizer)['model_state'].values()])
+    print('%d MB of parameters, %d MB of optimizer state, %s' % (num_bytes >> 20, 2 * num_bytes >> 20, device))
+
+    sync_stalls = run_sync(model, optimizer, save_dir, args)
+    async_stalls = run_async(model, optimizer, save_dir, args, logger)
+    print('training stall per checkpoint, sync save_checkpoint: %s s' % ', '.join(['%.2f' % x for x in sync_stalls]))
+    print('training stall per checkpoint, CheckpointWriter:     %s s' % ', '.join(['%.2f' % x for x in async_stalls]))
+    print('checkpoints kept: %s' % sorted([x.name for x in save_dir.glob('checkpoint_epoch_*.pth')]))
+    print('remove_old_checkpoints error raised by wait(): %s' % check_remove_error(save_dir))
+
+    latencies = time_ddp_snapshot(model, optimizer, device, args)
+    print('DDP snapshot to CPU: model_state_to_cpu + state_to_cpu %.1f ms, state_to_cpu only %.1f ms' % (
+        latencies[True], latencies[False]))
+
+
+if __name__ == '__main__':
+    main()
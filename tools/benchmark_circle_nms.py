@@ -0,0 +1,82 @@
+import argparse
+
+import numpy as np
+import torch
+
+from pcdet.models.model_utils import model_nms_utils
+
+from benchmark_utils.benchmark_utils import time_it
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='per-sample numba circle NMS against the batched circle NMS')
+    parser.add_argument('--batch_size', type=int, default=4, help='')
+    parser.add_argument('--num_boxes', type=int, nargs='+', default=[500, 1000, 2000, 4000], help='K per sample')
+    parser.add_argument('--min_radius', type=float, default=0.175, help='squared center distance threshold')
+    parser.add_argument('--post_max_size', type=int, default=500, help='')
+    parser.add_argument('--score_levels', type=int, default=20,
+                        help='the tie case rounds the scores down to this many levels, 0 skips it')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu', help='')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs of each method')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_detections(batch_size, num_boxes, rng, device, score_levels=None):
+    """
+    topk-like detections: clusters of nearby centers around objects plus scattered false positives, with
+    score_levels the scores are rounded down to that many values and many of them are tied
+    """
+    num_objects = max(num_boxes // 20, 1)
+    objects = rng.uniform(-75, 75, (batch_size, num_objects, 2))
+    object_ids = rng.integers(0, num_objects, (batch_size, num_boxes))
+    centers = np.take_along_axis(objects, object_ids[..., None], axis=1) + rng.normal(0, 0.4, (batch_size, num_boxes, 2))
+    scores = rng.random((batch_size, num_boxes))
+    if score_levels is not None:
+        scores = np.floor(scores * score_levels) / score_levels
+    valid_mask = scores > 0.1
+    return (torch.from_numpy(centers).float().to(device), torch.from_numpy(scores).float().to(device),
+            torch.from_numpy(valid_mask).to(device))
+
+
+def numba_circle_nms(centers, scores, valid_mask, min_radius, post_max_size):
+    selected = []
+    for i in range(scores.shape[0]):
+        inds = torch.nonzero(valid_mask[i]).view(-1)
+        boxes = torch.cat([centers[i, inds], scores[i, inds].view(-1, 1)], dim=1)
+        selected.append(inds[model_nms_utils.circle_nms_keep(boxes, min_radius, post_max_size=post_max_size)])
+    return selected
+
+
+def batched_circle_nms(centers, scores, valid_mask, min_radius, post_max_size):
+    order, keep = model_nms_utils.batched_circle_nms(
+        centers, scores, thresh=min_radius, valid_mask=valid_mask, post_max_size=post_max_size
+    )
+    return [order[i, keep[i]] for i in range(scores.shape[0])]
+
+
+def main():
+    args = parse_config()
+    device = torch.device(args.device)
+    rng = np.random.default_rng(args.seed)
+
+    print('batch size %d on %s' % (args.batch_size, device))
+    print('%6s %8s %12s %12s %10s %10s' % ('K', 'scores', 'numba (ms)', 'batched (ms)', 'kept', 'mismatch'))
+    score_levels_list = [None] + ([args.score_levels] if args.score_levels > 0 else [])
+    for num_boxes in args.num_boxes:
+        for score_levels in score_levels_list:
+            centers, scores, valid_mask = build_detections(args.batch_size, num_boxes, rng, device, score_levels)
+            inputs = (centers, scores, valid_mask, args.min_radius, args.post_max_size)
+            numba_selected, numba_ms = time_it(lambda: numba_circle_nms(*inputs), args.repeat, device)
+            batched_selected, batched_ms = time_it(lambda: batched_circle_nms(*inputs), args.repeat, device)
+
+            num_mismatch = sum([int(not torch.equal(a.cpu(), b.cpu()))
+                                for a, b in zip(numba_selected, batched_selected)])
+            num_kept = sum([len(a) for a in numba_selected])
+            print('%6d %8s %12.2f %12.2f %10d %10d' % (
+                num_boxes, 'tied' if score_levels is not None else 'random', numba_ms, batched_ms, num_kept,
+                num_mismatch
+            ))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+import argparse
+import copy
+import os
+import time
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+import torch.nn as nn
+import tqdm
+from easydict import EasyDict
+
+from pcdet.models import model_fn_decorator
+from train_utils.train_utils import exclude_unused_parameters, train_one_epoch
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(
+        description='2-process gloo check of static-graph DDP against find_unused_parameters DDP and one process'
+    )
+    parser.add_argument('--world_size', type=int, default=2, help='')
+    parser.add_argument('--batch_size', type=int, default=8, help='samples per rank and micro-batch')
+    parser.add_argument('--num_iters', type=int, default=7, help='micro-batches per rank')
+    parser.add_argument('--grad_accum_steps', type=int, default=3, help='')
+    parser.add_argument('--tcp_port', type=int, default=18888, help='')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+class ToyDetector(nn.Module):
+    """
+    a trunk and a loss head plus an auxiliary head that never feeds the loss, like the heads that are
+    excluded from DDP by exclude_unused_parameters; returns ret_dict, tb_dict, disp_dict like the detectors, so the
+    runs go through model_fn_decorator and load_data_to_gpu
+    """
+    def __init__(self):
+        super().__init__()
+        self.trunk = nn.Sequential(nn.Linear(16, 32), nn.ReLU(), nn.Linear(32, 32), nn.ReLU())
+        self.head = nn.Linear(32, 4)
+        self.aux_head = nn.Linear(32, 4)
+        self.register_buffer('global_step', torch.LongTensor(1).zero_())
+
+    def update_global_step(self):
+        self.global_step += 1
+
+    def set_cur_epoch(self, epoch):
+        pass
+
+    def forward(self, batch_dict):
+        pred = self.head(self.trunk(batch_dict['points']))
+        loss = ((pred - batch_dict['targets']) ** 2).mean()
+        return {'loss': loss}, {'loss_reg': loss.item()}, {}
+
+
+class RecordingScheduler(object):
+    def __init__(self):
+        self.steps = []
+
+    def step(self, it):
+        self.steps.append(it)
+
+
+def build_batches(args, num_ranks):
+    """
+    the same global micro-batches for every mode, split into num_ranks equal shards of numpy arrays like the
+    collated batches of the datasets
+    """
+    rng = np.random.default_rng(args.seed)
+    global_batches = [
+        {'points': rng.standard_normal((args.batch_size * args.world_size, 16)).astype(np.float32),
+         'targets': rng.standard_normal((args.batch_size * args.world_size, 4)).astype(np.float32)}
+        for _ in range(args.num_iters)
+    ]
+    return [[{key: np.split(val, num_ranks)[rank] for key, val in batch.items()} for batch in global_batches]
+            for rank in range(num_ranks)]
+
+
+def run_mode(model, batches, args, rank, optim_cfg):
+    optimizer = torch.optim.SGD(model.parameters(), lr=0.1, momentum=0.9)
+    scheduler = RecordingScheduler()
+    with tqdm.tqdm(disable=True) as tbar:
+        start = time.perf_counter()
+        accumulated_iter = train_one_epoch(
+            model, optimizer, batches, model_fn_decorator(), lr_scheduler=scheduler, accumulated_iter=0,
+            optim_cfg=optim_cfg, rank=rank + 1, tbar=tbar, total_it_each_epoch=len(batches),
+            dataloader_iter=iter(batches)
+        )
+        elapsed = time.perf_counter() - start
+    module = model.module if isinstance(model, nn.parallel.DistributedDataParallel) else model
+    state = {key: val.numpy().copy() for key, val in module.state_dict().items()}
+    return state, accumulated_iter, scheduler.steps, elapsed * 1000 / len(batches)
+
+
+def worker(rank, args, init_state, queue):
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(args.tcp_port)
+    dist.init_process_group(backend='gloo', rank=rank, world_size=args.world_size)
+    optim_cfg = EasyDict({'GRAD_NORM_CLIP': 10, 'GRAD_ACCUM_STEPS': args.grad_accum_steps})
+    batches = build_batches(args, args.world_size)[rank]
+
+    model = ToyDetector()
+    model.load_state_dict(init_state)
+    dynamic = nn.parallel.DistributedDataParallel(model, device_ids=None, find_unused_parameters=True)
+    results = {'dynamic': run_mode(dynamic, batches, args, rank, optim_cfg)}
+
+    model = ToyDetector()
+    model.load_state_dict(init_state)
+    init_buffers = {name: buf.clone() for name, buf in model.named_buffers()}
+    unused_names = exclude_unused_parameters(model, model_fn_decorator(), copy.deepcopy(batches[0]))
+    # model_fn_decorator counts the probe in global_step, exclude_unused_parameters has to undo it
+    changed_buffers = [name for name, buf in model.named_buffers() if not torch.equal(buf, init_buffers[name])]
+    static = nn.parallel.DistributedDataParallel(
+        model, device_ids=None, find_unused_parameters=False, static_graph=True
+    )
+    results['static'] = run_mode(static, batches, args, rank, optim_cfg)
+    if rank == 0:
+        queue.put((results, unused_names, changed_buffers))
+    dist.destroy_process_group()
+
+
+def max_diff(state_a, state_b):
+    return max([np.abs(state_a[key].astype(np.float64) - state_b[key]).max() for key in state_a])
+
+
+def main():
+    args = parse_config()
+    torch.manual_seed(args.seed)
+    init_state = copy.deepcopy(ToyDetector().state_dict())
+
+    # single-process reference: the shards of all ranks in one micro-batch
+    model = ToyDetector()
+    model.load_state_dict(init_state)
+    optim_cfg = EasyDict({'GRAD_NORM_CLIP': 10, 'GRAD_ACCUM_STEPS': args.grad_accum_steps})
+    reference = run_mode(model, build_batches(args, 1)[0], args, 0, optim_cfg)
+
+    ctx = mp.get_context('spawn')
+    queue = ctx.SimpleQueue()
+    mp.spawn(worker, args=(args, init_state, queue), nprocs=args.world_size, join=True)
+    results, unused_names, changed_buffers = queue.get()
+
+    print('%d gloo ranks on CPU, %d micro-batches of %d per rank, GRAD_ACCUM_STEPS %d'
+          % (args.world_size, args.num_iters, args.batch_size, args.grad_accum_steps))
+    print('excluded from static DDP: %s, buffers changed by the probe: %s' % (unused_names, changed_buffers))
+    print('%10s %14s %22s %16s %12s' % ('mode', 'optim steps', 'scheduler steps', 'max diff (ref)', 'ms / iter'))
+    for name, (state, num_steps, scheduler_steps, ms) in [('reference', reference), ('dynamic', results['dynamic']),
+                                                          ('static', results['static'])]:
+        print('%10s %14d %22s %16.2e %12.2f' % (name, num_steps, scheduler_steps, max_diff(state, reference[0]), ms))
+    print('static vs dynamic max diff: %.2e' % max_diff(results['static'][0], results['dynamic'][0]))
+
+
+if __name__ == '__main__':
+    main()
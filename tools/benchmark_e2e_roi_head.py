@@ -0,0 +1,122 @@
+import argparse
+
+import numpy as np
+import torch
+from easydict import EasyDict
+
+from pcdet.models.roi_heads.e2e_roi_head import E2EROIHead
+from pcdet.utils import box_utils, common_utils
+
+from benchmark_utils.benchmark_utils import time_it
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='profile of E2EROIHead with the closed-form local queries')
+    parser.add_argument('--num_rois', type=int, default=300, help='ROIs of every sample')
+    parser.add_argument('--num_points', type=int, default=60000, help='points of a synthetic scan')
+    parser.add_argument('--num_class', type=int, default=3, help='')
+    parser.add_argument('--batch_size', type=int, default=2, help='')
+    parser.add_argument('--device', type=str, default='cpu', help='')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs of every step')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_head_cfg():
+    code_weights = [1.0] * 7
+    return EasyDict({
+        'BOX_EXTRA_WIDTH': 0.5,
+        'CODER_CONFIG': {'BOX_CODER': 'ResidualCoder', 'BOX_CODER_CONFIG': {}},
+        'MATCHER_CONFIG': {
+            'losses': ['loss_ce', 'loss_bbox'], 'weight_dict': {'loss_ce': 1.0, 'loss_bbox': 1.0},
+            'use_focal_loss': True, 'code_weights': code_weights,
+        },
+        'SET_CRIT_CONFIG': {
+            'losses': ['loss_ce', 'loss_bbox'], 'weight_dict': {'loss_ce': 1.0, 'loss_bbox': 1.0}, 'sigma': 3.0,
+            'use_focal_loss': True, 'code_weights': code_weights,
+        },
+        'TEST_CONFIG': {'k': 100, 'use_nms': False, 'thresh': 0.0},
+    })
+
+
+def ref_get_roi_ref_points(batch_dict):
+    """
+    The reference: world corners of the rois, transformed back into the local frames
+    """
+    rois = batch_dict['rois']
+    bs, m, _ = rois.shape
+    roi_center = rois[:, :, 0:3].view(bs, m, 1, 3).contiguous()
+    roi_corners = box_utils.boxes_to_corners_3d(rois.view(bs * m, -1)[:, :7].contiguous()).view(bs, m, 8, 3)
+    roi_queries = torch.cat([roi_corners, roi_center], dim=2).contiguous()
+    return ref_to_local_coords(roi_queries, roi_center, rois[..., 6])
+
+
+def ref_to_local_coords(points, ref_point, angle):
+    tmp = points - ref_point
+    b, m, p, _ = tmp.shape
+    return common_utils.rotate_points_along_z(tmp.view(b * m, p, -1), -angle.view(-1)).view(b, m, p, -1)
+
+
+def build_batch(args, rng, device):
+    points = rng.uniform([-75, -75, -2], [75, 75, 4], (args.num_points, 3))
+    rois = np.concatenate([
+        rng.uniform(-70, 70, (args.batch_size, args.num_rois, 2)),
+        rng.uniform(-1, 1, (args.batch_size, args.num_rois, 1)),
+        rng.uniform(0.5, 5, (args.batch_size, args.num_rois, 3)),
+        rng.uniform(-np.pi, np.pi, (args.batch_size, args.num_rois, 1))
+    ], axis=-1)
+    batch_points = np.concatenate([
+        rng.integers(0, args.batch_size, (args.num_points, 1)), points, rng.random((args.num_points, 2))
+    ], axis=1)
+    scores = rng.random((args.batch_size, args.num_rois, args.num_class))
+    return {
+        'batch_size': args.batch_size,
+        'points': torch.from_numpy(batch_points).float().to(device),
+        'batch_box_preds': torch.from_numpy(rois).float().to(device),
+        'batch_cls_preds': torch.from_numpy(scores).float().to(device),
+    }
+
+
+def main():
+    args = parse_config()
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+
+    head = E2EROIHead(input_channels=64, model_cfg=build_head_cfg(), point_cloud_range=None, voxel_size=None,
+                      num_class=args.num_class).to(device)
+    head.eval()
+    batch_dict = head.pre_process(build_batch(args, rng, device))
+    rois = batch_dict['rois']
+    roi_center = rois[:, :, 0:3].unsqueeze(dim=2)
+    pooled_points = roi_center + torch.randn(rois.shape[0], rois.shape[1], 256, 3, device=device)
+
+    ref, latency = time_it(lambda: ref_get_roi_ref_points(batch_dict), args.repeat, device)
+    print('ref points, world corners + rotation  %8.3f ms' % latency)
+    out, latency = time_it(lambda: head.get_roi_ref_points(batch_dict), args.repeat, device)
+    print('ref points, closed form               %8.3f ms, max diff %.3e' % (latency, (out - ref).abs().max().item()))
+
+    ref, latency = time_it(lambda: ref_to_local_coords(pooled_points, roi_center, rois[..., 6]), args.repeat, device)
+    print('pooled points, rotate_points_along_z  %8.3f ms' % latency)
+    out, latency = time_it(lambda: head.to_local_coords(pooled_points, roi_center, rois[..., 6]), args.repeat, device)
+    print('pooled points, batched 2x2 rotation   %8.3f ms, max diff %.3e' % (latency, (out - ref).abs().max().item()))
+
+    def forward():
+        with torch.no_grad():
+            head.forward(dict(batch_dict))
+            return head.forward_ret_dict['pred_dicts']['pred_boxes']
+
+    head.get_roi_ref_points, head.to_local_coords = ref_get_roi_ref_points, ref_to_local_coords
+    ref, latency = time_it(forward, args.repeat, device)
+    print('head forward, reference transforms    %8.3f ms' % latency)
+    del head.get_roi_ref_points, head.to_local_coords
+    out, latency = time_it(forward, args.repeat, device)
+    print('head forward                          %8.3f ms, max diff %.3e' % (latency, (out - ref).abs().max().item()))
+
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU]) as prof:
+        forward()
+    print(prof.key_averages().table(sort_by='self_cpu_time_total', row_limit=15))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import pickle
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from easydict import EasyDict
+
+from pcdet.datasets.augmentor.database_sampler import DataBaseSampler
+
+CLASS_NAMES = ['Vehicle', 'Pedestrian', 'Cyclist']
+MEAN_SIZES = {'Vehicle': [4.7, 2.1, 1.7], 'Pedestrian': [0.9, 0.86, 1.71], 'Cyclist': [1.78, 0.84, 1.78]}
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(
+        description='per-frame cost of the GT sampling with one BEV IoU call over all the sampled boxes'
+    )
+    parser.add_argument('--root_path', type=str, default=None, help='dataset root of a real database')
+    parser.add_argument('--db_info_path', type=str, default=None, help='dbinfos pickle, relative to root_path')
+    parser.add_argument('--sample_groups', type=str, nargs='+',
+                        default=['Vehicle:15', 'Pedestrian:10', 'Cyclist:10'], help='')
+    parser.add_argument('--db_size', type=int, default=20000, help='objects of every class of a synthetic database')
+    parser.add_argument('--num_frames', type=int, default=200, help='')
+    parser.add_argument('--max_gt', type=int, default=40, help='boxes of the most crowded synthetic frame')
+    parser.add_argument('--limit_whole_scene', action='store_true', default=False, help='')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def random_boxes(class_names, rng):
+    sizes = np.array([MEAN_SIZES[x] for x in class_names]).reshape(-1, 3) * rng.uniform(0.8, 1.2, (len(class_names), 3))
+    return np.concatenate([
+        rng.uniform([-70, -70, -1], [70, 70, 1], (len(class_names), 3)), sizes,
+        rng.uniform(-np.pi, np.pi, (len(class_names), 1))
+    ], axis=1).astype(np.float32)
+
+
+def build_db_infos(db_size, rng):
+    db_infos = {}
+    for class_name in CLASS_NAMES:
+        boxes = random_boxes([class_name] * db_size, rng)
+        db_infos[class_name] = [{
+            'name': class_name, 'path': 'gt_database/%s_%d.bin' % (class_name, k), 'box3d_lidar': box,
+            'num_points_in_gt': int(rng.integers(1, 500)), 'difficulty': 0
+        } for k, box in enumerate(boxes)]
+    return db_infos
+
+
+def build_frames(num_frames, max_gt, rng):
+    frames = []
+    for _ in range(num_frames):
+        gt_names = np.array(CLASS_NAMES)[rng.integers(0, len(CLASS_NAMES), rng.integers(0, max_gt + 1))]
+        frames.append({'gt_boxes': random_boxes(gt_names, rng), 'gt_names': gt_names})
+    return frames
+
+
+def run_sampler(sampler, frames, seed, pooled):
+    np.random.seed(seed)
+    latencies, outputs = [], []
+    for frame in frames:
+        data_dict = {'gt_boxes': frame['gt_boxes'], 'gt_names': frame['gt_names']}
+        start = time.perf_counter()
+        sampled_boxes, sampled_dicts = sampler.sample_boxes_pooled(data_dict) if pooled \
+            else sampler.sample_boxes(data_dict)
+        latencies.append(time.perf_counter() - start)
+        outputs.append((sampled_boxes, [x['path'] for x in sampled_dicts], [x['name'] for x in sampled_dicts]))
+    return outputs, latencies
+
+
+def main():
+    args = parse_config()
+    rng = np.random.default_rng(args.seed)
+
+    if args.root_path is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        root_path, db_info_path = Path(tmp_dir.name), 'dbinfos_synthetic.pkl'
+        with open(root_path / db_info_path, 'wb') as f:
+            pickle.dump(build_db_infos(args.db_size, rng), f)
+    else:
+        root_path, db_info_path = Path(args.root_path), args.db_info_path
+
+    sampler_cfg = EasyDict({
+        'DB_INFO_PATH': [db_info_path], 'PREPARE': {'filter_by_min_points': ['%s:5' % x for x in CLASS_NAMES]},
+        'SAMPLE_GROUPS': args.sample_groups, 'NUM_POINT_FEATURES': 5, 'REMOVE_EXTRA_WIDTH': [0.0, 0.0, 0.0],
+        'LIMIT_WHOLE_SCENE': args.limit_whole_scene,
+    })
+    frames = build_frames(args.num_frames, args.max_gt, rng)
+    samplers = {}
+    for pooled in [False, True]:
+        start = time.perf_counter()
+        samplers[pooled] = DataBaseSampler(
+            root_path=root_path, sampler_cfg=EasyDict({**sampler_cfg, 'POOLED_SAMPLING': pooled}),
+            class_names=CLASS_NAMES
+        )
+        print('POOLED_SAMPLING=%-5s init %8.1f ms' % (pooled, (time.perf_counter() - start) * 1000))
+
+    ref, ref_latencies = run_sampler(samplers[False], frames, args.seed, pooled=False)
+    out, out_latencies = run_sampler(samplers[True], frames, args.seed, pooled=True)
+
+    num_same = sum([ref_paths == out_paths and np.array_equal(ref_boxes, out_boxes)
+                    for (ref_boxes, ref_paths, _), (out_boxes, out_paths, _) in zip(ref, out)])
+    for name, outputs, latencies in [('loop', ref, ref_latencies), ('pooled', out, out_latencies)]:
+        names = np.array([x for _, _, class_names in outputs for x in class_names])
+        print('%-6s %7.3f ms/frame (p90 %7.3f), sampled per frame: ' % (
+            name, np.median(latencies) * 1000, np.percentile(latencies, 90) * 1000
+        ) + ', '.join(['%s %.2f' % (x, np.sum(names == x) / len(frames)) for x in CLASS_NAMES]))
+    print('identical sampled boxes in %d / %d frames' % (num_same, len(frames)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+import argparse
+
+import numpy as np
+import torch
+
+from pcdet.ops.iou3d_nms import iou3d_nms_utils
+
+from benchmark_utils.benchmark_utils import time_it
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(
+        description='CPU rotated NMS / 3D IoU of iou3d_nms: timing on 1k-10k boxes and parity against a Python '
+                    'reference (and the CUDA kernels when there is a GPU)'
+    )
+    parser.add_argument('--num_boxes', type=int, nargs='+', default=[1000, 2000, 5000, 10000], help='')
+    parser.add_argument('--num_gt', type=int, default=200, help='boxes_b of the timed boxes_iou3d_gpu')
+    parser.add_argument('--parity_boxes', type=int, default=1000, help='boxes of the parity check')
+    parser.add_argument('--nms_thresh', type=float, default=0.1, help='')
+    parser.add_argument('--num_threads', type=int, nargs='+', default=[1, torch.get_num_threads()], help='')
+    parser.add_argument('--repeat', type=int, default=3, help='timed runs of each method')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_boxes(num_boxes, rng):
+    """
+    proposal-like boxes: clusters of jittered boxes around objects plus scattered false positives
+
+    Returns:
+        boxes: (N, 7) [x, y, z, dx, dy, dz, heading], float32
+        scores: (N), float32
+    """
+    num_objects = max(num_boxes // 10, 1)
+    objects = np.concatenate([
+        rng.uniform(-75, 75, (num_objects, 2)), rng.uniform(-1, 1, (num_objects, 1)),
+        rng.uniform([3.5, 1.6, 1.4], [5.0, 2.2, 2.0], (num_objects, 3)), rng.uniform(-np.pi, np.pi, (num_objects, 1))
+    ], axis=1)
+    boxes = objects[rng.integers(0, num_objects, num_boxes)]
+    boxes = boxes + rng.normal(0, 1, boxes.shape) * np.array([0.4, 0.4, 0.1, 0.2, 0.1, 0.1, 0.2])
+    boxes[:, 3:6] = np.abs(boxes[:, 3:6]) + 0.1
+    scores = rng.random(num_boxes)
+    return torch.from_numpy(boxes).float(), torch.from_numpy(scores).float()
+
+
+def box_corners_bev(box):
+    cos_a, sin_a = np.cos(box[6]), np.sin(box[6])
+    corners = np.array([[-1, -1], [1, -1], [1, 1], [-1, 1]], dtype=np.float64) * box[3:5] / 2
+    return corners @ np.array([[cos_a, sin_a], [-sin_a, cos_a]]) + box[0:2]
+
+
+def clip_polygon(subject, clip):
+    """
+    Sutherland-Hodgman clipping of a polygon by a convex counter-clockwise polygon
+    """
+    output = subject
+    for k in range(len(clip)):
+        edge_start, edge_end = clip[k], clip[(k + 1) % len(clip)]
+        edge = edge_end - edge_start
+        inputs, output = output, []
+        if len(inputs) == 0:
+            break
+        for i in range(len(inputs)):
+            cur, prev = inputs[i], inputs[i - 1]
+            cur_in = edge[0] * (cur[1] - edge_start[1]) - edge[1] * (cur[0] - edge_start[0]) >= 0
+            prev_in = edge[0] * (prev[1] - edge_start[1]) - edge[1] * (prev[0] - edge_start[0]) >= 0
+            if cur_in != prev_in:
+                direction = cur - prev
+                denom = edge[0] * direction[1] - edge[1] * direction[0]
+                t = (edge[1] * (prev[0] - edge_start[0]) - edge[0] * (prev[1] - edge_start[1])) / denom
+                output.append(prev + t * direction)
+            if cur_in:
+                output.append(cur)
+    return output
+
+
+def polygon_area(polygon):
+    if len(polygon) < 3:
+        return 0.0
+    polygon = np.array(polygon)
+    x, y = polygon[:, 0], polygon[:, 1]
+    return 0.5 * abs(np.dot(x, np.roll(y, -1)) - np.dot(y, np.roll(x, -1)))
+
+
+def overlap_bev_reference(boxes_a, boxes_b):
+    """
+    float64 Python reference of boxes_overlap_bev, pairs whose circumscribed circles do not meet are skipped
+    """
+    boxes_a, boxes_b = boxes_a.double().numpy(), boxes_b.double().numpy()
+    radius_a = np.linalg.norm(boxes_a[:, 3:5], axis=1) / 2
+    radius_b = np.linalg.norm(boxes_b[:, 3:5], axis=1) / 2
+    center_dist = np.linalg.norm(boxes_a[:, None, 0:2] - boxes_b[None, :, 0:2], axis=2)
+    overlaps = np.zeros((len(boxes_a), len(boxes_b)))
+    corners_b = [box_corners_bev(box) for box in boxes_b]
+    for i, j in zip(*np.nonzero(center_dist < radius_a[:, None] + radius_b[None, :])):
+        overlaps[i, j] = polygon_area(clip_polygon(list(box_corners_bev(boxes_a[i])), corners_b[j]))
+    return overlaps
+
+
+def iou_bev_reference(boxes_a, boxes_b):
+    overlaps = overlap_bev_reference(boxes_a, boxes_b)
+    area_a = (boxes_a[:, 3] * boxes_a[:, 4]).double().numpy()
+    area_b = (boxes_b[:, 3] * boxes_b[:, 4]).double().numpy()
+    return overlaps / np.maximum(area_a[:, None] + area_b[None, :] - overlaps, 1e-8)
+
+
+def iou3d_reference(boxes_a, boxes_b):
+    overlaps_bev = overlap_bev_reference(boxes_a, boxes_b)
+    boxes_a, boxes_b = boxes_a.double().numpy(), boxes_b.double().numpy()
+    max_of_min = np.maximum((boxes_a[:, 2] - boxes_a[:, 5] / 2)[:, None], (boxes_b[:, 2] - boxes_b[:, 5] / 2)[None])
+    min_of_max = np.minimum((boxes_a[:, 2] + boxes_a[:, 5] / 2)[:, None], (boxes_b[:, 2] + boxes_b[:, 5] / 2)[None])
+    overlaps_3d = overlaps_bev * np.clip(min_of_max - max_of_min, 0, None)
+    vol_a = np.prod(boxes_a[:, 3:6], axis=1)[:, None]
+    vol_b = np.prod(boxes_b[:, 3:6], axis=1)[None, :]
+    return overlaps_3d / np.maximum(vol_a + vol_b - overlaps_3d, 1e-6)
+
+
+def iou_normal_reference(boxes_a, boxes_b):
+    boxes_a, boxes_b = boxes_a.double().numpy(), boxes_b.double().numpy()
+    min_a, max_a = boxes_a[:, None, 0:2] - boxes_a[:, None, 3:5] / 2, boxes_a[:, None, 0:2] + boxes_a[:, None, 3:5] / 2
+    min_b, max_b = boxes_b[None, :, 0:2] - boxes_b[None, :, 3:5] / 2, boxes_b[None, :, 0:2] + boxes_b[None, :, 3:5] / 2
+    overlaps = np.prod(np.clip(np.minimum(max_a, max_b) - np.maximum(min_a, min_b), 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 3:5], axis=1)[:, None]
+    area_b = np.prod(boxes_b[:, 3:5], axis=1)[None, :]
+    return overlaps / np.maximum(area_a + area_b - overlaps, 1e-8)
+
+
+def corner_in_margin(box_a, box_b, margin=1e-2):
+    """
+    a corner of one box within margin outside the other one, check_in_box2d of the CPU and CUDA kernels counts it
+    as inside, which is the known deviation of the kernels from the exact overlap
+    """
+    for box, other in [(box_a, box_b), (box_b, box_a)]:
+        cos_a, sin_a = np.cos(-other[6]), np.sin(-other[6])
+        offsets = box_corners_bev(box) - other[0:2]
+        rot_x = offsets[:, 0] * cos_a - offsets[:, 1] * sin_a
+        rot_y = offsets[:, 0] * sin_a + offsets[:, 1] * cos_a
+        outside = (np.abs(rot_x) >= other[3] / 2) | (np.abs(rot_y) >= other[4] / 2)
+        in_margin = (np.abs(rot_x) < other[3] / 2 + margin) & (np.abs(rot_y) < other[4] / 2 + margin)
+        if (outside & in_margin).any():
+            return True
+    return False
+
+
+def nms_reference(boxes, scores, thresh, iou_func):
+    order = scores.sort(0, descending=True)[1]
+    iou = iou_func(boxes[order], boxes[order])
+    suppressed = np.zeros(len(order), dtype=bool)
+    keep = []
+    for i in range(len(order)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= iou[i] > thresh
+    return order[keep]
+
+
+def check_parity(args, rng):
+    boxes, scores = build_boxes(args.parity_boxes, rng)
+    gt_boxes = boxes[rng.permutation(len(boxes))[:args.num_gt]]
+
+    print('parity on %d boxes (and %d gt boxes) against the float64 Python reference' % (len(boxes), len(gt_boxes)))
+    results = {
+        'boxes_iou_bev': (iou3d_nms_utils.boxes_iou_bev(boxes, gt_boxes), iou_bev_reference(boxes, gt_boxes)),
+        'boxes_iou3d_gpu': (iou3d_nms_utils.boxes_iou3d_gpu(boxes, gt_boxes), iou3d_reference(boxes, gt_boxes)),
+    }
+    print('%22s %14s %12s %12s' % ('op', 'max abs diff', '> 1e-4', 'not margin'))
+    for name, (cpu_out, ref_out) in results.items():
+        diff = np.abs(cpu_out.double().numpy() - ref_out)
+        deviating = np.nonzero(diff > 1e-4)
+        num_unexplained = sum([int(not corner_in_margin(boxes[i].double().numpy(), gt_boxes[j].double().numpy()))
+                               for i, j in zip(*deviating)])
+        print('%22s %14.2e %12d %12d' % (name, diff.max(), len(deviating[0]), num_unexplained))
+
+    nms_results = {
+        'nms_gpu': (iou3d_nms_utils.nms_gpu, iou_bev_reference),
+        'nms_normal_gpu': (iou3d_nms_utils.nms_normal_gpu, iou_normal_reference),
+    }
+    for name, (nms_func, iou_func) in nms_results.items():
+        keep = nms_func(boxes, scores, args.nms_thresh)[0]
+        ref_keep = nms_reference(boxes, scores, args.nms_thresh, iou_func)
+        num_mismatch = len(set(keep.tolist()) ^ set(ref_keep.tolist()))
+        print('%22s %14s %12s' % (name, 'mismatch', '%d / %d' % (num_mismatch, len(ref_keep))))
+
+    if torch.cuda.is_available():
+        print('CPU against the CUDA kernels')
+        boxes_gpu, scores_gpu, gt_boxes_gpu = boxes.cuda(), scores.cuda(), gt_boxes.cuda()
+        for name in ['boxes_iou_bev', 'boxes_iou3d_gpu']:
+            gpu_out = getattr(iou3d_nms_utils, name)(boxes_gpu, gt_boxes_gpu).cpu()
+            print('%22s %14.2e' % (name, (gpu_out - results[name][0]).abs().max().item()))
+        for name in ['nms_gpu', 'nms_normal_gpu']:
+            keep = getattr(iou3d_nms_utils, name)(boxes, scores, args.nms_thresh)[0]
+            gpu_keep = getattr(iou3d_nms_utils, name)(boxes_gpu, scores_gpu, args.nms_thresh)[0].cpu()
+            num_mismatch = len(set(keep.tolist()) ^ set(gpu_keep.tolist()))
+            print('%22s %14s %12s' % (name, 'mismatch', '%d / %d' % (num_mismatch, len(gpu_keep))))
+
+
+def main():
+    args = parse_config()
+    rng = np.random.default_rng(args.seed)
+    device = torch.device('cpu')
+    check_parity(args, rng)
+
+    print('CPU timing, boxes_iou3d_gpu against %d gt boxes' % args.num_gt)
+    print('%8s %8s %14s %18s %18s %8s' % ('boxes', 'threads', 'nms_gpu (ms)', 'nms_normal (ms)', 'iou3d (ms)', 'kept'))
+    default_threads = torch.get_num_threads()
+    for num_boxes in args.num_boxes:
+        boxes, scores = build_boxes(num_boxes, rng)
+        gt_boxes = boxes[rng.permutation(num_boxes)[:args.num_gt]]
+        for num_threads in sorted(set(args.num_threads)):
+            torch.set_num_threads(num_threads)
+            (keep, _), nms_ms = time_it(
+                lambda: iou3d_nms_utils.nms_gpu(boxes, scores, args.nms_thresh), args.repeat, device
+            )
+            _, nms_normal_ms = time_it(
+                lambda: iou3d_nms_utils.nms_normal_gpu(boxes, scores, args.nms_thresh), args.repeat, device
+            )
+            _, iou3d_ms = time_it(lambda: iou3d_nms_utils.boxes_iou3d_gpu(boxes, gt_boxes), args.repeat, device)
+            print('%8d %8d %14.1f %18.1f %18.1f %8d' % (num_boxes, num_threads, nms_ms, nms_normal_ms, iou3d_ms,
+                                                        len(keep)))
+    torch.set_num_threads(default_threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import argparse
+
+import numpy as np
+import torch
+from easydict import EasyDict
+
+from pcdet.config import cfg, cfg_from_list, cfg_from_yaml_file
+from pcdet.datasets import build_dataloader
+from pcdet.models import build_network, load_data_to_gpu
+from pcdet.utils import common_utils
+from train_utils.optimizations import build_optimizer
+from train_utils.semi_utils import MeanTeacher
+from benchmark_utils.benchmark_utils import time_it
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='per-step overhead of the mean teacher against a supervised step')
+    parser.add_argument('--cfg_file', type=str, default='cfgs/waymo_p2s.yaml', help='model config')
+    parser.add_argument('--batch_size', type=int, default=2, help='')
+    parser.add_argument('--workers', type=int, default=0, help='')
+    parser.add_argument('--num_preds', type=int, default=500, help='teacher predictions per sample')
+    parser.add_argument('--device', type=str, default='cpu', help='')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every step')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    parser.add_argument('--set', dest='set_cfgs', default=None, nargs=argparse.REMAINDER,
+                        help='set extra config keys if needed')
+    args = parser.parse_args()
+
+    cfg_from_yaml_file(args.cfg_file, cfg)
+    if args.set_cfgs is not None:
+        cfg_from_list(args.set_cfgs, cfg)
+    return args, cfg
+
+
+def loop_ema_update(student, teacher, decay):
+    """
+    The reference: one update per parameter and buffer
+    """
+    with torch.no_grad():
+        for student_tensor, teacher_tensor in zip(
+                list(student.parameters()) + list(student.buffers()),
+                list(teacher.parameters()) + list(teacher.buffers())):
+            if teacher_tensor.is_floating_point():
+                teacher_tensor.mul_(decay).add_(student_tensor, alpha=1 - decay)
+            else:
+                teacher_tensor.copy_(student_tensor)
+
+
+def loop_filter_pseudo_labels(pred_dicts, score_thresh):
+    """
+    The reference: per-sample, per-class masks
+    """
+    gt_boxes = []
+    for pred_dict in pred_dicts:
+        keep = torch.zeros_like(pred_dict['pred_scores'], dtype=torch.bool)
+        for cls_idx, thresh in enumerate(score_thresh):
+            keep |= (pred_dict['pred_labels'] == cls_idx + 1) & (pred_dict['pred_scores'] >= thresh)
+        gt_boxes.append(torch.cat([
+            pred_dict['pred_boxes'][keep], pred_dict['pred_labels'][keep, None].float()
+        ], dim=-1))
+    max_keep = max(max([len(x) for x in gt_boxes]), 1)
+    batch_gt_boxes = gt_boxes[0].new_zeros((len(gt_boxes), max_keep, gt_boxes[0].shape[-1]))
+    for k, cur_gt_boxes in enumerate(gt_boxes):
+        batch_gt_boxes[k, :len(cur_gt_boxes)] = cur_gt_boxes
+    return batch_gt_boxes
+
+
+def build_pred_dicts(batch_size, num_preds, num_class, code_size, device, rng):
+    return [{
+        'pred_boxes': torch.from_numpy(rng.standard_normal((num_preds, code_size)).astype(np.float32)).to(device),
+        'pred_scores': torch.from_numpy(rng.random(num_preds).astype(np.float32)).to(device),
+        'pred_labels': torch.from_numpy(rng.integers(1, num_class + 1, num_preds)).to(device),
+    } for _ in range(batch_size)]
+
+
+def main():
+    args, cfg = parse_config()
+    device = torch.device(args.device)
+    common_utils.set_random_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    logger = common_utils.create_logger()
+
+    train_set, train_loader, _ = build_dataloader(
+        dataset_cfg=cfg.DATA_CONFIG, class_names=cfg.CLASS_NAMES, batch_size=args.batch_size, dist=False,
+        workers=args.workers, logger=logger, training=True
+    )
+    model = build_network(model_cfg=cfg.MODEL, num_class=len(cfg.CLASS_NAMES), dataset=train_set).to(device)
+    optimizer = build_optimizer(model, cfg.OPTIMIZATION)
+    batch_dict = next(iter(train_loader))
+    load_data_to_gpu(batch_dict, device)
+
+    semi_cfg = cfg.OPTIMIZATION.get('SEMI_SUPERVISED', None) or EasyDict({
+        'EMA_DECAY': 0.999, 'PSEUDO_SCORE_THRESH': [0.5] * len(cfg.CLASS_NAMES)
+    })
+    mean_teacher = MeanTeacher(model, semi_cfg, load_data_func=lambda x: None)
+    num_params = sum([x.numel() for x in model.parameters()])
+    num_tensors = len(list(model.parameters())) + len(list(model.buffers()))
+    logger.info('%d parameters in %d tensors' % (num_params, num_tensors))
+
+    def supervised_step():
+        model.train()
+        optimizer.zero_grad()
+        ret_dict, _, _ = model(dict(batch_dict))
+        ret_dict['loss'].mean().backward()
+        optimizer.step()
+
+    _, step_latency = time_it(supervised_step, args.repeat, device)
+    logger.info('supervised step                    %10.2f ms' % step_latency)
+
+    _, latency = time_it(lambda: loop_ema_update(model, mean_teacher.model, mean_teacher.decay), args.repeat, device)
+    logger.info('EMA, per-tensor loop               %10.2f ms (%5.2f%% of a step)' % (
+        latency, latency / step_latency * 100))
+    _, latency = time_it(mean_teacher.update, args.repeat, device)
+    logger.info('EMA, flat buffers + foreach        %10.2f ms (%5.2f%% of a step)' % (
+        latency, latency / step_latency * 100))
+
+    code_size = batch_dict['gt_boxes'].shape[-1] - 1
+    pred_dicts = build_pred_dicts(args.batch_size, args.num_preds, len(cfg.CLASS_NAMES), code_size, device, rng)
+    ref, latency = time_it(
+        lambda: loop_filter_pseudo_labels(pred_dicts, semi_cfg.PSEUDO_SCORE_THRESH), args.repeat, device
+    )
+    logger.info('pseudo-labels, per-sample loop     %10.2f ms (%5.2f%% of a step)' % (
+        latency, latency / step_latency * 100))
+    (out, _), latency = time_it(lambda: mean_teacher.filter_pseudo_labels(pred_dicts), args.repeat, device)
+    logger.info('pseudo-labels, padded batch        %10.2f ms (%5.2f%% of a step), max diff %.3e' % (
+        latency, latency / step_latency * 100, (out - ref).abs().max().item()))
+
+
+if __name__ == '__main__':
+    main()
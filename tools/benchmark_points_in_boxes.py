@@ -0,0 +1,66 @@
+import argparse
+
+import numpy as np
+import torch
+
+from pcdet.ops.roiaware_pool3d import roiaware_pool3d_utils
+
+from benchmark_utils.benchmark_utils import time_it
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='benchmark dense points_in_boxes masks against the BEV grid join')
+    parser.add_argument('--num_boxes', type=int, default=150, help='number of boxes in the scene')
+    parser.add_argument('--num_points', type=int, default=200000, help='number of points in the scene')
+    parser.add_argument('--scene_range', type=float, default=75.0, help='half size of the square scene in meters')
+    parser.add_argument('--cell_size', type=float, default=1.0, help='BEV grid cell size of the join')
+    parser.add_argument('--repeat', type=int, default=10, help='timed runs of each method')
+    parser.add_argument('--seed', type=int, default=0, help='random seed of the synthetic scene')
+    return parser.parse_args()
+
+
+def build_dense_scene(num_boxes, num_points, scene_range, seed):
+    """
+    boxes are placed independently, so some of them overlap
+    """
+    rng = np.random.default_rng(seed)
+    boxes = np.zeros((num_boxes, 7), dtype=np.float32)
+    boxes[:, 0:2] = rng.uniform(-scene_range, scene_range, (num_boxes, 2))
+    boxes[:, 2] = rng.uniform(-1.0, 1.0, num_boxes)
+    boxes[:, 3:6] = rng.uniform([3.5, 1.6, 1.4], [5.0, 2.2, 2.0], (num_boxes, 3))
+    boxes[:, 6] = rng.uniform(-np.pi, np.pi, num_boxes)
+
+    # half of the points are sampled around the boxes to mimic a dense scene
+    num_fg = num_points // 2
+    centers = boxes[rng.integers(0, num_boxes, num_fg), 0:3]
+    fg_points = centers + rng.normal(0, 1.5, (num_fg, 3)) * [1.0, 1.0, 0.5]
+    bg_points = rng.uniform(-scene_range, scene_range, (num_points - num_fg, 3)) * [1.0, 1.0, 0.03]
+    points = np.concatenate([fg_points, bg_points], axis=0).astype(np.float32)
+    return torch.from_numpy(points), torch.from_numpy(boxes)
+
+
+def main():
+    args = parse_config()
+    points, boxes = build_dense_scene(args.num_boxes, args.num_points, args.scene_range, args.seed)
+
+    point_masks, dense_ms = time_it(lambda: roiaware_pool3d_utils.points_in_boxes_cpu(points, boxes), args.repeat)
+    (box_ptr, pts_idx), join_ms = time_it(
+        lambda: roiaware_pool3d_utils.points_in_boxes_csr_cpu(points, boxes, cell_size=args.cell_size), args.repeat
+    )
+
+    # every box has to get exactly the points of its dense mask row, shared points included
+    csr_masks = torch.zeros_like(point_masks)
+    csr_masks[torch.arange(args.num_boxes).repeat_interleave(box_ptr[1:] - box_ptr[:-1]), pts_idx] = 1
+    num_mismatch = (csr_masks != point_masks).sum().item()
+    num_shared = (point_masks.sum(dim=0) > 1).sum().item()
+
+    print('scene: %d boxes, %d points, %d points in boxes, %d points in more than one box' % (
+        args.num_boxes, args.num_points, (point_masks.sum(dim=0) > 0).sum().item(), num_shared))
+    print('points_in_boxes_cpu:     %8.2f ms  %8.2f MB' % (
+        dense_ms, point_masks.numel() * point_masks.element_size() / 2 ** 20))
+    print('points_in_boxes_csr_cpu: %8.2f ms  %8.2f MB' % (
+        join_ms, (box_ptr.numel() + pts_idx.numel()) * pts_idx.element_size() / 2 ** 20))
+    print('mismatched (box, point) pairs: %d' % num_mismatch)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import argparse
+
+import numpy as np
+import torch
+
+from pcdet.ops.roipoint_pool3d_stack import roipoint_pool3d_stack_grid_utils
+from pcdet.utils import box_utils
+
+from benchmark_utils.benchmark_utils import time_it
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='latency of the grid-bucketed ROI point pooling')
+    parser.add_argument('--num_rois', type=int, nargs='+', default=[100, 200, 500], help='ROIs of every sample')
+    parser.add_argument('--num_points', type=int, default=60000, help='points of a synthetic scan')
+    parser.add_argument('--num_feature', type=int, default=2, help='')
+    parser.add_argument('--num_sampled_points', type=int, default=256, help='')
+    parser.add_argument('--pool_extra_width', type=float, default=0.5, help='')
+    parser.add_argument('--cell_size', type=float, nargs='+', default=[0.5, 1.0, 2.0], help='BEV cells of the points')
+    parser.add_argument('--batch_size', type=int, default=2, help='')
+    parser.add_argument('--device', type=str, default='cpu', help='')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every step')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_scan(num_points, rng, num_objects=80):
+    """
+    A rotating-lidar like scan: rings on the ground plane plus clusters of points on a few objects.
+    """
+    num_ground = num_points // 2
+    radius = 2.0 + 73.0 * rng.random(num_ground) ** 2
+    angle = rng.uniform(-np.pi, np.pi, num_ground)
+    ground = np.stack([radius * np.cos(angle), radius * np.sin(angle), rng.normal(-1.7, 0.05, num_ground)], axis=1)
+
+    boxes = np.concatenate([
+        rng.uniform(-60, 60, (num_objects, 2)), np.full((num_objects, 1), -0.9),
+        np.tile([[4.5, 2.0, 1.7]], (num_objects, 1)) * rng.uniform(0.8, 1.2, (num_objects, 3)),
+        rng.uniform(-np.pi, np.pi, (num_objects, 1))
+    ], axis=1)
+    num_object_points = num_points - num_ground
+    object_ids = rng.integers(0, num_objects, num_object_points)
+    local = rng.uniform(-0.5, 0.5, (num_object_points, 3)) * boxes[object_ids, 3:6]
+    cosa, sina = np.cos(boxes[object_ids, 6]), np.sin(boxes[object_ids, 6])
+    objects = boxes[object_ids, 0:3] + np.stack([
+        local[:, 0] * cosa - local[:, 1] * sina, local[:, 0] * sina + local[:, 1] * cosa, local[:, 2]
+    ], axis=1)
+    return np.concatenate([ground, objects], axis=0), boxes
+
+
+def build_rois(boxes, num_rois, rng):
+    rois = boxes[rng.integers(0, boxes.shape[0], num_rois)].copy()
+    rois[:, 0:3] += rng.normal(0, 0.5, (num_rois, 3))
+    rois[:, 3:6] *= rng.uniform(0.8, 1.2, (num_rois, 3))
+    rois[:, 6] += rng.normal(0, 0.2, num_rois)
+    return rois
+
+
+def check_pts_in_box3d(points, box):
+    """
+    check_pt_in_box3d of the CUDA kernel, float32 coordinates compared with float64 bounds
+    """
+    shift = points - box[0:3]
+    cosa, sina = torch.cos(-box[6]), torch.sin(-box[6])
+    local_x = shift[:, 0] * cosa + shift[:, 1] * (-sina)
+    local_y = shift[:, 0] * sina + shift[:, 1] * cosa
+    box, margin = box.double(), roipoint_pool3d_stack_grid_utils.BOX_MARGIN
+    return (shift[:, 2].abs().double() <= box[5] / 2.0) & (local_x.abs().double() < box[3] / 2.0 + margin) & \
+        (local_y.abs().double() < box[4] / 2.0 + margin)
+
+
+def dense_query(points, points_batch_id, boxes3d, num_sampled_points):
+    """
+    The CUDA kernel loop by loop: every point against every box of its sample, first points in the input order.
+    """
+    batch_size, boxes_num = boxes3d.shape[0:2]
+    point_idx = torch.full((batch_size, boxes_num, num_sampled_points), -1, dtype=torch.int32)
+    for bs_idx in range(batch_size):
+        pts_ids = (points_batch_id == bs_idx).nonzero()[:, 0]
+        for box_idx in range(boxes_num):
+            in_flag = check_pts_in_box3d(points[pts_ids], boxes3d[bs_idx, box_idx])
+            inside = pts_ids[in_flag][:num_sampled_points]
+            point_idx[bs_idx, box_idx, :inside.shape[0]] = inside.int()
+    return point_idx
+
+
+def main():
+    args = parse_config()
+    device = torch.device(args.device)
+    rng = np.random.default_rng(args.seed)
+
+    points, points_batch_id, object_boxes = [], [], []
+    for bs_idx in range(args.batch_size):
+        cur_points, cur_boxes = build_scan(args.num_points, rng)
+        points.append(cur_points)
+        points_batch_id.append(np.full(cur_points.shape[0], bs_idx))
+        object_boxes.append(cur_boxes)
+    points = torch.from_numpy(np.concatenate(points, axis=0)).float().to(device)
+    points_batch_id = torch.from_numpy(np.concatenate(points_batch_id, axis=0)).int().to(device)
+    point_features = torch.from_numpy(rng.random((points.shape[0], args.num_feature))).float().to(device)
+    print('%d points in %d scans' % (points.shape[0], args.batch_size))
+
+    for num_rois in args.num_rois:
+        rois = torch.from_numpy(np.stack([build_rois(boxes, num_rois, rng) for boxes in object_boxes])).float()
+        rois = rois.to(device)
+        pooled_rois = box_utils.enlarge_box3d(rois.view(-1, 7), [args.pool_extra_width] * 3).view(rois.shape)
+
+        print('%d ROIs per sample' % num_rois)
+        for cell_size in args.cell_size:
+            (point_idx, _), latency = time_it(
+                lambda: roipoint_pool3d_stack_grid_utils.roipoint_query_stack(
+                    points, points_batch_id, pooled_rois, args.num_sampled_points, cell_size=cell_size
+                ), args.repeat, device
+            )
+            _, pool_latency = time_it(
+                lambda: roipoint_pool3d_stack_grid_utils.roipoint_pool3d_stack(
+                    points, point_features, points_batch_id, rois, args.pool_extra_width, args.num_sampled_points,
+                    cell_size=cell_size
+                ), args.repeat, device
+            )
+            print('    cell_size %.2f: query %8.2f ms, pool %8.2f ms' % (cell_size, latency, pool_latency))
+
+        if device.type == 'cuda':
+            from pcdet.ops.roipoint_pool3d_stack.roipoint_pool3d_stack_utils import RoIPointQueryStackFunction
+            ref_idx, latency = time_it(
+                lambda: RoIPointQueryStackFunction.apply(
+                    points, points_batch_id, torch.bincount(points_batch_id.long()).int(), rois,
+                    args.pool_extra_width, args.num_sampled_points
+                ), args.repeat, device
+            )
+            print('    cuda query %8.2f ms' % latency)
+        else:
+            ref_idx = dense_query(points, points_batch_id, pooled_rois, args.num_sampled_points)
+        num_mismatch = (point_idx != ref_idx).any(dim=-1).sum().item()
+        print('    ROIs with sampled points different from the reference: %d' % num_mismatch)
+
+
+if __name__ == '__main__':
+    main()
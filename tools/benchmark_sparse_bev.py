@@ -0,0 +1,215 @@
+import argparse
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from easydict import EasyDict
+
+from benchmark_utils.benchmark_utils import time_it
+
+# BEV grid of the Waymo configs after the 8x 3D backbone
+POINT_CLOUD_RANGE = [-75.2, -75.2, -2, 75.2, 75.2, 4]
+BEV_CELL_SIZE = 0.8
+BACKBONE_CONFIG = {
+    'LAYER_NUMS': [5, 5], 'LAYER_STRIDES': [1, 2], 'NUM_FILTERS': [128, 256],
+    'UPSAMPLE_STRIDES': [1, 2], 'NUM_UPSAMPLE_FILTERS': [256, 256],
+}
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='active cells and latency of the sparsity-preserving BEV backbone')
+    parser.add_argument('--num_points', type=int, default=180000, help='points of a synthetic scan')
+    parser.add_argument('--num_bev_features', type=int, default=256, help='')
+    parser.add_argument('--batch_size', type=int, default=2, help='')
+    parser.add_argument('--budgets', type=str, nargs='+', default=['0,0', '1,0', '1,1', '2,1'],
+                        help='DILATION_BUDGET of the sparsity-preserving runs, comma separated per stage')
+    parser.add_argument('--cells_only', action='store_true', default=False, help='skip the spconv runs')
+    parser.add_argument('--parity_only', action='store_true', default=False,
+                        help='only check sparse_cat and to_sparse_bev against the dense path')
+    parser.add_argument('--device', type=str, default='cpu', help='')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every backbone')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_occupancy(batch_size, num_points, rng, num_objects=80):
+    """
+    BEV cells hit by synthetic 64-beam scans: the lower beams hit the ground on rings around the sensor, the other
+    points hit objects of car size scattered around it
+    Returns:
+        occupancy: (B, 1, ny, nx)
+    """
+    grid_size = int(round((POINT_CLOUD_RANGE[3] - POINT_CLOUD_RANGE[0]) / BEV_CELL_SIZE))
+    occupancy = np.zeros((batch_size, 1, grid_size, grid_size), dtype=np.float32)
+    elevation = np.deg2rad(np.linspace(-17.6, -1.0, 48))
+    num_ground = num_points * 2 // 3
+    for k in range(batch_size):
+        beam = rng.integers(0, len(elevation), num_ground)
+        angle = rng.uniform(-np.pi, np.pi, num_ground)
+        radius = 2.2 / np.tan(-elevation[beam])
+        ground = np.stack([radius * np.cos(angle), radius * np.sin(angle)], axis=1)
+
+        centers = rng.uniform(-70, 70, (num_objects, 2))
+        obj = rng.integers(0, num_objects, num_points - num_ground)
+        objects = centers[obj] + rng.uniform([-2.3, -1.0], [2.3, 1.0], (len(obj), 2))
+
+        xy = np.concatenate([ground, objects], axis=0)
+        cells = np.floor((xy - np.array(POINT_CLOUD_RANGE[0:2])) / BEV_CELL_SIZE).astype(np.int64)
+        cells = cells[((cells >= 0) & (cells < grid_size)).all(axis=1)]
+        occupancy[k, 0, cells[:, 1], cells[:, 0]] = 1
+    return torch.from_numpy(occupancy)
+
+
+def count_active_cells(occupancy, dilation_budget=None):
+    """
+    Active sites after every stage of the SparseBEVBackbone, a regular sparse convolution activates the outputs
+    with an active input in the kernel, a submanifold one keeps the active sites
+    Args:
+        occupancy: (B, 1, ny, nx)
+        dilation_budget: [num, ...] DILATION_BUDGET, None for regular sparse convolutions only
+    Returns:
+        stage_cells: [(active, total), ...] of every stage
+        head_cells: (active, total) of the concatenated levels
+    """
+    cfg = BACKBONE_CONFIG
+    x, stage_cells, ups = occupancy, [], []
+    for idx in range(len(cfg['LAYER_NUMS'])):
+        num_dilations = cfg['LAYER_NUMS'][idx] + 1 if dilation_budget is None else dilation_budget[idx]
+        if cfg['LAYER_STRIDES'][idx] > 1:
+            x = F.max_pool2d(x, kernel_size=3, stride=cfg['LAYER_STRIDES'][idx], padding=1)
+        for _ in range(min(num_dilations, cfg['LAYER_NUMS'][idx] + (cfg['LAYER_STRIDES'][idx] == 1))):
+            x = F.max_pool2d(x, kernel_size=3, stride=1, padding=1)
+        stage_cells.append((int(x.sum().item()), x.numel()))
+        ups.append(F.interpolate(x, scale_factor=cfg['UPSAMPLE_STRIDES'][idx], mode='nearest'))
+    head = torch.stack(ups, dim=0).amax(dim=0)
+    return stage_cells, (int(head.sum().item()), head.numel())
+
+
+def format_cells(stage_cells, head_cells):
+    return ', '.join(['stage %d %7d (%5.1f%%)' % (idx, active, active / total * 100)
+                      for idx, (active, total) in enumerate(stage_cells)]) + \
+        ', head %7d (%5.1f%%)' % (head_cells[0], head_cells[0] / head_cells[1] * 100)
+
+
+def random_sparse_tensor(batch_size, spatial_shape, num_channels, num_sites, generator):
+    import spconv
+
+    site_ids = torch.randperm(batch_size * int(np.prod(spatial_shape)), generator=generator)[:num_sites]
+    indices = []
+    for size in reversed(spatial_shape):
+        indices.append(site_ids % size)
+        site_ids = site_ids // size
+    indices.append(site_ids)
+    return spconv.SparseConvTensor(
+        features=torch.randn(num_sites, num_channels, generator=generator),
+        indices=torch.stack(indices[::-1], dim=1).int(), spatial_shape=list(spatial_shape), batch_size=batch_size
+    )
+
+
+def check_parity(args):
+    """
+    sparse_cat and HeightCompression.to_sparse_bev on synthetic sparse tensors against the dense path:
+    the densified outputs and the active sites have to match the dense concatenation / the dense BEV map
+    """
+    from pcdet.models.backbones_2d.map_to_bev.height_compression import HeightCompression
+    from pcdet.models.backbones_2d.sparse_bev_backbone import sparse_cat
+
+    generator = torch.Generator().manual_seed(args.seed)
+    for num_sites in [(300, 500, 100), (1000, 1000, 1000), (50, 2000, 10)]:
+        levels = [random_sparse_tensor(args.batch_size, [30, 40], num_channels, cur_sites, generator)
+                  for num_channels, cur_sites in zip([5, 7, 3], num_sites)]
+        out = sparse_cat(levels)
+        ref = torch.cat([level.dense() for level in levels], dim=1)
+        ref_sites = sum([level.dense().abs().sum(dim=1) > 0 for level in levels]) > 0
+        out_sites = torch.zeros_like(ref_sites)
+        out_sites[out.indices[:, 0].long(), out.indices[:, 1].long(), out.indices[:, 2].long()] = True
+        print('sparse_cat     sites per level %-18s max diff %.3e, active sites %6d, site mismatch %d' % (
+            num_sites, (out.dense() - ref).abs().max().item(), out.indices.shape[0],
+            (out_sites != ref_sites).sum().item()))
+
+    for num_sites in [100, 2000, 9000]:
+        x = random_sparse_tensor(args.batch_size, [4, 30, 40], 6, num_sites, generator)
+        dense = x.dense()
+        ref = dense.view(dense.shape[0], -1, *dense.shape[3:])
+        out = HeightCompression.to_sparse_bev(x)
+        ref_sites = ref.abs().sum(dim=1) > 0
+        out_sites = torch.zeros_like(ref_sites)
+        out_sites[out.indices[:, 0].long(), out.indices[:, 1].long(), out.indices[:, 2].long()] = True
+        print('to_sparse_bev  voxels %-27d max diff %.3e, active sites %6d, site mismatch %d' % (
+            num_sites, (out.dense() - ref).abs().max().item(), out.indices.shape[0],
+            (out_sites != ref_sites).sum().item()))
+
+
+def run_backbones(args, occupancy, budgets, device):
+    import spconv
+    from pcdet.models.backbones_2d import BaseBEVBackbone, SparseBEVBackbone
+    from pcdet.models.backbones_2d.sparse_bev_backbone import sparse_cat
+
+    indices = occupancy[:, 0].nonzero().int()
+    features = torch.randn(indices.shape[0], args.num_bev_features)
+    sparse_input = spconv.SparseConvTensor(
+        features=features.to(device), indices=indices.to(device), spatial_shape=list(occupancy.shape[2:]),
+        batch_size=args.batch_size
+    )
+    dense_input = sparse_input.dense()
+
+    def forward(backbone, x):
+        with torch.no_grad():
+            return backbone({'spatial_features': x})['spatial_features_2d']
+
+    dense_backbone = BaseBEVBackbone(EasyDict(BACKBONE_CONFIG), args.num_bev_features).to(device).eval()
+    _, latency = time_it(lambda: forward(dense_backbone, dense_input), args.repeat, device)
+    print('BaseBEVBackbone, dense                  %9.2f ms' % latency)
+
+    backbone = SparseBEVBackbone(EasyDict(BACKBONE_CONFIG), args.num_bev_features).to(device).eval()
+    ref, latency = time_it(lambda: forward(backbone, sparse_input), args.repeat, device)
+    print('SparseBEVBackbone, regular sparse convs %9.2f ms' % latency)
+
+    for budget in budgets:
+        model_cfg = EasyDict({**BACKBONE_CONFIG, 'SPARSITY_PRESERVING': True, 'DILATION_BUDGET': budget})
+        sparse_backbone = SparseBEVBackbone(model_cfg, args.num_bev_features).to(device).eval()
+        # submanifold and regular convolutions have the same weights, only the active sites differ
+        sparse_backbone.load_state_dict(backbone.state_dict())
+        out, latency = time_it(lambda: forward(sparse_backbone, sparse_input), args.repeat, device)
+        print('SparseBEVBackbone, budget %-13s %9.2f ms, nonzero head cells %5.1f%% (regular %5.1f%%)' % (
+            budget, latency, (out.abs().sum(dim=1) > 0).float().mean().item() * 100,
+            (ref.abs().sum(dim=1) > 0).float().mean().item() * 100
+        ))
+
+    # the single sparse concatenation against the concatenation of the densified levels
+    with torch.no_grad():
+        x, ups = sparse_input, []
+        for i in range(len(backbone.blocks)):
+            x = backbone.blocks[i](x)
+            ups.append(backbone.deblocks[i](x))
+    ref, latency = time_it(lambda: torch.cat([up.dense() for up in ups], dim=1), args.repeat, device)
+    print('levels, densify + cat                   %9.2f ms' % latency)
+    out, latency = time_it(lambda: sparse_cat(ups).dense(), args.repeat, device)
+    print('levels, sparse cat + densify            %9.2f ms, max diff %.3e' % (
+        latency, (out - ref).abs().max().item()))
+
+
+def main():
+    args = parse_config()
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+    rng = np.random.default_rng(args.seed)
+    budgets = [[int(x) for x in budget.split(',')] for budget in args.budgets]
+    if args.parity_only:
+        check_parity(args)
+        return
+
+    occupancy = build_occupancy(args.batch_size, args.num_points, rng)
+    print('input                              %7d (%5.1f%%) active BEV cells' % (
+        int(occupancy.sum().item()), occupancy.mean().item() * 100))
+    print('regular sparse convs           ' + format_cells(*count_active_cells(occupancy)))
+    for budget in budgets:
+        print('submanifold, budget %-10s ' % budget + format_cells(*count_active_cells(occupancy, budget)))
+
+    if not args.cells_only:
+        check_parity(args)
+        run_backbones(args, occupancy, budgets, device)
+
+
+if __name__ == '__main__':
+    main()
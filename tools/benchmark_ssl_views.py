@@ -0,0 +1,96 @@
+import argparse
+import time
+
+import numpy as np
+from easydict import EasyDict
+
+from pcdet.datasets.semi_dataset import SemiDatasetTemplate
+
+CLASS_NAMES = ['Vehicle', 'Pedestrian', 'Cyclist']
+FLIP = {'NAME': 'random_world_flip', 'ALONG_AXIS_LIST': ['x', 'y']}
+ROTATION = {'NAME': 'random_world_rotation', 'WORLD_ROT_ANGLE': [-0.78539816, 0.78539816]}
+SCALING = {'NAME': 'random_world_scaling', 'WORLD_SCALE_RANGE': [0.95, 1.05]}
+# (teacher, student) augmentations, the student of 'flip' is derived from the teacher voxels
+AUG_SETTINGS = {
+    'flip': ([FLIP], [FLIP]),
+    'flip_rot_scale': ([FLIP], [FLIP, ROTATION, SCALING]),
+}
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='per-sample CPU cost of the teacher / student view preprocessing')
+    parser.add_argument('--num_points', type=int, default=180000, help='points of a synthetic scan')
+    parser.add_argument('--num_boxes', type=int, default=60, help='')
+    parser.add_argument('--settings', type=str, nargs='+', default=list(AUG_SETTINGS.keys()), help='')
+    parser.add_argument('--repeat', type=int, default=20, help='timed samples of every setting')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_dataset_cfg(teacher_augs, student_augs, shared_view):
+    def augmentor_cfg(aug_config_list):
+        return {'DISABLE_AUG_LIST': ['placeholder'], 'AUG_CONFIG_LIST': aug_config_list}
+
+    return EasyDict({
+        'DATA_PATH': '.',
+        'POINT_CLOUD_RANGE': [-75.2, -75.2, -2, 75.2, 75.2, 4],
+        'POINT_FEATURE_ENCODING': {
+            'encoding_type': 'absolute_coordinates_encoding',
+            'used_feature_list': ['x', 'y', 'z', 'intensity', 'elongation'],
+            'src_feature_list': ['x', 'y', 'z', 'intensity', 'elongation'],
+        },
+        'DATA_AUGMENTOR': {'DISABLE_AUG_LIST': ['placeholder'], 'AUG_CONFIG_LIST': []},
+        'TEACHER_AUGMENTOR': augmentor_cfg(teacher_augs),
+        'STUDENT_AUGMENTOR': augmentor_cfg(student_augs),
+        'DATA_PROCESSOR': [
+            {'NAME': 'mask_points_and_boxes_outside_range', 'REMOVE_OUTSIDE_BOXES': True},
+            {'NAME': 'shuffle_points', 'SHUFFLE_ENABLED': {'train': True, 'test': False}},
+            {'NAME': 'transform_points_to_voxels', 'VOXEL_SIZE': [0.1, 0.1, 0.15], 'MAX_POINTS_PER_VOXEL': 5,
+             'MAX_NUMBER_OF_VOXELS': {'train': 150000, 'test': 150000}},
+        ],
+        'SHARED_VIEW_PREPROCESSING': shared_view,
+    })
+
+
+def build_sample(args, rng):
+    radius = 2.0 + 78.0 * rng.random(args.num_points) ** 2
+    angle = rng.uniform(-np.pi, np.pi, args.num_points)
+    points = np.stack([
+        radius * np.cos(angle), radius * np.sin(angle), rng.uniform(-2, 3, args.num_points),
+        rng.random(args.num_points), rng.random(args.num_points)
+    ], axis=1).astype(np.float32)
+    gt_boxes = np.concatenate([
+        rng.uniform(-70, 70, (args.num_boxes, 2)), np.full((args.num_boxes, 1), 0.5),
+        rng.uniform(1, 5, (args.num_boxes, 3)), rng.uniform(-np.pi, np.pi, (args.num_boxes, 1))
+    ], axis=1).astype(np.float32)
+    gt_names = np.array(CLASS_NAMES)[rng.integers(0, len(CLASS_NAMES), args.num_boxes)]
+    return {'points': points, 'frame_id': 'synthetic', 'gt_boxes': gt_boxes, 'gt_names': gt_names}
+
+
+def main():
+    args = parse_config()
+    rng = np.random.default_rng(args.seed)
+    sample = build_sample(args, rng)
+
+    for setting in args.settings:
+        teacher_augs, student_augs = AUG_SETTINGS[setting]
+        for shared_view in [False, True]:
+            dataset = SemiDatasetTemplate(
+                dataset_cfg=build_dataset_cfg(teacher_augs, student_augs, shared_view), class_names=CLASS_NAMES,
+                training=True
+            )
+            np.random.seed(args.seed)
+            dataset.prepare_data_ssl(dict(sample), output_dicts=['teacher', 'student'])
+            latencies = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                teacher_dict, student_dict = dataset.prepare_data_ssl(dict(sample), output_dicts=['teacher', 'student'])
+                latencies.append(time.perf_counter() - start)
+            print('%-16s shared_view=%-5s %8.2f ms/sample, %d / %d voxels' % (
+                setting, shared_view, np.median(latencies) * 1000, teacher_dict['voxels'].shape[0],
+                student_dict['voxels'].shape[0]
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+import argparse
+import copy
+
+import torch
+from easydict import EasyDict
+
+from pcdet.models.backbones_2d import swin_transformer
+from pcdet.models.backbones_2d.swin_transformer import SwinFPN
+
+from benchmark_utils.benchmark_utils import time_it
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='latency of SwinFPN with the cached masks and the fused attention')
+    parser.add_argument('--bev_size', type=int, nargs=2, default=[188, 188], help='H W of the BEV features')
+    parser.add_argument('--input_channels', type=int, default=256, help='')
+    parser.add_argument('--embed_dim', type=int, default=64, help='')
+    parser.add_argument('--depths', type=int, nargs='+', default=[2, 2, 2], help='')
+    parser.add_argument('--num_heads', type=int, nargs='+', default=[2, 4, 8], help='')
+    parser.add_argument('--window_size', type=int, default=7, help='')
+    parser.add_argument('--batch_size', type=int, default=2, help='')
+    parser.add_argument('--device', type=str, default='cpu', help='')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every step')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_model(args, use_sdpa):
+    model_cfg = EasyDict({
+        'SWIN_CFG': {
+            'patch_size': 1,
+            'depths': args.depths,
+            'num_heads': args.num_heads,
+            'window_size': args.window_size,
+            'mlp_ratio': 4.,
+            'embed_dim': args.embed_dim,
+            'patch_norm': True,
+            'drop_path_rate': 0,
+            'use_sdpa': use_sdpa,
+        },
+        'OUT_INDEX': 0,
+    })
+    return SwinFPN(model_cfg, args.input_channels)
+
+
+def clear_caches(model):
+    """
+    The state of the code before the caches: masks and relative position biases built on every forward
+    """
+    swin_transformer.get_shifted_window_mask.cache_clear()
+    for module in model.modules():
+        if isinstance(module, swin_transformer.WindowAttention):
+            module._relative_position_bias = (None, None)
+
+
+def main():
+    args = parse_config()
+    device = torch.device(args.device)
+    torch.manual_seed(args.seed)
+
+    model = build_model(args, use_sdpa=False).to(device)
+    model.encoder.init_weights()
+    model_sdpa = build_model(args, use_sdpa=True).to(device)
+    model_sdpa.load_state_dict(copy.deepcopy(model.state_dict()))
+    features = torch.randn(args.batch_size, args.input_channels, *args.bev_size, device=device)
+
+    def inference(cur_model, uncached=False):
+        cur_model.eval()
+        if uncached:
+            clear_caches(cur_model)
+        with torch.no_grad():
+            return cur_model({'spatial_features': features})['spatial_features_2d']
+
+    def train_step(cur_model):
+        cur_model.train()
+        cur_model.zero_grad()
+        out = cur_model({'spatial_features': features})['spatial_features_2d']
+        out.square().mean().backward()
+        return out.detach(), torch.cat([p.grad.flatten() for p in cur_model.parameters() if p.grad is not None])
+
+    ref, latency = time_it(lambda: inference(model, uncached=True), args.repeat, device)
+    print('inference, masks and biases rebuilt %8.2f ms' % latency)
+    out, latency = time_it(lambda: inference(model), args.repeat, device)
+    print('inference, cached                   %8.2f ms, max diff %.3e' % (latency, (out - ref).abs().max().item()))
+    out, latency = time_it(lambda: inference(model_sdpa), args.repeat, device)
+    print('inference, cached + sdpa            %8.2f ms, max diff %.3e' % (latency, (out - ref).abs().max().item()))
+
+    (ref, ref_grad), latency = time_it(lambda: train_step(model), args.repeat, device)
+    print('forward + backward                  %8.2f ms' % latency)
+    (out, grad), latency = time_it(lambda: train_step(model_sdpa), args.repeat, device)
+    print('forward + backward, sdpa            %8.2f ms, max diff %.3e, max grad diff %.3e' % (
+        latency, (out - ref).abs().max().item(), (grad - ref_grad).abs().max().item()
+    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+
+import numpy as np
+import torch
+
+from pcdet.utils import box_coder_utils, matcher
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(
+        description='TimeMatcher chunked assignment (MATCHER_CONFIG.chunk_memory_mb) against the dense cost: '
+                    'identical matches and the peak memory of one crowded scene'
+    )
+    parser.add_argument('--parity_scenes', type=int, default=30, help='random scenes of the parity check')
+    parser.add_argument('--max_queries', type=int, default=3000, help='')
+    parser.add_argument('--max_gt', type=int, default=120, help='')
+    parser.add_argument('--chunk_memory_mb', type=float, nargs='+', default=[1, 16, 64], help='budgets to check')
+    parser.add_argument('--memory_queries', type=int, default=376 * 376, help='queries of the peak memory scene')
+    parser.add_argument('--memory_gt', type=int, default=400, help='gt boxes of the peak memory scene')
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu', help='')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_matcher(chunk_memory_mb):
+    # the TimeMatcher settings of cfgs/waymo_p2s.yaml
+    box_coder = box_coder_utils.CenterCoder(code_size=7, encode_angle_by_sincos=True, period=2 * np.pi)
+    return matcher.TimeMatcher(
+        box_coder=box_coder, losses=['loss_ce', 'loss_bbox'], weight_dict={'loss_ce': 0.25, 'loss_bbox': 0.75},
+        use_focal_loss=True, code_weights=[1.0] * 8, period=2 * np.pi, chunk_memory_mb=chunk_memory_mb
+    )
+
+
+def build_scene(num_queries, num_gt, num_classes, seed, device):
+    """
+    Queries are noisy codes of the gt boxes (or of nothing) with random logits, like the predictions of a
+    partly trained head
+    """
+    generator = torch.Generator().manual_seed(seed)
+    box_coder = box_coder_utils.CenterCoder(code_size=7, encode_angle_by_sincos=True, period=2 * np.pi)
+    gt_boxes = torch.cat([
+        torch.rand(num_gt, 2, generator=generator) * 150 - 75,
+        torch.rand(num_gt, 1, generator=generator) * 2 - 1,
+        torch.rand(num_gt, 3, generator=generator) * 3 + 0.5,
+        torch.rand(num_gt, 1, generator=generator) * 2 * np.pi - np.pi,
+    ], dim=1)
+    codes = box_coder.encode([gt_boxes])[0]
+    owner = torch.randint(0, num_gt + 1, (num_queries,), generator=generator)
+    codes = torch.cat([codes, torch.zeros(1, codes.shape[1])], dim=0)[owner]
+    pred_dicts = {
+        'pred_logits': torch.randn(1, num_queries, num_classes, generator=generator).to(device),
+        'pred_boxes': (codes + torch.randn(codes.shape, generator=generator) * 0.5)[None].to(device),
+    }
+    gt_dicts = {
+        'gt_boxes': [gt_boxes.to(device)],
+        'gt_classes': [torch.randint(0, num_classes, (num_gt,), generator=generator).to(device)],
+    }
+    return pred_dicts, gt_dicts
+
+
+def matched_cost(time_matcher, pred_dicts, gt_dicts, inds):
+    example = time_matcher._get_per_scene_example(time_matcher._preprocess(pred_dicts, gt_dicts), 0)
+    query_inds, gt_inds = inds
+    return time_matcher.get_cost(example)[query_inds, gt_inds].double().sum().item()
+
+
+def check_parity(args, device):
+    dense = build_matcher(-1)
+    chunked = [build_matcher(x) for x in args.chunk_memory_mb]
+    rng = np.random.default_rng(args.seed)
+    num_same, max_cost_diff = np.zeros(len(chunked), dtype=np.int64), np.zeros(len(chunked))
+    for k in range(args.parity_scenes):
+        num_queries = int(rng.integers(1, args.max_queries + 1))
+        num_gt = int(rng.integers(1, args.max_gt + 1))
+        pred_dicts, gt_dicts = build_scene(num_queries, num_gt, 3, args.seed + k, device)
+        ref = dense(pred_dicts, gt_dicts)['inds'][0]
+        ref_cost = matched_cost(dense, pred_dicts, gt_dicts, ref)
+        for i, time_matcher in enumerate(chunked):
+            out = time_matcher(pred_dicts, gt_dicts)['inds'][0]
+            num_same[i] += int(torch.equal(ref[0], out[0]) and torch.equal(ref[1], out[1]))
+            cost = matched_cost(time_matcher, pred_dicts, gt_dicts, out)
+            max_cost_diff[i] = max(max_cost_diff[i], abs(cost - ref_cost) / max(abs(ref_cost), 1e-12))
+
+    for budget, same, cost_diff in zip(args.chunk_memory_mb, num_same, max_cost_diff):
+        print('chunk_memory_mb %6.1f: identical matches in %d / %d scenes, max relative matched cost diff %.2e' % (
+            budget, same, args.parity_scenes, cost_diff))
+
+
+def measure_peak(args, chunk_memory_mb, device_name, queue):
+    """
+    Runs in a fresh process so that the peak RSS only covers this matcher call. The process is started with a fixed
+    glibc mmap threshold, otherwise freed blocks stay in the heap and the RSS grows with every chunk.
+    """
+    device = torch.device(device_name)
+    pred_dicts, gt_dicts = build_scene(args.memory_queries, args.memory_gt, 3, args.seed, device)
+    time_matcher = build_matcher(chunk_memory_mb)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        base = torch.cuda.memory_allocated()
+    else:
+        base = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    start = time.perf_counter()
+    time_matcher(pred_dicts, gt_dicts)
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+        peak = torch.cuda.max_memory_allocated() - base
+    else:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 - base
+    queue.put((peak, time.perf_counter() - start))
+
+
+def main():
+    args = parse_config()
+    device = torch.device(args.device)
+    check_parity(args, device)
+
+    ctx = multiprocessing.get_context('spawn')
+    os.environ.setdefault('MALLOC_MMAP_THRESHOLD_', str(128 * 1024))
+    print('%d queries, %d gt boxes, %s' % (args.memory_queries, args.memory_gt, device))
+    for chunk_memory_mb in [-1] + args.chunk_memory_mb:
+        queue = ctx.Queue()
+        process = ctx.Process(target=measure_peak, args=(args, chunk_memory_mb, args.device, queue))
+        process.start()
+        peak, latency = queue.get()
+        process.join()
+        print('chunk_memory_mb %6.1f: peak %s growth %8.1f MB, %7.2f s' % (
+            chunk_memory_mb, 'allocated' if device.type == 'cuda' else 'RSS', peak / 2 ** 20, latency))
+
+
+if __name__ == '__main__':
+    main()
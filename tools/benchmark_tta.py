@@ -0,0 +1,282 @@
+import argparse
+import time
+
+import numpy as np
+import torch
+from easydict import EasyDict
+
+from pcdet.config import cfg, cfg_from_list, cfg_from_yaml_file
+from pcdet.datasets import build_dataloader
+from pcdet.models import build_network, load_data_to_gpu
+from pcdet.models.detectors.detector3d_template import Detector3DTemplate
+from pcdet.ops.iou3d_nms import iou3d_nms_utils
+from pcdet.utils import common_utils, tta_utils
+
+# DATA_CONFIG.TEST_TIME_AUGMENTATION of every policy, None runs the plain model
+TTA_POLICIES = {
+    'none': None,
+    'flip_x': {'FLIP_X': [False, True]},
+    'double_flip': {'FLIP_X': [False, True], 'FLIP_Y': [False, True]},
+    'rot': {'ROT_ANGLES': [0.0, -0.3927, 0.3927]},
+    'double_flip_rot': {'FLIP_X': [False, True], 'FLIP_Y': [False, True], 'ROT_ANGLES': [0.0, -0.3927, 0.3927]},
+    'double_flip_scale': {'FLIP_X': [False, True], 'FLIP_Y': [False, True], 'SCALES': [0.95, 1.0, 1.05]},
+}
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='accuracy and latency of the test-time augmentation policies')
+    parser.add_argument('--cfg_file', type=str, default=None, help='model config')
+    parser.add_argument('--ckpt', type=str, default=None, help='checkpoint of the model')
+    parser.add_argument('--synthetic', action='store_true', default=False,
+                        help='CPU-only run of the detector post-processing and fusion on synthetic proposals, '
+                             'uses cfgs/tta_synthetic.yaml unless --cfg_file is given')
+    parser.add_argument('--policies', type=str, nargs='+', default=list(TTA_POLICIES.keys()), help='')
+    parser.add_argument('--fusions', type=str, nargs='+', default=['wbf', 'nms'], help='TTA_FUSION.METHOD')
+    parser.add_argument('--iou_thresh', type=float, default=0.55, help='TTA_FUSION.IOU_THRESH')
+    parser.add_argument('--num_frames', type=int, default=50, help='first frames of the test split')
+    parser.add_argument('--batch_size', type=int, default=1, help='')
+    parser.add_argument('--workers', type=int, default=0, help='')
+    parser.add_argument('--device', type=str, default='cpu', help='')
+    parser.add_argument('--full_eval', action='store_true', default=False, help='also run dataset.evaluation')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    parser.add_argument('--set', dest='set_cfgs', default=None, nargs=argparse.REMAINDER,
+                        help='set extra config keys if needed')
+    args = parser.parse_args()
+    if args.synthetic and args.cfg_file is None:
+        args.cfg_file = 'cfgs/tta_synthetic.yaml'
+    assert args.cfg_file is not None and (args.synthetic or args.ckpt is not None), \
+        '--cfg_file and --ckpt are required without --synthetic'
+
+    cfg_from_yaml_file(args.cfg_file, cfg)
+    if args.set_cfgs is not None:
+        cfg_from_list(args.set_cfgs, cfg)
+    return args, cfg
+
+
+def run_policy(model, dataloader, args, logger):
+    dataset = dataloader.dataset
+    recall_thresh_list = cfg.MODEL.POST_PROCESSING.RECALL_THRESH_LIST
+    metric = {'gt': 0, **{'rcnn_%s' % str(thresh): 0 for thresh in recall_thresh_list}}
+    det_annos, latencies, num_frames = [], [], 0
+
+    for batch_dict in dataloader:
+        load_data_to_gpu(batch_dict, args.device)
+        if args.device != 'cpu':
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        with torch.no_grad():
+            pred_dicts, ret_dict = model(batch_dict)
+        if args.device != 'cpu':
+            torch.cuda.synchronize()
+        latencies.append(time.perf_counter() - start)
+
+        for key in metric:
+            metric[key] += ret_dict.get(key, 0)
+        det_annos += dataset.generate_prediction_dicts(batch_dict, pred_dicts, dataset.class_names)
+        num_frames += len(pred_dicts)
+        if num_frames >= args.num_frames:
+            break
+
+    # the first batch warms up the allocator and the dataloader
+    latency = np.mean(latencies[1:] if len(latencies) > 1 else latencies) / max(args.batch_size, 1) * 1000
+    report = {'ms/frame': latency}
+    for thresh in recall_thresh_list:
+        report['recall_%s' % str(thresh)] = metric['rcnn_%s' % str(thresh)] / max(metric['gt'], 1)
+    if args.full_eval:
+        result_str, _ = dataset.evaluation(
+            det_annos, dataset.class_names, eval_metric=cfg.MODEL.POST_PROCESSING.EVAL_METRIC
+        )
+        logger.info(result_str)
+    return report
+
+
+def build_synthetic_frame(syn_cfg, num_class, tta_views, rng):
+    """
+    Returns:
+        gt_boxes: (M, 8) [x, y, z, dx, dy, dz, heading, label]
+        box_preds: (V, N, 7) proposals of every view, in the frame of the view
+        cls_preds: (V, N, num_class) probabilities, N is the same for every view
+    """
+    num_objects = syn_cfg.NUM_OBJECTS
+    labels = rng.integers(0, num_class, num_objects)
+    gt_boxes = np.zeros((num_objects, 8), dtype=np.float32)
+    gt_boxes[:, 0:2] = rng.uniform(-syn_cfg.SCENE_RANGE, syn_cfg.SCENE_RANGE, (num_objects, 2))
+    gt_boxes[:, 3:6] = np.array(syn_cfg.MEAN_SIZE)[labels] * rng.uniform(0.9, 1.1, (num_objects, 3))
+    gt_boxes[:, 2] = gt_boxes[:, 5] / 2
+    gt_boxes[:, 6] = rng.uniform(-np.pi, np.pi, num_objects)
+    gt_boxes[:, 7] = labels + 1
+
+    num_proposals = syn_cfg.PROPOSALS_PER_OBJECT
+    box_preds, cls_preds = [], []
+    for view in tta_views:
+        # every view sees the objects in its own frame and makes its own errors
+        proposals = np.repeat(tta_utils.transform_boxes(gt_boxes[:, 0:7], view), num_proposals, axis=0)
+        proposals[:, 0:3] += rng.normal(0, syn_cfg.CENTER_NOISE, (proposals.shape[0], 3)) * [1, 1, 0.3]
+        proposals[:, 3:6] *= np.exp(rng.normal(0, syn_cfg.SIZE_NOISE, (proposals.shape[0], 3)))
+        proposals[:, 6] += rng.normal(0, syn_cfg.HEADING_NOISE, proposals.shape[0])
+        scores = rng.beta(4, 2, proposals.shape[0])
+        missed = np.repeat(rng.random(num_objects) < syn_cfg.MISS_RATE, num_proposals)
+        scores[missed] = 0
+
+        false_positives = tta_utils.transform_boxes(
+            build_synthetic_frame_false_positives(syn_cfg, num_class, rng), view
+        )
+        fp_scores = rng.beta(1.5, 5, false_positives.shape[0])
+        proposal_labels = np.concatenate([np.repeat(labels, num_proposals), rng.integers(0, num_class, len(fp_scores))])
+
+        cur_cls_preds = np.zeros((len(proposal_labels), num_class), dtype=np.float32)
+        cur_cls_preds[np.arange(len(proposal_labels)), proposal_labels] = np.concatenate([scores, fp_scores])
+        box_preds.append(np.concatenate([proposals, false_positives], axis=0))
+        cls_preds.append(cur_cls_preds)
+    return gt_boxes, np.stack(box_preds).astype(np.float32), np.stack(cls_preds)
+
+
+def build_synthetic_frame_false_positives(syn_cfg, num_class, rng):
+    num_boxes = syn_cfg.NUM_FALSE_POSITIVES
+    boxes = np.zeros((num_boxes, 7), dtype=np.float32)
+    boxes[:, 0:2] = rng.uniform(-syn_cfg.SCENE_RANGE, syn_cfg.SCENE_RANGE, (num_boxes, 2))
+    boxes[:, 3:6] = np.array(syn_cfg.MEAN_SIZE)[rng.integers(0, num_class, num_boxes)]
+    boxes[:, 2] = boxes[:, 5] / 2
+    boxes[:, 6] = rng.uniform(-np.pi, np.pi, num_boxes)
+    return boxes
+
+
+class SyntheticDataset(object):
+    def __init__(self, class_names):
+        self.class_names = class_names
+
+
+def match_predictions(pred_dict, gt_boxes, iou_thresh):
+    """
+    greedy matching in score order, a gt box of the same class is matched at most once
+    """
+    matched = np.zeros(pred_dict['pred_boxes'].shape[0], dtype=bool)
+    if matched.shape[0] == 0:
+        return matched
+    iou3d = iou3d_nms_utils.boxes_iou3d_gpu(
+        pred_dict['pred_boxes'][:, 0:7].contiguous(), torch.from_numpy(gt_boxes[:, 0:7])
+    ).numpy()
+    iou3d[pred_dict['pred_labels'].numpy()[:, None] != gt_boxes[None, :, 7]] = 0
+    gt_taken = np.zeros(gt_boxes.shape[0], dtype=bool)
+    for k in np.argsort(-pred_dict['pred_scores'].numpy(), kind='stable'):
+        ious = np.where(gt_taken, 0, iou3d[k])
+        if ious.shape[0] > 0 and ious.max() > iou_thresh:
+            matched[k] = True
+            gt_taken[ious.argmax()] = True
+    return matched
+
+
+def average_precision(scores, matched, num_gt):
+    order = np.argsort(-scores, kind='stable')
+    tp = np.cumsum(matched[order])
+    precision = tp / np.arange(1, len(order) + 1)
+    # all-point interpolation: precision envelope integrated over the recall steps
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    return float((precision * matched[order]).sum() / max(num_gt, 1))
+
+
+def run_synthetic_policy(model, frames, tta_views, args):
+    """
+    runs Detector3DTemplate.post_processing (per-view NMS, view fusion and recall) on the synthetic proposals
+    """
+    recall_thresh_list = cfg.MODEL.POST_PROCESSING.RECALL_THRESH_LIST
+    metric = {'gt': 0, **{'rcnn_%s' % str(thresh): 0 for thresh in recall_thresh_list}}
+    num_views = len(tta_views)
+    latencies, num_boxes, pred_scores, pred_matched = [], 0, [], []
+    for start in range(0, len(frames), args.batch_size):
+        batch = frames[start:start + args.batch_size]
+        batch_dict = {
+            'batch_size': len(batch) * num_views,
+            'batch_box_preds': torch.from_numpy(np.concatenate([box_preds for _, box_preds, _ in batch])),
+            'batch_cls_preds': torch.from_numpy(np.concatenate([cls_preds for _, _, cls_preds in batch])),
+            'cls_preds_normalized': True,
+            'gt_boxes': torch.from_numpy(np.stack([gt_boxes for gt_boxes, _, _ in batch])),
+        }
+        if num_views > 1:
+            batch_dict['tta_view'] = torch.from_numpy(np.tile(tta_views, (len(batch), 1)))
+
+        start_time = time.perf_counter()
+        pred_dicts, ret_dict = model.post_processing(batch_dict)
+        latencies.append(time.perf_counter() - start_time)
+
+        for key in metric:
+            metric[key] += ret_dict.get(key, 0)
+        for pred_dict, (gt_boxes, _, _) in zip(pred_dicts, batch):
+            num_boxes += pred_dict['pred_boxes'].shape[0]
+            pred_scores.append(pred_dict['pred_scores'].numpy())
+            pred_matched.append(match_predictions(pred_dict, gt_boxes, recall_thresh_list[0]))
+
+    report = {'ms/frame': np.sum(latencies) / len(frames) * 1000, 'boxes/frame': num_boxes / len(frames),
+              'ap_%s' % str(recall_thresh_list[0]): average_precision(
+                  np.concatenate(pred_scores), np.concatenate(pred_matched), metric['gt'])}
+    for thresh in recall_thresh_list:
+        report['recall_%s' % str(thresh)] = metric['rcnn_%s' % str(thresh)] / max(metric['gt'], 1)
+    return report
+
+
+def main_synthetic(args, cfg, logger):
+    syn_cfg = cfg.SYNTHETIC
+    model = Detector3DTemplate(
+        model_cfg=cfg.MODEL, num_class=len(cfg.CLASS_NAMES), dataset=SyntheticDataset(cfg.CLASS_NAMES)
+    )
+    model.eval()
+
+    reports = []
+    for policy in args.policies:
+        tta_cfg = TTA_POLICIES[policy]
+        tta_views = tta_utils.get_tta_views(tta_cfg) if tta_cfg is not None else tta_utils.get_tta_views({})
+        rng = np.random.default_rng(args.seed)
+        frames = [
+            build_synthetic_frame(syn_cfg, len(cfg.CLASS_NAMES), tta_views, rng) for _ in range(syn_cfg.NUM_FRAMES)
+        ]
+        for fusion in (args.fusions if len(tta_views) > 1 else ['-']):
+            cfg.MODEL.POST_PROCESSING.TTA_FUSION = EasyDict({'METHOD': fusion, 'IOU_THRESH': args.iou_thresh})
+            with torch.no_grad():
+                report = run_synthetic_policy(model, frames, tta_views, args)
+            reports.append((policy, len(tta_views), fusion, report))
+    return reports
+
+
+def main():
+    args, cfg = parse_config()
+    common_utils.set_random_seed(args.seed)
+    logger = common_utils.create_logger()
+
+    if args.synthetic:
+        reports = main_synthetic(args, cfg, logger)
+        logger.info('synthetic proposals (%s), %d frames, ms/frame is the post-processing only' % (
+            args.cfg_file, cfg.SYNTHETIC.NUM_FRAMES))
+
+    model = None
+    reports = reports if args.synthetic else []
+    for policy in (args.policies if not args.synthetic else []):
+        cfg.DATA_CONFIG.TEST_TIME_AUGMENTATION = EasyDict(TTA_POLICIES[policy]) \
+            if TTA_POLICIES[policy] is not None else None
+        test_set, test_loader, _ = build_dataloader(
+            dataset_cfg=cfg.DATA_CONFIG, class_names=cfg.CLASS_NAMES, batch_size=args.batch_size, dist=False,
+            workers=args.workers, logger=logger, training=False
+        )
+        num_views = len(test_set.tta_views) if test_set.tta_views is not None else 1
+        if model is None:
+            model = build_network(model_cfg=cfg.MODEL, num_class=len(cfg.CLASS_NAMES), dataset=test_set)
+            model.load_params_from_file(filename=args.ckpt, logger=logger, to_cpu=args.device == 'cpu')
+            model.to(args.device)
+            model.eval()
+            if hasattr(model, 'set_cur_epoch'):
+                model.set_cur_epoch(cfg.OPTIMIZATION.NUM_EPOCHS)
+
+        for fusion in (args.fusions if num_views > 1 else ['-']):
+            cfg.MODEL.POST_PROCESSING.TTA_FUSION = EasyDict({'METHOD': fusion, 'IOU_THRESH': args.iou_thresh})
+            report = run_policy(model, test_loader, args, logger)
+            reports.append((policy, num_views, fusion, report))
+            logger.info('%s (%d views, %s): %s' % (policy, num_views, fusion, report))
+
+    logger.info('%-20s %6s %6s %10s %s' % ('policy', 'views', 'fusion', 'ms/frame', 'recall'))
+    for policy, num_views, fusion, report in reports:
+        recalls = ' '.join(['%s=%.4f' % (key, val) for key, val in report.items()
+                            if key.startswith('recall') or key.startswith('ap_') or key == 'boxes/frame'])
+        logger.info('%-20s %6d %6s %10.1f %s' % (policy, num_views, fusion, report['ms/frame'], recalls))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+import time
+
+import numpy as np
+import torch
+
+
+def time_it(func, repeat, device=None):
+    """
+    Args:
+        func: callable, run once as warm-up and then repeat times
+        repeat:
+        device: torch.device, the CUDA queue is drained around every run on a GPU
+
+    Returns:
+        out: output of the last run
+        latency: median milliseconds of a run
+    """
+    sync = device is not None and device.type == 'cuda'
+    out = func()
+    latencies = []
+    for _ in range(repeat):
+        if sync:
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        out = func()
+        if sync:
+            torch.cuda.synchronize()
+        latencies.append(time.perf_counter() - start)
+    return out, np.median(latencies) * 1000
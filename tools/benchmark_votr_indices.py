@@ -0,0 +1,328 @@
+import argparse
+
+import numpy as np
+import torch
+from easydict import EasyDict
+
+from pcdet.config import cfg_from_yaml_file
+from pcdet.ops.votr_ops import votr_sorted_utils
+
+from benchmark_utils.benchmark_utils import time_it
+
+# VoTr-SSD style layers, used when no --cfg_file is given
+DEFAULT_RANGE_SPEC = [[2, 5, 1, 2, 5, 1, 0, 3, 1], [5, 25, 5, 5, 25, 5, 0, 15, 2], [25, 125, 25, 25, 125, 25, 0, 15, 3]]
+DEFAULT_LAYERS = [
+    {'STRIDE': [1, 1, 1], 'SP_ATTENTION': [{'NAME': 'LocalAttention', 'SIZE': 32, 'RANGE': 1}]},
+    {'STRIDE': [2, 2, 2], 'SP_ATTENTION': [{'NAME': 'LocalAttention', 'SIZE': 32, 'RANGE': 1}]},
+    {'STRIDE': [2, 2, 2], 'SP_ATTENTION': [{'NAME': 'LocalAttention', 'SIZE': 32, 'RANGE': 1}]},
+    {'STRIDE': [2, 2, 2], 'SP_ATTENTION': [{'NAME': 'LocalAttention', 'SIZE': 32, 'RANGE': 1}]},
+]
+DEFAULT_SUBM_ATTENTION = [
+    {'NAME': 'LocalAttention', 'SIZE': 16, 'RANGE': 1},
+    {'NAME': 'StridedAttention', 'SIZE': 16, 'RANGE_SPEC': DEFAULT_RANGE_SPEC},
+]
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='per-layer latency of the VoTr attention indices backends')
+    parser.add_argument('--cfg_file', type=str, default=None, help='VoTr model config, VoTr-SSD style layers if not set')
+    parser.add_argument('--grid_size', type=int, nargs=3, default=[1408, 1600, 41], help='x y z voxels')
+    parser.add_argument('--voxel_size', type=float, nargs=3, default=[0.05, 0.05, 0.1], help='')
+    parser.add_argument('--point_cloud_range', type=float, nargs=6, default=[0, -40, -3, 70.4, 40, 1], help='')
+    parser.add_argument('--num_points', type=int, default=20000, help='points of the synthetic scan')
+    parser.add_argument('--batch_size', type=int, default=2, help='')
+    parser.add_argument('--device', type=str, default='cpu', help='')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs of every step')
+    parser.add_argument('--parity_only', action='store_true', default=False,
+                        help='only check the searchsorted indices against the hash kernels on a small sparse tensor')
+    parser.add_argument('--seed', type=int, default=0, help='')
+    return parser.parse_args()
+
+
+def build_layers(cfg_file):
+    if cfg_file is None:
+        return [EasyDict({'STRIDE': layer['STRIDE'], 'SP_ATTENTION': layer['SP_ATTENTION'],
+                          'SUBM_ATTENTION': DEFAULT_SUBM_ATTENTION, 'NUM_DS_VOXELS': 90000})
+                for layer in DEFAULT_LAYERS]
+    cfg = EasyDict()
+    cfg_from_yaml_file(cfg_file, cfg)
+    return [EasyDict({'STRIDE': param.SP_CFGS.STRIDE, 'SP_ATTENTION': param.SP_CFGS.ATTENTION,
+                      'SUBM_ATTENTION': param.SUBM_CFGS.ATTENTION, 'NUM_DS_VOXELS': param.SP_CFGS.NUM_DS_VOXELS})
+            for param in cfg.MODEL.BACKBONE_3D.PARAMS]
+
+
+def build_scan_voxels(args, rng):
+    """
+    A rotating-lidar like scan: rings on the ground plane plus clusters of points on a few objects.
+    """
+    num_ground = args.num_points * 3 // 4
+    radius = 2.0 + 68.0 * rng.random(num_ground) ** 2
+    angle = rng.uniform(-np.pi / 4, np.pi / 4, num_ground)
+    ground = np.stack([radius * np.cos(angle), radius * np.sin(angle), rng.normal(-1.7, 0.05, num_ground)], axis=1)
+
+    num_objects = 30
+    centers = np.stack([rng.uniform(5, 65, num_objects), rng.uniform(-30, 30, num_objects),
+                        np.full(num_objects, -0.9)], axis=1)
+    num_object_points = args.num_points - num_ground
+    objects = centers[rng.integers(0, num_objects, num_object_points)] + \
+        rng.uniform(-1, 1, (num_object_points, 3)) * [2.0, 0.9, 0.8]
+
+    points = np.concatenate([ground, objects], axis=0)
+    pc_range = np.array(args.point_cloud_range)
+    coords = np.floor((points - pc_range[0:3]) / np.array(args.voxel_size)).astype(np.int64)
+    mask = np.all((coords >= 0) & (coords < np.array(args.grid_size)), axis=1)
+    return np.unique(coords[mask][:, ::-1], axis=0)  # (z, y, x)
+
+
+def attention_indices(backend, spatial_shape, mode, map_table, voxel_indices, strides=None):
+    if backend == 'searchsorted':
+        utils, suffix = votr_sorted_utils, ''
+    else:
+        from pcdet.ops.votr_ops import votr_utils
+        utils, suffix = votr_utils, '_hash'
+    kind = 'sparse' if strides is not None else 'subm'
+    name = 'local' if mode.NAME == 'LocalAttention' else 'strided'
+    func = getattr(utils, '%s_%s_attention%s_indices' % (kind, name, suffix))
+    spec = mode.RANGE if mode.NAME == 'LocalAttention' else mode.RANGE_SPEC
+    if strides is not None:
+        return func(spatial_shape, mode.SIZE, spec, strides, map_table, voxel_indices)
+    return func(spatial_shape, mode.SIZE, spec, map_table, voxel_indices)
+
+
+def random_sparse_tensor(batch_size, spatial_shape, num_voxels, rng):
+    """
+    Returns:
+        voxel_indices: (N, 4) unique (bs_idx, z, y, x) sorted by bs_idx, half of them in a few dense blobs so that
+            attend_size is reached, the others scattered over the grid
+    """
+    x_max, y_max, z_max = spatial_shape
+    voxel_indices = []
+    for bs_idx in range(batch_size):
+        centers = rng.integers(0, [z_max, y_max, x_max], (4, 3))
+        blobs = centers[rng.integers(0, 4, num_voxels // 2)] + rng.integers(-2, 3, (num_voxels // 2, 3))
+        scattered = rng.integers(0, [z_max, y_max, x_max], (num_voxels - num_voxels // 2, 3))
+        coords = np.clip(np.concatenate([blobs, scattered], axis=0), 0, [z_max - 1, y_max - 1, x_max - 1])
+        coords = np.unique(coords, axis=0)
+        voxel_indices.append(np.concatenate([np.full((coords.shape[0], 1), bs_idx), coords], axis=1))
+    return torch.from_numpy(np.concatenate(voxel_indices, axis=0)).int()
+
+
+def hash_kernel_indices(spatial_shape, mode, attend_voxels, query_voxels, strides=None):
+    """
+    Line by line python port of the *_attention_with_hash_kernel loops of build_attention_indices_gpu.cu, with a
+    dict per sample in place of the hash table. Reference of the searchsorted backend where CUDA is not available.
+    """
+    x_max, y_max, z_max = spatial_shape
+    subm = strides is None
+    x_stride, y_stride, z_stride = (1, 1, 1) if subm else strides
+    tables = {}
+    for bs_idx, z, y, x in attend_voxels.tolist():
+        table = tables.setdefault(bs_idx, {})
+        table[(z, y, x)] = len(table)
+
+    def in_grid(z, y, x):
+        return 0 <= z < z_max and 0 <= y < y_max and 0 <= x < x_max
+
+    if mode.NAME == 'LocalAttention':
+        r = mode.RANGE
+
+        def candidates(z, y, x):
+            ranges = [range(z * z_stride - r, z * z_stride + z_stride + r),
+                      range(y * y_stride - r, y * y_stride + y_stride + r),
+                      range(x * x_stride - r, x * x_stride + x_stride + r)]
+            for sz in ranges[0]:
+                for sy in ranges[1]:
+                    for sx in ranges[2]:
+                        yield sz, sy, sx
+    else:
+        def axis(idx, offset, stride):
+            if subm:
+                step = 2 * offset if offset > 0 else 1
+                return range(idx - offset, idx + offset + 1, step)
+            step = 2 * offset + stride - 1
+            start = idx * stride - offset
+            # a zero step never advances in the kernel, the position is visited once
+            return range(start, idx * stride + stride + offset, step) if step > 0 else [start]
+
+        def candidates(z, y, x):
+            for x_start, x_end, x_step, y_start, y_end, y_step, z_start, z_end, z_step in mode.RANGE_SPEC:
+                for z_offset in range(0, z_end, z_step):
+                    for y_offset in range(0, y_end, y_step):
+                        for x_offset in range(0, x_end, x_step):
+                            if x_offset < x_start and y_offset < y_start and z_offset < z_start:
+                                continue
+                            for sz in axis(z, z_offset, z_stride):
+                                for sy in axis(y, y_offset, y_stride):
+                                    for sx in axis(x, x_offset, x_stride):
+                                        yield sz, sy, sx
+
+    # only the sparse local kernel attends from queries out of the grid
+    check_query = subm or mode.NAME == 'StridedAttention'
+    attend_indices = torch.full((query_voxels.shape[0], mode.SIZE), -1, dtype=torch.int32)
+    for q_idx, (bs_idx, z, y, x) in enumerate(query_voxels.tolist()):
+        if check_query and not in_grid(z, y, x):
+            continue
+        table, num_samples = tables.get(bs_idx, {}), 0
+        for sz, sy, sx in candidates(z, y, x):
+            if not in_grid(sz, sy, sx) or (sz, sy, sx) not in table:
+                continue
+            if num_samples >= mode.SIZE:
+                break
+            attend_indices[q_idx, num_samples] = table[(sz, sy, sx)]
+            num_samples += 1
+    return attend_indices
+
+
+def check_parity(args, spatial_shape=(40, 40, 12), num_voxels=600, strides=(2, 2, 2)):
+    """
+    searchsorted indices of every attention mode of the default layers against the python port of the hash kernels
+    on a small random sparse tensor, and against votr_utils as well on a GPU
+    """
+    device = torch.device(args.device)
+    compare_hash = device.type == 'cuda'
+    rng = np.random.default_rng(args.seed)
+    spatial_shape = list(spatial_shape)
+    ds_spatial_shape = [s // t for s, t in zip(spatial_shape, strides)]
+    voxel_indices = random_sparse_tensor(args.batch_size, spatial_shape, num_voxels, rng).to(device)
+    map_table = votr_sorted_utils.build_sorted_table(args.batch_size, spatial_shape, voxel_indices)
+    ds_indices, ds_map_table = votr_sorted_utils.sorted_table_down_sample(
+        list(strides), num_voxels, args.batch_size, ds_spatial_shape, voxel_indices
+    )
+    # NUM_DS_VOXELS caps the downsampled voxels of every sample, the kept ones are the first of the uncapped ones
+    num_ds_voxels = int(votr_sorted_utils.get_batch_cnt(ds_indices, args.batch_size).max()) // 2
+    capped_indices, (capped_keys, capped_v_idx) = votr_sorted_utils.sorted_table_down_sample(
+        list(strides), num_ds_voxels, args.batch_size, ds_spatial_shape, voxel_indices
+    )
+    capped_ref = ds_map_table[1] < num_ds_voxels
+    print('down sample capped to %d voxels per sample: %d voxels, same as the first ones uncapped: %s' % (
+        num_ds_voxels, capped_indices.shape[0],
+        torch.equal(capped_indices, ds_indices[capped_ref]) and torch.equal(capped_keys, ds_map_table[0][capped_ref])
+        and torch.equal(capped_v_idx, ds_map_table[1][capped_ref])
+    ))
+    # queries out of the grid have to attend to nothing
+    outside = torch.tensor([[0, -1, 0, 0], [0, 0, ds_spatial_shape[1], 0]], dtype=torch.int32, device=device)
+    ds_queries = torch.cat([ds_indices, outside], dim=0)
+
+    if compare_hash:
+        from pcdet.ops.votr_ops import votr_utils
+        hash_size = 4 * num_voxels
+        hash_table = votr_utils.build_hash_table(args.batch_size, hash_size, spatial_shape, voxel_indices,
+                                                 votr_sorted_utils.get_batch_cnt(voxel_indices, args.batch_size))
+        hash_ds_indices, _ = votr_utils.hash_table_down_sample(
+            list(strides), ds_indices.shape[0], args.batch_size, hash_size, ds_spatial_shape, voxel_indices
+        )
+        # the hash path numbers the downsampled voxels in thread order, the subm indices are compared on a hash
+        # table of the sorted ones
+        hash_ds_keys = votr_sorted_utils.linearize_indices(*hash_ds_indices.long().unbind(dim=1), ds_spatial_shape)
+        print('down sample: %d voxels, same voxels as the hash path: %s' % (
+            ds_indices.shape[0], torch.equal(ds_map_table[0], torch.sort(hash_ds_keys)[0])))
+        ds_hash_table = votr_utils.build_hash_table(args.batch_size, hash_size, ds_spatial_shape, ds_indices,
+                                                    votr_sorted_utils.get_batch_cnt(ds_indices, args.batch_size))
+
+    layers = build_layers(None)
+    # small attend sizes, so that the kernels stop early on the blobs
+    strided_mode = EasyDict({'NAME': 'StridedAttention', 'SIZE': 16,
+                             'RANGE_SPEC': [[0, 2, 1, 0, 2, 1, 0, 2, 1], [2, 6, 2, 2, 6, 2, 0, 3, 1]]})
+    print('%d voxels in %d samples, grid %s, strides %s' % (
+        voxel_indices.shape[0], args.batch_size, spatial_shape, list(strides)))
+    print('%-28s %8s %12s %12s' % ('attention', 'queries', 'diff port', 'diff hash'))
+    num_mismatch = 0
+    modes = [(False, EasyDict({**mode, 'SIZE': 16})) for mode in layers[1].SP_ATTENTION] + [(False, strided_mode)] + \
+        [(True, EasyDict({**mode, 'SIZE': 8})) for mode in layers[1].SUBM_ATTENTION]
+    for subm, mode in modes:
+        if subm:
+            shape, table, attend_voxels, mode_strides = ds_spatial_shape, ds_map_table, ds_indices, None
+        else:
+            shape, table, attend_voxels, mode_strides = spatial_shape, map_table, voxel_indices, list(strides)
+        indices = attention_indices('searchsorted', shape, mode, table, ds_queries, mode_strides)
+        reference = hash_kernel_indices(shape, mode, attend_voxels.cpu(), ds_queries.cpu(), mode_strides)
+        port_diff = (indices.cpu() != reference).any(dim=1).sum().item()
+        num_mismatch += port_diff
+        hash_diff = '-'
+        if compare_hash:
+            table = ds_hash_table if subm else hash_table
+            hash_indices = attention_indices('hash', shape, mode, table, ds_queries, mode_strides)
+            hash_diff = (indices != hash_indices).any(dim=1).sum().item()
+            num_mismatch += hash_diff
+        print('%-28s %8d %12d %12s' % (
+            '%s_%s' % ('subm' if subm else 'sparse', mode.NAME), indices.shape[0], port_diff, hash_diff))
+    print('queries with indices different from the hash kernels: %d' % num_mismatch)
+    return num_mismatch
+
+
+def main():
+    args = parse_config()
+    if args.parity_only:
+        check_parity(args)
+        return
+    device = torch.device(args.device)
+    rng = np.random.default_rng(args.seed)
+    layers = build_layers(args.cfg_file)
+    compare_hash = device.type == 'cuda'
+
+    voxel_indices = []
+    for bs_idx in range(args.batch_size):
+        coords = torch.from_numpy(build_scan_voxels(args, rng))
+        voxel_indices.append(torch.cat([coords.new_full((coords.shape[0], 1), bs_idx), coords], dim=1))
+    voxel_indices = torch.cat(voxel_indices, dim=0).int().contiguous().to(device)
+    spatial_shape = list(args.grid_size)
+    print('%d voxels in %d scans, grid %s' % (voxel_indices.shape[0], args.batch_size, spatial_shape))
+
+    hash_size = 400000
+    for layer_idx, layer in enumerate(layers):
+        timings = {}
+        map_table, timings['map_table'] = time_it(
+            lambda: votr_sorted_utils.build_sorted_table(args.batch_size, spatial_shape, voxel_indices),
+            args.repeat, device
+        )
+        new_spatial_shape = [s // t for s, t in zip(spatial_shape, layer.STRIDE)]
+        (new_indices, new_map_table), timings['down_sample'] = time_it(
+            lambda: votr_sorted_utils.sorted_table_down_sample(layer.STRIDE, layer.NUM_DS_VOXELS, args.batch_size,
+                                                               new_spatial_shape, voxel_indices),
+            args.repeat, device
+        )
+
+        num_mismatch = 0
+        if compare_hash:
+            from pcdet.ops.votr_ops import votr_utils
+            v_bs_cnt = votr_sorted_utils.get_batch_cnt(voxel_indices, args.batch_size)
+            hash_table = votr_utils.build_hash_table(args.batch_size, hash_size, spatial_shape, voxel_indices, v_bs_cnt)
+            new_hash_table = votr_utils.build_hash_table(
+                args.batch_size, hash_size, new_spatial_shape, new_indices,
+                votr_sorted_utils.get_batch_cnt(new_indices, args.batch_size)
+            )
+
+        for mode in layer.SP_ATTENTION:
+            key = 'sparse_%s' % mode.NAME
+            indices, timings[key] = time_it(
+                lambda: attention_indices('searchsorted', spatial_shape, mode, map_table, new_indices, layer.STRIDE),
+                args.repeat, device
+            )
+            if compare_hash:
+                hash_indices = attention_indices('hash', spatial_shape, mode, hash_table, new_indices, layer.STRIDE)
+                num_mismatch += (indices != hash_indices).any(dim=1).sum().item()
+
+        for mode in layer.SUBM_ATTENTION:
+            key = 'subm_%s' % mode.NAME
+            indices, timings[key] = time_it(
+                lambda: attention_indices('searchsorted', new_spatial_shape, mode, new_map_table, new_indices),
+                args.repeat, device
+            )
+            if compare_hash:
+                hash_indices = attention_indices('hash', new_spatial_shape, mode, new_hash_table, new_indices)
+                num_mismatch += (indices != hash_indices).any(dim=1).sum().item()
+
+        print('layer %d: %d -> %d voxels, total %.2f ms' % (
+            layer_idx, voxel_indices.shape[0], new_indices.shape[0], sum(timings.values())))
+        for key, latency in timings.items():
+            print('    %-28s %8.2f ms' % (key, latency))
+        if compare_hash:
+            print('    voxels with indices different from the hash path: %d' % num_mismatch)
+
+        voxel_indices, spatial_shape = new_indices, new_spatial_shape
+
+    check_parity(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import argparse
+import copy
+
+import numpy as np
+from easydict import EasyDict
+
+from pcdet.datasets.augmentor.data_augmentor import DataAugmentor
+
+from benchmark_utils.benchmark_utils import time_it
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(
+        description='sequential world augmentation stages against the fused random_world_transform (FUSE_WORLD_AUG)'
+    )
+    parser.add_argument('--num_points', type=int, nargs='+', default=[50000, 200000], help='points per frame')
+    parser.add_argument('--num_boxes', type=int, default=100, help='gt boxes per frame')
+    parser.add_argument('--num_point_features', type=int, default=5, help='x, y, z, intensity, elongation')
+    parser.add_argument('--translate_std', type=float, default=0.5, help='0 drops random_world_translation')
+    parser.add_argument('--num_seeds', type=int, default=20, help='seeds of the parity check')
+    parser.add_argument('--repeat', type=int, default=20, help='timed frames of each method')
+    return parser.parse_args()
+
+
+def build_aug_config(fuse, translate_std):
+    # the world augmentations of the waymo dataset configs, plus an optional translation
+    aug_config_list = [
+        {'NAME': 'random_world_flip', 'ALONG_AXIS_LIST': ['x', 'y']},
+        {'NAME': 'random_world_rotation', 'WORLD_ROT_ANGLE': [-0.78539816, 0.78539816]},
+        {'NAME': 'random_world_scaling', 'WORLD_SCALE_RANGE': [0.95, 1.05]},
+    ]
+    if translate_std > 0:
+        aug_config_list.append({'NAME': 'random_world_translation', 'WORLD_TRANSLATE_STD': translate_std})
+    return EasyDict({'DISABLE_AUG_LIST': [], 'FUSE_WORLD_AUG': fuse, 'AUG_CONFIG_LIST': aug_config_list})
+
+
+def build_frame(num_points, num_boxes, num_point_features, rng):
+    points = np.concatenate([
+        rng.uniform(-75, 75, (num_points, 2)), rng.uniform(-2, 4, (num_points, 1)),
+        rng.random((num_points, num_point_features - 3))
+    ], axis=1).astype(np.float32)
+    gt_boxes = np.concatenate([
+        rng.uniform(-70, 70, (num_boxes, 2)), rng.uniform(-1, 1, (num_boxes, 1)),
+        rng.uniform(0.5, 5, (num_boxes, 3)), rng.uniform(-np.pi, np.pi, (num_boxes, 1))
+    ], axis=1).astype(np.float32)
+    return {'points': points, 'gt_boxes': gt_boxes, 'gt_names': np.array(['Vehicle'] * num_boxes)}
+
+
+def run_augmentor(augmentor, frame, seed=None):
+    if seed is not None:
+        np.random.seed(seed)
+    return augmentor.forward(copy.deepcopy(frame))
+
+
+def main():
+    args = parse_config()
+    rng = np.random.default_rng(0)
+    augmentors = {
+        name: DataAugmentor(None, build_aug_config(fuse, args.translate_std), ['Vehicle'])
+        for name, fuse in [('sequential', False), ('fused', True)]
+    }
+
+    frame = build_frame(10000, args.num_boxes, args.num_point_features, rng)
+    max_point_diff, max_box_diff = 0, 0
+    for seed in range(args.num_seeds):
+        sequential = run_augmentor(augmentors['sequential'], frame, seed)
+        fused = run_augmentor(augmentors['fused'], frame, seed)
+        max_point_diff = max(max_point_diff, np.abs(sequential['points'] - fused['points']).max())
+        max_box_diff = max(max_box_diff, np.abs(sequential['gt_boxes'] - fused['gt_boxes']).max())
+    print('parity over %d seeds: max abs diff points %.2e, gt_boxes %.2e' % (
+        args.num_seeds, max_point_diff, max_box_diff))
+
+    print('%10s %16s %12s %12s %10s' % ('points', 'frame copy (ms)', 'seq. (ms)', 'fused (ms)', 'speed-up'))
+    for num_points in args.num_points:
+        frame = build_frame(num_points, args.num_boxes, args.num_point_features, rng)
+        _, copy_ms = time_it(lambda: copy.deepcopy(frame), args.repeat)
+        _, sequential_ms = time_it(lambda: run_augmentor(augmentors['sequential'], frame), args.repeat)
+        _, fused_ms = time_it(lambda: run_augmentor(augmentors['fused'], frame), args.repeat)
+        print('%10d %16.2f %12.2f %12.2f %9.2fx' % (
+            num_points, copy_ms, sequential_ms, fused_ms, (sequential_ms - copy_ms) / (fused_ms - copy_ms)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+import argparse
+from pathlib import Path
+
+import numpy as np
+import torch
+
+from pcdet.config import cfg, cfg_from_list, cfg_from_yaml_file
+from pcdet.datasets import DatasetTemplate
+from pcdet.models import build_network
+from pcdet.utils import common_utils
+from serve_utils.inference_service import InferenceService, SyntheticClient
+
+
+def parse_config():
+    parser = argparse.ArgumentParser(description='arg parser')
+    parser.add_argument('--cfg_file', type=str, default='cfgs/waymo_p2s.yaml',
+                        help='specify the config for serving')
+    parser.add_argument('--ckpt', type=str, default=None, help='specify the pretrained model')
+    parser.add_argument('--device', type=str, default='cpu', help='device the model runs on')
+    parser.add_argument('--workers', type=int, default=2, help='number of preprocessing workers')
+    parser.add_argument('--max_batch_size', type=int, default=4, help='max number of frames per micro-batch')
+    parser.add_argument('--max_wait_ms', type=float, default=10, help='max waiting time of a micro-batch')
+    parser.add_argument('--num_requests', type=int, default=200, help='number of synthetic requests')
+    parser.add_argument('--request_rate', type=float, default=10, help='synthetic requests per second')
+    parser.add_argument('--num_points', type=int, default=20000, help='number of points per synthetic frame')
+    parser.add_argument('--set', dest='set_cfgs', default=None, nargs=argparse.REMAINDER,
+                        help='set extra config keys if needed')
+
+    args = parser.parse_args()
+
+    cfg_from_yaml_file(args.cfg_file, cfg)
+    if args.set_cfgs is not None:
+        cfg_from_list(args.set_cfgs, cfg)
+
+    return args, cfg
+
+
+def main():
+    args, cfg = parse_config()
+    logger = common_utils.create_logger()
+    logger.info('-----------------Inference Service of OpenPCDet-------------------------')
+    dataset = DatasetTemplate(
+        dataset_cfg=cfg.DATA_CONFIG, class_names=cfg.CLASS_NAMES, training=False,
+        root_path=Path('.'), logger=logger
+    )
+
+    model = build_network(model_cfg=cfg.MODEL, num_class=len(cfg.CLASS_NAMES), dataset=dataset)
+    if args.ckpt is not None:
+        model.load_params_from_file(filename=args.ckpt, logger=logger, to_cpu=True)
+    model.to(torch.device(args.device))
+    model.eval()
+
+    service = InferenceService(
+        model, dataset, max_batch_size=args.max_batch_size, max_wait_ms=args.max_wait_ms,
+        num_workers=args.workers, device=args.device, logger=logger
+    )
+    num_point_features = len(cfg.DATA_CONFIG.POINT_FEATURE_ENCODING.src_feature_list)
+    client = SyntheticClient(
+        service, cfg.DATA_CONFIG.POINT_CLOUD_RANGE, num_points=args.num_points,
+        num_point_features=num_point_features
+    )
+
+    with service:
+        client.run(num_requests=min(args.max_batch_size * 2, args.num_requests), request_rate=0)  # warm up
+        stats = client.run(num_requests=args.num_requests, request_rate=args.request_rate)
+
+    for key, val in stats.items():
+        logger.info('%s: %s' % (key, np.round(val, 3)))
+    logger.info('Serving done.')
+
+
+if __name__ == '__main__':
+    main()
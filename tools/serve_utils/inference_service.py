@@ -0,0 +1,209 @@
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from pcdet.models import load_data_to_gpu
+
+
+class InferenceRequest(object):
+    def __init__(self, points, frame_id):
+        self.points = points
+        self.frame_id = frame_id
+        self.future = Future()
+        self.submit_time = time.perf_counter()
+        self.data_dict = None
+
+
+class InferenceService(object):
+    """
+    Serves a detector behind a request queue:
+        submit() -> preprocessing worker pool (dataset.prepare_data) -> micro-batcher -> model.forward -> Future
+
+    A micro-batch is closed as soon as it holds max_batch_size samples, or max_wait_ms after its first sample
+    arrived, whichever happens first.
+    """
+    def __init__(self, model, dataset, max_batch_size=4, max_wait_ms=10, num_workers=2, device='cpu', logger=None):
+        """
+        Args:
+            model: detector in eval mode, already moved to device
+            dataset: DatasetTemplate whose prepare_data / collate_batch are used for preprocessing
+            max_batch_size: max number of samples forwarded together
+            max_wait_ms: max time the first sample of a micro-batch waits for more samples
+            num_workers: number of preprocessing threads
+            device: device the model runs on
+            logger:
+        """
+        self.model = model
+        self.dataset = dataset
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.num_workers = num_workers
+        self.device = torch.device(device)
+        self.logger = logger
+
+        self.ready_queue = queue.Queue()
+        self.preprocess_pool = None
+        self.batch_thread = None
+        self.stop_event = threading.Event()
+        # next() of itertools.count is atomic, submit() may be called from several client threads
+        self.frame_cnt = itertools.count()
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.batch_sizes = []
+        self.latencies = []
+
+    def start(self):
+        self.stop_event.clear()
+        self.preprocess_pool = ThreadPoolExecutor(max_workers=self.num_workers)
+        self.batch_thread = threading.Thread(target=self._batch_loop, daemon=True)
+        self.batch_thread.start()
+        return self
+
+    def stop(self):
+        if self.preprocess_pool is not None:
+            self.preprocess_pool.shutdown(wait=True)
+            self.preprocess_pool = None
+        self.stop_event.set()
+        if self.batch_thread is not None:
+            self.batch_thread.join()
+            self.batch_thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def submit(self, points, frame_id=None):
+        """
+        Args:
+            points: (N, 3 + C_in) numpy array in the unified normative coordinate
+            frame_id: optional
+        Returns:
+            future: resolves to the pred_dict of this frame with tensors on CPU
+        """
+        assert self.preprocess_pool is not None, 'InferenceService should be started before submitting requests'
+        frame_idx = next(self.frame_cnt)
+        if frame_id is None:
+            frame_id = frame_idx
+
+        request = InferenceRequest(points, frame_id)
+        self.preprocess_pool.submit(self._preprocess, request)
+        return request.future
+
+    def _preprocess(self, request):
+        try:
+            request.data_dict = self.dataset.prepare_data(data_dict={
+                'points': request.points,
+                'frame_id': request.frame_id,
+            })
+        except Exception as e:
+            request.future.set_exception(e)
+            return
+        self.ready_queue.put(request)
+
+    def _next_batch(self):
+        try:
+            first = self.ready_queue.get(timeout=0.05)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.ready_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _batch_loop(self):
+        while not (self.stop_event.is_set() and self.ready_queue.empty()):
+            batch = self._next_batch()
+            if len(batch) == 0:
+                continue
+            try:
+                pred_dicts = self._forward([request.data_dict for request in batch])
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            self.batch_sizes.append(len(batch))
+            finish_time = time.perf_counter()
+            for request, pred_dict in zip(batch, pred_dicts):
+                self.latencies.append(finish_time - request.submit_time)
+                request.future.set_result(pred_dict)
+
+    def _forward(self, data_dict_list):
+        batch_dict = self.dataset.collate_batch(data_dict_list)
+        load_data_to_gpu(batch_dict, self.device)
+        with torch.no_grad():
+            pred_dicts, _ = self.model(batch_dict)
+
+        ret_list = []
+        for pred_dict in pred_dicts:
+            ret_list.append({
+                key: val.cpu() if isinstance(val, torch.Tensor) else val for key, val in pred_dict.items()
+            })
+        return ret_list
+
+
+class SyntheticClient(object):
+    """
+    Local stand-in for remote callers: submits random point clouds at a fixed rate with exponential
+    inter-arrival times and measures the end-to-end latency of every request.
+    """
+    def __init__(self, service, point_cloud_range, num_points=20000, num_point_features=4, seed=0):
+        self.service = service
+        self.point_cloud_range = np.array(point_cloud_range, dtype=np.float32)
+        self.num_points = num_points
+        self.num_point_features = num_point_features
+        self.rng = np.random.RandomState(seed)
+
+    def generate_points(self):
+        points = self.rng.rand(self.num_points, self.num_point_features).astype(np.float32)
+        points[:, 0:3] = self.point_cloud_range[0:3] + \
+            points[:, 0:3] * (self.point_cloud_range[3:6] - self.point_cloud_range[0:3])
+        return points
+
+    def run(self, num_requests, request_rate):
+        """
+        Args:
+            num_requests:
+            request_rate: requests per second, <= 0 submits everything at once
+        Returns:
+            stats: dict of latency percentiles (ms), throughput (frames/s) and mean micro-batch size
+        """
+        payloads = [self.generate_points() for _ in range(num_requests)]
+        self.service.reset_stats()
+
+        futures = []
+        start_time = time.perf_counter()
+        for points in payloads:
+            futures.append(self.service.submit(points))
+            if request_rate > 0:
+                time.sleep(self.rng.exponential(1.0 / request_rate))
+
+        num_failed = sum([future.exception() is not None for future in futures])
+        total_time = time.perf_counter() - start_time
+
+        latencies = np.array(self.service.latencies) * 1000
+        batch_sizes = self.service.batch_sizes
+        return {
+            'num_requests': num_requests,
+            'num_failed': num_failed,
+            'latency_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) > 0 else float('nan'),
+            'latency_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) > 0 else float('nan'),
+            'throughput_fps': len(latencies) / total_time,
+            'mean_batch_size': float(np.mean(batch_sizes)) if len(batch_sizes) > 0 else 0.0,
+        }
@@ -11,11 +11,11 @@ import torch.nn as nn
 from tensorboardX import SummaryWriter
 
 from pcdet.config import cfg, cfg_from_list, cfg_from_yaml_file, log_config_to_file
-from pcdet.datasets import build_dataloader
+from pcdet.datasets import build_dataloader, build_semi_dataloader
 from pcdet.models import build_network, model_fn_decorator
 from pcdet.utils import common_utils
-from train_utils.optimization import build_optimizer, build_scheduler
-from train_utils.train_utils import train_model
+from train_utils.optimizations import build_optimizer, build_scheduler
+from train_utils.train_utils import exclude_unused_parameters, freeze_parameters, train_model
 
 
 # os.environ["CUDA_VISIBLE_DEVICES"] = '7'
@@ -46,6 +46,8 @@ def parse_config():
     )
     parser.add_argument('--launcher', choices=['none', 'pytorch', 'slurm'], default='none')
     parser.add_argument('--tcp_port', type=int, default=8888, help='tcp port for distrbuted training')
+    parser.add_argument('--dist_backend', choices=['nccl', 'gloo'], default='nccl',
+                        help='backend for distributed training, gloo also runs on CPU')
     parser.add_argument('--sync_bn', action='store_true', default=False, help='whether to use sync bn')
     parser.add_argument('--fix_random_seed', action='store_true', default=False, help='')
     parser.add_argument('--ckpt_save_interval', type=int, default=1, help='number of training epochs')
@@ -85,7 +87,7 @@ def main():
         total_gpus = 1
     else:
         total_gpus, cfg.LOCAL_RANK = getattr(common_utils, 'init_dist_%s' % args.launcher)(
-            args.tcp_port, args.local_rank, backend='nccl'
+            args.tcp_port, args.local_rank, backend=args.dist_backend
         )
         dist_train = True
 
@@ -134,16 +136,32 @@ def main():
     tb_log = SummaryWriter(log_dir=str(output_dir / 'tensorboard')) if cfg.LOCAL_RANK == 0 else None
 
     # -----------------------create dataloader & network & optimizer---------------------------
-    train_set, train_loader, train_sampler = build_dataloader(
-        dataset_cfg=cfg.DATA_CONFIG,
-        class_names=cfg.CLASS_NAMES,
-        batch_size=args.batch_size,
-        dist=dist_train, workers=args.workers,
-        logger=logger,
-        training=True,
-        merge_all_iters_to_one_epoch=args.merge_all_iters_to_one_epoch,
-        total_epochs=args.epochs
-    )
+    semi_supervised = cfg.OPTIMIZATION.get('SEMI_SUPERVISED', None) is not None
+    unlabeled_loader = unlabeled_sampler = teacher_state = None
+    if semi_supervised:
+        # mean teacher: labeled and unlabeled loaders of (teacher, student) views
+        datasets, dataloaders, samplers = build_semi_dataloader(
+            dataset_cfg=cfg.DATA_CONFIG,
+            class_names=cfg.CLASS_NAMES,
+            batch_size=args.batch_size,
+            dist=dist_train, workers=args.workers,
+            logger=logger,
+            merge_all_iters_to_one_epoch=args.merge_all_iters_to_one_epoch,
+            total_epochs=args.epochs
+        )
+        train_set, train_loader, train_sampler = datasets['labeled'], dataloaders['labeled'], samplers['labeled']
+        unlabeled_loader, unlabeled_sampler = dataloaders['unlabeled'], samplers['unlabeled']
+    else:
+        train_set, train_loader, train_sampler = build_dataloader(
+            dataset_cfg=cfg.DATA_CONFIG,
+            class_names=cfg.CLASS_NAMES,
+            batch_size=args.batch_size,
+            dist=dist_train, workers=args.workers,
+            logger=logger,
+            training=True,
+            merge_all_iters_to_one_epoch=args.merge_all_iters_to_one_epoch,
+            total_epochs=args.epochs
+        )
 
     # if args.runs_on == 'cloud':
     #     cfg.MODEL.PRE_PATH = cfg.MODEL.CLOUD_PRE_PATH
@@ -151,7 +169,8 @@ def main():
     model = build_network(model_cfg=cfg.MODEL, num_class=len(cfg.CLASS_NAMES), dataset=train_set)
     if args.sync_bn:
         model = torch.nn.SyncBatchNorm.convert_sync_batchnorm(model)
-    model.cuda()
+    if torch.cuda.is_available():
+        model.cuda()
 
     optimizer = build_optimizer(model, cfg.OPTIMIZATION)
 
@@ -164,6 +183,7 @@ def main():
     if args.pretrained_model is not None:
         model.load_params_from_file(filename=args.pretrained_model, to_cpu=dist, logger=logger)
 
+    resume_ckpt = args.ckpt
     if args.ckpt is not None:
         it, start_epoch = model.load_params_with_optimizer(args.ckpt, to_cpu=dist, optimizer=optimizer, logger=logger)
         last_epoch = start_epoch + 1
@@ -171,19 +191,42 @@ def main():
         ckpt_list = glob.glob(str(ckpt_dir / '*checkpoint_epoch_*.pth'))
         if len(ckpt_list) > 0:
             ckpt_list.sort(key=os.path.getmtime)
+            resume_ckpt = ckpt_list[-1]
             it, start_epoch = model.load_params_with_optimizer(
                 ckpt_list[-1], to_cpu=dist, optimizer=optimizer, logger=logger
             )
             last_epoch = start_epoch + 1
+    if semi_supervised and resume_ckpt is not None:
+        # without a saved teacher the teacher starts from the loaded student
+        teacher_state = torch.load(resume_ckpt, map_location='cpu').get('teacher_model_state', None)
 
     model.train()  # before wrap to DistributedDataParallel to support fixed some parameters
-    if dist_train:
-        model = nn.parallel.DistributedDataParallel(model, device_ids=[cfg.LOCAL_RANK % torch.cuda.device_count()], find_unused_parameters=True)
+    # a CPU model (gloo backend) is wrapped without device ids
+    device_ids = [cfg.LOCAL_RANK % torch.cuda.device_count()] if next(model.parameters()).is_cuda else None
+    if dist_train and cfg.OPTIMIZATION.get('DDP_STATIC_GRAPH', False):
+        # the mean teacher runs two forwards of the student (labeled / unlabeled) per step
+        assert not semi_supervised, 'DDP_STATIC_GRAPH is not supported with SEMI_SUPERVISED'
+        model.set_cur_epoch(start_epoch)
+        if cfg.OPTIMIZATION.get('DDP_UNUSED_PARAMS', None) is not None:
+            unused_names = freeze_parameters(model, cfg.OPTIMIZATION.DDP_UNUSED_PARAMS)
+        else:
+            # the probe batch is loaded in this process, the first frames of the rank's sampler
+            probe_inds = list(train_sampler)[:args.batch_size]
+            probe_batch = train_set.collate_batch([train_set[idx] for idx in probe_inds])
+            unused_names = exclude_unused_parameters(model, model_fn_decorator(), probe_batch, logger=logger)
+        logger.info('Parameters excluded from DDP (no gradient): %s' % unused_names)
+        model = nn.parallel.DistributedDataParallel(
+            model, device_ids=device_ids, find_unused_parameters=False, static_graph=True
+        )
+    elif dist_train:
+        model = nn.parallel.DistributedDataParallel(model, device_ids=device_ids, find_unused_parameters=True)
         # model = nn.parallel.DistributedDataParallel(model, device_ids=[cfg.LOCAL_RANK % torch.cuda.device_count()])
     logger.info(model)
 
+    # the schedulers count optimizer steps, GRAD_ACCUM_STEPS micro-batches make one step
+    accum_steps = cfg.OPTIMIZATION.get('GRAD_ACCUM_STEPS', 1)
     lr_scheduler, lr_warmup_scheduler = build_scheduler(
-        optimizer, total_iters_each_epoch=len(train_loader), total_epochs=args.epochs,
+        optimizer, total_iters_each_epoch=-(-len(train_loader) // accum_steps), total_epochs=args.epochs,
         last_epoch=last_epoch, optim_cfg=cfg.OPTIMIZATION
     )
 
@@ -207,7 +250,11 @@ def main():
         lr_warmup_scheduler=lr_warmup_scheduler,
         ckpt_save_interval=args.ckpt_save_interval,
         max_ckpt_save_num=args.max_ckpt_save_num,
-        merge_all_iters_to_one_epoch=args.merge_all_iters_to_one_epoch
+        merge_all_iters_to_one_epoch=args.merge_all_iters_to_one_epoch,
+        logger=logger,
+        unlabeled_loader=unlabeled_loader,
+        unlabeled_sampler=unlabeled_sampler,
+        teacher_state=teacher_state
     )
 
     logger.info('**********************End training %s/%s(%s)**********************\n\n\n'
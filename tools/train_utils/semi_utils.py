@@ -0,0 +1,196 @@
+import copy
+from collections import namedtuple
+
+import torch
+from torch.nn.utils.rnn import pad_sequence
+
+from pcdet.models import load_data_to_gpu
+
+ModelReturn = namedtuple('ModelReturn', ['loss', 'tb_dict', 'disp_dict'])
+
+
+def flatten_tensors_(tensors):
+    """
+    Moves the data of the tensors into one contiguous buffer, every tensor becomes a view of it.
+
+    Returns:
+        flat: (sum of numel)
+    """
+    flat = torch.cat([tensor.detach().reshape(-1) for tensor in tensors])
+    offset = 0
+    for tensor in tensors:
+        tensor.data = flat[offset:offset + tensor.numel()].view_as(tensor)
+        offset += tensor.numel()
+    return flat
+
+
+def get_view_transform(affine, heading):
+    """
+    Args:
+        affine: (B, 4, 4) world_affine of the views, transform of [x, y, z, 1] from the sample to the view
+        heading: (B, 2) world_heading of the views, [sign, offset]
+    Returns:
+        scale: (B), global scaling of the view
+        velocity_matrix: (B, 2, 2) rotation and flips of [vx, vy]
+    """
+    scale = affine[:, 0:3, 0].norm(dim=-1)
+    return scale, affine[:, 0:2, 0:2] / scale[:, None, None]
+
+
+def transform_boxes_between_views(boxes, src_affine, src_heading, dst_affine, dst_heading):
+    """
+    Args:
+        boxes: (B, N, 7 + C) [x, y, z, dx, dy, dz, heading, [vx], [vy]] in the source views
+        src_affine, dst_affine: (B, 4, 4) world_affine of the source / destination views of every sample
+        src_heading, dst_heading: (B, 2) world_heading of the source / destination views of every sample
+    Returns:
+        boxes: (B, N, 7 + C) in the destination views
+    """
+    relative = dst_affine @ torch.inverse(src_affine)
+    src_scale, src_velocity = get_view_transform(src_affine, src_heading)
+    dst_scale, dst_velocity = get_view_transform(dst_affine, dst_heading)
+
+    boxes = boxes.clone()
+    boxes[..., 0:3] = boxes[..., 0:3] @ relative[:, 0:3, 0:3].transpose(1, 2) + relative[:, None, 0:3, 3]
+    boxes[..., 3:6] *= (dst_scale / src_scale)[:, None, None]
+    # heading of the sample = src_sign * (heading - src_offset), the sign is +-1
+    sign = (dst_heading[:, 0] * src_heading[:, 0])[:, None]
+    boxes[..., 6] = sign * (boxes[..., 6] - src_heading[:, None, 1]) + dst_heading[:, None, 1]
+    if boxes.shape[-1] > 8:
+        # the augmentors do not scale the velocities
+        velocity_matrix = dst_velocity @ torch.inverse(src_velocity)
+        boxes[..., 7:9] = boxes[..., 7:9] @ velocity_matrix.transpose(1, 2)
+    return boxes
+
+
+class MeanTeacher(object):
+    """
+    Teacher of the mean teacher training (OPTIMIZATION.SEMI_SUPERVISED): an exponential moving average of the
+    student that labels the unlabeled samples.
+
+    The floating parameters and buffers of the teacher live in one flat buffer per dtype and device, so that an
+    update is one multiply of the buffer and one multi-tensor (foreach) add of the student tensors, collected once.
+    Pseudo-labels are filtered with per-class score thresholds on the padded predictions of the whole batch.
+    """
+    def __init__(self, model, semi_cfg, load_data_func=load_data_to_gpu):
+        self.decay = semi_cfg.get('EMA_DECAY', 0.999)
+        self.score_thresh = torch.tensor(semi_cfg.PSEUDO_SCORE_THRESH, dtype=torch.float32)
+        self.unlabeled_weight = semi_cfg.get('UNLABELED_WEIGHT', 1.0)
+        self.load_data_func = load_data_func
+
+        model = model.module if isinstance(model, torch.nn.parallel.DistributedDataParallel) else model
+        self.model = copy.deepcopy(model)
+        self.model.eval()
+        for param in self.model.parameters():
+            param.requires_grad_(False)
+
+        student_tensors = list(model.parameters()) + list(model.buffers())
+        teacher_tensors = list(self.model.parameters()) + list(self.model.buffers())
+        groups = {}
+        for student, teacher in zip(student_tensors, teacher_tensors):
+            key = (teacher.device, teacher.dtype) if teacher.is_floating_point() else None
+            groups.setdefault(key, ([], []))
+            # the optimizer updates the student tensors in place, the detached aliases stay valid
+            groups[key][0].append(student.detach())
+            groups[key][1].append(teacher)
+
+        # integer buffers (num_batches_tracked) are copied
+        self.copy_tensors = groups.pop(None, ([], []))
+        self.ema_groups = [
+            (flatten_tensors_(teacher_list), student_list, teacher_list)
+            for student_list, teacher_list in groups.values()
+        ]
+
+    @torch.no_grad()
+    def update(self):
+        for flat, student_list, teacher_list in self.ema_groups:
+            flat.mul_(self.decay)
+            torch._foreach_add_(teacher_list, student_list, alpha=1 - self.decay)
+        for student, teacher in zip(*self.copy_tensors):
+            teacher.copy_(student)
+
+    def set_cur_epoch(self, cur_epoch):
+        self.model.set_cur_epoch(cur_epoch)
+
+    def state_dict(self):
+        return self.model.state_dict()
+
+    def load_state_dict(self, state_dict):
+        # copies into the views of the flat buffers
+        self.model.load_state_dict(state_dict)
+
+    @torch.no_grad()
+    def filter_pseudo_labels(self, pred_dicts):
+        """
+        Args:
+            pred_dicts: list of B dicts, pred_boxes (N, 7 + C), pred_scores (N), pred_labels (N) starting from 1
+        Returns:
+            gt_boxes: (B, M, 7 + C + 1) [..., class], the boxes above the score threshold of their class, sorted by
+                the order of the predictions, zero padded
+            num_pseudo_labels: (B)
+        """
+        boxes = pad_sequence([x['pred_boxes'] for x in pred_dicts], batch_first=True)
+        scores = pad_sequence([x['pred_scores'] for x in pred_dicts], batch_first=True)
+        labels = pad_sequence([x['pred_labels'] for x in pred_dicts], batch_first=True)
+
+        score_thresh = self.score_thresh.to(scores.device)[(labels.long() - 1).clamp(min=0)]
+        keep = (labels > 0) & (scores >= score_thresh)
+        num_keep = keep.sum(dim=1)
+
+        # the kept boxes of every sample to the front, in their order, at least one zero row for the heads
+        max_keep = max(int(num_keep.max().item()) if num_keep.numel() > 0 else 0, 1)
+        order = torch.sort(keep.int(), dim=1, descending=True, stable=True)[1][:, :max_keep]
+        gt_boxes = torch.cat([boxes, labels[..., None].to(boxes.dtype)], dim=-1)
+        gt_boxes = gt_boxes.gather(1, order[..., None].expand(-1, -1, gt_boxes.shape[-1]))
+        valid = torch.arange(max_keep, device=gt_boxes.device)[None, :] < num_keep[:, None]
+        return gt_boxes * valid[..., None].to(gt_boxes.dtype), num_keep
+
+    @torch.no_grad()
+    def pseudo_label(self, teacher_batch, student_batch):
+        """
+        Args:
+            teacher_batch, student_batch: the two views of the same unlabeled samples, with world_affine and
+                world_heading (DATA_CONFIG.SHARED_VIEW_PREPROCESSING)
+        Returns:
+            gt_boxes: (B, M, 7 + C + 1) pseudo-labels in the student views
+            num_pseudo_labels: (B)
+        """
+        assert 'world_affine' in teacher_batch and 'world_affine' in student_batch, \
+            'the views of the unlabeled samples need world_affine, set DATA_CONFIG.SHARED_VIEW_PREPROCESSING'
+        self.model.eval()
+        pred_dicts, _ = self.model(teacher_batch)
+        gt_boxes, num_keep = self.filter_pseudo_labels(pred_dicts)
+        gt_boxes[..., :-1] = transform_boxes_between_views(
+            gt_boxes[..., :-1].float(), teacher_batch['world_affine'].float(), teacher_batch['world_heading'].float(),
+            student_batch['world_affine'].float(), student_batch['world_heading'].float()
+        ).to(gt_boxes.dtype)
+        valid = torch.arange(gt_boxes.shape[1], device=gt_boxes.device)[None, :] < num_keep[:, None]
+        return gt_boxes * valid[..., None].to(gt_boxes.dtype), num_keep
+
+    def model_func(self, model, batch):
+        """
+        Args:
+            model: the student
+            batch: (labeled_batch, unlabeled_batch), (teacher, student) views from the labeled / unlabeled loaders
+        Returns:
+            loss: loss of the labeled student views + UNLABELED_WEIGHT * loss of the unlabeled student views on the
+                pseudo-labels of the teacher
+        """
+        (_, labeled_batch), (unlabeled_teacher_batch, unlabeled_batch) = batch
+        for batch_dict in [labeled_batch, unlabeled_teacher_batch, unlabeled_batch]:
+            self.load_data_func(batch_dict)
+
+        unlabeled_batch['gt_boxes'], num_pseudo_labels = self.pseudo_label(unlabeled_teacher_batch, unlabeled_batch)
+        ret_dict, tb_dict, disp_dict = model(labeled_batch)
+        unlabeled_ret_dict, unlabeled_tb_dict, _ = model(unlabeled_batch)
+        loss = ret_dict['loss'].mean() + self.unlabeled_weight * unlabeled_ret_dict['loss'].mean()
+
+        tb_dict = {
+            **tb_dict, **{'unlabeled_' + key: val for key, val in unlabeled_tb_dict.items()},
+            'num_pseudo_labels': num_pseudo_labels.float().mean()
+        }
+        if hasattr(model, 'update_global_step'):
+            model.update_global_step()
+        else:
+            model.module.update_global_step()
+        return ModelReturn(loss, tb_dict, disp_dict)
@@ -1,15 +1,188 @@
+import contextlib
 import glob
+import numbers
 import os
+import threading
+import time
 
 import torch
+import torch.distributed as dist
 import tqdm
 from torch.nn.utils import clip_grad_norm_
 
+from pcdet.datasets.frame_sampling import pop_resample_count
+from pcdet.utils import common_utils
+
+
+class MetricsAccumulator(object):
+    """
+    Keeps per-key running sums of the training metrics on their own device, so that logging a step does not
+    force a host sync. reduce() returns the means since the last reduce with a single sync (and optionally a
+    single all-reduce across ranks). Non-numeric values are passed through as their latest value.
+    """
+    def __init__(self, dist_reduce=False, keys=None):
+        """
+        Args:
+            dist_reduce: all-reduce the sums and counts across ranks in reduce()
+            keys: the metrics that are all-reduced, with their prefix ('loss', 'tb/<key>', 'disp/<key>'), in a
+                fixed sorted order on every rank; a rank without a metric adds a zero sum and count.
+                None: the union of the keys of all ranks at the first reduce(), fixed from then on.
+                Metrics outside of keys are reported as the mean of the local rank.
+        """
+        self.dist_reduce = dist_reduce
+        self.keys = sorted(keys) if keys is not None else None
+        self.reset()
+
+    def reset(self):
+        self.sums = {}
+        self.counts = {}
+        self.latest = {}
+
+    def update(self, metrics, prefix=''):
+        for key, val in metrics.items():
+            key = prefix + key
+            if isinstance(val, torch.Tensor):
+                val = val.detach().float().mean()
+            elif isinstance(val, numbers.Number) and not isinstance(val, bool):
+                val = float(val)
+            else:
+                self.latest[key] = val
+                continue
+
+            self.sums[key] = self.sums[key] + val if key in self.sums else val
+            self.counts[key] = self.counts.get(key, 0) + 1
+
+    def reduce(self):
+        ret = dict(self.latest)
+        use_dist = self.dist_reduce and dist.is_available() and dist.is_initialized()
+        if use_dist and self.keys is None:
+            rank_keys = [None] * dist.get_world_size()
+            dist.all_gather_object(rank_keys, sorted(self.sums.keys()))
+            self.keys = sorted(set().union(*rank_keys))
+
+        # every rank all-reduces the same keys in the same order, the rank-local metrics are appended
+        dist_keys = self.keys if use_dist else []
+        keys = dist_keys + sorted([k for k in self.sums.keys() if k not in dist_keys])
+        if len(keys) == 0:
+            self.reset()
+            return ret
+
+        if use_dist and dist.get_backend() == 'nccl':
+            device = torch.device('cuda', torch.cuda.current_device())
+        else:
+            device = next((x.device for x in self.sums.values() if isinstance(x, torch.Tensor)), torch.device('cpu'))
+
+        sums = torch.stack([torch.as_tensor(self.sums.get(k, 0.0), dtype=torch.float32, device=device) for k in keys])
+        counts = torch.tensor([self.counts.get(k, 0) for k in keys], dtype=torch.float32, device=device)
+        if len(dist_keys) > 0:
+            stats = torch.stack([sums[:len(dist_keys)], counts[:len(dist_keys)]])
+            dist.all_reduce(stats)
+            sums = torch.cat([stats[0], sums[len(dist_keys):]])
+            counts = torch.cat([stats[1], counts[len(dist_keys):]])
+
+        means = (sums / counts.clamp(min=1)).tolist()
+        ret.update([(k, mean) for k, mean, count in zip(keys, means, counts.tolist()) if count > 0])
+        self.reset()
+        return ret
+
+
+def build_grad_scaler(model, optim_cfg):
+    """
+    Loss scaling is only needed for fp16 autocast on GPU, bf16 has the dynamic range of fp32.
+
+    Returns:
+        scaler: None without loss scaling, train_one_epoch then runs the plain fp32 update
+    """
+    use_amp = optim_cfg.get('USE_AMP', False)
+    amp_dtype = getattr(torch, optim_cfg.get('AMP_DTYPE', 'float16'))
+    device_type = next(model.parameters()).device.type
+    if not (use_amp and amp_dtype == torch.float16 and device_type == 'cuda'):
+        return None
+    if hasattr(torch, 'amp') and hasattr(torch.amp, 'GradScaler'):
+        return torch.amp.GradScaler(device_type)
+    return torch.cuda.amp.GradScaler()
+
+
+def freeze_parameters(model, name_prefixes):
+    """
+    Freezes the parameters whose names start with one of name_prefixes (OPTIMIZATION.DDP_UNUSED_PARAMS), the
+    config counterpart of exclude_unused_parameters.
+
+    Returns:
+        frozen_names: names of the frozen parameters
+    """
+    frozen_names = []
+    for name, param in model.named_parameters():
+        if param.requires_grad and name.startswith(tuple(name_prefixes)):
+            param.requires_grad_(False)
+            frozen_names.append(name)
+    return frozen_names
+
+
+def exclude_unused_parameters(model, model_func, batch, logger=None):
+    """
+    Runs one forward/backward pass on the unwrapped model and freezes the parameters that receive no gradient
+    on any rank (e.g. heads that do not contribute to the loss), so that DDP can be built with
+    find_unused_parameters=False and a static graph.
+
+    The buffers (BN running statistics, global_step) are restored after the pass, so the probe leaves no trace in
+    the model. A branch that is only skipped on the probe batch (e.g. no gt of a task) is frozen for the whole run,
+    so every frozen parameter is logged as a warning; OPTIMIZATION.DDP_UNUSED_PARAMS lists them explicitly instead.
+
+    Returns:
+        unused_names: names of the frozen parameters
+    """
+    model.train()
+    buffers = {name: buf.clone() for name, buf in model.named_buffers()}
+    loss, _, _ = model_func(model, batch)
+    loss.backward()
+    with torch.no_grad():
+        for name, buf in model.named_buffers():
+            buf.copy_(buffers[name])
+
+    params = [(name, param) for name, param in model.named_parameters() if param.requires_grad]
+    unused_mask = torch.tensor(
+        [param.grad is None for _, param in params], dtype=torch.int32, device=params[0][1].device
+    )
+    if dist.is_available() and dist.is_initialized():
+        dist.all_reduce(unused_mask, op=dist.ReduceOp.MIN)
+
+    unused_names = []
+    for (name, param), unused in zip(params, unused_mask.tolist()):
+        if unused:
+            param.requires_grad_(False)
+            unused_names.append(name)
+            if logger is not None:
+                logger.warning('%s got no gradient on the probe batch and is frozen for the whole run' % name)
+    model.zero_grad()
+    return unused_names
+
 
 def train_one_epoch(model, optimizer, train_loader, model_func, lr_scheduler, accumulated_iter, optim_cfg,
-                    rank, tbar, total_it_each_epoch, dataloader_iter, tb_log=None, leave_pbar=False):
+                    rank, tbar, total_it_each_epoch, dataloader_iter, tb_log=None, leave_pbar=False, scaler=None,
+                    mean_teacher=None, unlabeled_loader=None, epoch_stats=None):
+    """
+    With a mean_teacher, every batch pairs a batch of train_loader (labeled) with a batch of unlabeled_loader, the
+    loss comes from mean_teacher.model_func and the teacher is updated after every optimizer step.
+    epoch_stats: optional dict, 'resampled_frames' sums the frames re-sampled by the datasets of this rank
+    """
+    use_amp = optim_cfg.get('USE_AMP', False)
+    amp_dtype = getattr(torch, optim_cfg.get('AMP_DTYPE', 'float16'))
+    device_type = next(model.parameters()).device.type
+    if scaler is None:
+        scaler = build_grad_scaler(model, optim_cfg)
+
+    log_interval = optim_cfg.get('LOG_INTERVAL', 1)
+    accum_steps = optim_cfg.get('GRAD_ACCUM_STEPS', 1)
+    metrics = MetricsAccumulator(
+        dist_reduce=optim_cfg.get('LOG_ALL_REDUCE', False), keys=optim_cfg.get('LOG_KEYS', None)
+    )
+
     if total_it_each_epoch == len(train_loader):
         dataloader_iter = iter(train_loader)
+    if mean_teacher is not None:
+        model_func = mean_teacher.model_func
+        unlabeled_iter = iter(unlabeled_loader)
 
     if rank == 0:
         pbar = tqdm.tqdm(total=total_it_each_epoch, leave=leave_pbar, desc='train', dynamic_ncols=True)
@@ -22,50 +195,136 @@ def train_one_epoch(model, optimizer, train_loader, model_func, lr_scheduler, ac
             batch = next(dataloader_iter)
             print('new iters')
 
-        lr_scheduler.step(accumulated_iter)
+        if mean_teacher is not None:
+            try:
+                unlabeled_batch = next(unlabeled_iter)
+            except StopIteration:
+                unlabeled_iter = iter(unlabeled_loader)
+                unlabeled_batch = next(unlabeled_iter)
+            batch = (batch, unlabeled_batch)
+
+        num_resamples = pop_resample_count(batch)
+        if epoch_stats is not None:
+            epoch_stats['resampled_frames'] = epoch_stats.get('resampled_frames', 0) + num_resamples
+
+        # gradients of accum_steps micro-batches are summed before one optimizer step,
+        # the all-reduce of DDP only runs on the last micro-batch of each window
+        window_start = cur_it - cur_it % accum_steps
+        window_size = min(accum_steps, total_it_each_epoch - window_start)
+        is_update_step = cur_it + 1 == window_start + window_size
+
+        # accumulated_iter counts optimizer steps, the lr is set once per window
+        if cur_it == window_start:
+            lr_scheduler.step(accumulated_iter)
 
         try:
             cur_lr = float(optimizer.lr)
         except:
             cur_lr = optimizer.param_groups[0]['lr']
 
-        if tb_log is not None:
+        if tb_log is not None and cur_it == window_start:
             tb_log.add_scalar('meta_data/learning_rate', cur_lr, accumulated_iter)
 
         model.train()
-        optimizer.zero_grad()
 
-        loss, tb_dict, disp_dict = model_func(model, batch)
+        if cur_it == window_start:
+            optimizer.zero_grad()
 
-        loss.backward()
-        clip_grad_norm_(model.parameters(), optim_cfg.GRAD_NORM_CLIP)
-        optimizer.step()
+        # static-graph DDP records the graph on its first backward, which has to be synchronized;
+        # an extra all-reduce inside a window leaves the summed gradients unchanged
+        first_static_pass = cur_it == 0 and getattr(model, 'static_graph', False)
+        if not is_update_step and not first_static_pass and \
+                isinstance(model, torch.nn.parallel.DistributedDataParallel):
+            sync_context = model.no_sync()
+        else:
+            sync_context = contextlib.nullcontext()
+
+        with sync_context:
+            with common_utils.autocast(device_type, amp_dtype, enabled=use_amp):
+                loss, tb_dict, disp_dict = model_func(model, batch)
+            if scaler is not None:
+                scaler.scale(loss / window_size).backward()
+            else:
+                (loss / window_size).backward()
+
+        if is_update_step:
+            if scaler is not None:
+                scaler.unscale_(optimizer)  # clip the true gradients, not the scaled ones
+            clip_grad_norm_(model.parameters(), optim_cfg.GRAD_NORM_CLIP)
+            if scaler is not None:
+                scaler.step(optimizer)
+                scaler.update()
+            else:
+                optimizer.step()
+            if mean_teacher is not None:
+                mean_teacher.update()
+            accumulated_iter += 1
 
-        accumulated_iter += 1
-        disp_dict.update({'loss': loss.item(), 'lr': cur_lr})
+        metrics.update({'loss': loss})
+        metrics.update(tb_dict, prefix='tb/')
+        metrics.update(disp_dict, prefix='disp/')
 
-        # log to console and tensorboard
         if rank == 0:
             pbar.update()
             pbar.set_postfix(dict(total_it=accumulated_iter))
+
+        if (cur_it + 1) % log_interval != 0 and cur_it + 1 != total_it_each_epoch:
+            continue
+
+        # log to console and tensorboard, one device sync per log_interval iterations
+        reduced = metrics.reduce()
+        if rank == 0:
+            disp_dict = {key[len('disp/'):]: val for key, val in reduced.items() if key.startswith('disp/')}
+            disp_dict.update({'loss': reduced['loss'], 'lr': cur_lr})
             tbar.set_postfix(disp_dict)
             tbar.refresh()
 
             if tb_log is not None:
-                tb_log.add_scalar('train/loss', loss, accumulated_iter)
+                tb_log.add_scalar('train/loss', reduced['loss'], accumulated_iter)
                 tb_log.add_scalar('meta_data/learning_rate', cur_lr, accumulated_iter)
-                for key, val in tb_dict.items():
-                    tb_log.add_scalar('train/' + key, val, accumulated_iter)
+                for key, val in reduced.items():
+                    if key.startswith('tb/'):
+                        tb_log.add_scalar('train/' + key[len('tb/'):], val, accumulated_iter)
     if rank == 0:
         pbar.close()
     return accumulated_iter
 
 
+def log_frame_sampling_stats(epoch, epoch_stats, dataset, rank, logger):
+    """
+    Logs the frames re-sampled in the epoch because the augmentation removed all their boxes, summed over the
+    ranks, next to the frames without boxes that the sampler skips (FILTER_EMPTY_FRAMES).
+    """
+    num_resamples = torch.tensor([epoch_stats.get('resampled_frames', 0)], dtype=torch.int64)
+    if dist.is_available() and dist.is_initialized():
+        if dist.get_backend() == 'nccl':
+            num_resamples = num_resamples.cuda()
+        dist.all_reduce(num_resamples)
+    if rank != 0 or logger is None:
+        return
+
+    msg = 'Epoch %d: %d frames re-sampled after the augmentation removed all their boxes' % (
+        epoch, num_resamples.item())
+    num_empty_frames = getattr(dataset, 'num_empty_frames', None)
+    if num_empty_frames is not None:
+        msg += ', %d frames without boxes skipped' % num_empty_frames
+    logger.info(msg)
+
+
 def train_model(model, optimizer, train_loader, model_func, lr_scheduler, optim_cfg,
                 start_epoch, total_epochs, start_iter, rank, tb_log, ckpt_save_dir, train_sampler=None,
                 lr_warmup_scheduler=None, ckpt_save_interval=1, max_ckpt_save_num=50,
-                merge_all_iters_to_one_epoch=False):
+                merge_all_iters_to_one_epoch=False, logger=None, unlabeled_loader=None, unlabeled_sampler=None,
+                teacher_state=None):
     accumulated_iter = start_iter
+    scaler = build_grad_scaler(model, optim_cfg)
+    mean_teacher = None
+    if unlabeled_loader is not None:
+        from .semi_utils import MeanTeacher
+        mean_teacher = MeanTeacher(model, optim_cfg.SEMI_SUPERVISED)
+        if teacher_state is not None:
+            mean_teacher.load_state_dict(teacher_state)
+    ckpt_writer = CheckpointWriter(ckpt_save_dir, max_ckpt_save_num=max_ckpt_save_num, logger=logger)
     with tqdm.trange(start_epoch, total_epochs, desc='epochs', dynamic_ncols=True, leave=(rank == 0)) as tbar:
         total_it_each_epoch = len(train_loader)
         if merge_all_iters_to_one_epoch:
@@ -77,6 +336,8 @@ def train_model(model, optimizer, train_loader, model_func, lr_scheduler, optim_
         for cur_epoch in tbar:
             if train_sampler is not None:
                 train_sampler.set_epoch(cur_epoch)
+            if unlabeled_sampler is not None:
+                unlabeled_sampler.set_epoch(cur_epoch)
 
             # train one epoch
             if lr_warmup_scheduler is not None and cur_epoch < optim_cfg.WARMUP_EPOCH:
@@ -88,7 +349,10 @@ def train_model(model, optimizer, train_loader, model_func, lr_scheduler, optim_
                 model.set_cur_epoch(cur_epoch)
             else:
                 model.module.set_cur_epoch(cur_epoch)
+            if mean_teacher is not None:
+                mean_teacher.set_cur_epoch(cur_epoch)
 
+            epoch_stats = {}
             accumulated_iter = train_one_epoch(
                 model, optimizer, train_loader, model_func,
                 lr_scheduler=cur_scheduler,
@@ -96,24 +360,25 @@ def train_model(model, optimizer, train_loader, model_func, lr_scheduler, optim_
                 rank=rank, tbar=tbar, tb_log=tb_log,
                 leave_pbar=(cur_epoch + 1 == total_epochs),
                 total_it_each_epoch=total_it_each_epoch,
-                dataloader_iter=dataloader_iter
+                dataloader_iter=dataloader_iter,
+                scaler=scaler,
+                mean_teacher=mean_teacher,
+                unlabeled_loader=unlabeled_loader,
+                epoch_stats=epoch_stats
             )
+            log_frame_sampling_stats(cur_epoch + 1, epoch_stats, train_loader.dataset, rank, logger)
 
             # save trained model
             trained_epoch = cur_epoch + 1
             if trained_epoch % ckpt_save_interval == 0 and rank == 0:
-
-                ckpt_list = glob.glob(str(ckpt_save_dir / 'checkpoint_epoch_*.pth'))
-                ckpt_list.sort(key=os.path.getmtime)
-
-                if ckpt_list.__len__() >= max_ckpt_save_num:
-                    for cur_file_idx in range(0, len(ckpt_list) - max_ckpt_save_num + 1):
-                        os.remove(ckpt_list[cur_file_idx])
-
                 ckpt_name = ckpt_save_dir / ('checkpoint_epoch_%d' % trained_epoch)
-                save_checkpoint(
-                    checkpoint_state(model, optimizer, trained_epoch, accumulated_iter), filename=ckpt_name,
-                )
+                # CheckpointWriter.save copies the whole state to CPU once
+                state = checkpoint_state(model, optimizer, trained_epoch, accumulated_iter, model_to_cpu=False)
+                if mean_teacher is not None:
+                    state['teacher_model_state'] = mean_teacher.state_dict()
+                ckpt_writer.save(state, filename=ckpt_name)
+
+    ckpt_writer.close()
 
 
 def model_state_to_cpu(model_state):
@@ -123,11 +388,13 @@ def model_state_to_cpu(model_state):
     return model_state_cpu
 
 
-def checkpoint_state(model=None, optimizer=None, epoch=None, it=None):
+def checkpoint_state(model=None, optimizer=None, epoch=None, it=None, model_to_cpu=True):
     optim_state = optimizer.state_dict() if optimizer is not None else None
     if model is not None:
         if isinstance(model, torch.nn.parallel.DistributedDataParallel):
-            model_state = model_state_to_cpu(model.module.state_dict())
+            model_state = model.module.state_dict()
+            if model_to_cpu:
+                model_state = model_state_to_cpu(model_state)
         else:
             model_state = model.state_dict()
     else:
@@ -151,3 +418,89 @@ def save_checkpoint(state, filename='checkpoint'):
 
     filename = '{}.pth'.format(filename)
     torch.save(state, filename)
+
+
+def state_to_cpu(state):
+    """
+    Recursively copies all tensors of a (nested) checkpoint state to CPU, so that it stays valid while
+    training keeps updating the parameters and optimizer buffers in place.
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to(device='cpu', copy=True)
+    elif isinstance(state, dict):
+        return type(state)((key, state_to_cpu(val)) for key, val in state.items())
+    elif isinstance(state, (list, tuple)):
+        return type(state)(state_to_cpu(val) for val in state)
+    return state
+
+
+class CheckpointWriter(object):
+    """
+    Writes checkpoints in a background thread. The state is snapshotted to CPU on the training thread, then
+    torch.save goes to a temp file which is fsynced and atomically renamed, so a crash never leaves a
+    truncated checkpoint_epoch_*.pth behind for auto-resume. Old checkpoints are only removed after the new one
+    has been written. At most one write is in flight.
+    """
+    def __init__(self, ckpt_save_dir, max_ckpt_save_num=50, logger=None):
+        self.ckpt_save_dir = ckpt_save_dir
+        self.max_ckpt_save_num = max_ckpt_save_num
+        self.logger = logger
+        self.thread = None
+        self.error = None
+
+    def save(self, state, filename='checkpoint'):
+        start_time = time.time()
+        self.wait()
+        state = state_to_cpu(state)
+        stall_time = time.time() - start_time
+
+        filename = '{}.pth'.format(filename)
+        self.thread = threading.Thread(target=self._write, args=(state, filename, stall_time))
+        self.thread.start()
+
+    def wait(self):
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        self.wait()
+
+    def _write(self, state, filename, stall_time):
+        start_time = time.time()
+        tmp_filename = filename + '.tmp'
+        try:
+            with open(tmp_filename, 'wb') as f:
+                torch.save(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_filename, filename)
+
+            dir_fd = os.open(os.path.dirname(os.path.abspath(filename)), os.O_RDONLY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+        except Exception as e:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            self.error = e
+            return
+
+        try:
+            self.remove_old_checkpoints()
+        except Exception as e:
+            self.error = e
+        if self.logger is not None:
+            self.logger.info('Saved %s: training stalled %.2fs, background write %.2fs'
+                             % (filename, stall_time, time.time() - start_time))
+
+    def remove_old_checkpoints(self):
+        ckpt_list = glob.glob(str(self.ckpt_save_dir / 'checkpoint_epoch_*.pth'))
+        ckpt_list.sort(key=os.path.getmtime)
+
+        for cur_file_idx in range(0, len(ckpt_list) - self.max_ckpt_save_num):
+            os.remove(ckpt_list[cur_file_idx])